@@ -1,28 +1,533 @@
 # backup_db.py
 """
-Script per backup automatico del database SQLite.
-Usato da GitHub Actions ogni notte.
+Backup del database SQLite con snapshot consistenti, deduplicati e compressi.
+
+Usato da GitHub Actions ogni notte, utilizzabile anche a mano.
+
+Come funziona:
+- snapshot online con l'API di backup di SQLite (sqlite3.Connection.backup):
+  copia consistente anche se l'app sta scrivendo, mai un file "a metà";
+- PRAGMA quick_check sulla copia prima di archiviarla;
+- il file viene spezzato in pagine SQLite; ogni pagina ha un hash e solo le
+  pagine mai viste nello snapshot precedente vengono compresse (zstd se
+  installato, altrimenti zlib/DEFLATE) e aggiunte a un pack del nuovo
+  snapshot. Lo spazio cresce con le pagine cambiate, non con la dimensione
+  del DB;
+- ogni snapshot ha un manifest (JSON gzip) con tabella pagine, sha256 del
+  file completo ed esito dei controlli;
+- retention a fasce orarie/giornaliere/settimanali; i pack non più
+  referenziati da nessun manifest vengono cancellati.
+
+Struttura:
+    db_backups/
+        snapshots/snap_YYYYmmdd_HHMMSS.json.gz
+        packs/pack_YYYYmmdd_HHMMSS.bin
+
+Uso:
+    python backup_db.py                          # snapshot + retention (job notturno)
+    python backup_db.py snapshot
+    python backup_db.py list
+    python backup_db.py verify [--snapshot ID] [--quick-check]
+    python backup_db.py prune --hourly 24 --daily 7 --weekly 4
+    python backup_db.py restore --target data/forgialean_restored.db [--snapshot ID]
+    python backup_db.py import-legacy            # importa i vecchi forgialean_backup_*.db
 """
-import shutil
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime, timedelta
 from pathlib import Path
-from datetime import datetime
-
-DB_PATH = Path("data/forgialean.db")
-BACKUP_DIR = Path("db_backups")
-BACKUP_DIR.mkdir(exist_ok=True)
-
-if DB_PATH.exists():
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_name = f"forgialean_backup_{timestamp}.db"
-    backup_path = BACKUP_DIR / backup_name
-    
-    shutil.copy2(DB_PATH, backup_path)
-    
-    # Mantieni anche copia "latest" per restore facile
-    latest_path = BACKUP_DIR / "forgialean_latest.db"
-    shutil.copy2(DB_PATH, latest_path)
-    
-    print(f"✅ Backup creato: {backup_path}")
-    print(f"✅ Latest aggiornato: {latest_path}")
-else:
-    print("⚠️ Database non trovato, nessun backup creato")
\ No newline at end of file
+
+from cdc_journal import journal_seq
+
+try:
+    import zstandard
+except ImportError:  # dipendenza opzionale: senza si usa zlib
+    zstandard = None
+
+BASE_DIR = Path(__file__).parent
+DB_PATH = Path(os.getenv("FORGIALEAN_DB_PATH", BASE_DIR / "data" / "forgialean.db"))
+BACKUP_DIR = BASE_DIR / "db_backups"
+
+SNAPSHOT_DIR_NAME = "snapshots"
+PACK_DIR_NAME = "packs"
+
+# Pagine copiate per step dall'API di backup (tra uno step e l'altro
+# le scritture dell'app possono procedere)
+BACKUP_STEP_PAGES = 1024
+
+# Retention di default: snapshot più recente per ogni ora/giorno/settimana
+RETENTION = {"hourly": 24, "daily": 7, "weekly": 4}
+
+
+# ========================
+# COMPRESSIONE
+# ========================
+
+def _default_codec() -> str:
+    return "zstd" if zstandard is not None else "zlib"
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+
+def _decompressor(codec: str):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Snapshot compresso con zstd: installa il pacchetto 'zstandard'")
+        return zstandard.ZstdDecompressor().decompress
+    return zlib.decompress
+
+
+# Errori dei decompressori: un pack danneggiato diventa ValueError come gli hash errati
+_DECOMPRESS_ERRORS = (zlib.error,) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def _page_hash(page: bytes) -> str:
+    return hashlib.blake2b(page, digest_size=16).hexdigest()
+
+
+# ========================
+# MANIFEST
+# ========================
+
+def _dirs(backup_dir: Path) -> tuple[Path, Path]:
+    snaps = backup_dir / SNAPSHOT_DIR_NAME
+    packs = backup_dir / PACK_DIR_NAME
+    snaps.mkdir(parents=True, exist_ok=True)
+    packs.mkdir(parents=True, exist_ok=True)
+    return snaps, packs
+
+
+def load_manifest(path: Path) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_manifest(path: Path, manifest: dict) -> None:
+    tmp = path.with_suffix(".tmp")
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def list_snapshots(backup_dir: Path = BACKUP_DIR) -> list[Path]:
+    """Manifest ordinati dal più vecchio al più recente."""
+    snaps, _ = _dirs(backup_dir)
+    return sorted(snaps.glob("snap_*.json.gz"))
+
+
+def snapshot_id_of(path: Path) -> str:
+    return path.name.split(".")[0]
+
+
+# ========================
+# SNAPSHOT
+# ========================
+
+def _online_copy(db_path: Path, dest: Path) -> None:
+    """Copia consistente con l'API di backup (il DB sorgente resta in uso)."""
+    src = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    dst = sqlite3.connect(dest)
+    try:
+        src.backup(dst, pages=BACKUP_STEP_PAGES, sleep=0.005)
+    finally:
+        dst.close()
+        src.close()
+
+
+def quick_check(db_file: Path) -> str:
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("PRAGMA quick_check").fetchall()
+    finally:
+        conn.close()
+    return "ok" if rows == [("ok",)] else "; ".join(r[0] for r in rows[:10])
+
+
+def _page_size_and_seq(db_file: Path) -> tuple[int, int]:
+    """Dimensione pagina e ultima sequenza del journal CDC contenuta nella copia."""
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        return conn.execute("PRAGMA page_size").fetchone()[0], journal_seq(conn)
+    finally:
+        conn.close()
+
+
+def create_snapshot(
+    db_path: Path = DB_PATH,
+    backup_dir: Path = BACKUP_DIR,
+    codec: str | None = None,
+    created_at: datetime | None = None,
+    source_file: Path | None = None,
+) -> dict:
+    """
+    Crea uno snapshot. source_file permette di archiviare un file già
+    consistente (es. vecchi backup) senza passare dall'API di backup.
+    """
+    t0 = time.perf_counter()
+    codec = codec or _default_codec()
+    created_at = created_at or datetime.now()
+    snaps, packs = _dirs(backup_dir)
+
+    snapshot_id = f"snap_{created_at.strftime('%Y%m%d_%H%M%S')}"
+    manifest_path = snaps / f"{snapshot_id}.json.gz"
+    if manifest_path.exists():
+        raise FileExistsError(f"Snapshot {snapshot_id} già presente")
+
+    fd, tmp_name = tempfile.mkstemp(prefix="snapshot_", suffix=".db", dir=backup_dir)
+    os.close(fd)
+    tmp_db = Path(tmp_name)
+    try:
+        if source_file is None:
+            _online_copy(db_path, tmp_db)
+        else:
+            tmp_db.write_bytes(Path(source_file).read_bytes())
+
+        check = quick_check(tmp_db)
+        if check != "ok":
+            raise RuntimeError(f"quick_check fallito sulla copia: {check}")
+
+        page_size, cdc_seq = _page_size_and_seq(tmp_db)
+
+        # pagine già archiviate nello snapshot precedente (dedup)
+        known: dict[str, list] = {}
+        previous = list_snapshots(backup_dir)
+        if previous:
+            prev = load_manifest(previous[-1])
+            for h, loc in zip(prev["hashes"], prev["locations"]):
+                known.setdefault(h, loc)
+
+        pack_id = snapshot_id.replace("snap_", "pack_")
+        pack_path = packs / f"{pack_id}.bin"
+        pack_tmp = pack_path.with_suffix(".tmp")
+
+        hashes: list[str] = []
+        locations: list[list] = []
+        sha = hashlib.sha256()
+        new_pages = 0
+        offset = 0
+        with open(tmp_db, "rb") as f, open(pack_tmp, "wb") as pack:
+            while True:
+                page = f.read(page_size)
+                if not page:
+                    break
+                sha.update(page)
+                h = _page_hash(page)
+                loc = known.get(h)
+                if loc is None:
+                    blob = _compress(page, codec)
+                    pack.write(blob)
+                    loc = [pack_id, codec, offset, len(blob)]
+                    offset += len(blob)
+                    known[h] = loc
+                    new_pages += 1
+                hashes.append(h)
+                locations.append(loc)
+
+        if new_pages:
+            os.replace(pack_tmp, pack_path)
+        else:
+            pack_tmp.unlink()
+
+        manifest = {
+            "snapshot_id": snapshot_id,
+            "created_at": created_at.isoformat(timespec="seconds"),
+            "source": str(source_file or db_path),
+            "page_size": page_size,
+            "page_count": len(hashes),
+            "db_bytes": tmp_db.stat().st_size,
+            "sha256": sha.hexdigest(),
+            "quick_check": check,
+            "cdc_seq": cdc_seq,
+            "new_pages": new_pages,
+            "pack_bytes": offset,
+            "elapsed_s": round(time.perf_counter() - t0, 3),
+            "hashes": hashes,
+            "locations": locations,
+        }
+        _write_manifest(manifest_path, manifest)
+        return manifest
+    finally:
+        tmp_db.unlink(missing_ok=True)
+
+
+# ========================
+# LETTURA / VERIFICA / RESTORE
+# ========================
+
+def iter_snapshot_pages(manifest: dict, backup_dir: Path = BACKUP_DIR):
+    """Pagine dello snapshot in ordine, decompresse in streaming (un pack aperto per volta)."""
+    _, packs = _dirs(backup_dir)
+    handles: dict = {}
+    decompressors: dict = {}
+    try:
+        for pack_id, codec, offset, length in manifest["locations"]:
+            fh = handles.get(pack_id)
+            if fh is None:
+                fh = handles[pack_id] = open(packs / f"{pack_id}.bin", "rb")
+            if codec not in decompressors:
+                decompressors[codec] = _decompressor(codec)
+            fh.seek(offset)
+            try:
+                page = decompressors[codec](fh.read(length))
+            except _DECOMPRESS_ERRORS as e:
+                raise ValueError(f"Pack {pack_id} danneggiato all'offset {offset}: {e}") from e
+            yield page
+    finally:
+        for fh in handles.values():
+            fh.close()
+
+
+def materialize_snapshot(manifest: dict, dest: Path, backup_dir: Path = BACKUP_DIR) -> None:
+    """Ricostruisce il file DB dello snapshot in dest verificando hash pagine e sha256."""
+    sha = hashlib.sha256()
+    with open(dest, "wb") as out:
+        for expected, page in zip(manifest["hashes"], iter_snapshot_pages(manifest, backup_dir)):
+            if _page_hash(page) != expected:
+                raise ValueError(f"Pagina corrotta nello snapshot {manifest['snapshot_id']}")
+            sha.update(page)
+            out.write(page)
+    if sha.hexdigest() != manifest["sha256"]:
+        raise ValueError(f"Checksum sha256 non corrispondente per {manifest['snapshot_id']}")
+
+
+def verify_snapshot(manifest: dict, backup_dir: Path = BACKUP_DIR, run_quick_check: bool = False) -> str:
+    """'ok' oppure descrizione del problema."""
+    fd, tmp_name = tempfile.mkstemp(prefix="verify_", suffix=".db", dir=backup_dir)
+    os.close(fd)
+    tmp = Path(tmp_name)
+    try:
+        materialize_snapshot(manifest, tmp, backup_dir)
+        if run_quick_check:
+            return quick_check(tmp)
+        return "ok"
+    except (OSError, ValueError, RuntimeError) as e:
+        return str(e)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def restore_snapshot(manifest: dict, target: Path, backup_dir: Path = BACKUP_DIR) -> None:
+    """
+    Ripristina lo snapshot in target. Il file viene ricostruito e verificato
+    (hash, sha256, quick_check) accanto al target, poi copiato con l'API di
+    backup: sicuro anche se il target è aperto da altri processi.
+    """
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(prefix="restore_", suffix=".db", dir=target.parent)
+    os.close(fd)
+    tmp = Path(tmp_name)
+    try:
+        materialize_snapshot(manifest, tmp, backup_dir)
+        check = quick_check(tmp)
+        if check != "ok":
+            raise RuntimeError(f"quick_check fallito sullo snapshot {manifest['snapshot_id']}: {check}")
+        src = sqlite3.connect(f"file:{tmp}?mode=ro", uri=True)
+        dst = sqlite3.connect(target)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+# ========================
+# RETENTION
+# ========================
+
+def select_retained(created: list[datetime], policy: dict = RETENTION) -> set[int]:
+    """Indici da tenere: il più recente, più il più recente per ogni ora/giorno/settimana."""
+    if not created:
+        return set()
+    order = sorted(range(len(created)), key=lambda i: created[i], reverse=True)
+    keep = {order[0]}
+    buckets = {
+        "hourly": lambda d: d.strftime("%Y%m%d%H"),
+        "daily": lambda d: d.strftime("%Y%m%d"),
+        "weekly": lambda d: "%d-%02d" % d.isocalendar()[:2],
+    }
+    newest = created[order[0]]
+    horizons = {
+        "hourly": timedelta(hours=policy.get("hourly", 0)),
+        "daily": timedelta(days=policy.get("daily", 0)),
+        "weekly": timedelta(weeks=policy.get("weekly", 0)),
+    }
+    for tier, key in buckets.items():
+        seen = set()
+        for i in order:
+            if newest - created[i] >= horizons[tier]:
+                break
+            k = key(created[i])
+            if k not in seen and len(seen) < policy.get(tier, 0):
+                seen.add(k)
+                keep.add(i)
+    return keep
+
+
+def prune(backup_dir: Path = BACKUP_DIR, policy: dict = RETENTION, dry_run: bool = False) -> dict:
+    """Applica la retention e cancella i pack non più referenziati."""
+    snaps, packs = _dirs(backup_dir)
+    paths = list_snapshots(backup_dir)
+    manifests = [load_manifest(p) for p in paths]
+    created = [datetime.fromisoformat(m["created_at"]) for m in manifests]
+    keep = select_retained(created, policy)
+
+    removed = [p for i, p in enumerate(paths) if i not in keep]
+    referenced = {
+        loc[0]
+        for i, m in enumerate(manifests) if i in keep
+        for loc in m["locations"]
+    }
+    orphan_packs = [p for p in packs.glob("pack_*.bin") if p.stem not in referenced]
+    orphan_packs += list(packs.glob("pack_*.tmp"))
+
+    if not dry_run:
+        for p in removed:
+            p.unlink()
+        for p in orphan_packs:
+            p.unlink()
+    return {"snapshots_removed": len(removed), "packs_removed": len(orphan_packs), "kept": len(keep)}
+
+
+# ========================
+# IMPORT VECCHI BACKUP
+# ========================
+
+def import_legacy(backup_dir: Path = BACKUP_DIR, delete: bool = False) -> int:
+    """Archivia i vecchi forgialean_backup_YYYYmmdd_HHMMSS.db come snapshot deduplicati."""
+    existing = {snapshot_id_of(p) for p in list_snapshots(backup_dir)}
+    imported = 0
+    for legacy in sorted(backup_dir.glob("forgialean_backup_*.db")):
+        stamp = legacy.stem.replace("forgialean_backup_", "")
+        created = datetime.strptime(stamp, "%Y%m%d_%H%M%S")
+        if f"snap_{stamp}" not in existing:
+            create_snapshot(backup_dir=backup_dir, created_at=created, source_file=legacy)
+            imported += 1
+        if delete:
+            legacy.unlink()
+    return imported
+
+
+# ========================
+# CLI
+# ========================
+
+def _resolve_manifest(backup_dir: Path, snapshot: str | None) -> dict:
+    paths = list_snapshots(backup_dir)
+    if not paths:
+        raise SystemExit("⚠️ Nessuno snapshot disponibile")
+    if snapshot is None:
+        return load_manifest(paths[-1])
+    for p in paths:
+        if snapshot_id_of(p) == snapshot:
+            return load_manifest(p)
+    raise SystemExit(f"⚠️ Snapshot {snapshot} non trovato")
+
+
+def _print_snapshot(m: dict) -> None:
+    print(
+        f"✅ Snapshot {m['snapshot_id']}: {m['page_count']} pagine, "
+        f"{m['new_pages']} nuove ({m['pack_bytes'] / 1024:.0f} KB compressi su "
+        f"{m['db_bytes'] / 1024:.0f} KB), {m['elapsed_s']:.2f}s"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backup deduplicato del DB ForgiaLean")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--backup-dir", type=Path, default=BACKUP_DIR)
+    sub = parser.add_subparsers(dest="cmd")
+
+    p_snap = sub.add_parser("snapshot", help="crea uno snapshot online")
+    p_snap.add_argument("--codec", choices=["zstd", "zlib"], default=None)
+
+    sub.add_parser("list", help="elenca gli snapshot")
+
+    p_verify = sub.add_parser("verify", help="verifica hash e checksum degli snapshot")
+    p_verify.add_argument("--snapshot", default=None, help="ID snapshot (default: tutti)")
+    p_verify.add_argument("--quick-check", action="store_true", help="esegue anche PRAGMA quick_check")
+
+    p_prune = sub.add_parser("prune", help="applica la retention")
+    for tier, default in RETENTION.items():
+        p_prune.add_argument(f"--{tier}", type=int, default=default)
+    p_prune.add_argument("--dry-run", action="store_true")
+
+    p_restore = sub.add_parser("restore", help="ripristina uno snapshot")
+    p_restore.add_argument("--snapshot", default=None, help="ID snapshot (default: il più recente)")
+    p_restore.add_argument("--target", type=Path, required=True)
+    p_restore.add_argument("--force", action="store_true", help="consente di sovrascrivere un file esistente")
+
+    p_legacy = sub.add_parser("import-legacy", help="importa i vecchi backup .db completi")
+    p_legacy.add_argument("--delete", action="store_true", help="cancella i file .db dopo l'import")
+
+    args = parser.parse_args(argv)
+    backup_dir = args.backup_dir
+    backup_dir.mkdir(exist_ok=True)
+
+    if args.cmd in (None, "snapshot"):
+        if not args.db.exists():
+            print("⚠️ Database non trovato, nessun backup creato")
+            return
+        _print_snapshot(create_snapshot(args.db, backup_dir, codec=getattr(args, "codec", None)))
+        if args.cmd is None:
+            res = prune(backup_dir)
+            print(f"🧹 Retention: {res['snapshots_removed']} snapshot e {res['packs_removed']} pack rimossi")
+
+    elif args.cmd == "list":
+        for p in list_snapshots(backup_dir):
+            m = load_manifest(p)
+            print(
+                f"{m['snapshot_id']}  {m['created_at']}  {m['db_bytes'] / 1024:>9.0f} KB  "
+                f"nuove pagine {m['new_pages']:>6}  pack {m['pack_bytes'] / 1024:>8.0f} KB  {m['quick_check']}"
+            )
+
+    elif args.cmd == "verify":
+        paths = list_snapshots(backup_dir)
+        if args.snapshot:
+            paths = [p for p in paths if snapshot_id_of(p) == args.snapshot]
+        failed = 0
+        for p in paths:
+            esito = verify_snapshot(load_manifest(p), backup_dir, run_quick_check=args.quick_check)
+            print(f"{'✅' if esito == 'ok' else '❌'} {snapshot_id_of(p)}: {esito}")
+            failed += esito != "ok"
+        if failed:
+            sys.exit(1)
+
+    elif args.cmd == "prune":
+        policy = {tier: getattr(args, tier) for tier in RETENTION}
+        res = prune(backup_dir, policy, dry_run=args.dry_run)
+        print(
+            f"🧹 {'(dry-run) ' if args.dry_run else ''}tenuti {res['kept']}, "
+            f"rimossi {res['snapshots_removed']} snapshot e {res['packs_removed']} pack"
+        )
+
+    elif args.cmd == "restore":
+        if args.target.exists() and not args.force:
+            raise SystemExit(f"⚠️ {args.target} esiste già: usa --force per sovrascriverlo")
+        manifest = _resolve_manifest(backup_dir, args.snapshot)
+        t0 = time.perf_counter()
+        restore_snapshot(manifest, args.target, backup_dir)
+        print(f"✅ Snapshot {manifest['snapshot_id']} ripristinato in {args.target} ({time.perf_counter() - t0:.2f}s)")
+
+    elif args.cmd == "import-legacy":
+        n = import_legacy(backup_dir, delete=args.delete)
+        print(f"✅ {n} backup legacy importati")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# benchmark.py
+"""
+Benchmark headless dei builder e dei percorsi dati delle pagine.
+
+Gira su un DB sintetico generato da synthetic_data.py (mai sul DB reale),
+misura ogni target N volte e salva i risultati in JSON in benchmarks/
+per il confronto tra versioni (regressioni).
+
+Uso:
+    python benchmark.py --scale 1
+    python benchmark.py --scale 10 --repeat 10 --save
+    python benchmark.py --scale 10 --compare benchmarks/bench_10x_20260101_120000.json
+    python benchmark.py --scale 10 --compare latest --fail-on-regression
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).parent / "benchmarks"
+DATA_DIR = Path(__file__).parent / "data"
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except Exception:
+        return ""
+
+
+def build_targets(anno: int) -> dict:
+    """
+    Target da misurare. L'app viene importata qui, con FORGIALEAN_DB_PATH
+    già impostato da main().
+    """
+    import pandas as pd
+    from sqlmodel import select
+
+    import forgialean_ai_control_tower as app
+    from finance_utils import build_full_management_balance
+    from db import get_session, MarketingCampaign, Opportunity, Expense, Invoice, Client
+
+    fine_anno = date(anno, 12, 31)
+
+    def marketing_roi():
+        with get_session() as session:
+            campaigns = session.exec(select(MarketingCampaign)).all()
+            opps = session.exec(select(Opportunity)).all()
+            expenses = session.exec(select(Expense)).all()
+            invoices = session.exec(select(Invoice)).all()
+        df_camp = pd.DataFrame([c.__dict__ for c in campaigns])
+        df_opp = pd.DataFrame([o.__dict__ for o in opps]) if opps else pd.DataFrame()
+        df_exp = pd.DataFrame([e.__dict__ for e in expenses]) if expenses else pd.DataFrame()
+        df_inv = pd.DataFrame([i.__dict__ for i in invoices]) if invoices else pd.DataFrame()
+        return app.build_marketing_roi_kpis(df_camp, df_opp, df_exp, df_inv)
+
+    def lead_scoring():
+        with get_session() as session:
+            opps = session.exec(select(Opportunity)).all()
+            clients = session.exec(select(Client)).all()
+        df_opps = pd.DataFrame([o.__dict__ for o in opps])
+        client_map = {c.client_id: c.ragione_sociale for c in clients}
+        df_opps["Cliente"] = df_opps["client_id"].map(client_map)
+        return app.score_leads(df_opps)
+
+    return {
+        "build_income_statement_monthly": lambda: app.build_income_statement_monthly(anno),
+        "build_cashflow_monthly": lambda: app.build_cashflow_monthly(anno),
+        "calcola_saldo_cassa": lambda: app.calcola_saldo_cassa(fine_anno),
+        "build_balance_sheet": lambda: app.build_balance_sheet(fine_anno, 0.0),
+        "build_full_management_balance": lambda: build_full_management_balance(anno, fine_anno, 0.0),
+        "marketing_roi_aggregation": marketing_roi,
+        "lead_scoring": lead_scoring,
+    }
+
+
+def run_benchmarks(targets: dict, repeat: int = 5, warmup: int = 1) -> dict:
+    results = {}
+    for name, fn in targets.items():
+        for _ in range(warmup):
+            fn()
+        times_ms = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            times_ms.append((time.perf_counter() - t0) * 1000.0)
+        times_sorted = sorted(times_ms)
+        p95_idx = min(len(times_sorted) - 1, int(round(0.95 * (len(times_sorted) - 1))))
+        results[name] = {
+            "min_ms": times_sorted[0],
+            "median_ms": statistics.median(times_sorted),
+            "p95_ms": times_sorted[p95_idx],
+            "mean_ms": statistics.fmean(times_sorted),
+            "repeat": repeat,
+        }
+        print(f"  {name:<34} median {results[name]['median_ms']:>9.1f} ms   min {results[name]['min_ms']:>9.1f} ms")
+    return results
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """Confronta le mediane; restituisce i target peggiorati oltre la soglia."""
+    regressions = []
+    print(f"\nConfronto con baseline {baseline.get('created_at', '')} ({baseline.get('git_commit', '')})")
+    for name, cur in current["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old:
+            print(f"  {name:<34} (nuovo)")
+            continue
+        delta = (cur["median_ms"] - old["median_ms"]) / old["median_ms"] if old["median_ms"] else 0.0
+        flag = ""
+        if delta > threshold:
+            flag = "  ⚠️ REGRESSIONE"
+            regressions.append(name)
+        print(f"  {name:<34} {old['median_ms']:>9.1f} → {cur['median_ms']:>9.1f} ms ({delta:+.0%}){flag}")
+    return regressions
+
+
+def _latest_result(scale: int, exclude: Path | None = None) -> Path | None:
+    files = sorted(BENCH_DIR.glob(f"bench_{scale}x_*.json"))
+    files = [f for f in files if f != exclude]
+    return files[-1] if files else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark headless ForgiaLean Control Tower")
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", type=Path, default=None, help="DB sintetico (default data/forgialean_bench_<scale>x.db)")
+    parser.add_argument("--regenerate", action="store_true", help="rigenera il DB sintetico anche se esiste")
+    parser.add_argument("--save", action="store_true", help="salva i risultati in benchmarks/")
+    parser.add_argument("--compare", default=None, help="file JSON di baseline oppure 'latest'")
+    parser.add_argument("--threshold", type=float, default=0.20, help="soglia regressione sulla mediana (0.20 = +20%%)")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    db_path = args.db or DATA_DIR / f"forgialean_bench_{args.scale}x.db"
+
+    # Va impostato PRIMA di importare db: engine e builder puntano al DB sintetico
+    os.environ["FORGIALEAN_DB_PATH"] = str(db_path)
+
+    import synthetic_data
+
+    if args.regenerate or not db_path.exists():
+        print(f"🔧 Genero DB sintetico {args.scale}x in {db_path} ...")
+        counts = synthetic_data.generate(db_path, scale=args.scale, seed=args.seed)
+    else:
+        counts = None
+
+    anno = date.today().year - 1
+
+    print(f"⏱️ Benchmark {args.scale}x su {db_path} (anno {anno}, repeat={args.repeat})")
+    targets = build_targets(anno)
+    results = run_benchmarks(targets, repeat=args.repeat)
+
+    payload = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "scale": args.scale,
+        "seed": args.seed,
+        "anno": anno,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "row_counts": counts,
+        "results": results,
+    }
+
+    out_path = None
+    if args.save:
+        BENCH_DIR.mkdir(exist_ok=True)
+        out_path = BENCH_DIR / f"bench_{args.scale}x_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        out_path.write_text(json.dumps(payload, indent=2))
+        print(f"✅ Risultati salvati in {out_path}")
+
+    if args.compare:
+        baseline_path = (
+            _latest_result(args.scale, exclude=out_path) if args.compare == "latest" else Path(args.compare)
+        )
+        if baseline_path is None or not baseline_path.exists():
+            print("⚠️ Nessuna baseline trovata per il confronto")
+            return
+        regressions = compare(payload, json.loads(baseline_path.read_text()), args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
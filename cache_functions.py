@@ -16,7 +16,8 @@ Uso:
 """
 
 import streamlit as st
-from config import CACHE_TTL, CACHE_ENABLED
+from config import CACHE_TTL, CACHE_ENABLED, PERF_MONITOR_ENABLED
+from perf_monitor import instrument_cache
 from db import (
     get_session,
     Client,
@@ -38,9 +39,11 @@ from sqlmodel import select
 # ========================
 
 def cache_data(ttl):
-    """Wrapper che rispetta la configurazione CACHE_ENABLED"""
+    """Wrapper che rispetta la configurazione CACHE_ENABLED (e misura hit/miss se PERF_MONITOR_ENABLED)"""
     def decorator(func):
         if CACHE_ENABLED:
+            if PERF_MONITOR_ENABLED:
+                return instrument_cache(func, st.cache_data(ttl=ttl))
             return st.cache_data(ttl=ttl)(func)
         else:
             return func
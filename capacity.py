@@ -0,0 +1,373 @@
+# capacity.py
+"""
+Motore capacità people: ore registrate vs capacità teorica.
+
+- operatore dei timesheet (testo libero) -> dipendente tramite un indice di
+  nomi normalizzati (senza accenti/punteggiatura, ordine parole indifferente)
+  costruito da Employee più la tabella OperatorAlias;
+- giorni lavorativi con numpy.busday_count, vettoriale su tutti i dipendenti
+  (una chiamata per combinazione settimana lavorativa/calendario), festività
+  nazionali italiane + righe Holiday del calendario;
+- capacità da CapacityProfile: profilo del dipendente, altrimenti del reparto,
+  altrimenti i parametri standard;
+- ore registrate lette con una sola query raggruppata per operatore.
+
+Uso:
+    from capacity import compute_utilization, weekly_utilization
+    res = compute_utilization(date(2026, 1, 1), date(2026, 6, 30))
+    res["people"], res["departments"], res["unmatched"]
+
+    # heatmap settimanale dall'aggregato TimesheetWeek (db.py)
+    df_weeks = weekly_utilization(date(2025, 7, 1), date(2026, 6, 30))
+"""
+
+import re
+import unicodedata
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlmodel import Session, select
+
+from db import (
+    CapacityProfile,
+    Department,
+    Employee,
+    Holiday,
+    OperatorAlias,
+    get_analytics_session,
+)
+
+DEFAULT_ORE_GIORNO = 8.0
+DEFAULT_WEEKMASK = "1111100"
+DEFAULT_CALENDARIO = "IT"
+
+# Festività nazionali fisse (mese, giorno)
+_FESTIVITA_FISSE = [
+    (1, 1), (1, 6), (4, 25), (5, 1), (6, 2), (8, 15), (11, 1), (12, 8), (12, 25), (12, 26),
+]
+
+
+# ========================
+# OPERATORI -> DIPENDENTI
+# ========================
+
+def normalize_operator(name) -> str:
+    """'  Rossi, Mário ' e 'mario rossi' -> 'mario rossi'."""
+    if name is None:
+        return ""
+    s = unicodedata.normalize("NFKD", str(name))
+    s = "".join(ch for ch in s if not unicodedata.combining(ch)).lower()
+    tokens = re.sub(r"[^a-z0-9]+", " ", s).split()
+    return " ".join(sorted(tokens))
+
+
+def build_operator_index(session: Session) -> dict[str, int]:
+    """{nome normalizzato: employee_id} da anagrafica e alias (gli alias prevalgono)."""
+    index = {
+        normalize_operator(f"{nome} {cognome}"): emp_id
+        for emp_id, nome, cognome in session.exec(select(Employee.employee_id, Employee.nome, Employee.cognome)).all()
+    }
+    for alias, emp_id in session.exec(select(OperatorAlias.alias, OperatorAlias.employee_id)).all():
+        index[normalize_operator(alias)] = emp_id
+    return index
+
+
+def hours_by_operator(session: Session, data_da: date, data_a: date) -> pd.DataFrame:
+    """Ore per operatore nel periodo (una query GROUP BY)."""
+    rows = session.execute(
+        text(
+            "SELECT operatore, SUM(ore) FROM timeentry "
+            "WHERE data_lavoro BETWEEN :da AND :a GROUP BY operatore"
+        ),
+        {"da": data_da.isoformat(), "a": data_a.isoformat()},
+    ).fetchall()
+    return pd.DataFrame(rows, columns=["operatore", "ore"])
+
+
+def map_operators(df: pd.DataFrame, index: dict[str, int]) -> pd.DataFrame:
+    """Aggiunge employee_id alla colonna operatore (NaN se non riconosciuto)."""
+    df = df.copy()
+    distinct = pd.unique(df["operatore"].fillna(""))
+    lookup = {op: index.get(normalize_operator(op)) for op in distinct}
+    df["employee_id"] = df["operatore"].fillna("").map(lookup)
+    return df
+
+
+# ========================
+# CALENDARI E PROFILI
+# ========================
+
+def _easter(year: int) -> date:
+    """Domenica di Pasqua (algoritmo gregoriano anonimo)."""
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month = (h + l - 7 * m + 114) // 31
+    day = (h + l - 7 * m + 114) % 31 + 1
+    return date(year, month, day)
+
+
+def italian_holidays(year_from: int, year_to: int) -> list[date]:
+    days = []
+    for y in range(year_from, year_to + 1):
+        days += [date(y, m, d) for m, d in _FESTIVITA_FISSE]
+        days.append(_easter(y) + timedelta(days=1))  # Lunedì dell'Angelo
+    return days
+
+
+def holiday_calendar(session: Session, calendario: str, year_from: int, year_to: int) -> np.ndarray:
+    """Festività nazionali + chiusure del calendario, come datetime64[D] ordinati."""
+    extra = session.exec(
+        select(Holiday.data)
+        .where(Holiday.calendario == calendario)
+        .where(Holiday.data >= date(year_from, 1, 1))
+        .where(Holiday.data <= date(year_to, 12, 31))
+    ).all()
+    return np.unique(np.array(italian_holidays(year_from, year_to) + list(extra), dtype="datetime64[D]"))
+
+
+def load_employees(session: Session, default_ore: float, default_weekmask: str) -> pd.DataFrame:
+    """Dipendenti con reparto e profilo di capacità risolto (dipendente > reparto > standard)."""
+    df = pd.DataFrame(
+        session.exec(
+            select(
+                Employee.employee_id,
+                Employee.nome,
+                Employee.cognome,
+                Employee.department_id,
+                Employee.data_assunzione,
+                Employee.stato,
+            )
+        ).all(),
+        columns=["employee_id", "nome", "cognome", "department_id", "data_assunzione", "stato"],
+    )
+    departments = dict(session.exec(select(Department.department_id, Department.nome_reparto)).all())
+    df["persona"] = df["nome"] + " " + df["cognome"]
+    df["reparto"] = df["department_id"].map(departments).fillna("Senza reparto")
+
+    profiles = session.exec(select(CapacityProfile)).all()
+    by_emp = {p.employee_id: p for p in profiles if p.employee_id is not None}
+    by_dep = {p.department_id: p for p in profiles if p.employee_id is None and p.department_id is not None}
+
+    def _pick(row, attr, default):
+        p = by_emp.get(row.employee_id) or by_dep.get(row.department_id)
+        return getattr(p, attr) if p is not None else default
+
+    rows = list(df.itertuples(index=False))
+    df["ore_giorno"] = [float(_pick(r, "ore_giorno", default_ore)) for r in rows]
+    df["weekmask"] = [_pick(r, "weekmask", default_weekmask) for r in rows]
+    df["calendario"] = [_pick(r, "calendario", DEFAULT_CALENDARIO) for r in rows]
+    return df
+
+
+def _holidays_for(session: Session, calendars: dict, calendario: str, year_from: int, year_to: int) -> np.ndarray:
+    if calendario not in calendars:
+        calendars[calendario] = holiday_calendar(session, calendario, year_from, year_to)
+    return calendars[calendario]
+
+
+def working_days_matrix(session: Session, df_emp: pd.DataFrame, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    Giorni lavorativi (dipendenti x intervalli) con numpy.busday_count in
+    broadcasting: una chiamata per combinazione weekmask/calendario.
+    starts/ends: datetime64[D], fine esclusa. Si conta dalla data di assunzione.
+    """
+    starts = np.asarray(starts, dtype="datetime64[D]")
+    ends = np.asarray(ends, dtype="datetime64[D]")
+    year_from = int(str(starts.min())[:4])
+    year_to = int(str(ends.max())[:4])
+    hired = pd.to_datetime(df_emp["data_assunzione"], errors="coerce").to_numpy("datetime64[D]")
+
+    giorni = np.zeros((len(df_emp), len(starts)), dtype=np.int64)
+    calendars: dict = {}
+    for (weekmask, calendario), idx in df_emp.groupby(["weekmask", "calendario"]).indices.items():
+        h = hired[idx][:, None]
+        begins = np.where(np.isnat(h) | (h < starts[None, :]), starts[None, :], h)
+        begins = np.minimum(begins, ends[None, :])
+        giorni[idx] = np.busday_count(
+            begins,
+            np.broadcast_to(ends[None, :], begins.shape),
+            weekmask=weekmask,
+            holidays=_holidays_for(session, calendars, calendario, year_from, year_to),
+        )
+    return giorni
+
+
+def add_capacity(session: Session, df_emp: pd.DataFrame, data_da: date, data_a: date) -> pd.DataFrame:
+    """
+    Giorni lavorativi e capacità teorica nel periodo per ogni dipendente
+    (dalla data di assunzione se successiva a data_da).
+    """
+    df = df_emp.copy()
+    giorni = working_days_matrix(
+        session,
+        df,
+        np.array([data_da], dtype="datetime64[D]"),
+        np.array([data_a + timedelta(days=1)], dtype="datetime64[D]"),  # busday_count esclude la fine
+    )[:, 0]
+    df["giorni_lavorativi"] = giorni
+    df["capacita"] = giorni * df["ore_giorno"]
+    return df
+
+
+# ========================
+# UTILIZZO
+# ========================
+
+def compute_utilization(
+    data_da: date,
+    data_a: date,
+    default_ore: float = DEFAULT_ORE_GIORNO,
+    default_giorni: int = 5,
+) -> dict:
+    """
+    Ritorna {"people": per dipendente, "departments": per reparto,
+    "unmatched": operatori non riconosciuti con le loro ore}.
+    """
+    default_weekmask = "1" * int(default_giorni) + "0" * (7 - int(default_giorni))
+    with get_analytics_session() as session:
+        df_hours = hours_by_operator(session, data_da, data_a)
+        df_hours = map_operators(df_hours, build_operator_index(session))
+        df_emp = load_employees(session, default_ore, default_weekmask)
+        ore_emp = df_hours.dropna(subset=["employee_id"]).groupby("employee_id")["ore"].sum()
+        # persone attive oppure con ore nel periodo
+        df_emp = df_emp[(df_emp["stato"] != "non attivo") | df_emp["employee_id"].isin(ore_emp.index)]
+        df_emp = add_capacity(session, df_emp, data_da, data_a)
+
+    df_emp["ore_registrate"] = df_emp["employee_id"].map(ore_emp).fillna(0.0)
+    df_emp["utilization_pct"] = np.where(
+        df_emp["capacita"] > 0, df_emp["ore_registrate"] / df_emp["capacita"].where(df_emp["capacita"] > 0) * 100.0, 0.0
+    )
+
+    df_dep = (
+        df_emp.groupby("reparto", as_index=False)
+        .agg(persone=("employee_id", "count"), ore_registrate=("ore_registrate", "sum"), capacita=("capacita", "sum"))
+    )
+    df_dep["utilization_pct"] = np.where(
+        df_dep["capacita"] > 0, df_dep["ore_registrate"] / df_dep["capacita"].where(df_dep["capacita"] > 0) * 100.0, 0.0
+    )
+
+    unmatched = (
+        df_hours[df_hours["employee_id"].isna()][["operatore", "ore"]]
+        .assign(operatore=lambda d: d["operatore"].fillna("(vuoto)"))
+        .sort_values("ore", ascending=False)
+    )
+    return {
+        "people": df_emp.sort_values("utilization_pct", ascending=False).reset_index(drop=True),
+        "departments": df_dep.sort_values("utilization_pct", ascending=False).reset_index(drop=True),
+        "unmatched": unmatched.reset_index(drop=True),
+    }
+
+
+# ========================
+# SETTIMANE (AGGREGATO TimesheetWeek)
+# ========================
+
+def weekly_utilization(
+    week_from: date,
+    week_to: date,
+    default_ore: float = DEFAULT_ORE_GIORNO,
+    default_giorni: int = 5,
+) -> pd.DataFrame:
+    """
+    Ore e capacità per dipendente e settimana ISO (lunedì tra week_from e
+    week_to) dall'aggregato TimesheetWeek, senza leggere le righe timesheet.
+    Le ore di operatori non collegati finiscono su una riga unica
+    "(operatori non collegati)"; utilization_pct è NaN dove la capacità è zero
+    (prima dell'assunzione, settimane di sola festa).
+    """
+    monday_from = week_from - timedelta(days=week_from.weekday())
+    monday_to = week_to - timedelta(days=week_to.weekday())
+    weeks = np.arange(
+        np.datetime64(monday_from, "D"), np.datetime64(monday_to, "D") + 1, 7, dtype="datetime64[D]"
+    )
+    default_weekmask = "1" * int(default_giorni) + "0" * (7 - int(default_giorni))
+
+    with get_analytics_session() as session:
+        df_hours = pd.DataFrame(
+            session.execute(
+                text(
+                    "SELECT operatore, week_start, SUM(ore) FROM timesheetweek "
+                    "WHERE week_start BETWEEN :da AND :a GROUP BY operatore, week_start"
+                ),
+                {"da": monday_from.isoformat(), "a": monday_to.isoformat()},
+            ).fetchall(),
+            columns=["operatore", "week_start", "ore"],
+        )
+        df_hours = map_operators(df_hours, build_operator_index(session))
+        df_emp = load_employees(session, default_ore, default_weekmask)
+        with_hours = set(df_hours["employee_id"].dropna())
+        df_emp = df_emp[(df_emp["stato"] != "non attivo") | df_emp["employee_id"].isin(with_hours)].reset_index(drop=True)
+        giorni = working_days_matrix(session, df_emp, weeks, weeks + 7)
+
+    # griglia completa dipendenti x settimane (anche le settimane senza ore)
+    grid = pd.DataFrame({
+        "employee_id": np.repeat(df_emp["employee_id"].to_numpy(), len(weeks)),
+        "week_start": np.tile(weeks, len(df_emp)),
+        "giorni_lavorativi": giorni.ravel(),
+        "capacita": (giorni * df_emp["ore_giorno"].to_numpy()[:, None]).ravel(),
+    })
+    grid = grid.merge(df_emp[["employee_id", "persona", "reparto"]], on="employee_id", how="left")
+
+    df_hours["week_start"] = pd.to_datetime(df_hours["week_start"]).to_numpy("datetime64[D]")
+    ore = df_hours.dropna(subset=["employee_id"]).groupby(["employee_id", "week_start"], as_index=False)["ore"].sum()
+    grid = grid.merge(ore.rename(columns={"ore": "ore_registrate"}), on=["employee_id", "week_start"], how="left")
+    grid["ore_registrate"] = grid["ore_registrate"].fillna(0.0)
+
+    unmatched = (
+        df_hours[df_hours["employee_id"].isna()]
+        .groupby("week_start", as_index=False)["ore"].sum()
+        .rename(columns={"ore": "ore_registrate"})
+    )
+    if not unmatched.empty:
+        unmatched["persona"] = "(operatori non collegati)"
+        unmatched["reparto"] = "Senza reparto"
+        unmatched["capacita"] = 0.0
+        unmatched["giorni_lavorativi"] = 0
+        grid = pd.concat([grid, unmatched], ignore_index=True)
+
+    grid["week_start"] = pd.to_datetime(grid["week_start"])
+    iso = grid["week_start"].dt.isocalendar()
+    grid["settimana"] = iso["year"].astype(str) + "-W" + iso["week"].astype(str).str.zfill(2)
+    grid["utilization_pct"] = np.where(
+        grid["capacita"] > 0, grid["ore_registrate"] / grid["capacita"].where(grid["capacita"] > 0) * 100.0, np.nan
+    )
+    return grid
+
+
+def weekly_drilldown(employee_ids: list, week_start: date, include_unmatched: bool = False) -> pd.DataFrame:
+    """Ore per commessa/fase di un gruppo di dipendenti in una settimana (da TimesheetWeek)."""
+    with get_analytics_session() as session:
+        df = pd.DataFrame(
+            session.execute(
+                text(
+                    """
+                    SELECT w.operatore, w.commessa_id, c.cod_commessa, w.fase_id, f.nome_fase, w.ore
+                    FROM timesheetweek AS w
+                    LEFT JOIN projectcommessa AS c ON c.commessa_id = w.commessa_id
+                    LEFT JOIN taskfase AS f ON f.fase_id = w.fase_id
+                    WHERE w.week_start = :ws
+                    """
+                ),
+                {"ws": week_start.isoformat()},
+            ).fetchall(),
+            columns=["operatore", "commessa_id", "cod_commessa", "fase_id", "nome_fase", "ore"],
+        )
+        df = map_operators(df, build_operator_index(session))
+    mask = df["employee_id"].isin(employee_ids)
+    if include_unmatched:
+        mask |= df["employee_id"].isna()
+    return (
+        df[mask]
+        .groupby(["commessa_id", "cod_commessa", "fase_id", "nome_fase"], as_index=False, dropna=False)["ore"]
+        .sum()
+        .sort_values("ore", ascending=False)
+        .reset_index(drop=True)
+    )
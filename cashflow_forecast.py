@@ -0,0 +1,599 @@
+# cashflow_forecast.py
+"""
+Motore di forecast cashflow pluriennale per ForgiaLean Control Tower.
+
+- Consuntivo mensile calcolato in SQL (GROUP BY mese) e messo in cache,
+  con chiave sulla "versione" dei dati: si ricalcola solo se fatture,
+  pagamenti o spese cambiano.
+- Proiezione rolling su 12-36 mesi: consuntivo + budget + eventi + incassi
+  attesi delle fatture aperte, saldo con cumsum.
+- Classificazione categorie budget vettoriale (regex su tutta la colonna).
+- Modello dei ritardi di incasso per cliente: distribuzioni empiriche
+  (giorni data_fattura -> pagamento, pesate per importo) da Payment e
+  Invoice in una query raggruppata, tenute in memoria e aggiornate in modo
+  incrementale quando arrivano nuovi pagamenti. Clienti con poco storico
+  usano la distribuzione globale.
+- Simulazione Monte Carlo (NumPy) dei ritardi di incasso: per ogni fattura
+  aperta si estrae un ritardo dalla distribuzione del suo cliente,
+  condizionata all'età della fattura; risultato: bande percentili del
+  saldo mese per mese.
+
+Uso:
+    from cashflow_forecast import build_cashflow_forecast, simulate_cash_paths
+
+    df = build_cashflow_forecast(date(2026, 1, 1), 24, saldo_iniziale=10_000)
+    bande = simulate_cash_paths(df, saldo_iniziale=10_000, n_sims=10_000)
+"""
+
+import threading
+from collections import defaultdict
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from config import CACHE_TTL
+from cache_functions import cache_data
+from db import get_analytics_engine
+from perf_monitor import timed
+
+# Macro-categorie cashflow: la prima regex che corrisponde vince, default "operativo"
+CATEGORY_PATTERNS = {
+    "fisco_inps": r"fisco|imposte|tasse|inps|previd",
+    "investimenti_altro": r"invest|macchin|impiant|attrezz|capex",
+}
+MACRO_CATEGORIES = ["operativo", "fisco_inps", "investimenti_altro"]
+
+# Una fattura è chiusa se ha data_incasso oppure è marcata incassata
+_INVOICE_CLOSED_SQL = "(i.data_incasso IS NOT NULL OR i.stato_pagamento = 'incassata')"
+
+# Ritardi di incasso plausibili (giorni) usati per la distribuzione storica
+MAX_DELAY_DAYS = 365
+
+# Ritardo usato quando non c'è storico di incassi
+DEFAULT_DELAY_DAYS = 30
+
+# Osservazioni minime perché un cliente usi la propria distribuzione
+MIN_CLIENT_OBSERVATIONS = 5
+
+# Risoluzione dei quantili usati dal Monte Carlo
+QUANTILE_STEPS = 256
+
+
+# ========================
+# HELPER PERIODI
+# ========================
+
+def month_index(d) -> int:
+    """Indice mese assoluto (anno*12 + mese-1), per aritmetica sui mesi."""
+    return d.year * 12 + d.month - 1
+
+
+def month_labels(start: date, months: int) -> list[str]:
+    base = month_index(start)
+    return [f"{(base + k) // 12}-{(base + k) % 12 + 1:02d}" for k in range(months)]
+
+
+def classify_cashflow_categories(categorie: pd.Series) -> pd.Series:
+    """Restituisce operativo / fisco_inps / investimenti_altro per ogni categoria."""
+    nomi = categorie.fillna("").astype(str).str.lower()
+    conditions = [nomi.str.contains(pattern, regex=True) for pattern in CATEGORY_PATTERNS.values()]
+    return pd.Series(
+        np.select(conditions, list(CATEGORY_PATTERNS), default="operativo"),
+        index=categorie.index,
+    )
+
+
+# ========================
+# LETTURE DB (CACHE)
+# ========================
+
+def finance_data_version() -> tuple:
+    """
+    Firma economica dei dati finanziari (conteggi, id massimi, somme di
+    importi e date): cambia se cambia qualsiasi fattura, pagamento o spesa.
+    """
+    sql = """
+        SELECT
+            (SELECT COUNT(*) || ':' || IFNULL(MAX(invoice_id), 0) || ':'
+                    || TOTAL(importo_totale) || ':'
+                    || TOTAL(julianday(COALESCE(data_incasso, data_fattura)))
+                    || ':' || TOTAL(stato_pagamento = 'incassata')
+               FROM invoice),
+            (SELECT COUNT(*) || ':' || IFNULL(MAX(payment_id), 0) || ':'
+                    || TOTAL(amount) || ':' || TOTAL(julianday(payment_date))
+               FROM payment),
+            (SELECT COUNT(*) || ':' || IFNULL(MAX(expense_id), 0) || ':'
+                    || TOTAL(importo_totale) || ':'
+                    || TOTAL(julianday(COALESCE(data_pagamento, data)))
+               FROM expense)
+    """
+    with get_analytics_engine().connect() as conn:
+        return tuple(conn.execute(text(sql)).one())
+
+
+@cache_data(CACHE_TTL["transactional"])
+def get_monthly_cash_actuals(data_version: tuple) -> pd.DataFrame:
+    """
+    Consuntivo di cassa per mese ('YYYY-MM'):
+    - entrate: fatture chiuse alla data incasso (o fattura) + pagamenti
+      parziali delle fatture ancora aperte alla data pagamento
+    - uscite: spese alla data pagamento (o data spesa)
+    data_version serve solo come chiave di cache (vedi finance_data_version).
+    """
+    sql_in = f"""
+        SELECT periodo, SUM(importo) AS importo FROM (
+            SELECT strftime('%Y-%m', COALESCE(i.data_incasso, i.data_fattura)) AS periodo,
+                   i.importo_totale AS importo
+              FROM invoice i
+             WHERE {_INVOICE_CLOSED_SQL}
+            UNION ALL
+            SELECT strftime('%Y-%m', p.payment_date), p.amount
+              FROM payment p
+              JOIN invoice i ON i.invoice_id = p.invoice_id
+             WHERE NOT {_INVOICE_CLOSED_SQL}
+        )
+        WHERE periodo IS NOT NULL
+        GROUP BY periodo
+    """
+    sql_out = """
+        SELECT strftime('%Y-%m', COALESCE(data_pagamento, data)) AS periodo,
+               SUM(importo_totale) AS importo
+          FROM expense
+         WHERE COALESCE(data_pagamento, data) IS NOT NULL
+         GROUP BY periodo
+    """
+    with get_analytics_engine().connect() as conn:
+        df_in = pd.read_sql_query(text(sql_in), conn)
+        df_out = pd.read_sql_query(text(sql_out), conn)
+
+    df = (
+        df_in.rename(columns={"importo": "Entrate_actual"})
+        .merge(df_out.rename(columns={"importo": "Uscite_actual"}), on="periodo", how="outer")
+        .fillna(0.0)
+        .sort_values("periodo")
+        .reset_index(drop=True)
+    )
+    return df
+
+
+@cache_data(CACHE_TTL["transactional"])
+def get_open_receivables(data_version: tuple) -> pd.DataFrame:
+    """Fatture non incassate con importo residuo (totale - pagamenti) > 0."""
+    sql = f"""
+        SELECT i.invoice_id, i.client_id, i.data_fattura, i.data_scadenza,
+               i.importo_totale - IFNULL(SUM(p.amount), 0) AS importo_aperto
+          FROM invoice i
+          LEFT JOIN payment p ON p.invoice_id = i.invoice_id
+         WHERE NOT {_INVOICE_CLOSED_SQL}
+         GROUP BY i.invoice_id
+        HAVING importo_aperto > 0.005
+    """
+    with get_analytics_engine().connect() as conn:
+        df = pd.read_sql_query(text(sql), conn)
+    for col in ("data_fattura", "data_scadenza"):
+        df[col] = pd.to_datetime(df[col], errors="coerce")
+    return df
+
+
+def load_budget_and_events(start: date, months: int) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Budget e eventi puntuali nell'orizzonte, già etichettati per periodo."""
+    periodi = month_labels(start, months)
+    anni = sorted({int(p[:4]) for p in periodi})
+    fine = periodi[-1]
+    with get_analytics_engine().connect() as conn:
+        df_budget = pd.read_sql_query(
+            text(
+                "SELECT anno, mese, categoria, importo_previsto FROM cashflowbudget "
+                f"WHERE anno BETWEEN {anni[0]} AND {anni[-1]}"
+            ),
+            conn,
+        )
+        df_events = pd.read_sql_query(
+            text(
+                "SELECT strftime('%Y-%m', data) AS periodo, "
+                "SUM(CASE WHEN tipo = 'entrata' THEN importo ELSE -importo END) AS Events_netto "
+                "FROM cashflowevent "
+                "WHERE strftime('%Y-%m', data) BETWEEN :inizio AND :fine "
+                "GROUP BY periodo"
+            ),
+            conn,
+            params={"inizio": periodi[0], "fine": fine},
+        )
+
+    if not df_budget.empty:
+        df_budget["periodo"] = (
+            df_budget["anno"].astype(int).astype(str)
+            + "-"
+            + df_budget["mese"].astype(int).map("{:02d}".format)
+        )
+        df_budget = df_budget[df_budget["periodo"].isin(periodi)]
+    return df_budget, df_events
+
+
+# ========================
+# MODELLO RITARDI DI INCASSO PER CLIENTE
+# ========================
+
+# Osservazioni: ogni pagamento (payment_date - data_fattura, peso = importo)
+# e ogni fattura incassata senza righe Payment (data_incasso - data_fattura).
+# Una fattura con entrambe le fonti conta solo con i suoi pagamenti: per questo
+# la firma della parte fatture include anche quali fatture hanno pagamenti.
+_OBS_SELECT = f"""
+    SELECT client_id, giorni, SUM(peso) AS peso, COUNT(*) AS n FROM (
+        SELECT i.client_id AS client_id,
+               CAST(julianday(p.payment_date) - julianday(i.data_fattura) AS INTEGER) AS giorni,
+               p.amount AS peso
+          FROM payment p
+          JOIN invoice i ON i.invoice_id = p.invoice_id
+         WHERE i.data_fattura IS NOT NULL AND p.payment_id > :last_payment_id
+           AND :include_payments = 1
+        UNION ALL
+        SELECT i.client_id,
+               CAST(julianday(i.data_incasso) - julianday(i.data_fattura) AS INTEGER),
+               i.importo_totale
+          FROM invoice i
+         WHERE i.data_incasso IS NOT NULL AND i.data_fattura IS NOT NULL
+           AND NOT EXISTS (SELECT 1 FROM payment p WHERE p.invoice_id = i.invoice_id)
+           AND :include_invoices = 1
+    )
+    WHERE giorni BETWEEN 0 AND {MAX_DELAY_DAYS} AND peso > 0
+    GROUP BY client_id, giorni
+"""
+
+_SIGNATURE_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM payment),
+        (SELECT IFNULL(MAX(payment_id), 0) FROM payment),
+        (SELECT TOTAL(amount) FROM payment),
+        (SELECT TOTAL(julianday(payment_date)) FROM payment),
+        (SELECT COUNT(*) || ':' || TOTAL(julianday(data_incasso)) || ':' || TOTAL(importo_totale)
+                || ':' || TOTAL(julianday(data_fattura)) || ':' || IFNULL(MAX(invoice_id), 0)
+           FROM invoice WHERE data_incasso IS NOT NULL),
+        (SELECT TOTAL(invoice_id) FROM payment)
+"""
+
+_MODEL_LOCK = threading.Lock()
+_MODEL = {
+    "hist_pay": defaultdict(lambda: [0.0, 0]),  # (client_id, giorni) -> [peso, n]
+    "hist_inv": defaultdict(lambda: [0.0, 0]),
+    "pay_signature": None,  # (count, max_id, totale importi, totale date)
+    "inv_signature": None,
+    "compiled": None,
+}
+
+
+def _load_observations(conn, last_payment_id: int, payments: bool, invoices: bool) -> list:
+    return conn.execute(
+        text(_OBS_SELECT),
+        {
+            "last_payment_id": last_payment_id,
+            "include_payments": int(payments),
+            "include_invoices": int(invoices),
+        },
+    ).all()
+
+
+def _compile_model(hist_pay: dict, hist_inv: dict) -> dict | None:
+    """
+    Distribuzioni cumulative in array piatti: segmento 0 = globale, poi un
+    segmento per ogni cliente con abbastanza storico. keys = segmento + CDF,
+    così un solo searchsorted campiona tutte le fatture insieme.
+    """
+    per_client: dict = defaultdict(lambda: defaultdict(float))
+    n_client: dict = defaultdict(int)
+    glob: dict = defaultdict(float)
+    for hist in (hist_pay, hist_inv):
+        for (cid, giorni), (peso, n) in hist.items():
+            if peso <= 0:
+                continue
+            per_client[cid][giorni] += peso
+            n_client[cid] += n
+            glob[giorni] += peso
+    if not glob:
+        return None
+
+    owners = [None] + sorted(c for c in per_client if n_client[c] >= MIN_CLIENT_OBSERVATIONS)
+    keys, vals, starts, lengths = [], [], [], []
+    offset = 0
+    for seg, owner in enumerate(owners):
+        dist = glob if owner is None else per_client[owner]
+        giorni = np.array(sorted(dist), dtype=np.int64)
+        pesi = np.array([dist[g] for g in giorni])
+        cdf = np.cumsum(pesi) / pesi.sum()
+        cdf[-1] = 1.0
+        keys.append(seg + cdf)
+        vals.append(giorni)
+        starts.append(offset)
+        lengths.append(len(giorni))
+        offset += len(giorni)
+
+    return {
+        "keys": np.concatenate(keys),
+        "vals": np.concatenate(vals),
+        # chiave ordinata segmento/giorni per trovare la coda oltre l'età
+        "vals_key": np.concatenate([seg * (MAX_DELAY_DAYS + 1) + v for seg, v in enumerate(vals)]),
+        "seg_start": np.array(starts, dtype=np.int64),
+        "seg_len": np.array(lengths, dtype=np.int64),
+        "seg_of_client": {owner: seg for seg, owner in enumerate(owners) if owner is not None},
+        "n_obs_client": dict(n_client),
+    }
+
+
+def get_collection_model() -> dict | None:
+    """
+    Modello ritardi aggiornato. Ad ogni chiamata costa una query di firma:
+    - nuovi pagamenti (id oltre l'ultimo visto, righe vecchie invariate):
+      si leggono solo quelli e si aggiornano gli istogrammi;
+    - pagamenti modificati/cancellati: si ricarica la parte pagamenti;
+    - fatture incassate cambiate: si ricarica la parte fatture.
+    None se non c'è ancora storico di incassi.
+    """
+    with _MODEL_LOCK, get_analytics_engine().connect() as conn:
+        sig = conn.execute(text(_SIGNATURE_SQL)).one()
+        # parte fatture: incassi su invoice + numero, ultimo id e fatture dei pagamenti
+        pay_sig, inv_sig = tuple(sig[:4]), (sig[4], sig[0], sig[1], sig[5])
+        old_pay = _MODEL["pay_signature"]
+        changed = False
+
+        if old_pay != pay_sig:
+            new_rows = []
+            incremental = False
+            if old_pay is not None and pay_sig[1] > old_pay[1]:
+                new_stats = conn.execute(
+                    text(
+                        "SELECT COUNT(*), TOTAL(amount), TOTAL(julianday(payment_date)) "
+                        "FROM payment WHERE payment_id > :last"
+                    ),
+                    {"last": old_pay[1]},
+                ).one()
+                # le righe già viste sono invariate se i totali tornano
+                incremental = (
+                    old_pay[0] + new_stats[0] == pay_sig[0]
+                    and abs(old_pay[2] + new_stats[1] - pay_sig[2]) < 0.005
+                    and abs(old_pay[3] + new_stats[2] - pay_sig[3]) < 1e-6
+                )
+            if incremental:
+                new_rows = _load_observations(conn, old_pay[1], payments=True, invoices=False)
+            else:
+                _MODEL["hist_pay"].clear()
+                new_rows = _load_observations(conn, 0, payments=True, invoices=False)
+            for cid, giorni, peso, n in new_rows:
+                bucket = _MODEL["hist_pay"][(cid, giorni)]
+                bucket[0] += peso
+                bucket[1] += n
+            _MODEL["pay_signature"] = pay_sig
+            changed = True
+
+        if _MODEL["inv_signature"] != inv_sig:
+            _MODEL["hist_inv"].clear()
+            for cid, giorni, peso, n in _load_observations(conn, 0, payments=False, invoices=True):
+                _MODEL["hist_inv"][(cid, giorni)] = [peso, n]
+            _MODEL["inv_signature"] = inv_sig
+            changed = True
+
+        if changed:
+            _MODEL["compiled"] = _compile_model(_MODEL["hist_pay"], _MODEL["hist_inv"])
+        return _MODEL["compiled"]
+
+
+def sample_collection_delays(
+    model: dict | None,
+    client_ids: np.ndarray,
+    eta: np.ndarray,
+    u: np.ndarray,
+) -> np.ndarray:
+    """
+    Ritardo (giorni da data_fattura) per ogni fattura aperta, dato il
+    quantile u in [0, 1) della coda oltre l'età: u=0.5 è la mediana
+    condizionata, u casuale (shape (n_sims, n)) dà le estrazioni Monte Carlo.
+    Fatture più vecchie di ogni ritardo storico: ritardo = età (incasso ora).
+    """
+    eta = np.asarray(eta, dtype=np.int64)
+    if model is None:
+        return np.broadcast_to(np.maximum(eta, DEFAULT_DELAY_DAYS), np.shape(u)).copy()
+
+    seg_of = model["seg_of_client"]
+    seg = np.fromiter((seg_of.get(c, 0) for c in client_ids), dtype=np.int64, count=len(client_ids))
+    start = model["seg_start"][seg]
+    end = start + model["seg_len"][seg]
+
+    # primo ritardo > età nel segmento e massa cumulata fino a lì
+    pos = np.searchsorted(
+        model["vals_key"], seg * (MAX_DELAY_DAYS + 1) + np.minimum(eta, MAX_DELAY_DAYS), side="right"
+    )
+    coda_vuota = pos >= end
+    cdf_eta = np.where(pos > start, model["keys"][np.maximum(pos - 1, 0)] - seg, 0.0)
+
+    v = seg + cdf_eta + np.asarray(u) * (1.0 - cdf_eta)
+    j = np.minimum(np.searchsorted(model["keys"], v, side="right"), end - 1)
+    return np.where(coda_vuota, eta, model["vals"][j])
+
+
+def collection_model_summary() -> pd.DataFrame:
+    """Per cliente: osservazioni, distribuzione usata e ritardo mediano/p90."""
+    model = get_collection_model()
+    if model is None:
+        return pd.DataFrame(columns=["client_id", "osservazioni", "distribuzione", "mediana_gg", "p90_gg"])
+
+    def _quantile(seg: int, q: float) -> int:
+        a, n = model["seg_start"][seg], model["seg_len"][seg]
+        cdf = model["keys"][a:a + n] - seg
+        return int(model["vals"][a + min(np.searchsorted(cdf, q), n - 1)])
+
+    rows = []
+    for cid, n_obs in model["n_obs_client"].items():
+        seg = model["seg_of_client"].get(cid, 0)
+        rows.append({
+            "client_id": cid,
+            "osservazioni": n_obs,
+            "distribuzione": "cliente" if seg else "globale",
+            "mediana_gg": _quantile(seg, 0.5),
+            "p90_gg": _quantile(seg, 0.9),
+        })
+    return pd.DataFrame(rows).sort_values("osservazioni", ascending=False).reset_index(drop=True)
+
+
+# ========================
+# FORECAST DETERMINISTICO
+# ========================
+
+def place_receivables(
+    df_open: pd.DataFrame,
+    start: date,
+    months: int,
+    model: dict | None,
+    oggi: date | None = None,
+) -> np.ndarray:
+    """
+    Incassi attesi per mese (array lungo 'months') posizionando ogni fattura
+    aperta al ritardo mediano del suo cliente, condizionato all'età della
+    fattura. Nulla cade prima del mese corrente.
+    """
+    out = np.zeros(months)
+    if df_open.empty:
+        return out
+    oggi = oggi or date.today()
+    fatt = df_open["data_fattura"].fillna(pd.Timestamp(oggi))
+    eta = (pd.Timestamp(oggi) - fatt).dt.days.clip(lower=0).to_numpy()
+
+    ritardo = sample_collection_delays(model, df_open["client_id"].to_numpy(), eta, np.full(len(eta), 0.5))
+
+    arrivo = fatt + pd.to_timedelta(ritardo, unit="D")
+    idx = (arrivo.dt.year * 12 + arrivo.dt.month - 1).to_numpy() - month_index(start)
+    idx = np.maximum(idx, month_index(oggi) - month_index(start))
+    mask = (idx >= 0) & (idx < months)
+    np.add.at(out, idx[mask], df_open["importo_aperto"].to_numpy()[mask])
+    return out
+
+
+def expected_receipts(start: date, months: int, oggi: date | None = None) -> np.ndarray:
+    """Incassi attesi dalle fatture aperte per i 'months' mesi da 'start'."""
+    start = date(start.year, start.month, 1)
+    df_open = get_open_receivables(finance_data_version())
+    return place_receivables(df_open, start, months, get_collection_model(), oggi)
+
+
+@timed()
+def build_cashflow_forecast(
+    start: date,
+    months: int,
+    saldo_iniziale: float = 0.0,
+    oggi: date | None = None,
+) -> pd.DataFrame:
+    """
+    Tabella mensile su 'months' mesi da 'start' (primo del mese):
+    consuntivo, budget per macro-categoria, eventi, incassi attesi,
+    netto previsto e saldo (cumsum).
+    """
+    start = date(start.year, start.month, 1)
+    version = finance_data_version()
+    periodi = month_labels(start, months)
+
+    df = pd.DataFrame({"periodo": periodi})
+    df = df.merge(get_monthly_cash_actuals(version), on="periodo", how="left")
+
+    df_budget, df_events = load_budget_and_events(start, months)
+    if not df_budget.empty:
+        df_budget["macro_cat"] = classify_cashflow_categories(df_budget["categoria"])
+        budget_macro = df_budget.pivot_table(
+            index="periodo", columns="macro_cat", values="importo_previsto", aggfunc="sum"
+        )
+    else:
+        budget_macro = pd.DataFrame(index=pd.Index([], name="periodo"))
+    budget_macro = budget_macro.reindex(columns=MACRO_CATEGORIES, fill_value=0.0)
+    budget_macro.columns = [f"Budget_{c}" for c in MACRO_CATEGORIES]
+    df = df.merge(budget_macro.reset_index(), on="periodo", how="left")
+    df = df.merge(df_events, on="periodo", how="left")
+
+    df_open = get_open_receivables(version)
+    df["Incassi_attesi"] = place_receivables(df_open, start, months, get_collection_model(), oggi)
+
+    df = df.fillna(0.0)
+    df["Netto_actual"] = df["Entrate_actual"] - df["Uscite_actual"]
+    df["Netto_budget"] = df[[f"Budget_{c}" for c in MACRO_CATEGORIES]].sum(axis=1)
+    df["Netto_forecast"] = df["Netto_actual"] + df["Netto_budget"] + df["Events_netto"] + df["Incassi_attesi"]
+    df["Saldo_finale"] = saldo_iniziale + df["Netto_forecast"].cumsum()
+    df["Saldo_iniziale"] = df["Saldo_finale"] - df["Netto_forecast"]
+    return df
+
+
+# ========================
+# MONTE CARLO RITARDI DI INCASSO
+# ========================
+
+@timed()
+def simulate_cash_paths(
+    df_forecast: pd.DataFrame,
+    saldo_iniziale: float = 0.0,
+    n_sims: int = 10_000,
+    percentiles: tuple = (5, 25, 50, 75, 95),
+    seed: int | None = None,
+    oggi: date | None = None,
+    batch_size: int = 2_000,
+) -> pd.DataFrame:
+    """
+    Bande percentili del saldo mensile simulando i ritardi di incasso
+    delle fatture aperte (n_sims estrazioni dalla distribuzione del cliente,
+    condizionata all'età di ogni fattura). Il resto del forecast
+    (consuntivo, budget, eventi) è deterministico.
+    """
+    oggi = oggi or date.today()
+    months = len(df_forecast)
+    start = date(int(df_forecast["periodo"].iloc[0][:4]), int(df_forecast["periodo"].iloc[0][5:7]), 1)
+
+    version = finance_data_version()
+    df_open = get_open_receivables(version)
+    model = get_collection_model()
+
+    base = (df_forecast["Netto_forecast"] - df_forecast["Incassi_attesi"]).to_numpy()
+    rng = np.random.default_rng(seed)
+
+    saldi = np.empty((n_sims, months))
+    if df_open.empty:
+        saldi[:] = saldo_iniziale + np.cumsum(base)
+    else:
+        fatt = df_open["data_fattura"].fillna(pd.Timestamp(oggi))
+        eta = (pd.Timestamp(oggi) - fatt).dt.days.clip(lower=0).to_numpy()
+        importi = df_open["importo_aperto"].to_numpy()
+        client_ids = df_open["client_id"].to_numpy()
+        min_idx = month_index(oggi) - month_index(start)
+
+        # tabella giorno -> indice mese dell'orizzonte (evita aritmetica su date nel loop)
+        fatt_days = fatt.to_numpy().astype("datetime64[D]")
+        day0 = fatt_days.min()
+        max_delay = int(max(MAX_DELAY_DAYS, eta.max(), DEFAULT_DELAY_DAYS))
+        giorni = day0 + np.arange((fatt_days.max() - day0).astype(np.int64) + max_delay + 1)
+        start_m = np.datetime64(f"{start.year}-{start.month:02d}", "M")
+        day_to_month = np.maximum((giorni.astype("datetime64[M]") - start_m).astype(np.int64), min_idx)
+        fatt_off = (fatt_days - day0).astype(np.int64)
+
+        # quantili condizionati per fattura (QUANTILE_STEPS x n): nel loop
+        # un'estrazione è solo un indice intero nella tabella
+        u_grid = (np.arange(QUANTILE_STEPS) + 0.5) / QUANTILE_STEPS
+        quantili = sample_collection_delays(
+            model, client_ids, eta, np.broadcast_to(u_grid[:, None], (QUANTILE_STEPS, len(eta)))
+        )
+        arrivo_off = fatt_off + quantili
+        col = np.arange(len(eta))
+
+        for b0 in range(0, n_sims, batch_size):
+            nb = min(batch_size, n_sims - b0)
+            q = rng.integers(0, QUANTILE_STEPS, size=(nb, len(eta)))
+            idx = day_to_month[arrivo_off[q, col]]
+
+            # somma per (simulazione, mese) con un solo bincount
+            valid = (idx >= 0) & (idx < months)
+            flat = (np.arange(nb)[:, None] * months + idx)[valid]
+            pesi = np.broadcast_to(importi, (nb, len(eta)))[valid]
+            incassi = np.bincount(flat, weights=pesi, minlength=nb * months).reshape(nb, months)
+
+            saldi[b0:b0 + nb] = saldo_iniziale + np.cumsum(base + incassi, axis=1)
+
+    bande = np.percentile(saldi, percentiles, axis=0)
+    out = pd.DataFrame({"periodo": df_forecast["periodo"].to_numpy()})
+    for p, values in zip(percentiles, bande):
+        out[f"P{p}"] = values
+    out["Prob_saldo_negativo_%"] = (saldi < 0).mean(axis=0) * 100.0
+    return out
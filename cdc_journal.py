@@ -0,0 +1,543 @@
+# cdc_journal.py
+"""
+Journal CDC (change data capture) del database SQLite.
+
+Trigger AFTER INSERT/UPDATE/DELETE su ogni tabella scrivono in cdc_journal
+una riga per ogni modifica, con sequenza monotona (AUTOINCREMENT):
+    seq | ts | table_name | op (I/U/D) | pk (JSON) | row_json (riga completa, NULL per D)
+
+Essendo trigger, il journal cattura tutte le scritture (session.add/commit
+delle pagine, update in blocco, SQL diretto) senza toccare il codice app.
+
+Cosa ci si fa:
+- replica di lettura (data/forgialean_replica.db) aggiornata applicando
+  solo le modifiche nuove, senza ricopiare il DB;
+- backup incrementali: i segmenti del journal esportati in
+  db_backups/journal/ vengono riapplicati sopra uno snapshot di backup_db;
+- truncate del journal fino alla sequenza già coperta dall'ultimo snapshot.
+
+Uso:
+    python cdc_journal.py install                      # crea journal e trigger
+    python cdc_journal.py replica                      # aggiorna la replica
+    python cdc_journal.py export                       # segmento incrementale
+    python cdc_journal.py replay --snapshot ID --target out.db
+    python cdc_journal.py truncate                     # pulizia fino all'ultimo snapshot
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent
+DB_PATH = Path(os.getenv("FORGIALEAN_DB_PATH", BASE_DIR / "data" / "forgialean.db"))
+REPLICA_PATH = Path(os.getenv("FORGIALEAN_REPLICA_PATH", BASE_DIR / "data" / "forgialean_replica.db"))
+BACKUP_DIR = BASE_DIR / "db_backups"
+JOURNAL_DIR_NAME = "journal"
+
+JOURNAL_TABLE = "cdc_journal"
+STATE_TABLE = "cdc_state"
+TRIGGER_PREFIX = "cdc_"
+
+# Tabelle ad alto volume escluse dal journal: gli eventi macchina OEE (milioni
+# al mese) si ricaricano dai file sorgente, replica e backup ne hanno i rollup
+CDC_EXCLUDED_TABLES = ("oeeevent",)
+
+# Colonne per json_object (limite argomenti delle funzioni SQLite)
+_JSON_CHUNK = 60
+
+# Righe del journal lette/applicate per blocco
+REPLAY_BATCH = 5000
+
+_JOURNAL_DDL = f"""
+CREATE TABLE IF NOT EXISTS {JOURNAL_TABLE} (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    op TEXT NOT NULL,
+    pk TEXT NOT NULL,
+    row_json TEXT
+)
+"""
+
+
+def _q(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+# ========================
+# TRIGGER
+# ========================
+
+def _tracked_tables(conn) -> dict[str, tuple[list[str], list[str]]]:
+    """tabella -> (colonne, colonne chiave); rowid se la tabella non ha PK."""
+    tables = {}
+    rows = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+    ).fetchall()
+    # tabelle virtuali (es. indice FTS5) e loro tabelle ombra: gestite dai propri trigger
+    virtual = [name for name, sql in rows if (sql or "").upper().startswith("CREATE VIRTUAL TABLE")]
+    for name, _ in rows:
+        if name in (JOURNAL_TABLE, STATE_TABLE, *CDC_EXCLUDED_TABLES) or any(name == v or name.startswith(v + "_") for v in virtual):
+            continue
+        info = conn.execute(f"PRAGMA table_info({_q(name)})").fetchall()
+        cols = [r[1] for r in info]
+        pk = [r[1] for r in sorted(info, key=lambda r: r[5]) if r[5]] or ["rowid"]
+        tables[name] = (cols, pk)
+    return tables
+
+
+def _json_expr(alias: str, cols: list[str]) -> str:
+    parts = []
+    for i in range(0, len(cols), _JSON_CHUNK):
+        args = ", ".join(f"'{c}', {alias}.{_q(c)}" for c in cols[i:i + _JSON_CHUNK])
+        parts.append(f"json_object({args})")
+    expr = parts[0]
+    for p in parts[1:]:
+        expr = f"json_patch({expr}, {p})"
+    return expr
+
+
+def trigger_statements(table: str, cols: list[str], pk: list[str]) -> dict[str, str]:
+    """SQL dei trigger CDC per una tabella (nome trigger -> CREATE TRIGGER)."""
+    ins = f"INSERT INTO {JOURNAL_TABLE} (ts, table_name, op, pk, row_json) VALUES (strftime('%Y-%m-%dT%H:%M:%f', 'now'), '{table}'"
+    pk_new, pk_old = _json_expr("NEW", pk), _json_expr("OLD", pk)
+    row_new = _json_expr("NEW", cols)
+    pk_changed = " OR ".join(f"OLD.{_q(c)} IS NOT NEW.{_q(c)}" for c in pk)
+    base = f"{TRIGGER_PREFIX}{table}"
+    return {
+        f"{base}_ai": f"CREATE TRIGGER {_q(base + '_ai')} AFTER INSERT ON {_q(table)} BEGIN {ins}, 'I', {pk_new}, {row_new}); END",
+        f"{base}_au": f"CREATE TRIGGER {_q(base + '_au')} AFTER UPDATE ON {_q(table)} BEGIN {ins}, 'U', {pk_new}, {row_new}); END",
+        # cambio di chiave primaria: la vecchia riga va cancellata nella replica
+        f"{base}_ak": f"CREATE TRIGGER {_q(base + '_ak')} AFTER UPDATE ON {_q(table)} WHEN {pk_changed} BEGIN {ins}, 'D', {pk_old}, NULL); END",
+        f"{base}_ad": f"CREATE TRIGGER {_q(base + '_ad')} AFTER DELETE ON {_q(table)} BEGIN {ins}, 'D', {pk_old}, NULL); END",
+    }
+
+
+def install_cdc_triggers(conn) -> int:
+    """
+    Crea journal e trigger (connessione sqlite3). Ricrea solo i trigger il cui
+    SQL è cambiato (es. colonne aggiunte da migrate_db). Ritorna i trigger creati.
+    """
+    conn.execute(_JOURNAL_DDL)
+    existing = dict(conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE ?",
+        (TRIGGER_PREFIX + "%",),
+    ).fetchall())
+    wanted = {}
+    for table, (cols, pk) in _tracked_tables(conn).items():
+        wanted.update(trigger_statements(table, cols, pk))
+
+    created = 0
+    for name, sql in wanted.items():
+        if existing.get(name) == sql:
+            continue
+        conn.execute(f"DROP TRIGGER IF EXISTS {_q(name)}")
+        conn.execute(sql)
+        created += 1
+    for name in existing.keys() - wanted.keys():
+        conn.execute(f"DROP TRIGGER IF EXISTS {_q(name)}")
+    conn.commit()
+    return created
+
+
+def drop_cdc_triggers(conn) -> None:
+    names = [r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE ?",
+        (TRIGGER_PREFIX + "%",),
+    )]
+    for name in names:
+        conn.execute(f"DROP TRIGGER IF EXISTS {_q(name)}")
+    conn.commit()
+
+
+def journal_seq(conn) -> int:
+    """Ultima sequenza assegnata (vale anche se il journal è stato troncato)."""
+    try:
+        row = conn.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = ?", (JOURNAL_TABLE,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+def installed_journal_seq(conn) -> int | None:
+    """Come journal_seq, ma None se il journal non è installato."""
+    has = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (JOURNAL_TABLE,)
+    ).fetchone()
+    return None if has is None else journal_seq(conn)
+
+
+# ========================
+# INDICI IN MEMORIA
+# ========================
+
+@contextmanager
+def index_snapshot(engine):
+    """
+    Connessione sqlite3 diretta (niente wrapping riga per riga) in una
+    transazione di sola lettura: seq del journal e dati dalla stessa istantanea.
+    """
+    raw = engine.raw_connection()
+    conn = raw.driver_connection
+    try:
+        conn.execute("BEGIN")
+        yield conn
+    finally:
+        conn.rollback()
+        raw.close()
+
+
+def sync_index(conn, state: dict, rebuild, apply_journal, ttl_s: float, between_rebuilds=None) -> None:
+    """
+    Allinea un indice in memoria (segmenti, anagrafica clienti) al DB.
+    state tiene almeno built/seq/built_at; rebuild(conn) lo ricostruisce da zero,
+    apply_journal(conn, after_seq) applica le righe del journal e ritorna
+    l'ultima seq applicata. Senza journal: ricostruzione al massimo ogni ttl_s
+    secondi, in mezzo between_rebuilds(conn) se c'è.
+    Il chiamante tiene il lock dell'indice.
+    """
+    seq = installed_journal_seq(conn)
+    if not state["built"]:
+        rebuild(conn)
+    elif seq is None or state["seq"] is None:
+        if time.monotonic() - state["built_at"] >= ttl_s:
+            rebuild(conn)
+        elif between_rebuilds is not None:
+            between_rebuilds(conn)
+    elif seq != state["seq"]:
+        first = conn.execute(f"SELECT MIN(seq) FROM {JOURNAL_TABLE}").fetchone()[0]
+        # journal troncato oltre la seq applicata (o DB ripristinato): ricostruzione
+        if seq < state["seq"] or first is None or first > state["seq"] + 1:
+            rebuild(conn)
+        else:
+            # seq globale: anche se le ultime modifiche non riguardano l'indice
+            state["seq"] = max(apply_journal(conn, state["seq"]), seq)
+
+
+# ========================
+# REPLAY
+# ========================
+
+def _get_state(conn, key: str) -> int | None:
+    _ensure_state(conn)
+    row = conn.execute(f"SELECT value FROM {STATE_TABLE} WHERE name = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _ensure_state(conn) -> None:
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} (name TEXT PRIMARY KEY, value INTEGER)")
+
+
+def _set_state(conn, key: str, value: int) -> None:
+    _ensure_state(conn)
+    conn.execute(
+        f"INSERT INTO {STATE_TABLE} (name, value) VALUES (?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+        (key, value),
+    )
+
+
+def apply_changes(conn, rows) -> int:
+    """
+    Applica righe del journal (seq, table_name, op, pk, row_json) in ordine di seq.
+    Non fa commit. Ritorna l'ultima seq applicata (0 se nessuna).
+    """
+    last = 0
+    sql_cache: dict = {}
+    for seq, table, op, pk, row_json in rows:
+        if op == "D":
+            key = json.loads(pk)
+            sql = sql_cache.get((table, "D", tuple(key)))
+            if sql is None:
+                where = " AND ".join(f"{_q(c)} = ?" for c in key)
+                sql = sql_cache[(table, "D", tuple(key))] = f"DELETE FROM {_q(table)} WHERE {where}"
+            conn.execute(sql, tuple(key.values()))
+        else:
+            row = json.loads(row_json)
+            sql = sql_cache.get((table, "W", tuple(row)))
+            if sql is None:
+                cols = ", ".join(_q(c) for c in row)
+                marks = ", ".join("?" for _ in row)
+                sql = sql_cache[(table, "W", tuple(row))] = (
+                    f"INSERT OR REPLACE INTO {_q(table)} ({cols}) VALUES ({marks})"
+                )
+            conn.execute(sql, tuple(row.values()))
+        last = seq
+    return last
+
+
+def read_journal(conn, after_seq: int, batch: int = REPLAY_BATCH):
+    """Righe del journal con seq > after_seq, lette a blocchi."""
+    while True:
+        rows = conn.execute(
+            f"SELECT seq, table_name, op, pk, row_json FROM {JOURNAL_TABLE} "
+            "WHERE seq > ? ORDER BY seq LIMIT ?",
+            (after_seq, batch),
+        ).fetchall()
+        if not rows:
+            return
+        yield rows
+        after_seq = rows[-1][0]
+
+
+def _journal_bounds(conn) -> tuple[int | None, int]:
+    try:
+        first = conn.execute(f"SELECT MIN(seq) FROM {JOURNAL_TABLE}").fetchone()[0]
+    except sqlite3.OperationalError:
+        first = None
+    return first, journal_seq(conn)
+
+
+# ========================
+# REPLICA DI LETTURA
+# ========================
+
+def _rebuild_replica(source: Path, replica: Path) -> int:
+    tmp = replica.with_suffix(".tmp")
+    tmp.unlink(missing_ok=True)
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(tmp)
+    try:
+        src.backup(dst)
+        drop_cdc_triggers(dst)
+        seq = journal_seq(dst)
+        dst.execute(_JOURNAL_DDL)
+        dst.execute(f"DELETE FROM {JOURNAL_TABLE}")
+        _set_state(dst, "applied_seq", seq)
+        dst.commit()
+        dst.execute("VACUUM")
+    finally:
+        dst.close()
+        src.close()
+    os.replace(tmp, replica)
+    return seq
+
+
+def refresh_replica(source: Path = DB_PATH, replica: Path = REPLICA_PATH) -> dict:
+    """
+    Porta la replica allo stato del DB sorgente applicando solo il journal nuovo.
+    Ricostruisce da zero (backup API) se la replica manca, se il journal ha un
+    buco o se il sorgente non ha journal (CDC spento).
+    """
+    t0 = time.perf_counter()
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    try:
+        has_journal = src.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (JOURNAL_TABLE,)
+        ).fetchone() is not None
+        first, last = _journal_bounds(src)
+        applied = None
+        if replica.exists():
+            rep = sqlite3.connect(replica)
+            applied = _get_state(rep, "applied_seq")
+            rep.close()
+
+        gap = not has_journal or applied is None or applied > last or (first is not None and first > applied + 1)
+        if gap:
+            src.close()
+            seq = _rebuild_replica(source, replica)
+            return {"mode": "rebuild", "applied_seq": seq, "changes": 0,
+                    "elapsed_s": round(time.perf_counter() - t0, 3)}
+
+        rep = sqlite3.connect(replica)
+        changes = 0
+        try:
+            for rows in read_journal(src, applied):
+                applied = apply_changes(rep, rows)
+                _set_state(rep, "applied_seq", applied)
+                rep.commit()
+                changes += len(rows)
+        finally:
+            rep.close()
+        return {"mode": "incremental", "applied_seq": applied, "changes": changes,
+                "elapsed_s": round(time.perf_counter() - t0, 3)}
+    finally:
+        src.close()
+
+
+# ========================
+# SEGMENTI INCREMENTALI
+# ========================
+
+def _journal_dir(backup_dir: Path) -> Path:
+    d = backup_dir / JOURNAL_DIR_NAME
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
+
+def _segments(backup_dir: Path) -> list[tuple[int, int, Path]]:
+    out = []
+    for p in _journal_dir(backup_dir).glob("cdc_*.jsonl.gz"):
+        start, end = p.name[4:].split(".")[0].split("_")
+        out.append((int(start), int(end), p))
+    return sorted(out)
+
+
+def export_journal(source: Path = DB_PATH, backup_dir: Path = BACKUP_DIR) -> Path | None:
+    """Scrive le righe successive all'ultimo segmento in cdc_<da>_<a>.jsonl.gz."""
+    segments = _segments(backup_dir)
+    after = segments[-1][1] if segments else 0
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    try:
+        first, last = _journal_bounds(src)
+        if last <= after:
+            return None
+        if first is not None and first > after + 1 and segments:
+            print(f"⚠️ Journal troncato oltre l'ultimo segmento ({after}): serve un nuovo snapshot")
+        path = _journal_dir(backup_dir) / f"cdc_{after + 1:012d}_{last:012d}.jsonl.gz"
+        tmp = path.with_suffix(".tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            for rows in read_journal(src, after):
+                for row in rows:
+                    if row[0] > last:
+                        break
+                    f.write(json.dumps(row) + "\n")
+        os.replace(tmp, path)
+        return path
+    finally:
+        src.close()
+
+
+def replay_segments(target: Path, backup_dir: Path = BACKUP_DIR, keep_triggers: bool = True) -> dict:
+    """
+    Applica a target (tipicamente uno snapshot ripristinato) i segmenti con
+    seq successive a quella già contenuta nel file.
+    """
+    t0 = time.perf_counter()
+    conn = sqlite3.connect(target)
+    try:
+        applied = journal_seq(conn)
+        drop_cdc_triggers(conn)
+        changes = 0
+        for start, end, path in _segments(backup_dir):
+            if end <= applied:
+                continue
+            if start > applied + 1:
+                raise ValueError(f"Segmento mancante: journal fermo a {applied}, segmento successivo da {start}")
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                batch = []
+                for line in f:
+                    row = json.loads(line)
+                    if row[0] <= applied:
+                        continue
+                    batch.append(row)
+                    if len(batch) >= REPLAY_BATCH:
+                        applied = apply_changes(conn, batch)
+                        changes += len(batch)
+                        batch = []
+                if batch:
+                    applied = apply_changes(conn, batch)
+                    changes += len(batch)
+        # le nuove scritture continuano la sequenza dopo l'ultima applicata
+        conn.execute(_JOURNAL_DDL)
+        if applied > journal_seq(conn):
+            cur = conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (applied, JOURNAL_TABLE))
+            if cur.rowcount == 0:
+                conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (JOURNAL_TABLE, applied))
+        conn.commit()
+        if keep_triggers:
+            install_cdc_triggers(conn)
+        return {"applied_seq": applied, "changes": changes, "elapsed_s": round(time.perf_counter() - t0, 3)}
+    finally:
+        conn.close()
+
+
+def truncate_journal(source: Path = DB_PATH, backup_dir: Path = BACKUP_DIR, replica: Path | None = None) -> int:
+    """
+    Cancella le righe del journal che nessun consumatore deve più leggere.
+    Lato backup una riga è coperta se sta nell'ultimo snapshot (cdc_seq del manifest)
+    o in un segmento già esportato; con replica indicata deve essere anche già
+    applicata alla replica. Senza snapshot, segmenti né replica non cancella nulla.
+    """
+    import backup_db
+
+    bounds = []
+    snaps = backup_db.list_snapshots(backup_dir)
+    segments = _segments(backup_dir)
+    if snaps or segments:
+        snap_seq = backup_db.load_manifest(snaps[-1]).get("cdc_seq", 0) if snaps else 0
+        bounds.append(max(snap_seq, segments[-1][1] if segments else 0))
+    if replica is not None and replica.exists():
+        rep = sqlite3.connect(f"file:{replica}?mode=ro", uri=True)
+        try:
+            applied = rep.execute(f"SELECT value FROM {STATE_TABLE} WHERE name = 'applied_seq'").fetchone()
+        except sqlite3.OperationalError:
+            applied = None
+        finally:
+            rep.close()
+        bounds.append(applied[0] if applied else 0)
+    if not bounds:
+        return 0
+
+    conn = sqlite3.connect(source)
+    try:
+        cur = conn.execute(f"DELETE FROM {JOURNAL_TABLE} WHERE seq <= ?", (min(bounds),))
+        conn.commit()
+        return cur.rowcount
+    except sqlite3.OperationalError:
+        # journal mai installato (CDC spento)
+        return 0
+    finally:
+        conn.close()
+
+
+# ========================
+# CLI
+# ========================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Journal CDC del DB ForgiaLean")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--backup-dir", type=Path, default=BACKUP_DIR)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    sub.add_parser("install", help="crea journal e trigger")
+    p_rep = sub.add_parser("replica", help="aggiorna la replica di lettura")
+    p_rep.add_argument("--replica", type=Path, default=REPLICA_PATH)
+    sub.add_parser("export", help="esporta un segmento incrementale del journal")
+    p_replay = sub.add_parser("replay", help="ripristina uno snapshot e applica i segmenti")
+    p_replay.add_argument("--snapshot", default=None, help="ID snapshot (default: il più recente)")
+    p_replay.add_argument("--target", type=Path, required=True)
+    p_trunc = sub.add_parser("truncate", help="pulisce il journal già coperto da snapshot/segmenti")
+    p_trunc.add_argument("--replica", type=Path, default=None,
+                         help="conserva anche le righe non ancora applicate a questa replica")
+
+    args = parser.parse_args(argv)
+
+    if args.cmd == "install":
+        conn = sqlite3.connect(args.db)
+        n = install_cdc_triggers(conn)
+        conn.close()
+        print(f"✅ Journal CDC attivo ({n} trigger creati/aggiornati)")
+
+    elif args.cmd == "replica":
+        res = refresh_replica(args.db, args.replica)
+        print(f"✅ Replica {res['mode']}: {res['changes']} modifiche, seq {res['applied_seq']} ({res['elapsed_s']:.2f}s)")
+
+    elif args.cmd == "export":
+        path = export_journal(args.db, args.backup_dir)
+        print(f"✅ Segmento {path.name}" if path else "ℹ️ Nessuna modifica da esportare")
+
+    elif args.cmd == "replay":
+        import backup_db
+
+        if args.target.exists():
+            raise SystemExit(f"⚠️ {args.target} esiste già")
+        manifest = backup_db._resolve_manifest(args.backup_dir, args.snapshot)
+        backup_db.restore_snapshot(manifest, args.target, args.backup_dir)
+        res = replay_segments(args.target, args.backup_dir)
+        print(f"✅ {manifest['snapshot_id']} + {res['changes']} modifiche (seq {res['applied_seq']}) in {args.target}")
+
+    elif args.cmd == "truncate":
+        print(f"🧹 {truncate_journal(args.db, args.backup_dir, args.replica)} righe del journal rimosse")
+
+
+if __name__ == "__main__":
+    main()
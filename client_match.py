@@ -0,0 +1,418 @@
+# client_match.py
+"""
+Ricerca clienti duplicati (lead capture, anagrafica, pulizia in blocco).
+
+Chiavi normalizzate per ogni cliente, tenute in un indice in memoria:
+- fiscale: P.IVA (senza prefisso IT, solo cifre) e codice fiscale
+  (maiuscolo alfanumerico; per le società coincide con la P.IVA);
+- dominio email aziendale (i provider gratuiti tipo gmail.com sono ignorati);
+- ragione sociale normalizzata (senza accenti, punteggiatura e forme
+  giuridiche srl/spa/snc...) e indice inverso dei suoi trigrammi.
+
+Lookup di un candidato: chiavi esatte + conteggio sui trigrammi più rari
+della ragione sociale (le liste dei trigrammi comuni non si scorrono),
+poi punteggio Jaccard solo sui pochi candidati -> sotto il millisecondo
+anche con 100k clienti.
+
+Doppioni su tutta l'anagrafica (find_duplicate_clusters): blocchi per
+chiave esatta + sorted neighbourhood sulla ragione sociale (ordinamento
+per nome e per nome a parole invertite, confronto con i vicini in una
+finestra), quindi O(n log n); coppie unite in cluster con union-find.
+
+L'indice si aggiorna come quello dei segmenti: journal CDC (tabella client)
+se installato, altrimenti lettura dei soli client_id nuovi e ricostruzione
+completa al massimo ogni CLIENT_INDEX_TTL_S secondi.
+
+Uso:
+    from client_match import find_client_candidates
+    find_client_candidates("Rossi Meccanica S.r.l.", piva="IT01234567890")
+"""
+
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+
+import pandas as pd
+from sqlalchemy import text
+
+from cdc_journal import JOURNAL_TABLE, index_snapshot, installed_journal_seq, sync_index
+from db import engine
+
+# Senza journal CDC: ricostruzione completa (modifiche/eliminazioni) al massimo ogni N secondi
+CLIENT_INDEX_TTL_S = 300
+
+# Punteggio oltre il quale due clienti sono considerati lo stesso
+DUPLICATE_THRESHOLD = 0.8
+
+# Punteggio minimo per proporre un cliente come possibile doppione
+CANDIDATE_THRESHOLD = 0.5
+
+# Trigrammi (i più rari) usati per generare i candidati di un nome
+CANDIDATE_GRAMS = 8
+
+# Lunghezza minima oltre la quale la lista di un trigramma è troppo comune per
+# generare candidati (cresce con l'anagrafica: 0,5% dei clienti)
+MAX_GRAM_POSTING = 100
+
+# Candidati per nome valutati con il punteggio completo
+MAX_SCORED_CANDIDATES = 50
+
+# Vicini confrontati nel sorted neighbourhood del batch
+NEIGHBOUR_WINDOW = 5
+
+# Blocchi per chiave esatta più grandi di così non sono informativi (es. dominio di un gruppo)
+MAX_BLOCK_SIZE = 25
+
+FORME_GIURIDICHE = {
+    "srl", "srls", "spa", "snc", "sas", "sapa", "scarl", "scrl", "sc", "soc", "societa",
+    "coop", "cooperativa", "ditta", "sa", "ltd", "gmbh", "inc", "unipersonale", "semplificata",
+    "di", "e", "the", "and",
+}
+
+DOMINI_GENERICI = {
+    "gmail.com", "googlemail.com", "libero.it", "hotmail.com", "hotmail.it", "outlook.com",
+    "outlook.it", "live.com", "live.it", "yahoo.com", "yahoo.it", "icloud.com", "me.com",
+    "tiscali.it", "virgilio.it", "alice.it", "tin.it", "fastwebnet.it", "email.it",
+    "pec.it", "legalmail.it", "arubapec.it", "protonmail.com", "msn.com", "aol.com",
+}
+
+_INDEX: dict = {
+    "built": False,
+    "seq": None,         # ultima seq CDC applicata (None = journal non disponibile)
+    "built_at": 0.0,
+    "max_id": 0,         # client_id più alto letto (senza journal)
+    "rows": {},          # client_id -> (ragione_sociale, nome_norm, chiavi fiscali, dominio)
+    "grams": {},         # client_id -> frozenset trigrammi
+    "by_gram": {},       # trigramma -> set client_id
+    "by_fiscal": {},     # chiave fiscale -> set client_id
+    "by_domain": {},     # dominio -> set client_id
+}
+_INDEX_LOCK = threading.Lock()
+
+
+# ========================
+# NORMALIZZAZIONE
+# ========================
+
+def normalize_piva(value) -> str:
+    """'IT 01234567890' -> '01234567890' (le P.IVA estere restano alfanumeriche maiuscole)."""
+    if not value:
+        return ""
+    s = re.sub(r"[^A-Z0-9]", "", str(value).upper())
+    if s.startswith("IT") and s[2:].isdigit():
+        s = s[2:]
+    return s
+
+
+def normalize_cf(value) -> str:
+    return re.sub(r"[^A-Z0-9]", "", str(value).upper()) if value else ""
+
+
+def email_domain(email) -> str:
+    """Dominio dell'email, vuoto se manca o se è un provider generico."""
+    if not email or "@" not in str(email):
+        return ""
+    domain = str(email).strip().lower().rsplit("@", 1)[1].strip(" .>")
+    return "" if domain in DOMINI_GENERICI else domain
+
+
+def normalize_name(name) -> str:
+    """'Rossi Meccanica S.r.l.' e 'ROSSI MECCANICA SRL' -> 'rossi meccanica'."""
+    if not name:
+        return ""
+    s = unicodedata.normalize("NFKD", str(name))
+    s = "".join(ch for ch in s if not unicodedata.combining(ch)).lower()
+    s = re.sub(r"(?<![a-z0-9])([a-z0-9])\.(?=[a-z0-9](?:\.|\b))", r"\1", s)  # s.r.l. -> srl
+    s = s.replace("&", " e ")
+    tokens = [t for t in re.sub(r"[^a-z0-9]+", " ", s).split() if t not in FORME_GIURIDICHE]
+    return " ".join(tokens)
+
+
+def name_trigrams(name_norm: str) -> frozenset:
+    if not name_norm:
+        return frozenset()
+    s = f"  {name_norm} "
+    return frozenset(s[i:i + 3] for i in range(len(s) - 2))
+
+
+def _fiscal_keys(piva, cod_fiscale) -> tuple:
+    return tuple(k for k in dict.fromkeys((normalize_piva(piva), normalize_cf(cod_fiscale))) if k)
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    inter = len(a & b)
+    return inter / (len(a) + len(b) - inter)
+
+
+def match_score(fiscal_a, domain_a, grams_a, fiscal_b, domain_b, grams_b) -> tuple[float, str]:
+    """
+    Punteggio 0..1 e motivo:
+    stessa P.IVA/CF = 1; altrimenti Jaccard dei trigrammi del nome,
+    +0.3 se stesso dominio email; P.IVA diverse su entrambi -> massimo 0.5.
+    """
+    if fiscal_a and fiscal_b and set(fiscal_a) & set(fiscal_b):
+        return 1.0, "P.IVA/CF"
+    score = _jaccard(grams_a, grams_b)
+    reason = "nome"
+    if domain_a and domain_a == domain_b:
+        score = min(1.0, score + 0.3)
+        reason = "nome + dominio email" if score > 0.3 else "dominio email"
+    if fiscal_a and fiscal_b:
+        score = min(score, 0.5)
+    return round(score, 3), reason
+
+
+# ========================
+# INDICE
+# ========================
+
+def _add(client_id: int, ragione_sociale, piva, cod_fiscale, email) -> None:
+    name = normalize_name(ragione_sociale)
+    fiscal = _fiscal_keys(piva, cod_fiscale)
+    domain = email_domain(email)
+    grams = name_trigrams(name)
+    _INDEX["rows"][client_id] = (ragione_sociale, name, fiscal, domain)
+    _INDEX["grams"][client_id] = grams
+    for g in grams:
+        _INDEX["by_gram"].setdefault(g, set()).add(client_id)
+    for k in fiscal:
+        _INDEX["by_fiscal"].setdefault(k, set()).add(client_id)
+    if domain:
+        _INDEX["by_domain"].setdefault(domain, set()).add(client_id)
+    _INDEX["max_id"] = max(_INDEX["max_id"], client_id)
+
+
+def _remove(client_id: int) -> None:
+    row = _INDEX["rows"].pop(client_id, None)
+    if row is None:
+        return
+    _, _, fiscal, domain = row
+    for g in _INDEX["grams"].pop(client_id, ()):
+        _INDEX["by_gram"][g].discard(client_id)
+    for k in fiscal:
+        _INDEX["by_fiscal"][k].discard(client_id)
+    if domain:
+        _INDEX["by_domain"][domain].discard(client_id)
+
+
+_CLIENT_SQL = "SELECT client_id, ragione_sociale, piva, cod_fiscale, email FROM client"
+
+
+def _rebuild(conn) -> None:
+    seq = installed_journal_seq(conn)
+    _INDEX.update(rows={}, grams={}, by_gram={}, by_fiscal={}, by_domain={}, max_id=0)
+    for row in conn.execute(_CLIENT_SQL):
+        _add(*row)
+    _INDEX.update(built=True, seq=seq, built_at=time.monotonic())
+
+
+def _apply_journal(conn, after_seq: int) -> int:
+    rows = conn.execute(
+        f"SELECT seq, op, pk, row_json FROM {JOURNAL_TABLE} "
+        "WHERE seq > ? AND table_name = 'client' ORDER BY seq",
+        (after_seq,),
+    ).fetchall()
+    for seq, op, pk, row_json in rows:
+        client_id = next(iter(json.loads(pk).values()))
+        _remove(client_id)
+        if op != "D":
+            r = json.loads(row_json)
+            _add(client_id, r.get("ragione_sociale"), r.get("piva"), r.get("cod_fiscale"), r.get("email"))
+        after_seq = seq
+    return after_seq
+
+
+def refresh_index() -> dict:
+    """Allinea l'indice al DB (incrementale se possibile). Ritorna lo stato."""
+    with index_snapshot(engine) as conn, _INDEX_LOCK:
+        sync_index(conn, _INDEX, _rebuild, _apply_journal, CLIENT_INDEX_TTL_S, between_rebuilds=_add_new_clients)
+        return index_stats()
+
+
+def _add_new_clients(conn) -> None:
+    # senza journal si vedono subito almeno i clienti nuovi
+    for row in conn.execute(f"{_CLIENT_SQL} WHERE client_id > ?", (_INDEX["max_id"],)):
+        _add(*row)
+
+
+def index_stats() -> dict:
+    return {
+        "clients": len(_INDEX["rows"]),
+        "trigrams": len(_INDEX["by_gram"]),
+        "fiscal_keys": len(_INDEX["by_fiscal"]),
+        "domains": len(_INDEX["by_domain"]),
+        "seq": _INDEX["seq"],
+    }
+
+
+def invalidate_index() -> None:
+    with _INDEX_LOCK:
+        _INDEX["built"] = False
+
+
+# ========================
+# LOOKUP SINGOLO
+# ========================
+
+def _gram_candidates(grams: frozenset, exclude: int | None = None) -> set:
+    """
+    Clienti che condividono almeno metà dei trigrammi rari del nome (al massimo
+    MAX_SCORED_CANDIDATES, quelli con più trigrammi in comune).
+    I trigrammi comuni (liste oltre MAX_GRAM_POSTING) non generano candidati:
+    contano solo nel punteggio.
+    """
+    limit = max(MAX_GRAM_POSTING, len(_INDEX["rows"]) // 200)
+    postings = sorted((_INDEX["by_gram"][g] for g in grams if _INDEX["by_gram"].get(g)), key=len)
+    if not postings:
+        return set()
+    postings = [p for p in postings[:CANDIDATE_GRAMS] if len(p) <= limit] or postings[:1]
+    counts = Counter()
+    for ids in postings:
+        counts.update(ids)
+    counts.pop(exclude, None)
+    need = max(1, len(postings) // 2)
+    # solo i più sovrapposti arrivano al punteggio Jaccard completo
+    return {cid for cid, n in counts.most_common(MAX_SCORED_CANDIDATES) if n >= need}
+
+
+def find_client_candidates(
+    ragione_sociale: str | None = None,
+    piva: str | None = None,
+    cod_fiscale: str | None = None,
+    email: str | None = None,
+    limit: int = 5,
+    min_score: float = CANDIDATE_THRESHOLD,
+    exclude_id: int | None = None,
+) -> list[dict]:
+    """
+    Clienti esistenti che potrebbero essere lo stesso soggetto, dal più simile:
+    [{client_id, ragione_sociale, score, motivo}].
+    """
+    refresh_index()
+    fiscal = _fiscal_keys(piva, cod_fiscale)
+    domain = email_domain(email)
+    grams = name_trigrams(normalize_name(ragione_sociale))
+
+    with _INDEX_LOCK:
+        candidates = _gram_candidates(grams, exclude_id)
+        for k in fiscal:
+            candidates |= _INDEX["by_fiscal"].get(k, set())
+        if domain:
+            candidates |= _INDEX["by_domain"].get(domain, set())
+        candidates.discard(exclude_id)
+
+        out = []
+        for cid in candidates:
+            row = _INDEX["rows"].get(cid)
+            if row is None:
+                continue
+            score, reason = match_score(fiscal, domain, grams, row[2], row[3], _INDEX["grams"][cid])
+            if score >= min_score:
+                out.append({"client_id": cid, "ragione_sociale": row[0], "score": score, "motivo": reason})
+    out.sort(key=lambda c: (-c["score"], c["client_id"]))
+    return out[:limit]
+
+
+# Motivi abbastanza forti per collegare un cliente senza conferma: un nome solo
+# simile no, la stessa ragione sociale normalizzata sì
+AUTO_LINK_REASONS = ("P.IVA/CF", "nome + dominio email")
+
+
+def best_client_match(ragione_sociale=None, piva=None, cod_fiscale=None, email=None) -> int | None:
+    """
+    client_id del cliente sicuramente uguale: stessa P.IVA/CF, stessa ragione sociale
+    normalizzata, oppure nome simile e stesso dominio email con score >= DUPLICATE_THRESHOLD.
+    Altrimenti None (i candidati solo simili per nome vanno confermati da un utente,
+    vedi find_client_candidates).
+    """
+    found = find_client_candidates(ragione_sociale, piva, cod_fiscale, email, min_score=DUPLICATE_THRESHOLD)
+    name = normalize_name(ragione_sociale)
+    strong = [
+        c for c in found
+        if c["motivo"] in AUTO_LINK_REASONS
+        or (c["motivo"] == "nome" and c["score"] >= 1.0 and normalize_name(c["ragione_sociale"]) == name)
+    ]
+    return strong[0]["client_id"] if strong else None
+
+
+# ========================
+# DOPPIONI SU TUTTA L'ANAGRAFICA
+# ========================
+
+def _find(parent: dict, x: int) -> int:
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+def find_duplicate_clusters(min_score: float = DUPLICATE_THRESHOLD, window: int = NEIGHBOUR_WINDOW) -> pd.DataFrame:
+    """
+    Gruppi di clienti probabilmente duplicati.
+    Colonne: cluster, client_id, ragione_sociale, piva, email, score (migliore
+    coppia che lo lega al gruppo), motivo. Vuoto se non ci sono doppioni.
+    """
+    refresh_index()
+    with _INDEX_LOCK:
+        rows = dict(_INDEX["rows"])
+        grams = dict(_INDEX["grams"])
+        blocks = [ids for d in (_INDEX["by_fiscal"], _INDEX["by_domain"]) for ids in d.values() if 1 < len(ids) <= MAX_BLOCK_SIZE]
+        blocks = [sorted(ids) for ids in blocks]
+
+    # coppie candidate: blocchi esatti + vicini nei due ordinamenti del nome
+    pairs = set()
+    for ids in blocks:
+        pairs.update((a, b) for i, a in enumerate(ids) for b in ids[i + 1:])
+    named = [(r[1], cid) for cid, r in rows.items() if r[1]]
+    for key in (lambda t: t[0], lambda t: " ".join(reversed(t[0].split()))):
+        ordered = [cid for _, cid in sorted(named, key=lambda t: (key(t), t[1]))]
+        for i, a in enumerate(ordered):
+            for b in ordered[i + 1:i + window]:
+                pairs.add((min(a, b), max(a, b)))
+
+    parent: dict = {}
+    best: dict = {}
+    for a, b in pairs:
+        ra, rb = rows[a], rows[b]
+        score, reason = match_score(ra[2], ra[3], grams[a], rb[2], rb[3], grams[b])
+        if score < min_score:
+            continue
+        for x in (a, b):
+            parent.setdefault(x, x)
+            if score > best.get(x, (0, ""))[0]:
+                best[x] = (score, reason)
+        parent[_find(parent, a)] = _find(parent, b)
+
+    if not parent:
+        return pd.DataFrame(columns=["cluster", "client_id", "ragione_sociale", "piva", "email", "score", "motivo"])
+
+    df = pd.DataFrame({"client_id": list(parent)})
+    df["root"] = df["client_id"].map(lambda x: _find(parent, x))
+    df["ragione_sociale"] = df["client_id"].map(lambda x: rows[x][0])
+    df["score"] = df["client_id"].map(lambda x: best[x][0])
+    df["motivo"] = df["client_id"].map(lambda x: best[x][1])
+    with engine.connect() as conn:
+        extra = pd.read_sql(
+            text("SELECT client_id, piva, email FROM client WHERE client_id IN (SELECT value FROM json_each(:ids))"),
+            conn,
+            params={"ids": json.dumps([int(x) for x in parent])},
+        )
+    df = df.merge(extra, on="client_id", how="left")
+    df = df.sort_values(["root", "client_id"])
+    df["cluster"] = df.groupby("root", sort=False).ngroup() + 1
+    return df[["cluster", "client_id", "ragione_sociale", "piva", "email", "score", "motivo"]].reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    t0 = time.perf_counter()
+    stats = refresh_index()
+    print(f"✅ Indice clienti: {stats['clients']} clienti, {stats['trigrams']} trigrammi ({time.perf_counter() - t0:.2f}s)")
+    t0 = time.perf_counter()
+    clusters = find_duplicate_clusters()
+    n = clusters["cluster"].nunique() if not clusters.empty else 0
+    print(f"🔍 {n} gruppi di possibili doppioni ({len(clusters)} clienti) in {time.perf_counter() - t0:.2f}s")
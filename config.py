@@ -46,6 +46,73 @@ CACHE_TTL = {
 # Disabilitare cache completamente in development (utile per debug)
 CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
 
+# ========================
+# PERFORMANCE MONITOR (opt-in)
+# ========================
+# Se attivo misura pagine, query SQL, cache e chiamate esterne (vedi perf_monitor.py)
+PERF_MONITOR_ENABLED = os.getenv("PERF_MONITOR_ENABLED", "false").lower() == "true"
+
+# Numero massimo di campioni in memoria per tipo (page, query, cache, ...)
+PERF_MONITOR_MAX_SAMPLES = int(os.getenv("PERF_MONITOR_MAX_SAMPLES", "5000"))
+
+# ========================
+# JOURNAL CDC E REPLICA ANALITICA (vedi cdc_journal.py)
+# ========================
+# Replica analitica (opt-in): le pagine finanza leggono da una copia di sola lettura
+# aggiornata con il journal CDC, così i report non rallentano le scritture CRM
+ANALYTICS_REPLICA_ENABLED = os.getenv("ANALYTICS_REPLICA_ENABLED", "false").lower() == "true"
+
+# Trigger SQLite che registrano ogni modifica per replica e backup incrementali.
+# Di default attivi solo con la replica; spenti, migrate_db rimuove i trigger esistenti
+CDC_JOURNAL_ENABLED = os.getenv(
+    "CDC_JOURNAL_ENABLED", "true" if ANALYTICS_REPLICA_ENABLED else "false"
+).lower() == "true"
+
+# Ogni quanti secondi (al massimo) l'app pulisce il journal già applicato alla
+# replica e coperto dai backup (l'export dei segmenti lo fa il workflow di backup)
+CDC_JOURNAL_TRUNCATE_INTERVAL_S = int(os.getenv("CDC_JOURNAL_TRUNCATE_INTERVAL_S", "86400"))
+
+# Ritardo massimo (secondi) della replica rispetto al DB principale
+ANALYTICS_REPLICA_REFRESH_S = int(os.getenv("ANALYTICS_REPLICA_REFRESH_S", "30"))
+
+# ========================
+# ROLLUP ORE TIMESHEET
+# ========================
+# Ogni quanti secondi (al massimo) riverificare ore_consumate di fasi e commesse
+# contro la somma reale delle righe timesheet
+TIMESHEET_RECONCILE_INTERVAL_S = int(os.getenv("TIMESHEET_RECONCILE_INTERVAL_S", "3600"))
+
+# ========================
+# INVIO EMAIL SMTP (vedi email_sender.py)
+# ========================
+# Messaggi al minuto verso il server SMTP (0 = nessun limite) e picco consentito
+EMAIL_RATE_PER_MIN = int(os.getenv("EMAIL_RATE_PER_MIN", "120"))
+EMAIL_RATE_BURST = int(os.getenv("EMAIL_RATE_BURST", "20"))
+
+# Tentativi per errori temporanei (4xx, disconnessioni), con attesa crescente
+EMAIL_MAX_RETRIES = int(os.getenv("EMAIL_MAX_RETRIES", "3"))
+EMAIL_RETRY_BACKOFF_S = float(os.getenv("EMAIL_RETRY_BACKOFF_S", "2"))
+
+# Messaggi per connessione prima di riconnettersi e secondi di inattività prima di chiuderla
+EMAIL_MAX_PER_CONNECTION = int(os.getenv("EMAIL_MAX_PER_CONNECTION", "100"))
+EMAIL_IDLE_CLOSE_S = float(os.getenv("EMAIL_IDLE_CLOSE_S", "30"))
+
+# Messaggi massimi in coda (oltre, enqueue solleva queue.Full)
+EMAIL_QUEUE_MAX = int(os.getenv("EMAIL_QUEUE_MAX", "10000"))
+
+# ========================
+# DATI OEE DI LINEA (vedi oee_store.py)
+# ========================
+# Ore di inizio turno (il primo turno apre la giornata produttiva: gli eventi
+# prima delle 6 appartengono al turno di notte del giorno precedente)
+OEE_TURNI_INIZIO = tuple(int(h) for h in os.getenv("OEE_TURNI_INIZIO", "6,14,22").split(","))
+
+# Eventi macchina scritti per transazione (insieme ai rollup turno/giorno/settimana)
+OEE_INGEST_BATCH_ROWS = int(os.getenv("OEE_INGEST_BATCH_ROWS", "50000"))
+
+# Giorni di eventi grezzi da conservare (0 = per sempre); i rollup restano
+OEE_RAW_RETENTION_DAYS = int(os.getenv("OEE_RAW_RETENTION_DAYS", "0"))
+
 # ========================
 # TRACKING (GA4, Facebook)
 # ========================
@@ -112,6 +179,8 @@ PAGES_BY_ROLE = {
         "Operations / Commesse",
         "People & Reparti",
         "Capacità People",
+        "Performance",
+        "Dati OEE",
     ],
     "user": [
         "Presentazione",
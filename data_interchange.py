@@ -0,0 +1,352 @@
+# data_interchange.py
+"""
+Export/import in blocco delle tabelle SQLModel in formato Parquet (pyarrow).
+
+- schema Arrow ricavato dai modelli di db.py (tipi e nullabilità delle colonne);
+- lettura a blocchi da cursore SQLite (fetchmany) e scrittura incrementale
+  con ParquetWriter: la memoria dipende da PARQUET_CHUNK_ROWS, non dalla
+  dimensione della tabella;
+- import a blocchi (iter_batches + executemany) in una transazione per
+  tabella, modalità replace / append / upsert;
+- benchmark di andata e ritorno confrontato con l'export Excel attuale.
+
+Uso:
+    python data_interchange.py export --out export_parquet/
+    python data_interchange.py import --src export_parquet/ --mode replace
+    python data_interchange.py bench --db data/forgialean_bench_10x.db
+
+--db imposta FORGIALEAN_DB_PATH prima di importare db.py (come benchmark.py).
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Righe lette/scritte per blocco (un row group Parquet per blocco)
+PARQUET_CHUNK_ROWS = 50_000
+PARQUET_COMPRESSION = "zstd"
+MANIFEST_NAME = "_manifest.json"
+
+IMPORT_MODES = ("replace", "append", "upsert")
+
+# Formato con cui SQLAlchemy salva DateTime su SQLite
+_SQLITE_DATETIME_FMT = "%Y-%m-%d %H:%M:%S"
+
+
+# ========================
+# SCHEMA DAI MODELLI
+# ========================
+
+def _arrow_type(sa_type) -> pa.DataType:
+    name = type(sa_type).__name__
+    if name == "Integer":
+        return pa.int64()
+    if name == "Float":
+        return pa.float64()
+    if name == "Boolean":
+        return pa.bool_()
+    if name == "Date":
+        return pa.date32()
+    if name == "DateTime":
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def get_tables() -> dict:
+    """Tabelle di db.py in ordine di dipendenza (FK): nome -> sqlalchemy Table."""
+    from sqlmodel import SQLModel
+
+    import db  # noqa: F401  registra i modelli nel metadata
+
+    return {t.name: t for t in SQLModel.metadata.sorted_tables}
+
+
+def arrow_schema(table) -> pa.Schema:
+    fields = [
+        pa.field(c.name, _arrow_type(c.type), nullable=bool(c.nullable) or c.primary_key)
+        for c in table.columns
+    ]
+    pk = [c.name for c in table.primary_key.columns]
+    return pa.schema(fields, metadata={"table": table.name, "primary_key": ",".join(pk)})
+
+
+# ========================
+# CONVERSIONI SQLITE <-> ARROW
+# ========================
+
+def _to_arrow(values: list, field: pa.Field, table_name: str) -> pa.Array:
+    t = field.type
+    try:
+        if pa.types.is_boolean(t):
+            return pa.array(values, pa.int64()).cast(pa.bool_())
+        if pa.types.is_date32(t):
+            # alcune date sono salvate con l'orario: conta solo YYYY-MM-DD
+            return pc.utf8_slice_codeunits(pa.array(values, pa.string()), 0, 10).cast(t)
+        if pa.types.is_timestamp(t):
+            return pa.array(values, pa.string()).cast(t)
+        return pa.array(values, t)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        raise ValueError(f"{table_name}.{field.name}: valori non convertibili in {t} ({e})") from e
+
+
+def _to_sqlite(column: pa.ChunkedArray | pa.Array) -> list:
+    t = column.type
+    if pa.types.is_boolean(t):
+        column = column.cast(pa.int8())
+    elif pa.types.is_date32(t):
+        column = column.cast(pa.string())
+    elif pa.types.is_timestamp(t):
+        column = pc.strftime(column.cast(pa.timestamp("us")), format=_SQLITE_DATETIME_FMT)
+    return column.to_pylist()
+
+
+def _raw_connection(engine) -> tuple:
+    raw = engine.raw_connection()
+    return raw, raw.driver_connection
+
+
+# ========================
+# EXPORT
+# ========================
+
+def export_table(engine, table, path: Path, chunk_rows: int = PARQUET_CHUNK_ROWS) -> int:
+    """Scrive la tabella in un file Parquet a blocchi. Ritorna le righe esportate."""
+    schema = arrow_schema(table)
+    cols = ", ".join(f'"{f.name}"' for f in schema)
+    order = ", ".join(f'"{c.name}"' for c in table.primary_key.columns) or "rowid"
+
+    raw, conn = _raw_connection(engine)
+    rows_total = 0
+    tmp = path.with_suffix(".tmp")
+    try:
+        cur = conn.execute(f'SELECT {cols} FROM "{table.name}" ORDER BY {order}')
+        with pq.ParquetWriter(tmp, schema, compression=PARQUET_COMPRESSION) as writer:
+            while True:
+                rows = cur.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                columns = list(zip(*rows))
+                arrays = [_to_arrow(list(col), f, table.name) for col, f in zip(columns, schema)]
+                writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+                rows_total += len(rows)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+        raw.close()
+    return rows_total
+
+
+def export_all(engine, out_dir: Path, tables: list[str] | None = None) -> dict:
+    """Esporta tutte le tabelle (o quelle indicate) in out_dir/<tabella>.parquet + manifest."""
+    from sqlalchemy import inspect
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    existing = set(inspect(engine).get_table_names())
+    manifest = {"exported_at": datetime.now().isoformat(timespec="seconds"), "tables": {}, "missing": []}
+    for name, table in get_tables().items():
+        if tables and name not in tables:
+            continue
+        if name not in existing:
+            # DB non ancora migrato: la tabella del modello non c'è
+            manifest["missing"].append(name)
+            continue
+        t0 = time.perf_counter()
+        path = out_dir / f"{name}.parquet"
+        rows = export_table(engine, table, path)
+        manifest["tables"][name] = {
+            "rows": rows,
+            "bytes": path.stat().st_size,
+            "elapsed_s": round(time.perf_counter() - t0, 4),
+        }
+    (out_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    return manifest
+
+
+# ========================
+# IMPORT
+# ========================
+
+def import_table(engine, table, path: Path, mode: str = "replace", chunk_rows: int = PARQUET_CHUNK_ROWS) -> int:
+    """
+    Carica un file Parquet nella tabella. Le colonne del file devono esistere nel
+    modello; i tipi vengono convertiti allo schema del modello. Ritorna le righe importate.
+    """
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Modalità import non valida: {mode}")
+    target = arrow_schema(table)
+    pf = pq.ParquetFile(path)
+    names = pf.schema_arrow.names
+    unknown = [n for n in names if target.get_field_index(n) < 0]
+    if unknown:
+        raise ValueError(f"{path.name}: colonne non presenti nel modello {table.name}: {unknown}")
+    sub_schema = pa.schema([target.field(n) for n in names])
+
+    verb = "INSERT OR REPLACE" if mode == "upsert" else "INSERT"
+    cols = ", ".join(f'"{n}"' for n in names)
+    sql = f'{verb} INTO "{table.name}" ({cols}) VALUES ({", ".join("?" for _ in names)})'
+
+    raw, conn = _raw_connection(engine)
+    rows_total = 0
+    try:
+        conn.execute("BEGIN")
+        if mode == "replace":
+            conn.execute(f'DELETE FROM "{table.name}"')
+        for batch in pf.iter_batches(batch_size=chunk_rows):
+            batch = pa.Table.from_batches([batch]).cast(sub_schema)
+            columns = [_to_sqlite(batch.column(i)) for i in range(batch.num_columns)]
+            conn.executemany(sql, zip(*columns))
+            rows_total += batch.num_rows
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        raw.close()
+    return rows_total
+
+
+def import_all(engine, src_dir: Path, mode: str = "replace", tables: list[str] | None = None) -> dict:
+    """Importa i file <tabella>.parquet presenti in src_dir, in ordine di dipendenza."""
+    result = {}
+    for name, table in get_tables().items():
+        path = src_dir / f"{name}.parquet"
+        if (tables and name not in tables) or not path.exists():
+            continue
+        t0 = time.perf_counter()
+        rows = import_table(engine, table, path, mode=mode)
+        result[name] = {"rows": rows, "elapsed_s": round(time.perf_counter() - t0, 4)}
+    return result
+
+
+# ========================
+# BENCHMARK
+# ========================
+
+def _excel_export(engine, tables: dict) -> tuple[float, int, int]:
+    """Stesso percorso di export_all_to_excel: DataFrame completi + workbook in memoria."""
+    import io
+
+    import pandas as pd
+
+    t0 = time.perf_counter()
+    rows = 0
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
+        for name in tables:
+            df = pd.read_sql_table(name, engine)
+            rows += len(df)
+            if not df.empty:
+                df.to_excel(writer, index=False, sheet_name=name[:31])
+    return time.perf_counter() - t0, rows, buffer.getbuffer().nbytes
+
+
+def run_benchmark(engine, skip_excel: bool = False) -> dict:
+    """Export Parquet -> import in un DB vuoto -> confronto conteggi, più export Excel."""
+    from sqlalchemy import create_engine
+    from sqlmodel import SQLModel
+
+    with tempfile.TemporaryDirectory(prefix="parquet_bench_") as tmp:
+        tmp = Path(tmp)
+        t0 = time.perf_counter()
+        manifest = export_all(engine, tmp / "parquet")
+        export_s = time.perf_counter() - t0
+
+        target = create_engine(f"sqlite:///{tmp / 'roundtrip.db'}")
+        SQLModel.metadata.create_all(target)
+        t0 = time.perf_counter()
+        imported = import_all(target, tmp / "parquet")
+        import_s = time.perf_counter() - t0
+
+        # verifica semantica: il DB ricaricato riesportato deve dare le stesse tabelle Arrow
+        # (es. '2026-01-01 10:00:00' e '2026-01-01 10:00:00.000000' sono lo stesso valore)
+        export_all(target, tmp / "check", tables=list(manifest["tables"]))
+        target.dispose()
+        mismatches = [
+            name for name in manifest["tables"]
+            if not pq.read_table(tmp / "parquet" / f"{name}.parquet").equals(
+                pq.read_table(tmp / "check" / f"{name}.parquet")
+            )
+        ]
+
+    rows = sum(t["rows"] for t in manifest["tables"].values())
+    res = {
+        "rows": rows,
+        "parquet_export_s": round(export_s, 3),
+        "parquet_import_s": round(import_s, 3),
+        "parquet_bytes": sum(t["bytes"] for t in manifest["tables"].values()),
+        "parquet_rows_per_s": round(rows / export_s) if export_s else None,
+        "roundtrip_mismatches": mismatches,
+        "imported_rows": sum(t["rows"] for t in imported.values()),
+    }
+    if not skip_excel:
+        excel_s, _, excel_bytes = _excel_export(engine, manifest["tables"])
+        res.update({
+            "excel_export_s": round(excel_s, 3),
+            "excel_bytes": excel_bytes,
+            "excel_rows_per_s": round(rows / excel_s) if excel_s else None,
+        })
+    return res
+
+
+# ========================
+# CLI
+# ========================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export/import Parquet delle tabelle ForgiaLean")
+    parser.add_argument("--db", type=Path, default=None, help="DB da usare (default: quello dell'app)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_exp = sub.add_parser("export")
+    p_exp.add_argument("--out", type=Path, default=Path("export_parquet"))
+    p_exp.add_argument("--tables", nargs="*", default=None)
+
+    p_imp = sub.add_parser("import")
+    p_imp.add_argument("--src", type=Path, required=True)
+    p_imp.add_argument("--mode", choices=IMPORT_MODES, default="replace")
+    p_imp.add_argument("--tables", nargs="*", default=None)
+
+    p_bench = sub.add_parser("bench")
+    p_bench.add_argument("--skip-excel", action="store_true")
+
+    args = parser.parse_args(argv)
+    if args.db is not None:
+        os.environ["FORGIALEAN_DB_PATH"] = str(args.db.resolve())
+
+    from db import engine
+
+    if args.cmd == "export":
+        manifest = export_all(engine, args.out, args.tables)
+        rows = sum(t["rows"] for t in manifest["tables"].values())
+        print(f"✅ {len(manifest['tables'])} tabelle, {rows:,} righe esportate in {args.out}")
+
+    elif args.cmd == "import":
+        res = import_all(engine, args.src, mode=args.mode, tables=args.tables)
+        for name, r in res.items():
+            print(f"  {name:<28} {r['rows']:>10,} righe  {r['elapsed_s']:.3f}s")
+        print(f"✅ {len(res)} tabelle importate ({args.mode})")
+        # L'import scrive timeentry in SQL grezzo: riallinea ore_consumate e TimesheetWeek
+        if {"timeentry", "taskfase", "projectcommessa", "timesheetweek"} & res.keys():
+            from db import reconcile_time_rollups
+
+            rec = reconcile_time_rollups(fix=True)
+            fixed = sum(len(v) for v in rec["mismatches"].values())
+            print(f"✅ Rollup ore riallineati ({fixed} differenze corrette)")
+
+    elif args.cmd == "bench":
+        res = run_benchmark(engine, skip_excel=args.skip_excel)
+        print(json.dumps(res, indent=2))
+        if res["roundtrip_mismatches"]:
+            print(f"❌ Round-trip diverso per: {', '.join(res['roundtrip_mismatches'])}")
+
+
+if __name__ == "__main__":
+    main()
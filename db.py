@@ -1,11 +1,25 @@
+import json
+import os
+import sqlite3
+import threading
 from typing import Optional, List
 from datetime import date, datetime, timedelta
 from sqlmodel import delete
 from pathlib import Path
 
-from sqlalchemy import Column, DateTime
+from sqlalchemy import Column, DateTime, Index, event, func, text
 from sqlmodel import SQLModel, Field, Relationship, create_engine, Session, select
 
+from cdc_journal import drop_cdc_triggers, install_cdc_triggers, refresh_replica, truncate_journal
+from search_index import install_search_index, search as search_fts
+from config import (
+    ANALYTICS_REPLICA_ENABLED,
+    ANALYTICS_REPLICA_REFRESH_S,
+    CDC_JOURNAL_ENABLED,
+    CDC_JOURNAL_TRUNCATE_INTERVAL_S,
+    TIMESHEET_RECONCILE_INTERVAL_S,
+)
+
 # =========================
 # PATH DB IN CARTELLA SCRIVIBILE
 # =========================
@@ -14,7 +28,8 @@ BASE_DIR = Path(__file__).parent
 DATA_DIR = BASE_DIR / "data"
 DATA_DIR.mkdir(exist_ok=True)
 
-SQLITE_FILE_NAME = DATA_DIR / "forgialean.db"
+# FORGIALEAN_DB_PATH permette di puntare a un DB alternativo (es. dati sintetici per benchmark)
+SQLITE_FILE_NAME = Path(os.getenv("FORGIALEAN_DB_PATH", DATA_DIR / "forgialean.db"))
 SQLITE_URL = f"sqlite:///{SQLITE_FILE_NAME}"
 
 engine = create_engine(SQLITE_URL, echo=False)
@@ -175,10 +190,10 @@ class CrmAutomationRule(SQLModel, table=True):
     """Regole di automazione CRM (stile Keap/Infusionsoft, versione semplificata)."""
     rule_id: Optional[int] = Field(default=None, primary_key=True)
 
-    # Trigger: per ora gestiamo solo cambio stato opportunità
+    # Trigger: cambio stato opportunità oppure tag applicato/rimosso al cliente
     trigger_type: str = Field(
         default="status_change"
-    )  # in futuro: "tag_added", "tag_removed", ecc.
+    )  # "status_change", "tag_added", "tag_removed"
 
     from_status: Optional[str] = Field(
         default=None,
@@ -212,108 +227,419 @@ class CrmAutomationRule(SQLModel, table=True):
     attiva: bool = Field(default=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
-def run_crm_automations(opportunity_id: int, old_status: Optional[str]) -> None:
-    """
-    Esegue le regole di automazione CRM basate sul cambio di stato opportunità.
-    Va chiamata subito dopo aver aggiornato opp.stato_opportunita.
-    """
-    from forgialean_ai_control_tower import send_telegram_message  # evita import circolare se necessario
+# =========================
+# MOTORE AUTOMAZIONI CRM (IN BLOCCO)
+# =========================
 
-    with Session(engine) as session:
-        opp = session.get(Opportunity, opportunity_id)
-        if not opp:
-            return
+# Regole attive in cache, indicizzate per (trigger_type, to_status, from_status).
+# Invalidate dagli eventi ORM su CrmAutomationRule; il TTL copre modifiche
+# fatte fuori dall'app (es. SQL diretto).
+_RULES_CACHE_TTL_SECONDS = 300
+_rules_cache: dict = {"index": None, "loaded_at": None}
 
-        new_status = opp.stato_opportunita
+# SQLite: massimo numero di parametri per statement (chunk per gli IN)
+_SQLITE_IN_CHUNK = 900
 
-        # Prendi il client e i suoi tag (se servono per filtrare)
-        client = session.get(Client, opp.client_id) if opp.client_id else None
 
-        client_tag_ids: set[int] = set()
-        if client:
-            ct_rows = session.exec(
-                select(ContactTag.tag_id).where(
-                    ContactTag.contact_id == client.client_id
-                )
-            ).all()
-            client_tag_ids = {tid for (tid,) in ct_rows}
-
-        # Carica regole attive di tipo "status_change"
-        rules = session.exec(
-            select(CrmAutomationRule).where(
-                CrmAutomationRule.attiva == True,          # noqa
-                CrmAutomationRule.trigger_type == "status_change",
-                CrmAutomationRule.to_status == new_status,
-            )
-        ).all()
+def invalidate_automation_rules() -> None:
+    _rules_cache["index"] = None
+    _rules_cache["loaded_at"] = None
 
-        for rule in rules:
-            # Controlla from_status (se valorizzato)
-            if rule.from_status and rule.from_status != old_status:
-                continue
 
-            # Controlla required_tag_id (se valorizzato)
-            if rule.required_tag_id and rule.required_tag_id not in client_tag_ids:
-                continue
+def get_automation_rule_index(session: Session) -> dict:
+    """
+    Restituisce {(trigger_type, to_status, from_status): [regole]} con le sole
+    regole attive. from_status vuoto/None è indicizzato come None (qualsiasi).
+    """
+    now = datetime.utcnow()
+    loaded_at = _rules_cache["loaded_at"]
+    if _rules_cache["index"] is not None and loaded_at and (now - loaded_at).total_seconds() < _RULES_CACHE_TTL_SECONDS:
+        return _rules_cache["index"]
+
+    rules = session.exec(
+        select(CrmAutomationRule)
+        .where(CrmAutomationRule.attiva == True)  # noqa
+        .order_by(CrmAutomationRule.rule_id)
+    ).all()
 
-            # Azione: CREATE_TASK
-            if rule.action_type == "create_task":
-                due_date = date.today() + timedelta(days=rule.days_offset or 0)
-                new_task = CrmTask(
-                    opportunity_id=opp.opportunity_id,
-                    titolo=rule.task_title or f"Task auto per stato {new_status}",
-                    tipo=rule.task_type or "attivita",
-                    data_scadenza=due_date,
-                    stato="da_fare",
-                    note=f"Regola #{rule.rule_id} su cambio stato {old_status} -> {new_status}",
-                )
-                session.add(new_task)
+    index: dict = {}
+    for rule in rules:
+        # copia staccata dalla sessione: la cache sopravvive alla sessione
+        data = rule.model_dump()
+        key = (data["trigger_type"], data["to_status"], data["from_status"] or None)
+        index.setdefault(key, []).append(data)
 
-            # Azione: TELEGRAM_NOTIFY
-            if rule.action_type == "telegram_notify" and rule.telegram_message:
-                try:
-                    msg = rule.telegram_message.format(
-                        opp_id=opp.opportunity_id,
-                        client_name=getattr(client, "ragione_sociale", ""),
-                        old_status=old_status or "",
-                        new_status=new_status or "",
-                    )
-                    send_telegram_message(msg)
-                except Exception as e:
-                    print(f"Errore Telegram in run_crm_automations: {e}")
+    _rules_cache["index"] = index
+    _rules_cache["loaded_at"] = now
+    return index
 
-        session.commit()
 
-        # Dopo eventuali nuovi task, riallinea prossima azione
-        sync_next_action_from_tasks(opportunity_id)
+@event.listens_for(CrmAutomationRule, "after_insert")
+@event.listens_for(CrmAutomationRule, "after_update")
+@event.listens_for(CrmAutomationRule, "after_delete")
+def _on_rule_change(mapper, connection, target):
+    invalidate_automation_rules()
 
-def sync_next_action_from_tasks(opportunity_id: int) -> None:
-    """Aggiorna i campi 'prossima azione' dell'opportunità in base ai task aperti."""
-    with Session(engine) as session:
-        opp = session.get(Opportunity, opportunity_id)
-        if not opp:
-            return
 
+def _chunks(values: list, size: int = _SQLITE_IN_CHUNK):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _sync_next_actions(session: Session, opps: dict) -> None:
+    """Riallinea la 'prossima azione' di più opportunità con una query per chunk."""
+    first_task: dict = {}
+    ids = list(opps)
+    for chunk in _chunks(ids):
         tasks_open = session.exec(
             select(CrmTask)
-            .where(CrmTask.opportunity_id == opportunity_id)
+            .where(CrmTask.opportunity_id.in_(chunk))
             .where(CrmTask.stato == "da_fare")
-            .order_by(CrmTask.data_scadenza, CrmTask.created_at)
+            .order_by(CrmTask.opportunity_id, CrmTask.data_scadenza, CrmTask.created_at)
         ).all()
+        for t in tasks_open:
+            first_task.setdefault(t.opportunity_id, t)
 
-        if not tasks_open:
+    for opp_id, opp in opps.items():
+        next_task = first_task.get(opp_id)
+        if next_task is None:
             opp.data_prossima_azione = None
             opp.tipo_prossima_azione = None
             opp.note_prossima_azione = None
         else:
-            next_task = tasks_open[0]
             opp.data_prossima_azione = next_task.data_scadenza
             opp.tipo_prossima_azione = next_task.tipo or "Attività"
             opp.note_prossima_azione = next_task.titolo
-
         session.add(opp)
+
+
+def run_crm_automations_bulk(transitions: list[tuple[int, Optional[str]]]) -> dict:
+    """
+    Esegue le regole 'status_change' per un blocco di transizioni
+    [(opportunity_id, old_status), ...] già salvate sul DB.
+
+    Regole dalla cache indicizzata, tag dei clienti prefetchati in una query,
+    task creati e prossime azioni riallineate in un'unica transazione.
+    Le notifiche Telegram partono dopo il commit.
+    """
+    if not transitions:
+        return {"opportunities": 0, "tasks_created": 0, "notifications": 0}
+
+    # a parità di opportunità conta l'ultima transizione ricevuta
+    old_by_opp = {}
+    for opp_id, old_status in transitions:
+        old_by_opp[opp_id] = old_status
+
+    notifications: list[str] = []
+    tasks_created = 0
+
+    with Session(engine) as session:
+        rule_index = get_automation_rule_index(session)
+
+        opps: dict = {}
+        for chunk in _chunks(list(old_by_opp)):
+            for opp in session.exec(
+                select(Opportunity).where(Opportunity.opportunity_id.in_(chunk))
+            ).all():
+                opps[opp.opportunity_id] = opp
+        if not opps:
+            return {"opportunities": 0, "tasks_created": 0, "notifications": 0}
+
+        # regole candidate per ogni opportunità
+        candidates: dict = {}
+        needs_tags = False
+        for opp_id, opp in opps.items():
+            new_status = opp.stato_opportunita
+            old_status = old_by_opp[opp_id]
+            matched = list(rule_index.get(("status_change", new_status, None), []))
+            if old_status:
+                matched += rule_index.get(("status_change", new_status, old_status), [])
+            if matched:
+                matched.sort(key=lambda r: r["rule_id"])
+                candidates[opp_id] = matched
+                needs_tags = needs_tags or any(r["required_tag_id"] for r in matched)
+
+        # tag e ragione sociale dei clienti coinvolti (solo se servono)
+        client_ids = list({opps[i].client_id for i in candidates if opps[i].client_id})
+        client_tags: dict = {}
+        client_names: dict = {}
+        if needs_tags and client_ids:
+            for chunk in _chunks(client_ids):
+                for contact_id, tag_id in session.exec(
+                    select(ContactTag.contact_id, ContactTag.tag_id).where(ContactTag.contact_id.in_(chunk))
+                ).all():
+                    client_tags.setdefault(contact_id, set()).add(tag_id)
+        needs_names = any(
+            r["action_type"] == "telegram_notify" for rules in candidates.values() for r in rules
+        )
+        if needs_names and client_ids:
+            for chunk in _chunks(client_ids):
+                client_names.update(dict(session.exec(
+                    select(Client.client_id, Client.ragione_sociale).where(Client.client_id.in_(chunk))
+                ).all()))
+
+        today = date.today()
+        for opp_id, rules in candidates.items():
+            opp = opps[opp_id]
+            old_status = old_by_opp[opp_id]
+            new_status = opp.stato_opportunita
+            tag_ids = client_tags.get(opp.client_id, set())
+
+            for rule in rules:
+                if rule["required_tag_id"] and rule["required_tag_id"] not in tag_ids:
+                    continue
+
+                if rule["action_type"] == "create_task":
+                    session.add(CrmTask(
+                        opportunity_id=opp_id,
+                        titolo=rule["task_title"] or f"Task auto per stato {new_status}",
+                        tipo=rule["task_type"] or "attivita",
+                        data_scadenza=today + timedelta(days=rule["days_offset"] or 0),
+                        stato="da_fare",
+                        note=f"Regola #{rule['rule_id']} su cambio stato {old_status} -> {new_status}",
+                    ))
+                    tasks_created += 1
+
+                if rule["action_type"] == "telegram_notify" and rule["telegram_message"]:
+                    try:
+                        notifications.append(rule["telegram_message"].format(
+                            opp_id=opp_id,
+                            client_name=client_names.get(opp.client_id, ""),
+                            old_status=old_status or "",
+                            new_status=new_status or "",
+                        ))
+                    except Exception as e:
+                        print(f"Errore messaggio Telegram regola #{rule['rule_id']}: {e}")
+
+        session.flush()
+        _sync_next_actions(session, opps)
         session.commit()
 
+    if notifications:
+        from forgialean_ai_control_tower import send_telegram_message  # evita import circolare
+
+        for msg in notifications:
+            try:
+                send_telegram_message(msg)
+            except Exception as e:
+                print(f"Errore Telegram in run_crm_automations: {e}")
+
+    return {
+        "opportunities": len(opps),
+        "tasks_created": tasks_created,
+        "notifications": len(notifications),
+    }
+
+
+def run_crm_automations(opportunity_id: int, old_status: Optional[str]) -> None:
+    """
+    Esegue le regole di automazione CRM basate sul cambio di stato opportunità.
+    Va chiamata subito dopo aver aggiornato opp.stato_opportunita.
+    """
+    run_crm_automations_bulk([(opportunity_id, old_status)])
+
+
+def sync_next_action_from_tasks(opportunity_id: int) -> None:
+    """Aggiorna i campi 'prossima azione' dell'opportunità in base ai task aperti."""
+    with Session(engine) as session:
+        opp = session.get(Opportunity, opportunity_id)
+        if not opp:
+            return
+        _sync_next_actions(session, {opportunity_id: opp})
+        session.commit()
+
+
+# =========================
+# TAG IN BLOCCO (CONTACTTAG)
+# =========================
+# Applicazione/rimozione di tag su insiemi di clienti con un solo statement
+# (id passati come array JSON, nessun limite di parametri). I duplicati sono
+# scartati dall'indice unico (contact_id, tag_id) creato da migrate_db.
+# Le regole 'tag_added' / 'tag_removed' vengono valutate una volta per blocco.
+# Le coppie toccate arrivano da RETURNING (SQLite >= 3.35); con SQLite più vecchi
+# si leggono con una SELECT nella stessa transazione prima della scrittura.
+
+_SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Chiave di session.info: la transazione ha scritto contacttag con SQL diretto,
+# che gli eventi ORM non vedono; segments.py invalida il suo indice al commit.
+SEGMENT_DATA_CHANGED = "segments_changed"
+
+_TAG_PAIRS_SQL = """
+    SELECT c.client_id, t.tag_id
+    FROM json_each(:client_ids) AS ci
+    JOIN client AS c ON c.client_id = ci.value
+    JOIN json_each(:tag_ids) AS ti
+    JOIN tag AS t ON t.tag_id = ti.value
+"""
+_TAG_MATCH_SQL = """
+    contact_id IN (SELECT value FROM json_each(:client_ids))
+    AND tag_id IN (SELECT value FROM json_each(:tag_ids))
+"""
+
+def _utc_now_sql() -> str:
+    # stesso formato con cui SQLAlchemy salva i DateTime su SQLite
+    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def apply_tags_bulk(client_ids, tag_ids, run_automations: bool = True) -> dict:
+    """
+    Applica i tag a tutti i clienti indicati in un'unica transazione.
+    Coppie già presenti, clienti o tag inesistenti vengono ignorati.
+    """
+    client_ids = sorted({int(c) for c in client_ids})
+    tag_ids = sorted({int(t) for t in tag_ids})
+    if not client_ids or not tag_ids:
+        return {"added": 0, "tasks_created": 0, "notifications": 0}
+
+    params = {"now": _utc_now_sql(), "client_ids": json.dumps(client_ids), "tag_ids": json.dumps(tag_ids)}
+    insert_sql = (
+        "INSERT OR IGNORE INTO contacttag (contact_id, tag_id, created_at) "
+        f"SELECT pairs.client_id, pairs.tag_id, :now FROM ({_TAG_PAIRS_SQL}) AS pairs"
+    )
+    with Session(engine) as session:
+        if _SQLITE_HAS_RETURNING:
+            added = session.execute(text(insert_sql + " RETURNING contact_id, tag_id"), params).fetchall()
+        else:
+            added = session.execute(
+                text(
+                    f"SELECT pairs.client_id, pairs.tag_id FROM ({_TAG_PAIRS_SQL}) AS pairs "
+                    "WHERE NOT EXISTS (SELECT 1 FROM contacttag AS x "
+                    "WHERE x.contact_id = pairs.client_id AND x.tag_id = pairs.tag_id)"
+                ),
+                params,
+            ).fetchall()
+            if added:
+                session.execute(text(insert_sql), params)
+        added = [(r[0], r[1]) for r in added]
+        if added:
+            session.info[SEGMENT_DATA_CHANGED] = True
+        notifications = []
+        result = {"added": len(added), "tasks_created": 0, "notifications": 0}
+        if run_automations and added:
+            result["tasks_created"], notifications = _run_tag_rules(session, "tag_added", added)
+            result["notifications"] = len(notifications)
+        session.commit()
+
+    _send_notifications(notifications)
+    return result
+
+
+def remove_tags_bulk(client_ids, tag_ids, run_automations: bool = True) -> dict:
+    """Rimuove i tag da tutti i clienti indicati in un'unica transazione."""
+    client_ids = sorted({int(c) for c in client_ids})
+    tag_ids = sorted({int(t) for t in tag_ids})
+    if not client_ids or not tag_ids:
+        return {"removed": 0, "tasks_created": 0, "notifications": 0}
+
+    params = {"client_ids": json.dumps(client_ids), "tag_ids": json.dumps(tag_ids)}
+    with Session(engine) as session:
+        if _SQLITE_HAS_RETURNING:
+            removed = session.execute(
+                text(f"DELETE FROM contacttag WHERE {_TAG_MATCH_SQL} RETURNING contact_id, tag_id"), params
+            ).fetchall()
+        else:
+            removed = session.execute(
+                text(f"SELECT contact_id, tag_id FROM contacttag WHERE {_TAG_MATCH_SQL}"), params
+            ).fetchall()
+            if removed:
+                session.execute(text(f"DELETE FROM contacttag WHERE {_TAG_MATCH_SQL}"), params)
+        removed = sorted({(r[0], r[1]) for r in removed})
+        if removed:
+            session.info[SEGMENT_DATA_CHANGED] = True
+        notifications = []
+        result = {"removed": len(removed), "tasks_created": 0, "notifications": 0}
+        if run_automations and removed:
+            result["tasks_created"], notifications = _run_tag_rules(session, "tag_removed", removed)
+            result["notifications"] = len(notifications)
+        session.commit()
+
+    _send_notifications(notifications)
+    return result
+
+
+def _run_tag_rules(session: Session, trigger_type: str, pairs: list[tuple[int, int]]) -> tuple[int, list[str]]:
+    """
+    Regole 'tag_added' / 'tag_removed' per le coppie (client_id, tag_id) del blocco.
+
+    required_tag_id = tag che scatena la regola (None = qualsiasi tag);
+    to_status = stato delle opportunità del cliente su cui creare il task
+    ('*' = tutte). La notifica Telegram parte una volta per cliente e tag.
+    Ritorna (task creati, messaggi da inviare dopo il commit).
+    """
+    rule_index = get_automation_rule_index(session)
+    rules = sorted(
+        (r for key, rs in rule_index.items() if key[0] == trigger_type for r in rs),
+        key=lambda r: r["rule_id"],
+    )
+    if not rules:
+        return 0, []
+
+    client_ids = sorted({c for c, _ in pairs})
+    tag_names = dict(session.exec(select(Tag.tag_id, Tag.nome)).all())
+    client_names: dict = {}
+    opps_by_client: dict = {}
+    for chunk in _chunks(client_ids):
+        client_names.update(dict(session.exec(
+            select(Client.client_id, Client.ragione_sociale).where(Client.client_id.in_(chunk))
+        ).all()))
+        if any(r["action_type"] == "create_task" for r in rules):
+            for opp in session.exec(select(Opportunity).where(Opportunity.client_id.in_(chunk))).all():
+                opps_by_client.setdefault(opp.client_id, []).append(opp)
+
+    today = date.today()
+    touched_opps: dict = {}
+    notifications: list[str] = []
+    tasks_created = 0
+    for client_id, tag_id in pairs:
+        for rule in rules:
+            if rule["required_tag_id"] and rule["required_tag_id"] != tag_id:
+                continue
+
+            if rule["action_type"] == "create_task":
+                for opp in opps_by_client.get(client_id, []):
+                    if rule["to_status"] not in ("*", opp.stato_opportunita):
+                        continue
+                    session.add(CrmTask(
+                        opportunity_id=opp.opportunity_id,
+                        titolo=rule["task_title"] or f"Task auto per tag {tag_names.get(tag_id, tag_id)}",
+                        tipo=rule["task_type"] or "attivita",
+                        data_scadenza=today + timedelta(days=rule["days_offset"] or 0),
+                        stato="da_fare",
+                        note=f"Regola #{rule['rule_id']} su {trigger_type} '{tag_names.get(tag_id, tag_id)}'",
+                    ))
+                    touched_opps[opp.opportunity_id] = opp
+                    tasks_created += 1
+
+            if rule["action_type"] == "telegram_notify" and rule["telegram_message"]:
+                try:
+                    notifications.append(rule["telegram_message"].format(
+                        opp_id="",
+                        client_name=client_names.get(client_id, ""),
+                        tag_name=tag_names.get(tag_id, ""),
+                        old_status="",
+                        new_status="",
+                    ))
+                except Exception as e:
+                    print(f"Errore messaggio Telegram regola #{rule['rule_id']}: {e}")
+
+    if touched_opps:
+        session.flush()
+        _sync_next_actions(session, touched_opps)
+    return tasks_created, notifications
+
+
+def _send_notifications(notifications: list[str]) -> None:
+    if not notifications:
+        return
+    from forgialean_ai_control_tower import send_telegram_message  # evita import circolare
+
+    for msg in notifications:
+        try:
+            send_telegram_message(msg)
+        except Exception as e:
+            print(f"Errore Telegram in automazioni tag: {e}")
+
 
 class Invoice(SQLModel, table=True):
     invoice_id: Optional[int] = Field(default=None, primary_key=True)
@@ -390,6 +716,110 @@ class TimeEntry(SQLModel, table=True):
     operatore: Optional[str] = None
 
 
+class TimesheetImport(SQLModel, table=True):
+    """File timesheet già importato (sha256 del contenuto): impedisce di importarlo due volte."""
+    import_id: Optional[int] = Field(default=None, primary_key=True)
+    file_hash: str = Field(index=True, unique=True)
+    filename: str
+    righe: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class TimesheetWeek(SQLModel, table=True):
+    """Ore per operatore, settimana ISO e fase, mantenute a delta dalle scritture timesheet."""
+    # chiave dell'upsert (ON CONFLICT): stesso nome dell'indice creato in migrate_db sui DB esistenti
+    __table_args__ = (
+        Index("ux_timesheetweek_key", "operatore", "week_start", "commessa_id", "fase_id", unique=True),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    operatore: str = Field(default="", index=True)  # testo come nel timesheet ('' se vuoto)
+    week_start: date = Field(index=True)  # lunedì della settimana ISO
+    iso_year: int
+    iso_week: int
+    commessa_id: int
+    fase_id: int
+    ore: float = 0.0
+    righe: int = 0
+
+
+class OeeLine(SQLModel, table=True):
+    """Linea / macchina di cui si raccolgono gli eventi OEE."""
+    line_id: Optional[int] = Field(default=None, primary_key=True)
+    codice: str = Field(index=True, unique=True)  # come arriva dai file macchina (es. "L1")
+    nome: str
+    reparto: Optional[str] = None
+    pezzi_ora_nominali: Optional[float] = None  # velocità ideale: senza, Performance = 100%
+    valore_orario: float = 0.0  # margine per ora di linea (€)
+    attiva: bool = Field(default=True)
+
+
+class OeeEvent(SQLModel, table=True):
+    """
+    Evento macchina grezzo: un intervallo di produzione che inizia in ts.
+    Chiave naturale (line_id, ts): indice unico dichiarato qui e creato in migrate_db sui DB esistenti.
+    """
+    __table_args__ = (Index("ux_oeeevent_line_ts", "line_id", "ts", unique=True),)
+
+    event_id: Optional[int] = Field(default=None, primary_key=True)
+    line_id: int = Field(foreign_key="oeeline.line_id")
+    ts: datetime
+    giorno: date  # giornata produttiva (il turno di notte resta nel giorno in cui è iniziato)
+    turno: int
+    planned_s: float = 0.0
+    run_s: float = 0.0
+    downtime_s: float = 0.0
+    total_count: int = 0
+    good_count: int = 0
+    downtime_reason: Optional[str] = None
+
+
+class OeeShiftStat(SQLModel, table=True):
+    """Rollup OEE per linea, giornata e turno, aggiornato a delta dall'ingestion."""
+    line_id: int = Field(primary_key=True)
+    giorno: date = Field(primary_key=True)
+    turno: int = Field(primary_key=True)
+    planned_s: float = 0.0
+    run_s: float = 0.0
+    downtime_s: float = 0.0
+    total_count: int = 0
+    good_count: int = 0
+    eventi: int = 0
+
+
+class OeeDayStat(SQLModel, table=True):
+    """Rollup OEE per linea e giornata."""
+    line_id: int = Field(primary_key=True)
+    giorno: date = Field(primary_key=True)
+    planned_s: float = 0.0
+    run_s: float = 0.0
+    downtime_s: float = 0.0
+    total_count: int = 0
+    good_count: int = 0
+    eventi: int = 0
+
+
+class OeeWeekStat(SQLModel, table=True):
+    """Rollup OEE per linea e settimana ISO (lunedì in week_start)."""
+    line_id: int = Field(primary_key=True)
+    week_start: date = Field(primary_key=True)
+    planned_s: float = 0.0
+    run_s: float = 0.0
+    downtime_s: float = 0.0
+    total_count: int = 0
+    good_count: int = 0
+    eventi: int = 0
+
+
+class OeeDowntimeDay(SQLModel, table=True):
+    """Minuti di fermo per linea, giornata e causale (Pareto fermate)."""
+    line_id: int = Field(primary_key=True)
+    giorno: date = Field(primary_key=True)
+    causale: str = Field(primary_key=True)
+    downtime_s: float = 0.0
+    occorrenze: int = 0
+
+
 class Department(SQLModel, table=True):
     department_id: Optional[int] = Field(default=None, primary_key=True)
     nome_reparto: str
@@ -407,6 +837,31 @@ class Employee(SQLModel, table=True):
     stato: Optional[str] = None  # attivo, non attivo
 
 
+class OperatorAlias(SQLModel, table=True):
+    """Nome operatore usato nei timesheet (normalizzato) -> dipendente."""
+    alias_id: Optional[int] = Field(default=None, primary_key=True)
+    alias: str = Field(index=True, unique=True)  # vedi capacity.normalize_operator
+    employee_id: int = Field(foreign_key="employee.employee_id")
+
+
+class CapacityProfile(SQLModel, table=True):
+    """Profilo di capacità per dipendente o per reparto (il dipendente prevale)."""
+    profile_id: Optional[int] = Field(default=None, primary_key=True)
+    employee_id: Optional[int] = Field(default=None, foreign_key="employee.employee_id", index=True)
+    department_id: Optional[int] = Field(default=None, foreign_key="department.department_id", index=True)
+    ore_giorno: float = 8.0
+    weekmask: str = "1111100"  # lun..dom, 1 = giorno lavorativo
+    calendario: str = "IT"  # calendario festività (Holiday.calendario)
+
+
+class Holiday(SQLModel, table=True):
+    """Festività/chiusure aziendali aggiuntive rispetto alle festività nazionali."""
+    holiday_id: Optional[int] = Field(default=None, primary_key=True)
+    calendario: str = Field(default="IT", index=True)
+    data: date
+    descrizione: Optional[str] = None
+
+
 class KpiDepartmentTimeseries(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     department_id: int = Field(foreign_key="department.department_id")
@@ -653,6 +1108,9 @@ class Tag(SQLModel, table=True):
 
 class ContactTag(SQLModel, table=True):
     """Associazione Many-to-Many contatto <-> tag."""
+    # DB esistenti: creato da migrate_db dopo la rimozione dei duplicati
+    __table_args__ = (Index("ux_contacttag_contact_tag", "contact_id", "tag_id", unique=True),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     contact_id: int = Field(foreign_key="client.client_id")
     tag_id: int = Field(foreign_key="tag.tag_id")
@@ -689,23 +1147,577 @@ class CampaignEvent(SQLModel, table=True):
 
 
 # =========================
-# INIT & SESSION
+# EVENT LOG OPPORTUNITÀ (FLAME POINTS / FUNNEL)
 # =========================
 
-def init_db():
-    """Crea le tabelle e ripristina backup se disponibile"""
-    from pathlib import Path
-    import shutil
+# Milestone del funnel in ordine: (azione, etichetta, flag, data, punti)
+FUNNEL_MILESTONES = [
+    ("form_oee_submitted", "MQL - Form OEE", "form_oee_completed", "date_form_oee", 10),
+    ("form_call_submitted", "SQL - Form call", "form_call_completed", "date_form_call", 20),
+    ("demo_scheduled", "Demo fissata", "demo_scheduled", "date_demo", 30),
+    ("contract_sent", "Contratto inviato", "contract_sent", "date_contract_sent", 40),
+    ("contract_signed", "Contratto firmato", "contract_signed", "date_contract_signed", 100),
+]
+FLAME_ACTION_POINTS = {action: points for action, _, _, _, points in FUNNEL_MILESTONES}
+_MILESTONE_INDEX = {m[0]: i for i, m in enumerate(FUNNEL_MILESTONES)}
 
-    BACKUP_LATEST = Path("db_backups/forgialean_latest.db")
-    DB_PATH = Path(SQLITE_FILE_NAME)
+# Righe mantenute nella leaderboard precalcolata
+FLAME_LEADERBOARD_SIZE = 50
 
-    # Se esiste backup e DB è vuoto/mancante, ripristina
-    if BACKUP_LATEST.exists() and (not DB_PATH.exists() or DB_PATH.stat().st_size < 1000):
-        print("🔄 Ripristino backup database...")
-        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(BACKUP_LATEST, DB_PATH)
-        print(f"✅ Database ripristinato da {BACKUP_LATEST}")
+
+class OpportunityEvent(SQLModel, table=True):
+    """Log append-only delle azioni funnel/gamification su un'opportunità."""
+    event_id: Optional[int] = Field(default=None, primary_key=True)
+    opportunity_id: int = Field(foreign_key="opportunity.opportunity_id", index=True)
+    action: str = Field(index=True)  # es. "form_oee_submitted", "contract_signed"
+    points: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+
+class FunnelStageStat(SQLModel, table=True):
+    """Contatori per milestone mantenuti in modo incrementale dall'event log."""
+    stage: str = Field(primary_key=True)  # azione milestone
+    ordine: int = 0
+    num_opps: int = 0  # opportunità che hanno raggiunto la milestone
+    total_points: int = 0
+    # tempo di conversione dalla milestone precedente raggiunta
+    conv_days_sum: float = 0.0
+    conv_count: int = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class FlameLeaderboard(SQLModel, table=True):
+    """Top-N opportunità per flame points (precalcolata)."""
+    opportunity_id: int = Field(primary_key=True, foreign_key="opportunity.opportunity_id")
+    flame_points: int = Field(default=0, index=True)
+
+
+def _update_flame_leaderboard(session: Session, opportunity_id: int, flame_points: int) -> None:
+    """
+    Mantiene la top-N: i punti crescono soltanto, quindi un'opportunità
+    fuori classifica entra solo se supera l'ultima.
+    """
+    row = session.get(FlameLeaderboard, opportunity_id)
+    if row:
+        row.flame_points = flame_points
+        session.add(row)
+        return
+
+    n_rows = session.exec(select(func.count()).select_from(FlameLeaderboard)).one()
+    if n_rows < FLAME_LEADERBOARD_SIZE:
+        session.add(FlameLeaderboard(opportunity_id=opportunity_id, flame_points=flame_points))
+        return
+
+    last = session.exec(
+        select(FlameLeaderboard).order_by(FlameLeaderboard.flame_points).limit(1)
+    ).first()
+    if last and flame_points > last.flame_points:
+        session.delete(last)
+        session.add(FlameLeaderboard(opportunity_id=opportunity_id, flame_points=flame_points))
+
+
+def _stage_stat(session: Session, action: str) -> FunnelStageStat:
+    stat = session.get(FunnelStageStat, action)
+    if not stat:
+        stat = FunnelStageStat(stage=action, ordine=_MILESTONE_INDEX[action])
+    return stat
+
+
+def _previous_milestone_time(session: Session, opportunity_id: int, action: str) -> Optional[datetime]:
+    """Momento in cui l'opportunità ha raggiunto la milestone precedente più vicina."""
+    previous = [m[0] for m in FUNNEL_MILESTONES[: _MILESTONE_INDEX[action]]]
+    if not previous:
+        return None
+    rows = session.exec(
+        select(OpportunityEvent.action, func.min(OpportunityEvent.created_at))
+        .where(OpportunityEvent.opportunity_id == opportunity_id)
+        .where(OpportunityEvent.action.in_(previous))
+        .group_by(OpportunityEvent.action)
+    ).all()
+    if not rows:
+        return None
+    first_by_action = dict(rows)
+    for prev in reversed(previous):
+        if prev in first_by_action:
+            return first_by_action[prev]
+    return None
+
+
+def record_opportunity_event(
+    session: Session,
+    opp: Opportunity,
+    action: str,
+    points: int,
+    when: Optional[datetime] = None,
+) -> None:
+    """
+    Registra un'azione sull'opportunità: aggiorna flame points e flag milestone,
+    aggiunge l'evento al log e aggiorna contatori per fase e leaderboard.
+    Non fa commit: va chiamata dentro la sessione del chiamante.
+    """
+    when = when or datetime.utcnow()
+
+    opp.flame_points = (opp.flame_points or 0) + points
+
+    if action in _MILESTONE_INDEX:
+        _, _, flag_attr, date_attr, _ = FUNNEL_MILESTONES[_MILESTONE_INDEX[action]]
+        first_time = not getattr(opp, flag_attr)
+        setattr(opp, flag_attr, True)
+        setattr(opp, date_attr, when.date())
+
+        stat = _stage_stat(session, action)
+        stat.total_points += points
+        if first_time:
+            stat.num_opps += 1
+            prev_time = _previous_milestone_time(session, opp.opportunity_id, action)
+            if prev_time:
+                stat.conv_days_sum += (when - prev_time).total_seconds() / 86400.0
+                stat.conv_count += 1
+        stat.updated_at = datetime.utcnow()
+        session.add(stat)
+
+    session.add(OpportunityEvent(
+        opportunity_id=opp.opportunity_id,
+        action=action,
+        points=points,
+        created_at=when,
+    ))
+    session.add(opp)
+    _update_flame_leaderboard(session, opp.opportunity_id, opp.flame_points)
+
+
+def rebuild_opportunity_aggregates() -> None:
+    """
+    Ricalcola da zero contatori per fase e leaderboard partendo dall'event log
+    e dai flame_points correnti (job di riconciliazione).
+    """
+    with Session(engine) as session:
+        first_times = session.exec(
+            select(
+                OpportunityEvent.opportunity_id,
+                OpportunityEvent.action,
+                func.min(OpportunityEvent.created_at),
+            )
+            .where(OpportunityEvent.action.in_(list(_MILESTONE_INDEX)))
+            .group_by(OpportunityEvent.opportunity_id, OpportunityEvent.action)
+        ).all()
+        points_by_stage = dict(session.exec(
+            select(OpportunityEvent.action, func.sum(OpportunityEvent.points))
+            .group_by(OpportunityEvent.action)
+        ).all())
+
+        reached: dict[int, dict[str, datetime]] = {}
+        for opp_id, action, ts in first_times:
+            reached.setdefault(opp_id, {})[action] = ts
+
+        session.execute(delete(FunnelStageStat))
+        stats = {
+            action: FunnelStageStat(
+                stage=action,
+                ordine=i,
+                total_points=int(points_by_stage.get(action) or 0),
+            )
+            for i, (action, *_rest) in enumerate(FUNNEL_MILESTONES)
+        }
+        for times in reached.values():
+            prev_ts = None
+            for action, *_rest in FUNNEL_MILESTONES:
+                ts = times.get(action)
+                if ts is None:
+                    continue
+                stats[action].num_opps += 1
+                if prev_ts is not None:
+                    stats[action].conv_days_sum += (ts - prev_ts).total_seconds() / 86400.0
+                    stats[action].conv_count += 1
+                prev_ts = ts
+        for stat in stats.values():
+            session.add(stat)
+
+        session.execute(delete(FlameLeaderboard))
+        top = session.exec(
+            select(Opportunity.opportunity_id, Opportunity.flame_points)
+            .where(Opportunity.flame_points > 0)
+            .order_by(Opportunity.flame_points.desc())
+            .limit(FLAME_LEADERBOARD_SIZE)
+        ).all()
+        for opp_id, pts in top:
+            session.add(FlameLeaderboard(opportunity_id=opp_id, flame_points=pts))
+
+        session.commit()
+
+
+def forget_opportunity_events(session: Session, opportunity_id: int) -> None:
+    """
+    Da chiamare prima di eliminare un'opportunità: toglie i suoi eventi
+    dai contatori, dal log e dalla leaderboard.
+    """
+    events = session.exec(
+        select(OpportunityEvent)
+        .where(OpportunityEvent.opportunity_id == opportunity_id)
+        .order_by(OpportunityEvent.created_at)
+    ).all()
+
+    first_times: dict[str, datetime] = {}
+    for ev in events:
+        if ev.action in _MILESTONE_INDEX:
+            stat = _stage_stat(session, ev.action)
+            stat.total_points -= ev.points
+            first_times.setdefault(ev.action, ev.created_at)
+            session.add(stat)
+        session.delete(ev)
+
+    prev_ts = None
+    for action, *_rest in FUNNEL_MILESTONES:
+        ts = first_times.get(action)
+        if ts is None:
+            continue
+        stat = _stage_stat(session, action)
+        stat.num_opps = max(0, stat.num_opps - 1)
+        if prev_ts is not None:
+            stat.conv_days_sum -= (ts - prev_ts).total_seconds() / 86400.0
+            stat.conv_count = max(0, stat.conv_count - 1)
+        session.add(stat)
+        prev_ts = ts
+
+    row = session.get(FlameLeaderboard, opportunity_id)
+    if row:
+        session.delete(row)
+        session.flush()
+        # riempie il posto liberato con la migliore opportunità fuori classifica
+        in_board = select(FlameLeaderboard.opportunity_id)
+        candidate = session.exec(
+            select(Opportunity.opportunity_id, Opportunity.flame_points)
+            .where(Opportunity.opportunity_id != opportunity_id)
+            .where(Opportunity.flame_points > 0)
+            .where(Opportunity.opportunity_id.not_in(in_board))
+            .order_by(Opportunity.flame_points.desc())
+            .limit(1)
+        ).first()
+        if candidate:
+            session.add(FlameLeaderboard(opportunity_id=candidate[0], flame_points=candidate[1]))
+
+
+def backfill_opportunity_events() -> None:
+    """
+    Prima attivazione dell'event log: genera gli eventi storici dai flag e
+    dalle date milestone già presenti sulle opportunità, poi ricalcola gli
+    aggregati. Eventuali punti non spiegati dalle milestone finiscono in un
+    evento "legacy_points", così la somma degli eventi coincide con flame_points.
+    """
+    with Session(engine) as session:
+        has_events = session.exec(select(OpportunityEvent.event_id).limit(1)).first()
+        if has_events:
+            return
+
+        opps = session.exec(
+            select(Opportunity).where(
+                (Opportunity.flame_points > 0)
+                | (Opportunity.form_oee_completed == True)   # noqa
+                | (Opportunity.form_call_completed == True)  # noqa
+                | (Opportunity.demo_scheduled == True)       # noqa
+                | (Opportunity.contract_sent == True)        # noqa
+                | (Opportunity.contract_signed == True)      # noqa
+            )
+        ).all()
+        if not opps:
+            return
+
+        rows = []
+        for opp in opps:
+            fallback = datetime.combine(opp.data_apertura or date.today(), datetime.min.time())
+            explained = 0
+            for action, _, flag_attr, date_attr, points in FUNNEL_MILESTONES:
+                if not getattr(opp, flag_attr):
+                    continue
+                d = getattr(opp, date_attr)
+                ts = datetime.combine(d, datetime.min.time()) if d else fallback
+                rows.append({"opportunity_id": opp.opportunity_id, "action": action, "points": points, "created_at": ts})
+                explained += points
+            remainder = (opp.flame_points or 0) - explained
+            if remainder:
+                rows.append({
+                    "opportunity_id": opp.opportunity_id,
+                    "action": "legacy_points",
+                    "points": remainder,
+                    "created_at": fallback,
+                })
+
+        if rows:
+            session.execute(OpportunityEvent.__table__.insert(), rows)
+            session.commit()
+        print(f"✅ Event log opportunità: {len(rows)} eventi storici generati")
+
+    rebuild_opportunity_aggregates()
+
+
+# =========================
+# ROLLUP ORE TIMESHEET (DELTA)
+# =========================
+# TaskFase.ore_consumate e ProjectCommessa.ore_consumate sono aggiornate solo
+# con la differenza di ore della scrittura (inserimento, modifica, eliminazione):
+# il costo non cresce con lo storico. reconcile_time_rollups() riverifica i
+# totali contro le righe TimeEntry (job periodico).
+
+_reconcile_state: dict = {"last_run": None, "last_result": None}
+
+
+def _week_of(day) -> tuple[date, int, int]:
+    """(lunedì, anno ISO, settimana ISO) del giorno."""
+    if isinstance(day, str):
+        day = date.fromisoformat(day[:10])
+    iso = day.isocalendar()
+    return day - timedelta(days=day.weekday()), iso[0], iso[1]
+
+
+def _add_delta(deltas: dict, commessa_id, fase_id, operatore, data_lavoro, ore, righe) -> None:
+    acc = deltas.setdefault((commessa_id, fase_id, operatore or "", data_lavoro), [0.0, 0])
+    acc[0] += float(ore or 0.0)
+    acc[1] += righe
+
+
+def _apply_hours_delta(session: Session, deltas: dict) -> None:
+    """
+    Applica {(commessa_id, fase_id, operatore, data_lavoro): [delta_ore, delta_righe]}
+    a fasi e commesse (UPDATE incrementale per id) e all'aggregato settimanale
+    TimesheetWeek (upsert). Tutto in executemany. Non fa commit.
+    """
+    by_fase: dict = {}
+    by_commessa: dict = {}
+    by_week: dict = {}
+    for (commessa_id, fase_id, operatore, data_lavoro), (delta, righe) in deltas.items():
+        by_fase[fase_id] = by_fase.get(fase_id, 0.0) + delta
+        by_commessa[commessa_id] = by_commessa.get(commessa_id, 0.0) + delta
+        key = (operatore, *_week_of(data_lavoro), commessa_id, fase_id)
+        acc = by_week.setdefault(key, [0.0, 0])
+        acc[0] += delta
+        acc[1] += righe
+
+    for table, key, values in (
+        ("taskfase", "fase_id", by_fase),
+        ("projectcommessa", "commessa_id", by_commessa),
+    ):
+        params = [{"id": k, "delta": v} for k, v in values.items() if k is not None and v]
+        if params:
+            session.execute(
+                text(f"UPDATE {table} SET ore_consumate = COALESCE(ore_consumate, 0) + :delta WHERE {key} = :id"),
+                params,
+            )
+
+    params = [
+        {
+            "operatore": op, "week_start": ws.isoformat(), "iso_year": y, "iso_week": w,
+            "commessa_id": c, "fase_id": f, "ore": ore, "righe": righe,
+        }
+        for (op, ws, y, w, c, f), (ore, righe) in by_week.items()
+        if ore or righe
+    ]
+    if params:
+        session.execute(
+            text(
+                """
+                INSERT INTO timesheetweek (operatore, week_start, iso_year, iso_week, commessa_id, fase_id, ore, righe)
+                VALUES (:operatore, :week_start, :iso_year, :iso_week, :commessa_id, :fase_id, :ore, :righe)
+                ON CONFLICT (operatore, week_start, commessa_id, fase_id)
+                DO UPDATE SET ore = ore + excluded.ore, righe = righe + excluded.righe
+                """
+            ),
+            params,
+        )
+        if any(p["righe"] < 0 for p in params):
+            session.execute(text("DELETE FROM timesheetweek WHERE righe <= 0"))
+
+
+def add_time_entries(session: Session, entries: list) -> None:
+    """Aggiunge righe timesheet e somma le loro ore ai rollup. Non fa commit."""
+    deltas: dict = {}
+    for entry in entries:
+        session.add(entry)
+        _add_delta(deltas, entry.commessa_id, entry.fase_id, entry.operatore, entry.data_lavoro, entry.ore, 1)
+    _apply_hours_delta(session, deltas)
+
+
+def insert_time_entries_bulk(session: Session, rows: list[dict]) -> int:
+    """
+    Inserisce righe timesheet già validate ({commessa_id, fase_id, data_lavoro,
+    ore, operatore}) con un executemany e aggiorna i rollup una volta sola.
+    Non fa commit.
+    """
+    if not rows:
+        return 0
+    session.execute(
+        text(
+            "INSERT INTO timeentry (commessa_id, fase_id, data_lavoro, ore, operatore) "
+            "VALUES (:commessa_id, :fase_id, :data_lavoro, :ore, :operatore)"
+        ),
+        [{**r, "data_lavoro": r["data_lavoro"].isoformat()} for r in rows],
+    )
+    deltas: dict = {}
+    for r in rows:
+        _add_delta(deltas, r["commessa_id"], r["fase_id"], r["operatore"], r["data_lavoro"], r["ore"], 1)
+    _apply_hours_delta(session, deltas)
+    return len(rows)
+
+
+def update_time_entry(session: Session, entry: TimeEntry, **changes) -> None:
+    """Modifica una riga timesheet spostando la differenza di ore. Non fa commit."""
+    deltas: dict = {}
+    _add_delta(deltas, entry.commessa_id, entry.fase_id, entry.operatore, entry.data_lavoro, -(entry.ore or 0.0), -1)
+    for attr, value in changes.items():
+        setattr(entry, attr, value)
+    _add_delta(deltas, entry.commessa_id, entry.fase_id, entry.operatore, entry.data_lavoro, entry.ore, 1)
+    session.add(entry)
+    _apply_hours_delta(session, deltas)
+
+
+def delete_time_entries(session: Session, *where) -> int:
+    """
+    Elimina le righe timesheet che soddisfano le condizioni e toglie le loro
+    ore dai rollup (somme per fase, operatore e giorno con una GROUP BY). Non fa commit.
+    """
+    sums = session.exec(
+        select(
+            TimeEntry.commessa_id, TimeEntry.fase_id, TimeEntry.operatore, TimeEntry.data_lavoro,
+            func.sum(TimeEntry.ore), func.count(),
+        )
+        .where(*where)
+        .group_by(TimeEntry.commessa_id, TimeEntry.fase_id, TimeEntry.operatore, TimeEntry.data_lavoro)
+    ).all()
+    if not sums:
+        return 0
+    session.exec(delete(TimeEntry).where(*where))
+    deltas: dict = {}
+    for c, f, op, day, ore, n in sums:
+        _add_delta(deltas, c, f, op, day, -(ore or 0.0), -n)
+    _apply_hours_delta(session, deltas)
+    return sum(n for *_rest, n in sums)
+
+
+def _expected_timesheet_weeks(session: Session) -> dict:
+    """Aggregato settimanale ricalcolato dalle righe TimeEntry (per giorno in SQL, poi per settimana)."""
+    expected: dict = {}
+    rows = session.execute(text(
+        """
+        SELECT COALESCE(operatore, ''), data_lavoro, commessa_id, fase_id, SUM(ore), COUNT(*)
+        FROM timeentry GROUP BY operatore, data_lavoro, commessa_id, fase_id
+        """
+    ))
+    for op, day, c, f, ore, n in rows:
+        ws, y, w = _week_of(day)
+        acc = expected.setdefault((op, ws.isoformat(), c, f), [y, w, 0.0, 0])
+        acc[2] += ore or 0.0
+        acc[3] += n
+    return expected
+
+
+def rebuild_timesheet_weeks(session: Session, expected: Optional[dict] = None) -> int:
+    """Riscrive da zero TimesheetWeek. Non fa commit."""
+    expected = expected if expected is not None else _expected_timesheet_weeks(session)
+    session.execute(text("DELETE FROM timesheetweek"))
+    params = [
+        {
+            "operatore": op, "week_start": ws, "iso_year": y, "iso_week": w,
+            "commessa_id": c, "fase_id": f, "ore": ore, "righe": n,
+        }
+        for (op, ws, c, f), (y, w, ore, n) in expected.items()
+    ]
+    if params:
+        session.execute(
+            text(
+                "INSERT INTO timesheetweek (operatore, week_start, iso_year, iso_week, commessa_id, fase_id, ore, righe) "
+                "VALUES (:operatore, :week_start, :iso_year, :iso_week, :commessa_id, :fase_id, :ore, :righe)"
+            ),
+            params,
+        )
+    return len(params)
+
+
+def reconcile_time_rollups(fix: bool = True, tolerance: float = 1e-6) -> dict:
+    """
+    Confronta ore_consumate di fasi e commesse con la somma delle righe
+    timesheet; con fix=True riallinea i valori divergenti.
+    Ritorna il numero di fasi/commesse verificate e le differenze trovate.
+    """
+    checks = {
+        "taskfase": ("fase_id", "fase_id"),
+        "projectcommessa": ("commessa_id", "commessa_id"),
+    }
+    result: dict = {"checked": {}, "mismatches": {}, "fixed": fix}
+    with Session(engine) as session:
+        for table, (key, te_key) in checks.items():
+            rows = session.execute(text(
+                f"""
+                SELECT t.{key}, COALESCE(t.ore_consumate, 0), COALESCE(s.ore, 0)
+                FROM {table} AS t
+                LEFT JOIN (
+                    SELECT {te_key}, SUM(ore) AS ore FROM timeentry GROUP BY {te_key}
+                ) AS s ON s.{te_key} = t.{key}
+                """
+            )).fetchall()
+            result["checked"][table] = len(rows)
+            mismatches = [
+                {"id": rid, "stored": stored, "actual": actual}
+                for rid, stored, actual in rows
+                if abs(stored - actual) > tolerance
+            ]
+            result["mismatches"][table] = mismatches
+            if fix and mismatches:
+                session.execute(
+                    text(f"UPDATE {table} SET ore_consumate = :actual WHERE {key} = :id"),
+                    [{"id": m["id"], "actual": m["actual"]} for m in mismatches],
+                )
+
+        # aggregato settimanale: confronto chiave per chiave, ricostruzione se diverge
+        expected = _expected_timesheet_weeks(session)
+        stored = {
+            (op, str(ws)[:10], c, f): (ore, n)
+            for op, ws, c, f, ore, n in session.execute(text(
+                "SELECT operatore, week_start, commessa_id, fase_id, ore, righe FROM timesheetweek"
+            ))
+        }
+        week_mismatches = [
+            {"key": k, "stored": stored.get(k), "actual": (v[2], v[3])}
+            for k, v in expected.items()
+            if k not in stored or abs(stored[k][0] - v[2]) > tolerance or stored[k][1] != v[3]
+        ] + [{"key": k, "stored": v, "actual": None} for k, v in stored.items() if k not in expected]
+        result["checked"]["timesheetweek"] = len(expected)
+        result["mismatches"]["timesheetweek"] = week_mismatches
+        if fix and week_mismatches:
+            rebuild_timesheet_weeks(session, expected)
+        session.commit()
+
+    _reconcile_state["last_run"] = datetime.utcnow()
+    _reconcile_state["last_result"] = result
+    return result
+
+
+def maybe_reconcile_time_rollups() -> Optional[dict]:
+    """Esegue la riconciliazione se è passato TIMESHEET_RECONCILE_INTERVAL_S dall'ultima."""
+    last_run = _reconcile_state["last_run"]
+    if last_run is not None and (datetime.utcnow() - last_run).total_seconds() < TIMESHEET_RECONCILE_INTERVAL_S:
+        return None
+    return reconcile_time_rollups(fix=True)
+
+
+def get_reconcile_status() -> dict:
+    return dict(_reconcile_state)
+
+
+# =========================
+# INIT & SESSION
+# =========================
+
+def init_db():
+    """Crea le tabelle e ripristina il backup verificato più recente se il DB manca"""
+    from restore_db import restore_if_needed
+
+    report = restore_if_needed(SQLITE_FILE_NAME)
+    if report is not None:
+        for tentativo in report["failed_attempts"]:
+            print(f"❌ Backup scartato {tentativo['source']}: {tentativo['error']}")
+        if report["restored"]:
+            print(f"✅ Database ripristinato da {report['source']} in {report['elapsed_s']:.2f}s")
+        else:
+            print("⚠️ Nessun backup valido: si parte da un database vuoto")
 
     # Crea tabelle se non esistono
     SQLModel.metadata.create_all(engine)
@@ -889,6 +1901,229 @@ def migrate_db():
         else:
             print("ℹ️ Tabella CrmAutomationRule non trovata (nessuna regola auto creata)")
 
+        # Opportunità per cliente (conteggi dei segmenti CRM)
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_opportunity_client_id ON opportunity (client_id);"
+        )
+        # Indice per il riempimento della leaderboard fiamme
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_opportunity_flame_points ON opportunity (flame_points);"
+        )
+        conn.commit()
+
+        # Aggregato settimanale timesheet: chiave per l'upsert a delta. Con righe
+        # duplicate l'aggregato si svuota e viene rigenerato dallo storico più sotto
+        try:
+            conn.exec_driver_sql(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ux_timesheetweek_key "
+                "ON timesheetweek (operatore, week_start, commessa_id, fase_id);"
+            )
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"⚠️ Aggregato settimanale timesheet con chiavi duplicate, lo rigenero: {e}")
+            try:
+                conn.exec_driver_sql("DELETE FROM timesheetweek;")
+                conn.exec_driver_sql(
+                    "CREATE UNIQUE INDEX ux_timesheetweek_key "
+                    "ON timesheetweek (operatore, week_start, commessa_id, fase_id);"
+                )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"⚠️ Errore creazione indice unico TimesheetWeek: {e}")
+
+        # Indice coprente per le ore per operatore in un periodo (capacity.py)
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_timeentry_data_operatore ON timeentry (data_lavoro, operatore, ore);"
+        )
+        conn.commit()
+
+        # Eventi OEE: un solo evento per linea e istante (re-import idempotente)
+        try:
+            conn.exec_driver_sql(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ux_oeeevent_line_ts ON oeeevent (line_id, ts);"
+            )
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"⚠️ Errore creazione indice unico eventi OEE (eventi duplicati da verificare): {e}")
+
+        # ContactTag: una sola riga per (contatto, tag), poi indice unico per i bulk
+        has_unique_tag_index = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type='index' AND name='ux_contacttag_contact_tag';"
+        ).fetchone()
+        if not has_unique_tag_index:
+            try:
+                removed = conn.exec_driver_sql(
+                    """
+                    DELETE FROM contacttag
+                    WHERE id NOT IN (SELECT MIN(id) FROM contacttag GROUP BY contact_id, tag_id)
+                    """
+                ).rowcount
+                conn.exec_driver_sql(
+                    "CREATE UNIQUE INDEX ux_contacttag_contact_tag ON contacttag (contact_id, tag_id);"
+                )
+                conn.commit()
+                print(f"✅ Indice unico ContactTag creato ({removed} duplicati rimossi)")
+            except Exception as e:
+                print(f"⚠️ Errore creazione indice unico ContactTag: {e}")
+
+    # Event log opportunità: genera lo storico alla prima attivazione
+    try:
+        backfill_opportunity_events()
+    except Exception as e:
+        print(f"⚠️ Errore backfill event log opportunità: {e}")
+
+    # Aggregato settimanale timesheet: generato dallo storico alla prima attivazione
+    try:
+        with Session(engine) as session:
+            empty = session.exec(select(TimesheetWeek.id).limit(1)).first() is None
+            if empty and session.exec(select(TimeEntry.entry_id).limit(1)).first() is not None:
+                n = rebuild_timesheet_weeks(session)
+                session.commit()
+                print(f"✅ Aggregato settimanale timesheet: {n} righe generate")
+    except Exception as e:
+        print(f"⚠️ Errore backfill aggregato settimanale timesheet: {e}")
+
+    # Ricerca full-text: tabella FTS5 e trigger (indice generato alla prima attivazione)
+    raw = engine.raw_connection()
+    try:
+        res = install_search_index(raw.driver_connection)
+        if res["rows"] is not None:
+            print(f"✅ Indice ricerca full-text: {res['rows']} righe indicizzate")
+    except Exception as e:
+        print(f"⚠️ Errore installazione ricerca full-text (FTS5): {e}")
+    finally:
+        raw.close()
+
+    # Journal CDC: trigger aggiornati solo se cambiano tabelle/colonne; con il
+    # journal spento si tolgono quelli rimasti da avvii precedenti
+    raw = engine.raw_connection()
+    try:
+        if CDC_JOURNAL_ENABLED:
+            install_cdc_triggers(raw.driver_connection)
+        else:
+            drop_cdc_triggers(raw.driver_connection)
+    except Exception as e:
+        print(f"⚠️ Errore aggiornamento journal CDC: {e}")
+    finally:
+        raw.close()
+
 def get_session() -> Session:
     """Restituisce una nuova sessione SQLModel"""
-    return Session(engine)
\ No newline at end of file
+    return Session(engine)
+
+
+def global_search(text: str, limit: int = 20, entities=None) -> list[dict]:
+    """Ricerca full-text su clienti, opportunità, attività e task (vedi search_index.py)."""
+    raw = engine.raw_connection()
+    try:
+        return search_fts(raw.driver_connection, text, limit=limit, entities=entities)
+    finally:
+        raw.close()
+
+
+# =========================
+# REPLICA ANALITICA (SOLA LETTURA)
+# =========================
+# I builder finanziari leggono da una copia del DB aggiornata con il journal CDC
+# al massimo ogni ANALYTICS_REPLICA_REFRESH_S secondi, oppure subito dopo un commit
+# del processo (il riallineamento è incrementale). L'aggiornamento gira in un thread
+# di background: nel frattempo le letture usano l'ultima replica valida (il DB
+# principale solo finché la prima copia non è pronta). Con ANALYTICS_REPLICA_ENABLED
+# spento (default) tutto continua a leggere dal DB principale.
+
+ANALYTICS_REPLICA_PATH = Path(os.getenv("FORGIALEAN_REPLICA_PATH", DATA_DIR / "forgialean_replica.db"))
+
+_replica_state: dict = {
+    "engine": None,
+    "refreshed_at": None,
+    "last_result": None,
+    "truncated_at": None,
+    "dirty": True,
+    "refreshing": False,
+}
+_replica_lock = threading.Lock()
+
+
+def _refresh_replica_worker(started: datetime) -> None:
+    try:
+        result = refresh_replica(SQLITE_FILE_NAME, ANALYTICS_REPLICA_PATH)
+    except Exception as e:
+        print(f"⚠️ Replica analitica non aggiornabile, resta l'ultima copia valida: {e}")
+        with _replica_lock:
+            # riprova alla prossima lettura dopo ANALYTICS_REPLICA_REFRESH_S
+            _replica_state["refreshed_at"] = started
+            _replica_state["refreshing"] = False
+        return
+
+    with _replica_lock:
+        # una ricostruzione sostituisce il file: le connessioni del pool vanno chiuse
+        if result["mode"] == "rebuild" and _replica_state["engine"] is not None:
+            _replica_state["engine"].dispose()
+        if _replica_state["engine"] is None:
+            _replica_state["engine"] = create_engine(
+                f"sqlite:///file:{ANALYTICS_REPLICA_PATH}?mode=ro&uri=true", echo=False
+            )
+        _replica_state["refreshed_at"] = started
+        _replica_state["last_result"] = result
+        _replica_state["refreshing"] = False
+    _maybe_truncate_journal(datetime.now())
+
+
+def get_analytics_engine():
+    """Engine per le letture analitiche: ultima replica valida se attiva, altrimenti il DB principale."""
+    if not ANALYTICS_REPLICA_ENABLED:
+        return engine
+
+    with _replica_lock:
+        now = datetime.now()
+        refreshed_at = _replica_state["refreshed_at"]
+        stale = (
+            _replica_state["dirty"]
+            or refreshed_at is None
+            or (now - refreshed_at).total_seconds() >= ANALYTICS_REPLICA_REFRESH_S
+        )
+        if stale and not _replica_state["refreshing"]:
+            # i commit arrivati durante l'aggiornamento lo rimettono a True
+            _replica_state["dirty"] = False
+            _replica_state["refreshing"] = True
+            threading.Thread(
+                target=_refresh_replica_worker, args=(now,), name="analytics-replica", daemon=True
+            ).start()
+        return _replica_state["engine"] or engine
+
+
+def _maybe_truncate_journal(now: datetime) -> None:
+    """Pulisce il journal già applicato alla replica, al massimo ogni CDC_JOURNAL_TRUNCATE_INTERVAL_S."""
+    last = _replica_state["truncated_at"]
+    if not CDC_JOURNAL_ENABLED or (last is not None and (now - last).total_seconds() < CDC_JOURNAL_TRUNCATE_INTERVAL_S):
+        return
+    _replica_state["truncated_at"] = now
+    try:
+        truncate_journal(SQLITE_FILE_NAME, replica=ANALYTICS_REPLICA_PATH)
+    except Exception as e:
+        print(f"⚠️ Pulizia journal CDC non riuscita: {e}")
+
+
+@event.listens_for(engine, "commit")
+def _mark_replica_stale(conn) -> None:
+    """Dopo una scrittura di questo processo la prossima lettura analitica riallinea la replica."""
+    _replica_state["dirty"] = True
+
+
+def get_analytics_session() -> Session:
+    """Sessione di sola lettura per report e builder finanziari."""
+    return Session(get_analytics_engine())
+
+
+def get_replica_status() -> dict:
+    """Stato della replica analitica per la pagina admin."""
+    return {
+        "enabled": ANALYTICS_REPLICA_ENABLED,
+        "path": str(ANALYTICS_REPLICA_PATH),
+        "refreshed_at": _replica_state["refreshed_at"],
+        "refreshing": _replica_state["refreshing"],
+        **(_replica_state["last_result"] or {}),
+    }
@@ -0,0 +1,542 @@
+# email_sender.py
+"""
+Invio email in background per ForgiaLean Control Tower (mini-report OEE, campagne).
+
+- coda in memoria: enqueue_email / enqueue_many ritornano subito, la pagina
+  Streamlit non aspetta il server SMTP;
+- un worker in background (thread daemon, avviato al primo messaggio)
+  riusa la stessa connessione SMTP (STARTTLS + login una sola volta) per
+  fino a EMAIL_MAX_PER_CONNECTION messaggi e la chiude dopo
+  EMAIL_IDLE_CLOSE_S secondi senza invii;
+- limite di EMAIL_RATE_PER_MIN messaggi al minuto (token bucket, picco
+  EMAIL_RATE_BURST);
+- errori temporanei (4xx, disconnessioni, timeout) ritentati fino a
+  EMAIL_MAX_RETRIES volte con attesa crescente (il messaggio aspetta in
+  disparte e torna in fondo alla coda, gli altri continuano a partire);
+  errori definitivi (5xx,
+  destinatario rifiutato, credenziali) contati come falliti.
+
+La coda non è persistente: i messaggi non ancora inviati si perdono al
+riavvio del processo (i lead restano comunque salvati nel DB).
+
+Server di prova locale (nessun invio reale, stile aiosmtpd):
+    python email_sender.py stub --port 2525
+    python email_sender.py bench --count 300 --handshake-ms 30
+"""
+
+import argparse
+import atexit
+import base64
+import heapq
+import queue
+import random
+import smtplib
+import socketserver
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from email.mime.text import MIMEText
+
+import perf_monitor
+from config import (
+    EMAIL_IDLE_CLOSE_S,
+    EMAIL_MAX_PER_CONNECTION,
+    EMAIL_MAX_RETRIES,
+    EMAIL_QUEUE_MAX,
+    EMAIL_RATE_BURST,
+    EMAIL_RATE_PER_MIN,
+    EMAIL_RETRY_BACKOFF_S,
+)
+
+# Attesa massima tra due tentativi (secondi)
+_MAX_BACKOFF_S = 60.0
+
+_COND = threading.Condition()
+_STOP = threading.Event()
+_QUEUE: deque = deque()
+# messaggi da ritentare: heap di (non prima di, id, job) su time.monotonic()
+_DEFERRED: list = []
+_FAILURES: deque = deque(maxlen=50)
+_STATE = {
+    "config": None,
+    "worker": None,
+    "next_id": 1,
+    "pending": 0,
+    "sent": 0,
+    "failed": 0,
+    "retried": 0,
+    "connections": 0,
+    "last_error": None,
+    "last_sent_at": None,
+}
+
+
+# ========================
+# CONFIGURAZIONE
+# ========================
+
+def configure_smtp(
+    host: str,
+    port: int,
+    user: str | None,
+    password: str | None,
+    from_address: str,
+    starttls: bool = True,
+    timeout: float = 30.0,
+    rate_per_min: int | None = None,
+) -> None:
+    """Parametri del server SMTP; la connessione viene aperta dal worker al primo invio."""
+    with _COND:
+        _STATE["config"] = {
+            "host": host,
+            "port": int(port),
+            "user": user,
+            "password": password,
+            "from_address": from_address,
+            "starttls": starttls,
+            "timeout": timeout,
+            "rate_per_min": EMAIL_RATE_PER_MIN if rate_per_min is None else rate_per_min,
+        }
+
+
+# ========================
+# CODA
+# ========================
+
+def enqueue_email(to: str, subject: str, body: str, subtype: str = "html", tag: str | None = None) -> int:
+    """Mette in coda un messaggio e ritorna il suo id (l'invio avviene in background)."""
+    return enqueue_many([{"to": to, "subject": subject, "body": body, "subtype": subtype, "tag": tag}])[0]
+
+
+def enqueue_many(messages) -> list[int]:
+    """
+    Mette in coda più messaggi in un colpo solo.
+    messages: dict con to, subject, body e opzionali subtype ("html"/"plain"), tag.
+    """
+    messages = list(messages)
+    with _COND:
+        if _STATE["config"] is None:
+            raise RuntimeError("SMTP non configurato: chiamare configure_smtp() prima dell'invio")
+        waiting = len(_QUEUE) + len(_DEFERRED)
+        if waiting + len(messages) > EMAIL_QUEUE_MAX:
+            raise queue.Full(f"coda email piena ({waiting} messaggi in attesa)")
+        ids = []
+        for m in messages:
+            job = {
+                "id": _STATE["next_id"],
+                "to": m["to"],
+                "subject": m["subject"],
+                "body": m["body"],
+                "subtype": m.get("subtype") or "html",
+                "tag": m.get("tag"),
+                "attempts": 0,
+                "enqueued_at": time.time(),
+            }
+            _STATE["next_id"] += 1
+            _QUEUE.append(job)
+            ids.append(job["id"])
+        _STATE["pending"] += len(ids)
+        _ensure_worker()
+        _COND.notify_all()
+    return ids
+
+
+def flush(timeout: float | None = None) -> bool:
+    """Attende che tutti i messaggi in coda siano inviati o falliti; False se scade il timeout."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with _COND:
+        while _STATE["pending"] > 0:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            _COND.wait(remaining)
+    return True
+
+
+def queue_status() -> dict:
+    """Contatori della coda per la pagina Performance."""
+    with _COND:
+        worker = _STATE["worker"]
+        return {
+            "queued": len(_QUEUE) + len(_DEFERRED),
+            "deferred": len(_DEFERRED),
+            "in_flight": _STATE["pending"] - len(_QUEUE) - len(_DEFERRED),
+            "sent": _STATE["sent"],
+            "failed": _STATE["failed"],
+            "retried": _STATE["retried"],
+            "connections": _STATE["connections"],
+            "per_connection": _STATE["sent"] / _STATE["connections"] if _STATE["connections"] else None,
+            "last_error": _STATE["last_error"],
+            "last_sent_at": _STATE["last_sent_at"],
+            "worker_alive": worker is not None and worker.is_alive(),
+            "rate_per_min": (_STATE["config"] or {}).get("rate_per_min"),
+        }
+
+
+def recent_failures() -> list[dict]:
+    """Ultimi messaggi falliti definitivamente (destinatario, oggetto, errore)."""
+    with _COND:
+        return list(_FAILURES)
+
+
+def shutdown(timeout: float = 5.0) -> None:
+    """Ferma il worker chiudendo la connessione (i messaggi ancora in coda restano non inviati)."""
+    _STOP.set()
+    with _COND:
+        worker = _STATE["worker"]
+        _COND.notify_all()
+    if worker is not None:
+        worker.join(timeout)
+
+
+atexit.register(shutdown)
+
+
+# ========================
+# WORKER
+# ========================
+
+def _ensure_worker() -> None:
+    """Avvia il worker se non è attivo (chiamata con _COND acquisito)."""
+    worker = _STATE["worker"]
+    if worker is not None and worker.is_alive():
+        return
+    _STOP.clear()
+    worker = threading.Thread(target=_worker_loop, name="email-sender", daemon=True)
+    _STATE["worker"] = worker
+    worker.start()
+
+
+def _next_job(idle_timeout: float | None):
+    """
+    Prossimo messaggio pronto, o None se non ce ne sono per idle_timeout secondi
+    o si sta chiudendo. I ritentativi scaduti passano in fondo alla coda.
+    """
+    with _COND:
+        deadline = None if idle_timeout is None else time.monotonic() + idle_timeout
+        while not _STOP.is_set():
+            now = time.monotonic()
+            while _DEFERRED and _DEFERRED[0][0] <= now:
+                _QUEUE.append(heapq.heappop(_DEFERRED)[2])
+            if _QUEUE:
+                return _QUEUE.popleft()
+            waits = [_DEFERRED[0][0] - now] if _DEFERRED else []
+            if deadline is not None:
+                if deadline <= now:
+                    return None
+                waits.append(deadline - now)
+            _COND.wait(min(waits) if waits else None)
+        return None
+
+
+def _job_done(job: dict, error: Exception | None = None) -> None:
+    with _COND:
+        _STATE["pending"] -= 1
+        if error is None:
+            _STATE["sent"] += 1
+            _STATE["last_sent_at"] = datetime.now()
+        else:
+            _STATE["failed"] += 1
+            _STATE["last_error"] = f"{type(error).__name__}: {error}"
+            _FAILURES.append(
+                {
+                    "id": job["id"],
+                    "to": job["to"],
+                    "subject": job["subject"],
+                    "tag": job["tag"],
+                    "attempts": job["attempts"] + 1,
+                    "error": _STATE["last_error"],
+                    "at": datetime.now(),
+                }
+            )
+        _COND.notify_all()
+
+
+def _is_transient(e: Exception) -> bool:
+    """4xx, disconnessioni e errori di rete si ritentano; 5xx e credenziali errate no."""
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in e.recipients.values())
+    if isinstance(e, smtplib.SMTPResponseException):
+        return 400 <= e.smtp_code < 500
+    if isinstance(e, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(e, smtplib.SMTPException):
+        return False
+    return isinstance(e, OSError)
+
+
+def _keeps_connection(e: Exception) -> bool:
+    """Rifiuti del singolo messaggio: smtplib ha già fatto RSET, la connessione resta valida."""
+    return isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError))
+
+
+def _connect(cfg: dict) -> smtplib.SMTP:
+    with perf_monitor.track("external", "SMTP connessione (pool)", host=cfg["host"]):
+        conn = smtplib.SMTP(cfg["host"], cfg["port"], timeout=cfg["timeout"])
+        try:
+            if cfg["starttls"]:
+                conn.starttls()
+            if cfg["user"]:
+                conn.login(cfg["user"], cfg["password"])
+        except Exception:
+            _close(conn)
+            raise
+    with _COND:
+        _STATE["connections"] += 1
+    return conn
+
+
+def _close(conn) -> None:
+    if conn is None:
+        return None
+    try:
+        conn.quit()
+    except Exception:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    return None
+
+
+def _build_message(job: dict, cfg: dict) -> MIMEText:
+    msg = MIMEText(job["body"], job["subtype"], "utf-8")
+    msg["Subject"] = job["subject"]
+    msg["From"] = cfg["from_address"]
+    msg["To"] = job["to"]
+    return msg
+
+
+def _worker_loop() -> None:
+    conn = None
+    conn_sent = 0
+    tokens = float(EMAIL_RATE_BURST)
+    refilled_at = time.monotonic()
+
+    while True:
+        job = _next_job(EMAIL_IDLE_CLOSE_S if conn is not None else None)
+        if job is None:
+            # inattivo (o in chiusura): libera la connessione
+            conn = _close(conn)
+            if _STOP.is_set():
+                return
+            continue
+
+        with _COND:
+            cfg = _STATE["config"]
+
+        # limite di invio: token bucket
+        rate = cfg["rate_per_min"]
+        if rate > 0:
+            now = time.monotonic()
+            tokens = min(float(EMAIL_RATE_BURST), tokens + (now - refilled_at) * rate / 60.0)
+            refilled_at = now
+            if tokens < 1.0:
+                _STOP.wait((1.0 - tokens) * 60.0 / rate)
+                tokens, refilled_at = 1.0, time.monotonic()
+            tokens -= 1.0
+
+        msg = _build_message(job, cfg)
+        reused = conn is not None
+        try:
+            if conn is not None and conn_sent >= EMAIL_MAX_PER_CONNECTION:
+                conn = _close(conn)
+            if conn is None:
+                conn, conn_sent, reused = _connect(cfg), 0, False
+            try:
+                with perf_monitor.track("external", "SMTP send_message (pool)", host=cfg["host"]):
+                    conn.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                if not reused:
+                    raise
+                # connessione riusata chiusa dal server nel frattempo: una nuova e si riprova subito
+                _close(conn)
+                conn, conn_sent = _connect(cfg), 0
+                conn.send_message(msg)
+            conn_sent += 1
+            _job_done(job)
+        except Exception as e:
+            if not _keeps_connection(e):
+                conn = _close(conn)
+            if _is_transient(e) and job["attempts"] < EMAIL_MAX_RETRIES and not _STOP.is_set():
+                job["attempts"] += 1
+                backoff = min(EMAIL_RETRY_BACKOFF_S * 2 ** (job["attempts"] - 1), _MAX_BACKOFF_S)
+                with _COND:
+                    _STATE["retried"] += 1
+                    _STATE["last_error"] = f"{type(e).__name__}: {e}"
+                    # il worker intanto prosegue con gli altri messaggi
+                    heapq.heappush(_DEFERRED, (time.monotonic() + backoff, job["id"], job))
+            else:
+                _job_done(job, e)
+
+
+# ========================
+# SERVER SMTP DI PROVA
+# ========================
+
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Server SMTP minimale in stile aiosmtpd: accetta AUTH e messaggi senza
+    inviarli. handshake_ms simula il costo di connessione + TLS, fail_rate
+    risponde 451 (errore temporaneo) a una quota dei messaggi; i destinatari
+    che contengono "rifiuta" ricevono 550.
+    """
+
+    def _reply(self, line: str) -> None:
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        srv = self.server
+        with srv.lock:
+            srv.stats["connections"] += 1
+        time.sleep(srv.handshake_ms / 1000.0)
+        self._reply("220 stub.forgialean ESMTP")
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            verb = line[:4].upper()
+            if verb == "EHLO":
+                self.wfile.write(b"250-stub.forgialean\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+            elif verb == "HELO":
+                self._reply("250 stub.forgialean")
+            elif verb == "AUTH":
+                parts = line.split()
+                if len(parts) == 2 and parts[1].upper() == "LOGIN":
+                    self._reply("334 " + base64.b64encode(b"Username:").decode())
+                    self.rfile.readline()
+                    self._reply("334 " + base64.b64encode(b"Password:").decode())
+                    self.rfile.readline()
+                self._reply("235 2.7.0 Authentication successful")
+            elif verb == "MAIL":
+                self._reply("250 OK")
+            elif verb == "RCPT":
+                self._reply("550 5.1.1 Mailbox unavailable" if "rifiuta" in line.lower() else "250 OK")
+            elif verb == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                time.sleep(srv.latency_ms / 1000.0)
+                if srv.fail_rate and random.random() < srv.fail_rate:
+                    self._reply("451 4.3.0 Temporary failure")
+                    continue
+                with srv.lock:
+                    srv.stats["messages"] += 1
+                self._reply("250 OK queued")
+            elif verb in ("RSET", "NOOP"):
+                self._reply("250 OK")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handshake_ms: float = 0.0, latency_ms: float = 0.0, fail_rate: float = 0.0):
+        super().__init__(address, StubSMTPHandler)
+        self.handshake_ms = handshake_ms
+        self.latency_ms = latency_ms
+        self.fail_rate = fail_rate
+        self.lock = threading.Lock()
+        self.stats = {"connections": 0, "messages": 0}
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, **kwargs) -> StubSMTPServer:
+    """Avvia il server di prova in un thread; port=0 sceglie una porta libera (server.server_address)."""
+    server = StubSMTPServer((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, name="smtp-stub", daemon=True).start()
+    return server
+
+
+# ========================
+# BENCHMARK
+# ========================
+
+def run_benchmark(count: int = 300, handshake_ms: float = 30.0, latency_ms: float = 1.0) -> dict:
+    """Una connessione per messaggio (vecchio invia_minireport_oee) contro coda + connessione riusata."""
+    server = start_stub_server(handshake_ms=handshake_ms, latency_ms=latency_ms)
+    host, port = server.server_address
+    body = "<p>Mini-report OEE di prova</p>" * 40
+    try:
+        t0 = time.perf_counter()
+        for i in range(count):
+            msg = MIMEText(body, "html", "utf-8")
+            msg["Subject"] = "Mini-report OEE"
+            msg["From"] = "info@forgialean.it"
+            msg["To"] = f"lead{i}@example.com"
+            with smtplib.SMTP(host, port) as conn:
+                conn.login("stub", "stub")
+                conn.send_message(msg)
+        single_s = time.perf_counter() - t0
+        single_conn = server.stats["connections"]
+
+        configure_smtp(host, port, "stub", "stub", "info@forgialean.it", starttls=False, rate_per_min=0)
+        t0 = time.perf_counter()
+        enqueue_many(
+            {"to": f"lead{i}@example.com", "subject": "Mini-report OEE", "body": body} for i in range(count)
+        )
+        enqueue_s = time.perf_counter() - t0
+        flush()
+        pooled_s = time.perf_counter() - t0
+        return {
+            "count": count,
+            "single_s": single_s,
+            "single_connections": single_conn,
+            "pooled_s": pooled_s,
+            "pooled_connections": server.stats["connections"] - single_conn,
+            "enqueue_ms": enqueue_s * 1000,
+            "delivered": server.stats["messages"],
+        }
+    finally:
+        shutdown()
+        server.shutdown()
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Invio email ForgiaLean: server SMTP di prova e benchmark")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_stub = sub.add_parser("stub", help="server SMTP locale che accetta e scarta i messaggi")
+    p_stub.add_argument("--host", default="127.0.0.1")
+    p_stub.add_argument("--port", type=int, default=2525)
+    p_stub.add_argument("--handshake-ms", type=float, default=0.0)
+    p_stub.add_argument("--fail-rate", type=float, default=0.0)
+    p_bench = sub.add_parser("bench", help="confronta invio singolo e coda con connessione riusata")
+    p_bench.add_argument("--count", type=int, default=300)
+    p_bench.add_argument("--handshake-ms", type=float, default=30.0)
+    p_bench.add_argument("--latency-ms", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "stub":
+        server = StubSMTPServer((args.host, args.port), handshake_ms=args.handshake_ms, fail_rate=args.fail_rate)
+        print(f"✅ Server SMTP di prova su {args.host}:{args.port} (SMTP_STARTTLS=false nei secrets)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            print(f"📬 {server.stats['messages']} messaggi su {server.stats['connections']} connessioni")
+        return
+
+    r = run_benchmark(args.count, args.handshake_ms, args.latency_ms)
+    print(f"📧 {r['count']} messaggi, handshake simulato {args.handshake_ms:.0f} ms")
+    print(
+        f"   una connessione per messaggio: {r['single_s']:.2f}s "
+        f"({r['count'] / r['single_s']:,.0f} msg/s, {r['single_connections']} connessioni)"
+    )
+    print(
+        f"   coda + connessione riusata:    {r['pooled_s']:.2f}s "
+        f"({r['count'] / r['pooled_s']:,.0f} msg/s, {r['pooled_connections']} connessioni)"
+    )
+    print(f"   messa in coda: {r['enqueue_ms']:.1f} ms · consegnati dal server di prova: {r['delivered']}")
+
+
+if __name__ == "__main__":
+    main()
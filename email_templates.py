@@ -0,0 +1,425 @@
+# email_templates.py
+"""
+Template email del mini-report OEE, compilati una volta per fascia.
+
+Il corpo HTML è un unico template con campi {nome}, {oee_perc:.1f}, ...;
+compile_minireport(fascia) lo analizza una volta, inserisce i testi della
+fascia (critica / intermedia / alta) e lascia una tupla di blocchi statici
+tra i soli campi personali. La versione compilata resta in cache: ogni
+email è un "".join dei blocchi con i valori formattati (str.format
+rileggerebbe ogni volta tutti i ~2 KB del template).
+
+- render_minireport(...)        una email (build_email_body nell'app)
+- render_minireport_batch(df)   DataFrame di lead -> tracking_id + body,
+                                colonne formattate in blocco e tracking id
+                                generati insieme
+
+Il benchmark confronta anche il percorso precedente (template interpolato
+per intero a ogni email, come il vecchio build_email_body).
+
+Uso:
+    python email_templates.py bench --rows 50000
+"""
+
+import argparse
+import functools
+import html
+import os
+import string
+import time
+import urllib.parse
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# Turni/anno ipotizzati (es. 250 giorni lavorativi)
+TURNI_ANNO = 250
+
+# Pagina del passo successivo (form richiamata) con i parametri di tracking
+CTA_BASE_URL = "https://forgialean.streamlit.app/"
+
+MINIREPORT_SUBJECT = "Il tuo mini‑report OEE e il prossimo passo"
+
+BATCH_COLUMNS = ("nome", "azienda", "email", "oee_perc", "perdita_euro_turno", "fascia")
+
+TESTI_FASCIA = {
+    "critica": {
+        "intro_fascia": (
+            "Questo valore ti colloca in una <b>fascia critica</b>: una quota importante della capacità "
+            "della linea si sta perdendo ogni giorno tra fermi, velocità sotto target e scarti. "
+            "Di fatto stai pagando impianti, persone e straordinari per una capacità che non arriva mai al cliente."
+        ),
+        "proposta": (
+            "In casi come il tuo l’obiettivo è recuperare una parte significativa di questa perdita, "
+            "portando l’OEE verso valori più vicini al 75–80% e liberando ore equivalenti di produzione "
+            "senza nuovi investimenti in macchine."
+        ),
+    },
+    "intermedia": {
+        "intro_fascia": (
+            "Questo valore ti colloca in una <b>fascia intermedia</b>: la linea lavora, ma ci sono ancora "
+            "margini importanti dovuti a setup, organizzazione del lavoro, micro‑fermi e variazioni di velocità. "
+            "Ogni giorno una parte della capacità che stai pagando non si traduce in pezzi buoni fatturabili."
+        ),
+        "proposta": (
+            "In situazioni come la tua il potenziale tipico è un +10–15 punti OEE, lavorando in modo mirato "
+            "sulle cause principali invece che su interventi generici."
+        ),
+    },
+    "alta": {
+        "intro_fascia": (
+            "Questo valore ti colloca in una <b>fascia alta</b>: sei già in un contesto ben strutturato "
+            "e sopra la media di molte PMI del settore. Le perdite non sono più ‘disastrose’, ma ogni punto OEE "
+            "che riesci a recuperare vale molto in termini di €/anno."
+        ),
+        "proposta": (
+            "In questi contesti il lavoro non è spegnere incendi, ma fare fine‑tuning: stabilità, setup rapidi, "
+            "gestione mix e variabilità, concentrandosi dove ogni ora equivalente recuperata ha il massimo impatto economico."
+        ),
+    },
+}
+
+MINIREPORT_TEMPLATE = """
+<p>Ciao {nome},</p>
+
+<p>grazie per aver condiviso i dati della tua linea.</p>
+
+<p>In base alle informazioni che hai inserito, la stima è:</p>
+
+<ul>
+  <li>OEE stimato: <b>{oee_perc:.1f}%</b></li>
+  <li>Capacità persa: circa <b>€ {perdita_euro_turno:,.0f} per turno</b> su una macchina/linea</li>
+  <li>Se lavori a 1 turno (8 h): perdita annua ≈ <b>€ {perdita_annua_1t:,.0f}</b></li>
+  <li>Se lavori a 2 turni (16 h): perdita annua ≈ <b>€ {perdita_annua_2t:,.0f}</b></li>
+  <li>Se lavori a 3 turni (24 h): perdita annua ≈ <b>€ {perdita_annua_3t:,.0f}</b></li>
+</ul>
+
+<p>{intro_fascia}</p>
+
+<p>{proposta}</p>
+
+<p>A questo punto hai due opzioni:</p>
+
+<ul>
+  <li><b>Lasciare le cose come sono</b>, accettando che questi circa <b>€ {perdita_euro_turno:,.0f} per turno</b>
+      restino un costo fisso nascosto.</li>
+  <li><b>Lavorarci in modo strutturato</b> per trasformare una parte di quella perdita in capacità e margine.</li>
+</ul>
+
+<p>
+Se vuoi valutare seriamente come recuperare una parte di questi importi,
+clicca sul pulsante qui sotto e compila il form con il tuo <b>numero diretto</b> e la <b>fascia oraria</b> in cui preferisci essere richiamato.
+</p>
+
+<p>
+  <a href="{cta_url}" style="
+      display:inline-block;
+      padding:10px 18px;
+      background-color:#27AE60;
+      color:#ffffff;
+      text-decoration:none;
+      border-radius:4px;
+      font-weight:bold;
+  " role="button">
+    Completa il passo successivo
+  </a>
+</p>
+
+<p>
+Se in questo momento decidi di non intervenire, puoi utilizzare il mini‑report come base di confronto interna
+e condividerlo con chi presidia budget e investimenti, per rendere chiaro l’impatto economico delle perdite di OEE.
+</p>
+
+<p>Un saluto,<br>
+Marian Dutu – Operations &amp; OEE Improvement<br>
+ForgiaLean <br>
+P.IVA: 04336611209 <br>
+<a href="mailto:info@forgialean.it">info@forgialean.it</a>
+</p>
+"""
+
+# Campi personali del template (indice usato negli slot compilati)
+_FIELDS = ("nome", "oee_perc", "perdita_euro_turno", "perdita_annua_1t", "perdita_annua_2t", "perdita_annua_3t", "cta_url")
+
+# urllib.parse.quote per testo ASCII in una sola str.translate (stesso risultato, ~4x più veloce)
+_URL_SAFE = set(string.ascii_letters + string.digits + "_.-~/")
+_URL_QUOTE = str.maketrans({chr(c): chr(c) if chr(c) in _URL_SAFE else f"%{c:02X}" for c in range(128)})
+
+
+# ========================
+# COMPILAZIONE
+# ========================
+
+@functools.lru_cache(maxsize=None)
+def compile_minireport(fascia: str) -> tuple[tuple[str, ...], tuple[tuple[int, str], ...]]:
+    """
+    Template già analizzato per una fascia: (literals, slots) con
+    email = literals[0] + slot[0] + literals[1] + slot[1] + ...
+    I testi della fascia fanno parte dei literals; ogni slot è
+    (indice in _FIELDS, format spec). Fasce sconosciute = "alta",
+    come nel vecchio build_email_body.
+    """
+    static = TESTI_FASCIA.get(fascia, TESTI_FASCIA["alta"])
+    literals, slots, current = [], [], ""
+    for literal, field, spec, _conv in string.Formatter().parse(MINIREPORT_TEMPLATE):
+        current += literal
+        if field is None:
+            continue
+        if field in static:
+            current += static[field]
+            continue
+        literals.append(current)
+        slots.append((_FIELDS.index(field), spec))
+        current = ""
+    literals.append(current)
+    return tuple(literals), tuple(slots)
+
+
+def _assemble(literals: tuple, values) -> str:
+    parts = [literals[0]]
+    for value, literal in zip(values, literals[1:]):
+        parts += (value, literal)
+    return "".join(parts)
+
+
+def _quote(text: str) -> str:
+    return text.translate(_URL_QUOTE) if text.isascii() else urllib.parse.quote(text)
+
+
+def _cta_url(nome: str, azienda: str, email: str, tracking_id: str) -> str:
+    return (
+        f"{CTA_BASE_URL}?step=call_oee&nome={_quote(nome)}&azienda={_quote(azienda)}"
+        f"&email={_quote(email)}&source=email_minireport&tid={tracking_id}"
+    )
+
+
+def _format_column(values: list, spec: str) -> list[str]:
+    """Formatta una colonna; importi ",.0f" arrotondati in blocco e scritti come interi."""
+    if spec == ",.0f":
+        # np.rint arrotonda come il formato .0f (metà al pari sul valore binario)
+        return [format(n, ",") for n in np.rint(np.asarray(values, dtype=float)).astype(np.int64).tolist()]
+    if not spec:
+        return values
+    return [format(v, spec) for v in values]
+
+
+# ========================
+# RENDER
+# ========================
+
+def render_minireport(nome, azienda, email, oee_perc, perdita_euro_turno, fascia, tracking_id: str | None = None) -> str:
+    """Corpo HTML del mini-report per un lead (tracking_id nuovo se non indicato)."""
+    literals, slots = compile_minireport(fascia)
+    values = (
+        html.escape(nome),
+        oee_perc,
+        perdita_euro_turno,
+        perdita_euro_turno * TURNI_ANNO,
+        perdita_euro_turno * 2 * TURNI_ANNO,
+        perdita_euro_turno * 3 * TURNI_ANNO,
+        _cta_url(nome, azienda, email, tracking_id or str(uuid.uuid4())),
+    )
+    return _assemble(literals, [format(values[i], spec) for i, spec in slots])
+
+
+def _tracking_ids(n: int) -> list[str]:
+    """n UUID4 da un'unica lettura di os.urandom (bit di versione/variante impostati in blocco)."""
+    raw = np.frombuffer(os.urandom(16 * n), dtype=np.uint8).reshape(n, 16).copy()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    hexes = raw.tobytes().hex()
+    return [
+        f"{h[0:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:32]}"
+        for h in (hexes[i:i + 32] for i in range(0, 32 * n, 32))
+    ]
+
+
+def render_minireport_batch(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Mini-report per ogni riga di df (colonne BATCH_COLUMNS).
+    Ritorna un DataFrame con lo stesso indice e colonne tracking_id, body.
+    """
+    missing = [c for c in BATCH_COLUMNS if c not in df.columns]
+    if missing:
+        raise ValueError(f"Colonne mancanti: {', '.join(missing)}")
+    if df.empty:
+        return pd.DataFrame({"tracking_id": pd.Series(dtype=str), "body": pd.Series(dtype=str)}, index=df.index)
+
+    nome = df["nome"].fillna("").astype(str).tolist()
+    azienda = df["azienda"].fillna("").astype(str).tolist()
+    email = df["email"].fillna("").astype(str).tolist()
+    perdita = pd.to_numeric(df["perdita_euro_turno"], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+    fasce = df["fascia"].fillna("").astype(str).tolist()
+    tracking_ids = _tracking_ids(len(df))
+
+    fields = (
+        [html.escape(n) for n in nome],
+        pd.to_numeric(df["oee_perc"], errors="coerce").fillna(0.0).tolist(),
+        perdita,
+        perdita * TURNI_ANNO,
+        perdita * 2 * TURNI_ANNO,
+        perdita * 3 * TURNI_ANNO,
+        [_cta_url(*row) for row in zip(nome, azienda, email, tracking_ids)],
+    )
+
+    # stesso template per tutte le fasce: gli slot (e le colonne formattate) sono condivisi
+    compiled = {f: compile_minireport(f) for f in set(fasce)}
+    slots = next(iter(compiled.values()))[1]
+    columns = {}
+    for slot in slots:
+        if slot not in columns:
+            columns[slot] = _format_column(fields[slot[0]], slot[1])
+    rows = zip(*(columns[slot] for slot in slots))
+    bodies = [_assemble(compiled[f][0], values) for f, values in zip(fasce, rows)]
+    # dtype object: con pandas 3 le colonne di testo diventerebbero stringhe Arrow (copia di tutti i body)
+    return pd.DataFrame(
+        {"tracking_id": pd.Series(tracking_ids, index=df.index, dtype=object),
+         "body": pd.Series(bodies, index=df.index, dtype=object)}
+    )
+
+
+# ========================
+# BENCHMARK
+# ========================
+
+def _bench_leads(rows: int, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    oee = rng.uniform(35, 92, rows)
+    return pd.DataFrame(
+        {
+            "nome": [f"Lead {i} Rossi" for i in range(rows)],
+            "azienda": [f"Officina {i} S.r.l." for i in range(rows)],
+            "email": [f"lead{i}@officina{i % 500}.it" for i in range(rows)],
+            "oee_perc": oee,
+            "perdita_euro_turno": rng.uniform(50, 2_500, rows).round(2),
+            "fascia": np.select([oee < 60, oee < 80], ["critica", "intermedia"], default="alta"),
+        }
+    )
+
+
+def _legacy_minireport(nome, azienda, email, oee_perc, perdita_euro_turno, fascia) -> str:
+    """
+    Il vecchio build_email_body dell'app (solo per il confronto nel benchmark):
+    testi, URL e importi ricalcolati e l'intero f-string interpolato a ogni email.
+    """
+    testi = TESTI_FASCIA.get(fascia, TESTI_FASCIA["alta"])
+    intro_fascia, proposta = testi["intro_fascia"], testi["proposta"]
+    perdita_annua_1t = perdita_euro_turno * TURNI_ANNO
+    perdita_annua_2t = perdita_euro_turno * 2 * TURNI_ANNO
+    perdita_annua_3t = perdita_euro_turno * 3 * TURNI_ANNO
+    cta_url = (
+        CTA_BASE_URL
+        + "?step=call_oee"
+        + f"&nome={urllib.parse.quote(nome)}"
+        + f"&azienda={urllib.parse.quote(azienda)}"
+        + f"&email={urllib.parse.quote(email)}"
+        + "&source=email_minireport"
+        + f"&tid={urllib.parse.quote(str(uuid.uuid4()))}"
+    )
+
+    corpo = f"""
+<p>Ciao {nome},</p>
+
+<p>grazie per aver condiviso i dati della tua linea.</p>
+
+<p>In base alle informazioni che hai inserito, la stima è:</p>
+
+<ul>
+  <li>OEE stimato: <b>{oee_perc:.1f}%</b></li>
+  <li>Capacità persa: circa <b>€ {perdita_euro_turno:,.0f} per turno</b> su una macchina/linea</li>
+  <li>Se lavori a 1 turno (8 h): perdita annua ≈ <b>€ {perdita_annua_1t:,.0f}</b></li>
+  <li>Se lavori a 2 turni (16 h): perdita annua ≈ <b>€ {perdita_annua_2t:,.0f}</b></li>
+  <li>Se lavori a 3 turni (24 h): perdita annua ≈ <b>€ {perdita_annua_3t:,.0f}</b></li>
+</ul>
+
+<p>{intro_fascia}</p>
+
+<p>{proposta}</p>
+
+<p>A questo punto hai due opzioni:</p>
+
+<ul>
+  <li><b>Lasciare le cose come sono</b>, accettando che questi circa <b>€ {perdita_euro_turno:,.0f} per turno</b>
+      restino un costo fisso nascosto.</li>
+  <li><b>Lavorarci in modo strutturato</b> per trasformare una parte di quella perdita in capacità e margine.</li>
+</ul>
+
+<p>
+Se vuoi valutare seriamente come recuperare una parte di questi importi,
+clicca sul pulsante qui sotto e compila il form con il tuo <b>numero diretto</b> e la <b>fascia oraria</b> in cui preferisci essere richiamato.
+</p>
+
+<p>
+  <a href="{cta_url}" style="
+      display:inline-block;
+      padding:10px 18px;
+      background-color:#27AE60;
+      color:#ffffff;
+      text-decoration:none;
+      border-radius:4px;
+      font-weight:bold;
+  " role="button">
+    Completa il passo successivo
+  </a>
+</p>
+
+<p>
+Se in questo momento decidi di non intervenire, puoi utilizzare il mini‑report come base di confronto interna
+e condividerlo con chi presidia budget e investimenti, per rendere chiaro l’impatto economico delle perdite di OEE.
+</p>
+
+<p>Un saluto,<br>
+Marian Dutu – Operations &amp; OEE Improvement<br>
+ForgiaLean <br>
+P.IVA: 04336611209 <br>
+<a href="mailto:info@forgialean.it">info@forgialean.it</a>
+</p>
+"""
+    return corpo
+
+
+def run_benchmark(rows: int = 50_000) -> dict:
+    df = _bench_leads(rows)
+    records = df.to_dict("records")
+
+    t0 = time.perf_counter()
+    for r in records:
+        _legacy_minireport(r["nome"], r["azienda"], r["email"], r["oee_perc"], r["perdita_euro_turno"], r["fascia"])
+    legacy_s = time.perf_counter() - t0
+
+    compile_minireport.cache_clear()
+    t0 = time.perf_counter()
+    for r in records:
+        render_minireport(r["nome"], r["azienda"], r["email"], r["oee_perc"], r["perdita_euro_turno"], r["fascia"])
+    single_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    out = render_minireport_batch(df)
+    batch_s = time.perf_counter() - t0
+    return {
+        "rows": rows,
+        "legacy_per_s": rows / legacy_s,
+        "single_per_s": rows / single_s,
+        "batch_per_s": rows / batch_s,
+        "batch_s": batch_s,
+        "avg_body_kb": out["body"].str.len().mean() / 1024,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Template mini-report OEE")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_bench = sub.add_parser("bench", help="velocità di render singolo e in blocco")
+    p_bench.add_argument("--rows", type=int, default=50_000)
+    args = parser.parse_args(argv)
+
+    r = run_benchmark(args.rows)
+    print(f"📧 {r['rows']:,} mini-report (≈{r['avg_body_kb']:.1f} KB ciascuno)")
+    print(f"   template interpolato a ogni email:  {r['legacy_per_s']:,.0f} email/s (vecchio build_email_body)")
+    print(f"   render_minireport (uno alla volta): {r['single_per_s']:,.0f} email/s")
+    print(f"   render_minireport_batch:            {r['batch_per_s']:,.0f} email/s ({r['batch_s']:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
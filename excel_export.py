@@ -0,0 +1,185 @@
+# excel_export.py
+"""
+Export Excel multi-foglio in streaming, a memoria costante.
+
+- xlsxwriter in modalità constant_memory: ogni riga viene scritta su disco
+  appena prodotta, il workbook non resta mai intero in RAM;
+- le righe arrivano direttamente da un cursore SQLite (fetchmany), senza
+  passare da DataFrame;
+- tutti i fogli sono letti nella stessa transazione di lettura (dati coerenti);
+- il file viene generato in un temporaneo e messo in cache su disco con chiave
+  (fogli richiesti, versione dei dati): riscaricare lo stesso report senza
+  modifiche nel frattempo non costa nulla.
+
+Versione dei dati: sequenza del journal CDC (o seq applicata della replica
+analitica); senza journal si usa mtime/dimensione del file DB.
+
+Uso:
+    from excel_export import get_workbook, cached_workbook
+
+    path = cached_workbook("overview", {"Clienti": "client"})   # None se da rigenerare
+    path = get_workbook("overview", {"Clienti": "client", "Fatture": "invoice"})
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from datetime import date, datetime
+from pathlib import Path
+
+import xlsxwriter
+
+from cdc_journal import JOURNAL_TABLE, STATE_TABLE, journal_seq
+from db import DATA_DIR, get_analytics_engine
+
+EXPORT_CACHE_DIR = DATA_DIR / "export_cache"
+
+# Righe lette dal cursore per blocco
+EXCEL_CHUNK_ROWS = 5_000
+
+# Limite righe di un foglio Excel (header escluso)
+EXCEL_MAX_ROWS = 1_048_575
+
+_build_lock = threading.Lock()
+
+
+# ========================
+# VERSIONE DATI
+# ========================
+
+def _data_version(conn) -> str:
+    """Versione dei dati visibili dalla connessione (dentro la transazione di lettura)."""
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if STATE_TABLE in tables:
+        row = conn.execute(f"SELECT value FROM {STATE_TABLE} WHERE name = 'applied_seq'").fetchone()
+        if row:
+            return f"replica-{row[0]}"
+    if JOURNAL_TABLE in tables:
+        return f"cdc-{journal_seq(conn)}"
+    db_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    st = os.stat(db_file)
+    return f"file-{st.st_mtime_ns}-{st.st_size}"
+
+
+def _cache_path(name: str, sheets: dict, version: str) -> Path:
+    key = hashlib.sha1(json.dumps([sheets, version], sort_keys=True).encode()).hexdigest()[:16]
+    return EXPORT_CACHE_DIR / f"{name}_{key}.xlsx"
+
+
+# ========================
+# SCRITTURA
+# ========================
+
+def _converters(conn, table: str) -> list:
+    """Conversione per colonna in base al tipo dichiarato (date e datetime come celle data)."""
+    convs = []
+    for _, _, decl, *_ in conn.execute(f'PRAGMA table_info("{table}")'):
+        decl = (decl or "").upper()
+        if decl == "DATE":
+            convs.append(lambda v: date.fromisoformat(v[:10]) if isinstance(v, str) else v)
+        elif decl == "DATETIME":
+            convs.append(lambda v: datetime.fromisoformat(v) if isinstance(v, str) else v)
+        else:
+            convs.append(None)
+    return convs
+
+
+def _write_sheet(workbook, conn, sheet_name: str, table: str, formats: dict) -> int:
+    ws = workbook.add_worksheet(sheet_name[:31])
+    cur = conn.execute(f'SELECT * FROM "{table}"')
+    header = [d[0] for d in cur.description]
+    ws.write_row(0, 0, header, formats["header"])
+    convs = _converters(conn, table)
+    date_cols = [i for i, c in enumerate(convs) if c is not None]
+
+    r = 0
+    while r < EXCEL_MAX_ROWS:
+        rows = cur.fetchmany(min(EXCEL_CHUNK_ROWS, EXCEL_MAX_ROWS - r))
+        if not rows:
+            break
+        for row in rows:
+            r += 1
+            if date_cols:
+                row = list(row)
+                for i in date_cols:
+                    try:
+                        row[i] = convs[i](row[i])
+                    except ValueError:
+                        pass  # valore non ISO: resta testo
+                for i, v in enumerate(row):
+                    if isinstance(v, datetime):
+                        ws.write_datetime(r, i, v, formats["datetime"])
+                    elif isinstance(v, date):
+                        ws.write_datetime(r, i, datetime(v.year, v.month, v.day), formats["date"])
+                    else:
+                        ws.write(r, i, v)
+            else:
+                ws.write_row(r, 0, row)
+    ws.freeze_panes(1, 0)
+    return r
+
+
+def build_workbook(conn, sheets: dict, path: Path) -> dict:
+    """Scrive i fogli (nome foglio -> tabella) in path. Ritorna le righe per foglio."""
+    workbook = xlsxwriter.Workbook(str(path), {"constant_memory": True, "tmpdir": str(path.parent)})
+    formats = {
+        "header": workbook.add_format({"bold": True}),
+        "date": workbook.add_format({"num_format": "yyyy-mm-dd"}),
+        "datetime": workbook.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"}),
+    }
+    try:
+        return {sheet: _write_sheet(workbook, conn, sheet, table, formats) for sheet, table in sheets.items()}
+    finally:
+        workbook.close()
+
+
+# ========================
+# CACHE
+# ========================
+
+def _read_connection():
+    raw = get_analytics_engine().raw_connection()
+    conn = raw.driver_connection
+    conn.execute("BEGIN")  # stessa istantanea per versione e fogli
+    return raw, conn
+
+
+def cached_workbook(name: str, sheets: dict) -> Path | None:
+    """Workbook già pronto per la versione corrente dei dati, altrimenti None."""
+    raw, conn = _read_connection()
+    try:
+        path = _cache_path(name, sheets, _data_version(conn))
+    finally:
+        conn.rollback()
+        raw.close()
+    return path if path.exists() else None
+
+
+def get_workbook(name: str, sheets: dict) -> Path:
+    """Workbook per la versione corrente dei dati: dalla cache oppure generato ora."""
+    EXPORT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with _build_lock:
+        raw, conn = _read_connection()
+        try:
+            path = _cache_path(name, sheets, _data_version(conn))
+            if path.exists():
+                return path
+            fd, tmp_name = tempfile.mkstemp(prefix=f"{name}_", suffix=".xlsx.tmp", dir=EXPORT_CACHE_DIR)
+            os.close(fd)
+            tmp = Path(tmp_name)
+            try:
+                build_workbook(conn, sheets, tmp)
+                os.replace(tmp, path)
+            finally:
+                tmp.unlink(missing_ok=True)
+        finally:
+            conn.rollback()
+            raw.close()
+
+        # versioni precedenti dello stesso report non servono più
+        for old in EXPORT_CACHE_DIR.glob(f"{name}_*.xlsx"):
+            if old != path:
+                old.unlink(missing_ok=True)
+        return path
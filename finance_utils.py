@@ -2,8 +2,12 @@
 from datetime import date
 import pandas as pd
 
-from db import get_session, Invoice, Expense, TaxDeadline, TaxConfig, InpsContribution
+from db import get_analytics_session, Invoice, Expense, TaxDeadline, TaxConfig, InpsContribution
 from sqlmodel import select
+from perf_monitor import timed
+
+
+@timed()
 def build_full_management_balance(year: int, ref_date: date, saldo_cassa: float) -> dict:
     """
     Restituisce:
@@ -11,7 +15,7 @@ def build_full_management_balance(year: int, ref_date: date, saldo_cassa: float)
       - 'conto_economico': DataFrame con Ricavi/Costi/INPS/Imposte/Utile dell'anno 'year'
       - 'indicatori': DataFrame con alcuni KPI di bilancio
     """
-    with get_session() as session:
+    with get_analytics_session() as session:
         invoices = session.exec(select(Invoice)).all()
         expenses = session.exec(select(Expense)).all()
         deadlines = session.exec(
@@ -183,11 +187,12 @@ def build_full_management_balance(year: int, ref_date: date, saldo_cassa: float)
         "indicatori": df_ind,
     }
 
+@timed()
 def calcola_imposte_e_inps_normative(year: int) -> dict:
     """
     Calcolo 'normativo' semplificato di reddito, imposta e INPS per l'anno.
     """
-    with get_session() as session:
+    with get_analytics_session() as session:
         cfg = session.exec(
             select(TaxConfig).where(TaxConfig.year == year)
         ).first()
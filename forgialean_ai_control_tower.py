@@ -2,25 +2,48 @@ from datetime import date, timedelta, datetime
 import time
 from pathlib import Path
 import io
+import queue
 import urllib.parse 
 import streamlit as st
 import streamlit.components.v1 as components
 import pandas as pd
+import numpy as np
 import plotly.express as px
+import plotly.graph_objects as go
 import pdfplumber
 from sqlmodel import SQLModel, Field, Session, select, delete
 from finance_utils import (
     build_full_management_balance,
     calcola_imposte_e_inps_normative,
 )
+from cashflow_forecast import (
+    build_cashflow_forecast,
+    simulate_cash_paths,
+    expected_receipts,
+    collection_model_summary,
+)
+from excel_export import cached_workbook, get_workbook
+from segments import resolve_segment, segment_clients, tag_expression
+from timesheet_import import (
+    file_hash,
+    find_previous_import,
+    import_timesheet_rows,
+    read_timesheet_file,
+    validate_timesheet,
+)
+from capacity import compute_utilization, normalize_operator, weekly_drilldown, weekly_utilization
+from client_match import DUPLICATE_THRESHOLD, best_client_match, find_client_candidates, find_duplicate_clusters
 from sqlalchemy import text
 from config import CACHE_TTL, PAGES_BY_ROLE, APP_NAME, LOGO_PATH, MY_COMPANY_DATA
 from enum import Enum
 
 from db import (
+    engine,
     init_db,
     migrate_db,
     get_session,
+    get_analytics_session,
+    get_replica_status,
     Client,
     EmailOpen,
     Opportunity,
@@ -31,6 +54,9 @@ from db import (
     TimeEntry,
     Department,
     Employee,
+    OperatorAlias,
+    CapacityProfile,
+    Holiday,
     KpiDepartmentTimeseries,
     KpiEmployeeTimeseries,
     LoginEvent,
@@ -55,13 +81,33 @@ from db import (
     CampaignEvent,
     CrmAutomationRule,
     run_crm_automations,
+    run_crm_automations_bulk,
+    apply_tags_bulk,
+    remove_tags_bulk,
     get_vendor_defaults,
     learn_vendor_defaults,
+    FUNNEL_MILESTONES,
+    FLAME_ACTION_POINTS,
+    FLAME_LEADERBOARD_SIZE,
+    OpportunityEvent,
+    OeeLine,
+    FunnelStageStat,
+    FlameLeaderboard,
+    record_opportunity_event,
+    forget_opportunity_events,
+    add_time_entries,
+    update_time_entry,
+    delete_time_entries,
+    maybe_reconcile_time_rollups,
+    global_search,
 
 )
 init_db()
 migrate_db()
 
+import perf_monitor
+perf_monitor.install_all(engine)
+
 from cache_functions import (
     get_all_clients,
     get_all_opportunities,
@@ -82,8 +128,18 @@ from cache_functions import (
 from tracking import track_ga4_event, track_facebook_event
 from streamlit_calendar import calendar
 import requests
-import smtplib
-from email.mime.text import MIMEText
+from email_sender import configure_smtp, enqueue_email, enqueue_many, queue_status as email_queue_status, recent_failures
+from email_templates import MINIREPORT_SUBJECT, render_minireport, render_minireport_batch
+from oee_engine import OEE_TARGET, classify_fascia, compute_oee
+from oee_store import (
+    import_oee_events,
+    load_oee_rollup,
+    oee_data_range,
+    read_oee_file,
+    rebuild_oee_rollups,
+    summarize_oee,
+    validate_oee_events,
+)
 
 import json
 import uuid
@@ -280,68 +336,76 @@ def assign_flame_points(opp_id: int, action: str, points: int = 0):
     - contract_signed: 100 punti (VINTO!)
     """
     
-    action_points = {
-        "form_oee_submitted": 10,
-        "form_call_submitted": 20,
-        "demo_scheduled": 30,
-        "contract_sent": 40,
-        "contract_signed": 100,
-    }
-    
-    flame_to_add = action_points.get(action, points)
-    
+    flame_to_add = FLAME_ACTION_POINTS.get(action, points)
+
     with get_session() as session:
         opp = session.get(Opportunity, opp_id)
         if opp:
-            # Aggiorna fiamme
-            opp.flame_points = (opp.flame_points or 0) + flame_to_add
-            
-            # Aggiorna stato azione
-            if action == "form_oee_submitted":
-                opp.form_oee_completed = True
-                opp.date_form_oee = date.today()
-            elif action == "form_call_submitted":
-                opp.form_call_completed = True
-                opp.date_form_call = date.today()
-            elif action == "demo_scheduled":
-                opp.demo_scheduled = True
-                opp.date_demo = date.today()
-            elif action == "contract_sent":
-                opp.contract_sent = True
-                opp.date_contract_sent = date.today()
-            elif action == "contract_signed":
-                opp.contract_signed = True
-                opp.date_contract_signed = date.today()
-            
-            session.add(opp)
+            # Aggiorna fiamme, flag milestone, event log e aggregati
+            record_opportunity_event(session, opp, action, flame_to_add)
             session.commit()
-    
+
     return flame_to_add
 
 
 def get_flame_leaderboard(limit: int = 10):
-    """Ritorna top N aziende per flame points"""
+    """Ritorna top N aziende per flame points (dalla leaderboard precalcolata)"""
     with get_session() as session:
-        opps = session.exec(
-            select(Opportunity)
-            .order_by(Opportunity.flame_points.desc())
-            .limit(limit)
-        ).all()
-        
+        if limit <= FLAME_LEADERBOARD_SIZE:
+            rows = session.exec(
+                select(FlameLeaderboard.flame_points, Opportunity, Client)
+                .join(Opportunity, Opportunity.opportunity_id == FlameLeaderboard.opportunity_id)
+                .join(Client, Client.client_id == Opportunity.client_id, isouter=True)
+                .order_by(FlameLeaderboard.flame_points.desc())
+                .limit(limit)
+            ).all()
+        else:
+            rows = session.exec(
+                select(Opportunity.flame_points, Opportunity, Client)
+                .join(Client, Client.client_id == Opportunity.client_id, isouter=True)
+                .order_by(Opportunity.flame_points.desc())
+                .limit(limit)
+            ).all()
+
         leaderboard = []
-        for opp in opps:
-            client = session.get(Client, opp.client_id)
+        for points, opp, client in rows:
             leaderboard.append({
                 "Cliente": client.ragione_sociale if client else "N/A",
                 "Opportunità": opp.nome_opportunita,
-                "🔥 Fiamme": opp.flame_points or 0,
+                "🔥 Fiamme": points or 0,
                 "Fase": opp.fase_pipeline,
-                "Probabilità": f"{opp.probabilita:.0f}%",
+                "Probabilità": f"{opp.probabilita or 0:.0f}%",
             })
-        
+
         return leaderboard
 
 
+def get_funnel_milestone_stats() -> pd.DataFrame:
+    """
+    Funnel milestone dai contatori precalcolati (FunnelStageStat):
+    opportunità per milestone, conversione e giorni medi dalla milestone precedente.
+    """
+    with get_session() as session:
+        stats = {s.stage: s for s in session.exec(select(FunnelStageStat)).all()}
+
+    rows = []
+    prev_num = None
+    for action, label, _, _, _ in FUNNEL_MILESTONES:
+        stat = stats.get(action)
+        num = stat.num_opps if stat else 0
+        rows.append({
+            "Milestone": label,
+            "Opportunità": num,
+            "🔥 Punti": stat.total_points if stat else 0,
+            "Conversione da prec. %": round(num / prev_num * 100, 1) if prev_num else None,
+            "Giorni medi da prec.": (
+                round(stat.conv_days_sum / stat.conv_count, 1) if stat and stat.conv_count else None
+            ),
+        })
+        prev_num = num
+    return pd.DataFrame(rows)
+
+
 def render_flame_badge(flame_points: int):
     """Renderizza badge fiamma in HTML"""
     if flame_points >= 100:
@@ -380,6 +444,41 @@ def get_lead_temperature(flame_points: int | None) -> str:
     else:
         return "Freddo"
 
+@perf_monitor.timed()
+def score_leads(df_opps: pd.DataFrame, oggi: date | None = None) -> pd.DataFrame:
+    """
+    Lead scoring vettoriale sulle opportunità:
+    - Lead_temperature da flame_points (stesse soglie di get_lead_temperature)
+    - in_ritardo / senza_azione sulla data prossima azione
+    - priorita: Chiusa, Critica, Alta, Normale
+    """
+    df = df_opps.copy()
+    oggi_ts = pd.Timestamp(oggi or date.today())
+
+    df["flame_points"] = df.get("flame_points", 0).fillna(0)
+    fp = df["flame_points"]
+    df["Lead_temperature"] = np.select(
+        [fp >= 100, fp >= 50, fp >= 20],
+        ["Bollente", "Caldo", "Tiepido"],
+        default="Freddo",
+    )
+
+    # conversione solo locale: la colonna originale resta a oggetti date
+    data_next = pd.to_datetime(df.get("data_prossima_azione"))
+    df["in_ritardo"] = data_next.notna() & (data_next < oggi_ts)
+    df["senza_azione"] = data_next.isna()
+
+    df["priorita"] = np.select(
+        [
+            df["stato_opportunita"].ne("aperta"),
+            df["in_ritardo"],
+            df["Lead_temperature"].isin(["Bollente", "Caldo"]) & df["senza_azione"],
+        ],
+        ["Chiusa", "Critica", "Alta"],
+        default="Normale",
+    )
+    return df
+
 # === LETTURA SECRETS ===
 TELEGRAM_BOT_TOKEN = st.secrets["tracking"]["TELEGRAM_BOT_TOKEN"]
 TELEGRAM_CHAT_ID = st.secrets["tracking"]["TELEGRAM_CHAT_ID"]
@@ -389,6 +488,9 @@ SMTP_PORT = int(st.secrets["email"]["SMTP_PORT"])
 SMTP_USER = st.secrets["email"]["SMTP_USER"]
 SMTP_PASSWORD = st.secrets["email"]["SMTP_PASSWORD"]
 FROM_ADDRESS = st.secrets["email"]["FROM_ADDRESS"]
+SMTP_STARTTLS = str(st.secrets["email"].get("SMTP_STARTTLS", "true")).lower() == "true"
+
+configure_smtp(SMTP_SERVER, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, FROM_ADDRESS, starttls=SMTP_STARTTLS)
 
 init_db()
 migrate_db()
@@ -483,175 +585,39 @@ import urllib.parse
 import uuid
 
 def build_email_body(nome, azienda, email, oee_perc, perdita_euro_turno, fascia):
-    if fascia == "critica":
-        intro_fascia = (
-            "Questo valore ti colloca in una <b>fascia critica</b>: una quota importante della capacità "
-            "della linea si sta perdendo ogni giorno tra fermi, velocità sotto target e scarti. "
-            "Di fatto stai pagando impianti, persone e straordinari per una capacità che non arriva mai al cliente."
-        )
-        proposta = (
-            "In casi come il tuo l’obiettivo è recuperare una parte significativa di questa perdita, "
-            "portando l’OEE verso valori più vicini al 75–80% e liberando ore equivalenti di produzione "
-            "senza nuovi investimenti in macchine."
-        )
-    elif fascia == "intermedia":
-        intro_fascia = (
-            "Questo valore ti colloca in una <b>fascia intermedia</b>: la linea lavora, ma ci sono ancora "
-            "margini importanti dovuti a setup, organizzazione del lavoro, micro‑fermi e variazioni di velocità. "
-            "Ogni giorno una parte della capacità che stai pagando non si traduce in pezzi buoni fatturabili."
-        )
-        proposta = (
-            "In situazioni come la tua il potenziale tipico è un +10–15 punti OEE, lavorando in modo mirato "
-            "sulle cause principali invece che su interventi generici."
-        )
-    else:
-        intro_fascia = (
-            "Questo valore ti colloca in una <b>fascia alta</b>: sei già in un contesto ben strutturato "
-            "e sopra la media di molte PMI del settore. Le perdite non sono più ‘disastrose’, ma ogni punto OEE "
-            "che riesci a recuperare vale molto in termini di €/anno."
-        )
-        proposta = (
-            "In questi contesti il lavoro non è spegnere incendi, ma fare fine‑tuning: stabilità, setup rapidi, "
-            "gestione mix e variabilità, concentrandosi dove ogni ora equivalente recuperata ha il massimo impatto economico."
-        )
-
-    # Turni/anno ipotizzati (es. 250 giorni lavorativi)
-    turni_anno = 250
-    perdita_annua_1t = perdita_euro_turno * turni_anno
-    perdita_annua_2t = perdita_euro_turno * 2 * turni_anno
-    perdita_annua_3t = perdita_euro_turno * 3 * turni_anno
-
-    # ID univoco per il tracking del click da email
-    tracking_id = str(uuid.uuid4())
-
-    # URL della pagina/step successivo con parametri di tracking
-    cta_url = (
-        "https://forgialean.streamlit.app/"
-        f"?step=call_oee"
-        f"&nome={urllib.parse.quote(nome)}"
-        f"&azienda={urllib.parse.quote(azienda)}"
-        f"&email={urllib.parse.quote(email)}"
-        f"&source=email_minireport"
-        f"&tid={urllib.parse.quote(tracking_id)}"
-    )
-
-    corpo = f"""
-<p>Ciao {nome},</p>
-
-<p>grazie per aver condiviso i dati della tua linea.</p>
-
-<p>In base alle informazioni che hai inserito, la stima è:</p>
-
-<ul>
-  <li>OEE stimato: <b>{oee_perc:.1f}%</b></li>
-  <li>Capacità persa: circa <b>€ {perdita_euro_turno:,.0f} per turno</b> su una macchina/linea</li>
-  <li>Se lavori a 1 turno (8 h): perdita annua ≈ <b>€ {perdita_annua_1t:,.0f}</b></li>
-  <li>Se lavori a 2 turni (16 h): perdita annua ≈ <b>€ {perdita_annua_2t:,.0f}</b></li>
-  <li>Se lavori a 3 turni (24 h): perdita annua ≈ <b>€ {perdita_annua_3t:,.0f}</b></li>
-</ul>
-
-<p>{intro_fascia}</p>
-
-<p>{proposta}</p>
-
-<p>A questo punto hai due opzioni:</p>
-
-<ul>
-  <li><b>Lasciare le cose come sono</b>, accettando che questi circa <b>€ {perdita_euro_turno:,.0f} per turno</b>
-      restino un costo fisso nascosto.</li>
-  <li><b>Lavorarci in modo strutturato</b> per trasformare una parte di quella perdita in capacità e margine.</li>
-</ul>
-
-<p>
-Se vuoi valutare seriamente come recuperare una parte di questi importi,
-clicca sul pulsante qui sotto e compila il form con il tuo <b>numero diretto</b> e la <b>fascia oraria</b> in cui preferisci essere richiamato.
-</p>
-
-<p>
-  <a href="{cta_url}" style="
-      display:inline-block;
-      padding:10px 18px;
-      background-color:#27AE60;
-      color:#ffffff;
-      text-decoration:none;
-      border-radius:4px;
-      font-weight:bold;
-  " role="button">
-    Completa il passo successivo
-  </a>
-</p>
-
-<p>
-Se in questo momento decidi di non intervenire, puoi utilizzare il mini‑report come base di confronto interna
-e condividerlo con chi presidia budget e investimenti, per rendere chiaro l’impatto economico delle perdite di OEE.
-</p>
-
-<p>Un saluto,<br>
-Marian Dutu – Operations &amp; OEE Improvement<br>
-ForgiaLean <br>
-P.IVA: 04336611209 <br>
-<a href="mailto:info@forgialean.it">info@forgialean.it</a>
-</p>
-"""
-    return corpo
+    """Corpo HTML del mini‑report OEE (template compilato per fascia, vedi email_templates.py)."""
+    return render_minireport(nome, azienda, email, oee_perc, perdita_euro_turno, fascia)
 
 def calcola_oee_e_perdita(ore_turno, ore_fermi, scarti, velocita, valore_orario):
     """
-    Calcola:
+    Calcola (un turno, vedi oee_engine.compute_oee per linee × turni × giorni):
     - OEE in percentuale
-    - Perdita economica per turno in €
+    - Perdita economica per turno in € (gap dal target 85%)
     - Fascia OEE: 'critica', 'intermedia', 'alta'
     """
-    if ore_turno <= 0:
-        return 0.0, 0.0, "critica"
-
-    # Availability, Performance, Quality
-    availability = max(0.0, 1.0 - (ore_fermi / ore_turno))
-    performance = velocita / 100.0
-    quality = max(0.0, 1.0 - scarti / 100.0)
-
-    oee = availability * performance * quality
-    oee_target = 0.85
-    gap_oee = max(0.0, oee_target - oee)
-
-    capacita_persa_turno = gap_oee * ore_turno
-    perdita_euro_turno = capacita_persa_turno * valore_orario
-
-    # Classificazione fascia OEE
-    if oee < 0.60:
-        fascia = "critica"
-    elif oee < 0.80:
-        fascia = "intermedia"
-    else:
-        fascia = "alta"
-
-    return oee * 100.0, perdita_euro_turno, fascia
+    r = compute_oee(ore_turno, ore_fermi, velocita, scarti, valore_orario)
+    oee = float(r["oee"])
+    return oee * 100.0, float(r["perdita_euro"]), str(classify_fascia(oee))
 
-def invia_minireport_oee(email_destinatario: str, subject: str, body: str):
+def invia_minireport_oee(email_destinatario: str, subject: str, body: str) -> int:
     """
-    Invia il mini‑report OEE via email in formato testo/HTML semplice.
+    Mette in coda il mini‑report OEE (HTML): lo invia il worker di email_sender
+    riusando la connessione SMTP, senza bloccare la pagina. Ritorna l'id in coda.
     """
-    msg = MIMEText(body, "html", "utf-8")
-    msg["Subject"] = subject
-    msg["From"] = FROM_ADDRESS
-    msg["To"] = email_destinatario
-
-    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASSWORD)
-        server.send_message(msg)
+    return enqueue_email(email_destinatario, subject, body, tag="minireport_oee")
 
 # === FUNZIONE SALDO CASSA GESTIONALE ===
 from datetime import date
 from sqlmodel import select
 
+@perf_monitor.timed()
 def calcola_saldo_cassa(data_rif: date, account_id: int | None = None) -> float:
     """
     Saldo cassa complessivo (o per singolo conto) alla data_rif.
 
     Formula: saldo_iniziale + incassi - uscite_spese - uscite_fisco_inps
     """
-    with get_session() as session:
+    with get_analytics_session() as session:
         # 1) Saldo iniziale conti
         q_acc = select(Account)
         if account_id is not None:
@@ -690,9 +656,10 @@ def calcola_saldo_cassa(data_rif: date, account_id: int | None = None) -> float:
     saldo = saldo_iniziale + incassi - uscite_spese - uscite_fisco_inps
     return float(saldo)
 
+@perf_monitor.timed()
 def build_income_statement(anno_sel: int) -> pd.DataFrame:
     """Conto Economico gestionale semplice per anno: Proventi, Costi, Netto."""
-    with get_session() as session:
+    with get_analytics_session() as session:
         # Ricavi: imponibile fatture per anno selezionato (data_fattura)
         invoices = session.exec(
             select(Invoice).where(
@@ -755,20 +722,25 @@ def build_income_statement(anno_sel: int) -> pd.DataFrame:
     ]
     return pd.DataFrame(data)
 
-def export_all_to_excel(dfs: dict, filename: str):
-    buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
-        for sheet_name, df in dfs.items():
-            if df is not None and not df.empty:
-                safe_name = sheet_name[:31]
-                df.to_excel(writer, index=False, sheet_name=safe_name)
-    buffer.seek(0)
-    st.download_button(
-        label="⬇️ Esporta tutto in Excel",
-        data=buffer,
-        file_name=filename,
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    )
+def export_all_to_excel(sheets: dict, filename: str, report: str = "report"):
+    """
+    Download Excel multi-foglio (nome foglio -> tabella DB) generato in streaming
+    da excel_export e riusato finché i dati non cambiano.
+    """
+    path = cached_workbook(report, sheets)
+    if path is None:
+        if not st.button("📦 Prepara export Excel", key=f"prepare_export_{report}"):
+            st.caption("Il file viene generato una volta e riusato finché i dati non cambiano.")
+            return
+        with st.spinner("Generazione export in corso..."):
+            path = get_workbook(report, sheets)
+    with open(path, "rb") as f:
+        st.download_button(
+            label="⬇️ Esporta tutto in Excel",
+            data=f,
+            file_name=filename,
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
 
 st.set_page_config(
     page_title=APP_NAME,
@@ -780,9 +752,10 @@ track_email_click_from_query()
 
 from sqlalchemy import text  # assicurati che sia importato in testa al file
 
+@perf_monitor.timed()
 def build_income_statement_monthly(anno_sel: int) -> pd.DataFrame:
     """Conto Economico gestionale per mese: Proventi, Costi, Netto."""
-    with get_session() as session:
+    with get_analytics_session() as session:
         invoices = session.exec(
             select(Invoice).where(
                 Invoice.data_fattura.is_not(None),
@@ -893,14 +866,16 @@ def build_income_statement_monthly(anno_sel: int) -> pd.DataFrame:
 
 from sqlalchemy import text  # già importato in alto, va bene
 
+@perf_monitor.timed()
 def build_cashflow_monthly(anno: int) -> pd.DataFrame:
     """
     Cashflow operativo mensile:
     - Incassi clienti (Payment)
     - Uscite spese (Expense pagate)
     - Uscite fisco/INPS (TaxDeadline pagate)
+    - Incassi attesi: fatture aperte collocate con il modello ritardi per cliente
     """
-    with get_session() as session:
+    with get_analytics_session() as session:
         # Incassi clienti
         pays = session.exec(
             select(Payment).where(
@@ -996,17 +971,28 @@ def build_cashflow_monthly(anno: int) -> pd.DataFrame:
         - df_cf["Uscite_spese"]
         - df_cf["Uscite_fisco_inps"]
     )
+    df_cf["Incassi_attesi"] = expected_receipts(date(anno, 1, 1), 12)
+    df_cf["Net_cash_flow_previsto"] = df_cf["Net_cash_flow"] + df_cf["Incassi_attesi"]
     df_cf["Mese"] = df_cf["mese"].apply(lambda m: f"{m:02d}/{anno}")
 
     return df_cf[
-        ["Mese", "Incassi_clienti", "Uscite_spese", "Uscite_fisco_inps", "Net_cash_flow"]
+        [
+            "Mese",
+            "Incassi_clienti",
+            "Uscite_spese",
+            "Uscite_fisco_inps",
+            "Net_cash_flow",
+            "Incassi_attesi",
+            "Net_cash_flow_previsto",
+        ]
     ]
 
+@perf_monitor.timed()
 def build_balance_sheet(data_rif: date, saldo_cassa: float) -> pd.DataFrame:
     """Stato Patrimoniale minimale alla data: Attività, Passività, Patrimonio Netto."""
     data_rif_dt = pd.to_datetime(data_rif)
 
-    with get_session() as session:
+    with get_analytics_session() as session:
         # Fatture emesse fino a data_rif
         invoices = session.exec(
             select(Invoice).where(Invoice.data_fattura <= data_rif)
@@ -1088,7 +1074,7 @@ def build_balance_sheet(data_rif: date, saldo_cassa: float) -> pd.DataFrame:
     if not df_inv.empty:
         totale_fatture = df_inv["importo_totale"].sum()
         if not df_pay.empty:
-            incassi = df_pay["importo_pagato"].sum()
+            incassi = df_pay["amount"].sum()
         else:
             incassi = 0.0
         crediti_clienti = max(totale_fatture - incassi, 0.0)
@@ -1543,29 +1529,35 @@ def page_presentation():
                     valore_orario=valore_orario,
                 )
 
-                subject = "Il tuo mini‑report OEE e il prossimo passo"
+                subject = MINIREPORT_SUBJECT
                 body = build_email_body(
                     nome, azienda, email, oee_perc, perdita_euro_turno, fascia
                 )
 
-                invia_minireport_oee(email, subject, body)
-
-                st.success(
-                    "**GRAZIE!!!** Richiesta ricevuta. Riceverai entro **2 ore lavorative** una mail da "
-                    "**info@forgialean.it** con il tuo mini‑report OEE: stima degli sprechi €/giorno "
-                    "per una macchina/linea e 3 leve operative su cui intervenire.\n\n"
-                    "_Se non la vedi in posta in arrivo, controlla anche la **cartella spam/indesiderata**._"
-                )
+                try:
+                    invia_minireport_oee(email, subject, body)
+                except (queue.Full, RuntimeError) as e:
+                    st.warning(
+                        f"Richiesta salvata, ma il mini‑report non è stato messo in coda ({e}): "
+                        "ti contatteremo da **info@forgialean.it**."
+                    )
+                else:
+                    st.success(
+                        "**GRAZIE!!!** Richiesta ricevuta. Riceverai entro **2 ore lavorative** una mail da "
+                        "**info@forgialean.it** con il tuo mini‑report OEE: stima degli sprechi €/giorno "
+                        "per una macchina/linea e 3 leve operative su cui intervenire.\n\n"
+                        "_Se non la vedi in posta in arrivo, controlla anche la **cartella spam/indesiderata**._"
+                    )
 
-                st.markdown(
-                    """
+                    st.markdown(
+                        """
 Turni lunghi, impianti sotto il loro potenziale e margini che si assottigliano **non sono sostenibili a lungo**.
 
 Quando riceverai la mail da **info@forgialean.it**, se vuoi davvero intervenire su questi problemi,
 segui le istruzioni e completa il **passo successivo** lasciando i dati richiesti per essere contattato.
 È pensato per chi vuole trasformare il check OEE in un miglioramento concreto, non solo in un numero da guardare.
 """
-                )
+                    )
 
             except Exception as e:
                 st.error("Si è verificato un errore nel salvataggio del lead OEE.")
@@ -1789,16 +1781,13 @@ se un progetto ForgiaLean può portarti **+16% OEE e più margine**, senza perde
             if ore_turno <= 0 or valore_orario_calc <= 0:
                 st.warning("Imposta ore teoriche per turno e valore orario maggiori di zero.")
             else:
-                availability = max(0.0, 1.0 - (ore_fermi_calc / ore_turno))
-                performance = velocita_calc / 100.0
-                quality = max(0.0, 1.0 - scarti_calc / 100.0)
-
-                oee = availability * performance * quality
-                oee_target = 0.85
+                r = compute_oee(ore_turno, ore_fermi_calc, velocita_calc, scarti_calc, valore_orario_calc)
+                oee = float(r["oee"])
+                oee_target = OEE_TARGET
                 gap_oee = max(0.0, oee_target - oee)
 
-                capacita_persa_turno = gap_oee * ore_turno
-                perdita_euro_turno = capacita_persa_turno * valore_orario_calc
+                capacita_persa_turno = float(r["ore_perse"])
+                perdita_euro_turno = float(r["perdita_euro"])
 
                 st.write(f"OEE stimato: **{oee*100:.1f}%** (target {oee_target*100:.0f}%)")
                 st.write(f"Gap OEE: **{gap_oee*100:.1f} punti**")
@@ -1825,6 +1814,36 @@ se un progetto ForgiaLean può portarti **+16% OEE e più margine**, senza perde
                         "Per più macchine/linee simili moltiplica questa stima per il numero di asset."
                     )
 
+                # Sensibilità: perdita annua per ogni combinazione fermi × velocità (un solo calcolo NumPy)
+                fermi_grid = np.round(np.arange(0.0, min(ore_turno, 4.0) + 0.001, 0.25), 2)
+                velocita_grid = np.arange(60.0, 101.0, 2.5)
+                surface = compute_oee(
+                    ore_turno, fermi_grid[:, None], velocita_grid[None, :], scarti_calc, valore_orario_calc
+                )["perdita_euro"] * max(turni_anno, 1)
+                fig_sens = go.Figure(
+                    go.Heatmap(
+                        z=surface,
+                        x=velocita_grid,
+                        y=fermi_grid,
+                        colorscale="Reds",
+                        colorbar=dict(title="€/anno" if turni_anno > 0 else "€/turno"),
+                        hovertemplate="Velocità %{x:.1f}%<br>Fermi %{y:.2f} h/turno<br>€ %{z:,.0f}<extra></extra>",
+                    )
+                )
+                fig_sens.add_trace(
+                    go.Scatter(
+                        x=[velocita_calc], y=[ore_fermi_calc], mode="markers",
+                        marker=dict(symbol="x", size=12, color="black"), name="Situazione attuale",
+                    )
+                )
+                fig_sens.update_layout(
+                    title=f"Perdita {'annua' if turni_anno > 0 else 'per turno'} al variare di fermi e velocità (scarti {scarti_calc:.1f}%)",
+                    xaxis_title="Velocità reale vs nominale (%)",
+                    yaxis_title="Ore di fermo per turno",
+                    height=420,
+                )
+                st.plotly_chart(fig_sens, width="stretch")
+
 
 # =========================
 # PAGINA: OVERVIEW
@@ -2180,12 +2199,13 @@ def page_overview():
 
     export_all_to_excel(
         {
-            "Clienti": df_clients,
-            "Opportunita": df_opps,
-            "Fatture": df_invoices,
-            "Commesse": df_commesse,
+            "Clienti": "client",
+            "Opportunita": "opportunity",
+            "Fatture": "invoice",
+            "Commesse": "projectcommessa",
         },
         "forgialean_control_tower.xlsx",
+        report="overview",
     )
 
 # =========================
@@ -2226,12 +2246,28 @@ def page_clients():
             codice_destinatario = st.text_input("Codice destinatario (7 char)", "")
             pec_fatturazione = st.text_input("PEC fatturazione", "")
 
+        ignora_duplicati = st.checkbox("Salva anche se esistono clienti simili", value=False)
         submitted = st.form_submit_button("Salva cliente")
 
     # ⬇️ TUTTA LA LOGICA DI SALVATAGGIO DOPO IL FORM
+    duplicati = []
+    if submitted and ragione_sociale.strip() and not ignora_duplicati:
+        duplicati = find_client_candidates(ragione_sociale.strip(), piva=piva, cod_fiscale=cod_fiscale)
+
     if submitted:
         if not ragione_sociale.strip():
             st.warning("La ragione sociale è obbligatoria.")
+        elif duplicati:
+            st.warning(
+                "Esistono già clienti simili: controlla prima di crearne uno nuovo "
+                "(oppure spunta 'Salva anche se esistono clienti simili')."
+            )
+            st.dataframe(
+                pd.DataFrame(duplicati).rename(
+                    columns={"client_id": "ID", "ragione_sociale": "Ragione sociale", "score": "Somiglianza", "motivo": "Motivo"}
+                ),
+                use_container_width=True,
+            )
         else:
             try:
                 with get_session() as session:
@@ -2283,6 +2319,18 @@ def page_clients():
         st.info("Modifica ed eliminazione clienti disponibili solo per ruolo 'admin'.")
         st.stop()
 
+    with st.expander("🔍 Possibili clienti duplicati"):
+        soglia_dup = st.slider("Somiglianza minima", 0.5, 1.0, DUPLICATE_THRESHOLD, 0.05, key="dup_threshold")
+        if st.button("Cerca duplicati in anagrafica", key="dup_run"):
+            st.session_state["dup_clusters"] = find_duplicate_clusters(min_score=soglia_dup)
+        df_dup = st.session_state.get("dup_clusters")
+        if df_dup is not None:
+            if df_dup.empty:
+                st.success("Nessun possibile duplicato trovato.")
+            else:
+                st.caption(f"{df_dup['cluster'].nunique()} gruppi, {len(df_dup)} clienti coinvolti.")
+                st.dataframe(df_dup, use_container_width=True)
+
     st.markdown("---")
     st.subheader("✏️ Modifica / elimina cliente (solo admin)")
 
@@ -2382,7 +2430,8 @@ def page_clients():
                     for a in acts:
                         session.delete(a)
 
-                    # Eventuali altre entità collegate all'opportunità (se ne aggiungerai)
+                    # Event log fiamme/funnel e aggregati
+                    forget_opportunity_events(session, opp.opportunity_id)
 
                     session.delete(opp)
 
@@ -2785,7 +2834,7 @@ def page_crm_sales():
                     # tag già applicati a questo client
                     applied_ct = session.exec(
                         select(ContactTag)
-                        .where(ContactTag.client_id == client.client_id)
+                        .where(ContactTag.contact_id == client.client_id)
                     ).all()
                     applied_tag_ids = {ct.tag_id for ct in applied_ct}
 
@@ -2815,17 +2864,8 @@ def page_crm_sales():
                             )
                             if tag_to_add_label != "(seleziona)":
                                 if st.button("➕ Applica tag", key=f"btn_add_tag_{client.client_id}"):
-                                    with get_session() as session:
-                                        tag_obj = session.exec(
-                                            select(Tag).where(Tag.nome == tag_to_add_label)
-                                        ).first()
-                                        if tag_obj:
-                                            ct = ContactTag(
-                                                client_id=client.client_id,
-                                                tag_id=tag_obj.tag_id,
-                                            )
-                                            session.add(ct)
-                                            session.commit()
+                                    tag_obj = next(t for t in available_tags if t.nome == tag_to_add_label)
+                                    apply_tags_bulk([client.client_id], [tag_obj.tag_id])
                                     st.success(f"Tag '{tag_to_add_label}' applicato al cliente.")
                                     st.rerun()
                         else:
@@ -2843,18 +2883,8 @@ def page_crm_sales():
                         )
                         if tag_to_remove_label != "(seleziona)":
                             if st.button("🗑️ Rimuovi tag", key=f"btn_remove_tag_{client.client_id}"):
-                                with get_session() as session:
-                                    tag_obj = session.exec(
-                                        select(Tag).where(Tag.nome == tag_to_remove_label)
-                                    ).first()
-                                    if tag_obj:
-                                        session.exec(
-                                            delete(ContactTag).where(
-                                                ContactTag.client_id == client.client_id,
-                                                ContactTag.tag_id == tag_obj.tag_id,
-                                            )
-                                        )
-                                        session.commit()
+                                tag_ids_to_remove = [tid for tid, nome in tag_map.items() if nome == tag_to_remove_label]
+                                remove_tags_bulk([client.client_id], tag_ids_to_remove)
                                 st.success(f"Tag '{tag_to_remove_label}' rimosso dal cliente.")
                                 st.rerun()
 
@@ -3131,8 +3161,7 @@ def page_crm_sales():
     )
 
     # === Lead scoring da flame_points ===
-    df_opps["flame_points"] = df_opps.get("flame_points", 0).fillna(0)
-    df_opps["Lead_temperature"] = df_opps["flame_points"].apply(get_lead_temperature)
+    df_opps = score_leads(df_opps)
     st.markdown("### 🔥 Priorità lead (fiamme)")
 
     col_f1, col_f2 = st.columns(2)
@@ -3152,29 +3181,6 @@ def page_crm_sales():
     if filtro_temp:
         df_view = df_view[df_view["Lead_temperature"].isin(filtro_temp)]
 
-    # Flag ritardo prossima azione
-    oggi = pd.Timestamp(date.today())
-    df_view["data_prossima_azione"] = pd.to_datetime(
-        df_view.get("data_prossima_azione")
-    )
-    df_view["in_ritardo"] = df_view["data_prossima_azione"].notna() & (
-        df_view["data_prossima_azione"] < oggi
-    )
-    # Flag senza prossima azione pianificata
-    df_view["senza_azione"] = df_view["data_prossima_azione"].isna()
-
-    # Priorità opportunità (testuale)
-    def compute_priority(row):
-        if row.get("stato_opportunita") != "aperta":
-            return "Chiusa"
-        if row.get("in_ritardo"):
-            return "Critica"
-        if row.get("Lead_temperature") in ["Bollente", "Caldo"] and row.get("senza_azione"):
-            return "Alta"
-        return "Normale"
-
-    df_view["priorita"] = df_view.apply(compute_priority, axis=1)
-
     # Ordina: prima per fiamme (se spuntato), poi per data prossima azione
     sort_cols = ["data_prossima_azione"]
     ascending = [True]
@@ -3637,6 +3643,64 @@ def page_crm_sales():
         df_list = df_f[cols_list].copy()
         st.dataframe(df_list, hide_index=True, width="stretch")
 
+        # -------------------------
+        # Cambio stato in blocco
+        # -------------------------
+        with st.expander("⚡ Cambio stato in blocco"):
+            # esito del cambio precedente, salvato prima del rerun
+            bulk_msg = st.session_state.pop("bulk_status_msg", None)
+            if bulk_msg:
+                st.success(bulk_msg)
+            bulk_labels = (
+                df_f["opportunity_id"].astype(str)
+                + " – "
+                + df_f["Cliente"].astype(str)
+                + " – "
+                + df_f["nome_opportunita"].astype(str)
+            ).tolist()
+            bulk_sel = st.multiselect(
+                "Opportunità",
+                options=bulk_labels,
+                key="bulk_status_opps",
+            )
+            bulk_status = st.selectbox(
+                "Nuovo stato",
+                ["aperta", "vinta", "persa"],
+                key="bulk_status_value",
+            )
+            if st.button("Applica a selezionate", key="bulk_status_apply") and bulk_sel:
+                bulk_ids = [int(lbl.split(" – ")[0]) for lbl in bulk_sel]
+                transitions = []
+                with get_session() as session:
+                    opps_db = session.exec(
+                        select(Opportunity).where(Opportunity.opportunity_id.in_(bulk_ids))
+                    ).all()
+                    for opp_db in opps_db:
+                        old_status = opp_db.stato_opportunita
+                        if old_status == bulk_status:
+                            continue
+                        opp_db.stato_opportunita = bulk_status
+                        session.add(opp_db)
+                        session.add(
+                            CrmActivity(
+                                opportunity_id=opp_db.opportunity_id,
+                                tipo="fase",
+                                canale="crm",
+                                oggetto="Cambio stato in blocco",
+                                descrizione=f"Stato: {bulk_status} (da: {old_status})",
+                            )
+                        )
+                        transitions.append((opp_db.opportunity_id, old_status))
+                    session.commit()
+
+                # Automazioni CRM: una sola transazione per tutto il blocco
+                esito = run_crm_automations_bulk(transitions)
+                st.session_state["bulk_status_msg"] = (
+                    f"Stato aggiornato su {len(transitions)} opportunità, "
+                    f"{esito['tasks_created']} task creati."
+                )
+                st.rerun()
+
         st.markdown("---")
         st.markdown("**Dettaglio opportunità**")
 
@@ -4423,6 +4487,7 @@ def page_crm_sales():
         with get_session() as session:
             obj = session.get(Opportunity, opp_id_sel)
             if obj:
+                forget_opportunity_events(session, obj.opportunity_id)
                 session.delete(obj)
                 session.commit()
         st.success("Opportunità eliminata.")
@@ -4532,23 +4597,7 @@ def page_crm_segments():
     role = st.session_state.get("role", "user")
 
     with get_session() as session:
-        clients = session.exec(select(Client).order_by(Client.ragione_sociale)).all()
         tags = session.exec(select(Tag).order_by(Tag.nome)).all()
-        contact_tags = session.exec(select(ContactTag)).all()
-
-    if not clients:
-        st.info("Nessun cliente registrato.")
-        return
-
-    df_clients = pd.DataFrame([c.__dict__ for c in clients])
-    df_clients["label"] = (
-        df_clients["client_id"].astype(str) + " - " + df_clients["ragione_sociale"]
-    )
-
-    # Mappa client_id -> set(tag_id)
-    ct_map: dict[int, set[int]] = {}
-    for ct in contact_tags or []:
-        ct_map.setdefault(ct.client_id, set()).add(ct.tag_id)
 
     # scelta tag filtro
     st.subheader("Filtra clienti per tag")
@@ -4557,55 +4606,59 @@ def page_crm_segments():
         st.info("Nessun tag definito. Crea tag dalla pagina CRM / opportunità.")
         return
 
-    tag_options = {t.nome: t.tag_id for t in tags}
-    selected_tag_names = st.multiselect(
-        "Seleziona uno o più tag",
-        options=list(tag_options.keys()),
+    tag_names = [t.nome for t in tags]
+    mode = st.radio(
+        "Tipo di filtro",
+        ["Tutti i tag (AND)", "Almeno un tag (OR)", "Espressione avanzata"],
+        horizontal=True,
     )
 
-    if not selected_tag_names:
+    if mode == "Espressione avanzata":
+        expression = st.text_input(
+            "Espressione segmento",
+            placeholder='tag:"Lead caldo" AND NOT tag:Newsletter AND opp:stato=aperta',
+        )
+        st.caption(
+            "Operatori: AND, OR, NOT, parentesi. Predicati: tag:Nome (o tag:\"Nome con spazi\"), "
+            "opp:any, opp:stato=aperta|vinta|persa, opp:fase=\"Offerta\", tutti."
+        )
+    else:
+        selected_tag_names = st.multiselect("Seleziona uno o più tag", options=tag_names)
+        excluded_tag_names = st.multiselect(
+            "Escludi clienti con questi tag",
+            options=[n for n in tag_names if n not in selected_tag_names],
+        )
+        expression = ""
+        if selected_tag_names:
+            expression = "(" + tag_expression(selected_tag_names, "AND" if mode.startswith("Tutti") else "OR") + ")"
+            for n in excluded_tag_names:
+                expression += f' AND NOT tag:"{n}"'
+
+    if not expression.strip():
         st.caption("Seleziona almeno un tag per vedere i clienti segmentati.")
         return
 
-    selected_tag_ids = {tag_options[n] for n in selected_tag_names}
-
-    # clienti che hanno TUTTI i tag selezionati (AND)
-    def has_all_tags(cid: int) -> bool:
-        tag_set = ct_map.get(cid, set())
-        return selected_tag_ids.issubset(tag_set)
-
-    df_seg = df_clients[df_clients["client_id"].apply(has_all_tags)].copy()
+    t0 = time.perf_counter()
+    try:
+        seg_ids = resolve_segment(expression)
+    except ValueError as e:
+        st.error(f"Espressione non valida: {e}")
+        return
+    elapsed_ms = (time.perf_counter() - t0) * 1000
 
-    if df_seg.empty:
-        st.markdown(
-            "Risultati: **0** clienti con tutti i tag selezionati."
-        )
+    if len(seg_ids) == 0:
+        st.markdown("Risultati: **0** clienti nel segmento.")
         st.info("Nessun cliente corrisponde a questa combinazione di tag.")
         return
 
-    # Conta opportunità per ogni client_id
-    with get_session() as session:
-        opps_seg = session.exec(
-            select(Opportunity.client_id).where(
-                Opportunity.client_id.in_(df_seg["client_id"].tolist())
-            )
-        ).all()
-
-    opp_counts: dict[int, int] = {}
-    for (cid,) in opps_seg:
-        opp_counts[cid] = opp_counts.get(cid, 0) + 1
-
-    df_seg["num_opps"] = df_seg["client_id"].map(opp_counts).fillna(0).astype(int)
-
-    st.markdown(
-        f"Risultati: **{df_seg.shape[0]}** clienti con tutti i tag selezionati."
-    )
+    # Solo i clienti del segmento, con conteggio opportunità aggregato in SQL
+    df_seg = segment_clients(expression, seg_ids)
 
-    cols_show = ["client_id", "ragione_sociale", "email", "telefono", "num_opps"]
-    cols_show = [c for c in cols_show if c in df_seg.columns]
+    st.markdown(f"Risultati: **{df_seg.shape[0]}** clienti nel segmento.")
+    st.caption(f"Segmento: `{expression}` · calcolato in {elapsed_ms:.1f} ms")
 
     st.dataframe(
-        df_seg[cols_show].rename(
+        df_seg.rename(
             columns={
                 "client_id": "ID",
                 "ragione_sociale": "Cliente",
@@ -4615,6 +4668,41 @@ def page_crm_segments():
         use_container_width=True,
     )
 
+    # =========================
+    # AZIONI SUL SEGMENTO (SOLO ADMIN)
+    # =========================
+    if role != "admin":
+        return
+
+    st.markdown("---")
+    st.subheader(f"🏷️ Tag su tutto il segmento ({len(seg_ids)} clienti)")
+
+    # esito dell'ultima azione, salvato prima del rerun che aggiorna i conteggi
+    bulk_msg = st.session_state.pop("seg_bulk_msg", None)
+    if bulk_msg:
+        st.success(bulk_msg)
+
+    tag_ids_by_name = {t.nome: t.tag_id for t in tags}
+    col_bulk1, col_bulk2 = st.columns(2)
+    with col_bulk1:
+        bulk_add = st.multiselect("Applica tag", options=tag_names, key="seg_bulk_add")
+        if st.button("➕ Applica al segmento", disabled=not bulk_add):
+            esito = apply_tags_bulk(seg_ids.tolist(), [tag_ids_by_name[n] for n in bulk_add])
+            st.session_state["seg_bulk_msg"] = (
+                f"Tag applicati: {esito['added']} nuove associazioni, "
+                f"{esito['tasks_created']} task da automazioni."
+            )
+            st.rerun()
+    with col_bulk2:
+        bulk_remove = st.multiselect("Rimuovi tag", options=tag_names, key="seg_bulk_remove")
+        if st.button("🗑️ Rimuovi dal segmento", disabled=not bulk_remove):
+            esito = remove_tags_bulk(seg_ids.tolist(), [tag_ids_by_name[n] for n in bulk_remove])
+            st.session_state["seg_bulk_msg"] = (
+                f"Tag rimossi: {esito['removed']} associazioni, "
+                f"{esito['tasks_created']} task da automazioni."
+            )
+            st.rerun()
+
 def page_crm_funnel():
     st.title("📈 Funnel CRM & campagne")
 
@@ -4676,6 +4764,16 @@ def page_crm_funnel():
         st.markdown("**Dettaglio win rate per fase pipeline**")
         st.dataframe(win_per_fase, use_container_width=True)
 
+    st.subheader("🔥 Funnel milestone (event log)")
+
+    df_milestones = get_funnel_milestone_stats()
+    if df_milestones["Opportunità"].sum() == 0:
+        st.info("Nessuna milestone registrata nell'event log.")
+    else:
+        st.dataframe(df_milestones, hide_index=True, use_container_width=True)
+        fig_milestones = px.funnel(df_milestones, x="Opportunità", y="Milestone")
+        st.plotly_chart(fig_milestones, use_container_width=True)
+
     st.subheader("📣 Funnel per campagna (UTM)")
 
     if "utm_campaign" not in df_opps.columns:
@@ -4745,6 +4843,7 @@ def page_lead_capture():
 
         submitted = st.form_submit_button("📨 Invia richiesta")
 
+    crea_lead, match_id = False, None
     if submitted:
         # Validazioni base
         if not azienda.strip() or not nome.strip() or not email.strip():
@@ -4754,12 +4853,42 @@ def page_lead_capture():
             st.warning("Devi accettare l'informativa privacy per procedere.")
             st.stop()
 
+        # Collegamento automatico solo con P.IVA/CF o nome + stesso dominio email
+        match_id = best_client_match(azienda.strip(), email=email.strip())
+        # Somiglianze solo per nome: le conferma un utente interno (al pubblico
+        # non si mostrano altri clienti e il lead diventa un cliente nuovo)
+        candidates = []
+        if match_id is None and st.session_state.get("role"):
+            candidates = find_client_candidates(azienda.strip(), email=email.strip())
+        if candidates:
+            st.session_state["lead_candidates"] = candidates
+        else:
+            crea_lead = True
+
+    # Conferma del cliente simile (i valori del form restano quelli inviati)
+    candidates = st.session_state.get("lead_candidates")
+    if candidates and not crea_lead:
+        st.warning(f"Clienti simili a **{azienda.strip()}**: collegare il lead a uno di questi?")
+        labels = {0: "➕ Nuovo cliente"}
+        labels.update({
+            c["client_id"]: f"{c['ragione_sociale']} (ID {c['client_id']}, {c['motivo']} {c['score']:.2f})"
+            for c in candidates
+        })
+        scelta = st.radio("Cliente", list(labels), format_func=labels.get, key="lead_candidate_choice")
+        col_ok, col_cancel = st.columns(2)
+        conferma = col_ok.button("✅ Conferma e crea lead", key="lead_candidate_confirm")
+        annulla = col_cancel.button("Annulla", key="lead_candidate_cancel")
+        if conferma:
+            st.session_state.pop("lead_candidates", None)
+            crea_lead, match_id = True, scelta or None
+        elif annulla:
+            st.session_state.pop("lead_candidates", None)
+            st.rerun()
+
+    if crea_lead:
         # 1) Crea / trova Client
         with get_session() as session:
-            # Cerca client per ragione_sociale (case-insensitive molto semplice)
-            existing_client = session.exec(
-                select(Client).where(Client.ragione_sociale == azienda.strip())
-            ).first()
+            existing_client = session.get(Client, match_id) if match_id else None
 
             if existing_client:
                 client = existing_client
@@ -6510,6 +6639,13 @@ def page_operations():
 
     st.title("🏭 Operations / Commesse (SQLite)")
 
+    # verifica periodica dei totali ore (rollup aggiornati a delta)
+    esito_reconcile = maybe_reconcile_time_rollups()
+    if esito_reconcile:
+        n_fix = sum(len(m) for m in esito_reconcile["mismatches"].values())
+        if n_fix:
+            st.warning(f"Totali ore riallineati su {n_fix} fasi/commesse (verifica periodica timesheet).")
+
     # =========================
     # FORM INSERIMENTO COMMESSA
     # =========================
@@ -6668,31 +6804,55 @@ def page_operations():
                         ore=float(ore_lavorate),
                         operatore=operatore.strip() or None,
                     )
-                    session.add(new_entry)
-
-                    total_ore_fase = session.exec(
-                        select(TimeEntry.ore).where(TimeEntry.fase_id == fase_id_ts)
-                    ).all()
-                    somma_fase = sum(total_ore_fase)
-
-                    fase_obj = session.get(TaskFase, fase_id_ts)
-                    if fase_obj:
-                        fase_obj.ore_consumate = somma_fase
-
-                    total_ore_comm = session.exec(
-                        select(TimeEntry.ore).where(TimeEntry.commessa_id == commessa_id_ts)
-                    ).all()
-                    somma_comm = sum(total_ore_comm)
-
-                    comm_obj = session.get(ProjectCommessa, commessa_id_ts)
-                    if comm_obj:
-                        comm_obj.ore_consumate = somma_comm
-
+                    add_time_entries(session, [new_entry])
                     session.commit()
 
                 st.success("Ore registrate e KPIs aggiornati.")
                 st.rerun()
 
+    with st.expander("📥 Import massivo ore (CSV / Excel)"):
+        st.caption(
+            "Colonne: fase_id, data_lavoro, ore, operatore (commessa_id opzionale, "
+            "se presente deve corrispondere alla fase). Separatore , o ; e date "
+            "AAAA-MM-GG oppure GG/MM/AAAA."
+        )
+        ts_file = st.file_uploader("File timesheet", type=["csv", "xlsx"], key="ts_bulk_file")
+        if ts_file is not None:
+            ts_digest = file_hash(ts_file.getvalue())
+            ts_previous = find_previous_import(ts_digest)
+            try:
+                df_ts_upload = read_timesheet_file(ts_file.getvalue(), ts_file.name)
+            except Exception as e:
+                st.error(f"File non leggibile: {e}")
+                df_ts_upload = None
+            if ts_previous is not None:
+                st.info(
+                    f"File già importato il {ts_previous.created_at:%d/%m/%Y %H:%M} "
+                    f"come '{ts_previous.filename}' ({ts_previous.righe} righe): non verrà importato di nuovo."
+                )
+
+            if df_ts_upload is not None:
+                ts_rows, ts_errors = validate_timesheet(df_ts_upload)
+                st.write(f"Righe valide: **{len(ts_rows)}** su {len(df_ts_upload)}")
+                if ts_errors:
+                    st.warning(f"{len(ts_errors)} righe con errori.")
+                    st.dataframe(pd.DataFrame(ts_errors), use_container_width=True)
+                skip_invalid = st.checkbox("Importa solo le righe valide", value=False, key="ts_bulk_skip")
+
+                if st.button(
+                    "📥 Importa ore",
+                    key="ts_bulk_import",
+                    disabled=not ts_rows or bool(ts_errors and not skip_invalid) or ts_previous is not None,
+                ):
+                    esito_ts = import_timesheet_rows(ts_rows, ts_digest, ts_file.name)
+                    if esito_ts["duplicate"]:
+                        st.info("File già importato: nessuna riga scritta.")
+                    else:
+                        st.success(
+                            f"Importate {esito_ts['inserted']} righe in {esito_ts['elapsed_s']:.2f}s "
+                            f"(una transazione, {esito_ts['batches']} blocchi), totali ore aggiornati."
+                        )
+
     st.markdown("---")
 
     # =========================
@@ -6887,7 +7047,7 @@ def page_operations():
 
             if delete_comm:
                 with get_session() as session:
-                    session.exec(delete(TimeEntry).where(TimeEntry.commessa_id == comm_id_sel))
+                    delete_time_entries(session, TimeEntry.commessa_id == comm_id_sel)
                     session.exec(delete(TaskFase).where(TaskFase.commessa_id == comm_id_sel))
                     obj = session.get(ProjectCommessa, comm_id_sel)
                     if obj:
@@ -6963,7 +7123,7 @@ def page_operations():
 
             if delete_fase:
                 with get_session() as session:
-                    session.exec(delete(TimeEntry).where(TimeEntry.fase_id == fase_id_sel))
+                    delete_time_entries(session, TimeEntry.fase_id == fase_id_sel)
                     obj = session.get(TaskFase, fase_id_sel)
                     if obj:
                         session.delete(obj)
@@ -6981,33 +7141,37 @@ def page_operations():
     else:
         time_ids = [t.entry_id for t in times_all]
         time_id_sel = st.selectbox("ID riga timesheet", time_ids, key="op_time_sel")
+        te_sel = next(t for t in times_all if t.entry_id == time_id_sel)
 
-        if st.button("🗑 Elimina riga timesheet selezionata"):
+        col_te1, col_te2 = st.columns(2)
+        with col_te1:
+            ore_te_e = st.number_input(
+                "Ore riga selezionata",
+                min_value=0.0,
+                step=0.5,
+                value=float(te_sel.ore or 0.0),
+                key=f"op_time_ore_{time_id_sel}",
+            )
+        with col_te2:
+            data_te_e = st.date_input(
+                "Data lavoro riga selezionata",
+                value=te_sel.data_lavoro or date.today(),
+                key=f"op_time_data_{time_id_sel}",
+            )
+
+        if st.button("💾 Aggiorna riga timesheet selezionata"):
             with get_session() as session:
                 te = session.get(TimeEntry, time_id_sel)
                 if te:
-                    comm_id = te.commessa_id
-                    fase_id = te.fase_id
-                    session.delete(te)
+                    update_time_entry(session, te, ore=float(ore_te_e), data_lavoro=data_te_e)
                     session.commit()
+            st.success("Riga timesheet aggiornata e ore ricalcolate.")
+            st.rerun()
 
-                    total_ore_fase = session.exec(
-                        select(TimeEntry.ore).where(TimeEntry.fase_id == fase_id)
-                    ).all()
-                    somma_fase = sum(total_ore_fase)
-                    fase_obj2 = session.get(TaskFase, fase_id)
-                    if fase_obj2:
-                        fase_obj2.ore_consumate = somma_fase
-
-                    total_ore_comm = session.exec(
-                        select(TimeEntry.ore).where(TimeEntry.commessa_id == comm_id)
-                    ).all()
-                    somma_comm = sum(total_ore_comm)
-                    comm_obj2 = session.get(ProjectCommessa, comm_id)
-                    if comm_obj2:
-                        comm_obj2.ore_consumate = somma_comm
-
-                    session.commit()
+        if st.button("🗑 Elimina riga timesheet selezionata"):
+            with get_session() as session:
+                delete_time_entries(session, TimeEntry.entry_id == time_id_sel)
+                session.commit()
             st.success("Riga timesheet eliminata e ore ricalcolate.")
             st.rerun()
 
@@ -7061,12 +7225,185 @@ def page_marketing_campaigns():
     else:
         st.info("Nessuna campagna registrata.")
 
+    # =========================
+    # MINI-REPORT OEE IN BLOCCO (SOLO ADMIN)
+    # =========================
+    if st.session_state.get("role") != "admin":
+        return
+
+    st.markdown("---")
+    st.subheader("📧 Mini‑report OEE in blocco")
+    st.caption(
+        "File CSV/XLSX con colonne nome, azienda, email, ore_fermi, scarti, velocita, valore_orario "
+        "(ore_turno opzionale, default 8). Le email vengono messe in coda e inviate in background."
+    )
+    uploaded = st.file_uploader("File lead", type=["csv", "xlsx"], key="minireport_batch_file")
+    if uploaded is None:
+        return
+
+    try:
+        if uploaded.name.lower().endswith(".xlsx"):
+            df_leads = pd.read_excel(io.BytesIO(uploaded.getvalue()))
+        else:
+            df_leads = pd.read_csv(io.BytesIO(uploaded.getvalue()), sep=None, engine="python")
+    except Exception as e:
+        st.error(f"File {uploaded.name} non leggibile: {e}")
+        return
+    df_leads.columns = [str(c).strip().lower() for c in df_leads.columns]
+    required = ["nome", "azienda", "email", "ore_fermi", "scarti", "velocita", "valore_orario"]
+    missing = [c for c in required if c not in df_leads.columns]
+    if missing:
+        st.error(f"Colonne mancanti: {', '.join(missing)}")
+        return
+
+    if "ore_turno" not in df_leads.columns:
+        df_leads["ore_turno"] = 8.0
+    num_cols = ["ore_turno", "ore_fermi", "scarti", "velocita", "valore_orario"]
+    for col in num_cols:
+        df_leads[col] = pd.to_numeric(df_leads[col], errors="coerce")
+    df_leads["email"] = df_leads["email"].astype(str).str.strip().str.lower()
+    valid = (
+        df_leads["email"].str.fullmatch(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+        & df_leads[num_cols].notna().all(axis=1)
+    )
+    df_valid = df_leads[valid].drop_duplicates("email")
+    scartati = len(df_leads) - len(df_valid)
+    if df_valid.empty:
+        st.warning("Nessun lead valido nel file (email o valori numerici mancanti).")
+        return
+
+    risultati = compute_oee(
+        df_valid["ore_turno"].to_numpy(),
+        df_valid["ore_fermi"].to_numpy(),
+        df_valid["velocita"].to_numpy(),
+        df_valid["scarti"].to_numpy(),
+        df_valid["valore_orario"].to_numpy(),
+    )
+    df_valid = df_valid.assign(
+        oee_perc=risultati["oee"] * 100.0,
+        perdita_euro_turno=risultati["perdita_euro"],
+        fascia=classify_fascia(risultati["oee"]),
+    )
+
+    t0 = time.perf_counter()
+    rendered = render_minireport_batch(df_valid)
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+
+    col_b1, col_b2, col_b3 = st.columns(3)
+    col_b1.metric("Lead validi", len(df_valid))
+    col_b2.metric("Scartati / duplicati", scartati)
+    col_b3.metric("Render email", f"{elapsed_ms:.0f} ms")
+    st.dataframe(
+        df_valid.groupby("fascia").agg(lead=("email", "size"), oee_medio=("oee_perc", "mean"))
+        .style.format({"oee_medio": "{:.1f}%"}),
+        width="stretch",
+    )
+    with st.expander(f"Anteprima: {df_valid['nome'].iloc[0]} <{df_valid['email'].iloc[0]}>"):
+        st.markdown(rendered["body"].iloc[0], unsafe_allow_html=True)
+
+    if st.button(f"📤 Metti in coda {len(df_valid)} mini‑report", key="minireport_batch_send"):
+        try:
+            ids = enqueue_many(
+                {"to": to, "subject": MINIREPORT_SUBJECT, "body": body, "tag": "minireport_batch"}
+                for to, body in zip(df_valid["email"], rendered["body"])
+            )
+        except Exception as e:
+            st.error(f"Impossibile mettere in coda le email: {e}")
+        else:
+            st.success(f"✅ {len(ids)} email in coda: avanzamento nella pagina Amministrazione › Performance.")
+
+
+@perf_monitor.timed()
+def build_marketing_roi_kpis(
+    df_camp: pd.DataFrame,
+    df_opp: pd.DataFrame,
+    df_exp: pd.DataFrame,
+    df_inv: pd.DataFrame,
+    data_da: date | None = None,
+    data_a: date | None = None,
+) -> pd.DataFrame:
+    """
+    KPI per campagna marketing: ricavi, costi, clienti acquisiti, CAC, LTV, ROI.
+
+    - Ricavi: fatture dei clienti acquisiti con un'opportunità vinta collegata
+      alla campagna (prima opp vinta per cliente), filtrate per data_da/data_a.
+    - Costi: spese collegate alla campagna.
+    """
+    # ---- Ricavi per campagna (via fatture) ----
+    ricavi_per_campagna = {}
+    clienti_per_campagna = {}
+
+    if not df_opp.empty and not df_inv.empty:
+        stato = df_opp["stato_opportunita"].fillna("").astype(str)
+        campaign_ids = df_opp["campaign_id"].astype("Int64")
+        is_won = stato.str.lower().eq("vinta")
+
+        # mappiamo client_id -> campaign_id usando le opp vinte
+        df_won = df_opp.assign(campaign_id=campaign_ids)[is_won & campaign_ids.notna()]
+        df_won = df_won.sort_values("data_apertura").drop_duplicates(subset=["client_id"])
+        client_to_campaign = df_won.set_index("client_id")["campaign_id"]
+
+        df_inv2 = df_inv
+        if data_da:
+            df_inv2 = df_inv2[df_inv2["data_fattura"] >= data_da]
+        if data_a:
+            df_inv2 = df_inv2[df_inv2["data_fattura"] <= data_a]
+
+        df_inv2 = df_inv2.assign(campaign_id=df_inv2["client_id"].map(client_to_campaign))
+        df_inv2 = df_inv2[df_inv2["campaign_id"].notna()]
+
+        grp = df_inv2.groupby("campaign_id")
+        ricavi_per_campagna = grp["importo_totale"].sum().to_dict()
+        clienti_per_campagna = grp["client_id"].nunique().to_dict()
+
+    # ---- Costi marketing per campagna (Expense) ----
+    costi_per_campagna = {}
+    if not df_exp.empty:
+        campaign_ids = df_exp["campaign_id"].astype("Int64")
+        costi_per_campagna = (
+            df_exp.loc[campaign_ids.notna(), "importo_totale"]
+            .groupby(campaign_ids[campaign_ids.notna()])
+            .sum()
+            .to_dict()
+        )
+
+    # ---- Tabella KPI per campagna ----
+    if df_camp.empty:
+        return pd.DataFrame()
+
+    cid = df_camp["campaign_id"]
+    ricavi = cid.map(ricavi_per_campagna).fillna(0.0).astype(float)
+    costi = cid.map(costi_per_campagna).fillna(0.0).astype(float)
+    n_clienti = cid.map(clienti_per_campagna).fillna(0).astype(int)
+
+    per_cliente = n_clienti.where(n_clienti > 0)
+    cac = (costi / per_cliente).fillna(0.0)  # [web:624][web:628]
+    ltv = (ricavi / per_cliente).fillna(0.0)  # [web:629][web:632]
+    roi = ((ricavi - costi) / costi.where(costi > 0)).fillna(0.0)  # [web:630][web:633]
+    ltv_cac = (ltv / cac.where(cac > 0)).fillna(0.0)
+
+    return pd.DataFrame(
+        {
+            "campaign_id": cid,
+            "Nome campagna": df_camp["nome"],
+            "Tipo": df_camp.get("tipo"),
+            "Canale": df_camp.get("canale"),
+            "Ricavi (€)": ricavi,
+            "Costi marketing (€)": costi,
+            "Clienti acquisiti": n_clienti,
+            "CAC (€)": cac,
+            "LTV (€)": ltv,
+            "LTV/CAC": ltv_cac,
+            "ROI": roi,
+        }
+    ).reset_index(drop=True)
+
 
 def page_marketing_roi():
     st.title("📈 Marketing ROI & CAC per campagna")
 
     # ---- Carica campagne, opportunità, spese, fatture ----
-    with get_session() as session:
+    with get_analytics_session() as session:
         campaigns = session.exec(select(MarketingCampaign)).all()
         opps = session.exec(select(Opportunity)).all()
         expenses = session.exec(select(Expense)).all()
@@ -7105,139 +7442,14 @@ def page_marketing_roi():
     with col_f2:
         data_a = st.date_input("A data (fatture, opzionale)", value=None)
 
-    # ---- Prepara flag opportunità vinte ----
-    if not df_opp.empty:
-        df_opp["stato_opportunita"] = df_opp["stato_opportunita"].fillna("").astype(str)
-        df_opp["is_won"] = df_opp["stato_opportunita"].str.lower().eq("vinta")
-    else:
-        df_opp["is_won"] = []
-
-    # ---- Ricavi per campagna (via fatture) ----
-    ricavi_per_campagna = {}
-    clienti_per_campagna = {}
-
-    if not df_opp.empty and not df_inv.empty:
-        df_opp["campaign_id"] = df_opp["campaign_id"].astype("Int64")
-
-        # mappiamo client_id -> campaign_id usando le opp vinte
-        df_won = df_opp[df_opp["is_won"] & df_opp["campaign_id"].notna()].copy()
-        df_won = df_won.sort_values("data_apertura").drop_duplicates(subset=["client_id"])
-        client_to_campaign = df_won.set_index("client_id")["campaign_id"].to_dict()
-
-        df_inv2 = df_inv.copy()
+    df_kpi = build_marketing_roi_kpis(df_camp, df_opp, df_exp, df_inv, data_da, data_a)
 
-        # filtro anno obbligatorio sulla data fattura
-        df_inv2 = df_inv2[df_inv2["data_fattura"].notna()]
-        df_inv2["anno"] = df_inv2["data_fattura"].apply(lambda d: d.year)
-        df_inv2 = df_inv2[df_inv2["anno"] == anno_sel]
+    if df_kpi.empty:
+        st.info("Nessun dato sufficiente per calcolare CAC/ROI (mancano fatture e/o spese collegate a campagne).")
+        return
 
-        # filtri opzionali data_da / data_a
-        if data_da:
-            df_inv2 = df_inv2[df_inv2["data_fattura"] >= data_da]
-        if data_a:
-            df_inv2 = df_inv2[df_inv2["data_fattura"] <= data_a]
-
-        df_inv2["campaign_id"] = df_inv2["client_id"].map(client_to_campaign)
-        df_inv2 = df_inv2[df_inv2["campaign_id"].notna()]
-
-        grp_rev = df_inv2.groupby("campaign_id")["importo_totale"].sum().rename("ricavi").reset_index()
-        ricavi_per_campagna = dict(zip(grp_rev["campaign_id"], grp_rev["ricavi"]))
-
-        grp_clients = df_inv2.groupby("campaign_id")["client_id"].nunique().rename("n_clienti").reset_index()
-        clienti_per_campagna = dict(zip(grp_clients["campaign_id"], grp_clients["n_clienti"]))
-
-    # ---- Costi marketing per campagna (Expense) ----
-    costi_per_campagna = {}
-    if not df_exp.empty:
-        df_exp["campaign_id"] = df_exp["campaign_id"].astype("Int64")
-
-        df_exp2 = df_exp[df_exp["campaign_id"].notna()].copy()
-
-        # uso data_pagamento se presente, altrimenti data
-        df_exp2["data_rif"] = pd.to_datetime(
-            df_exp2["data_pagamento"].fillna(df_exp2["data"]),
-            errors="coerce",
-        )
-        df_exp2 = df_exp2.dropna(subset=["data_rif"])
-        df_exp2["anno"] = df_exp2["data_rif"].dt.year
-        df_exp2 = df_exp2[df_exp2["anno"] == anno_sel]
-
-        grp_cost = df_exp2.groupby("campaign_id")["importo_totale"].sum().rename("costi_marketing").reset_index()
-        costi_per_campagna = dict(zip(grp_cost["campaign_id"], grp_cost["costi_marketing"]))
-
-    # ---- Ricavi per campagna (via fatture) ----
-    ricavi_per_campagna = {}
-    clienti_per_campagna = {}
-
-    if not df_opp.empty and not df_inv.empty:
-        df_opp["campaign_id"] = df_opp["campaign_id"].astype("Int64")
-
-        # mappiamo client_id -> campaign_id usando le opp vinte
-        df_won = df_opp[df_opp["is_won"] & df_opp["campaign_id"].notna()].copy()
-        df_won = df_won.sort_values("data_apertura").drop_duplicates(subset=["client_id"])
-
-        client_to_campaign = df_won.set_index("client_id")["campaign_id"].to_dict()
-
-        df_inv2 = df_inv.copy()
-        if data_da:
-            df_inv2 = df_inv2[df_inv2["data_fattura"] >= data_da]
-        if data_a:
-            df_inv2 = df_inv2[df_inv2["data_fattura"] <= data_a]
-
-        df_inv2["campaign_id"] = df_inv2["client_id"].map(client_to_campaign)
-        df_inv2 = df_inv2[df_inv2["campaign_id"].notna()]
-
-        grp_rev = df_inv2.groupby("campaign_id")["importo_totale"].sum().rename("ricavi").reset_index()
-        ricavi_per_campagna = dict(zip(grp_rev["campaign_id"], grp_rev["ricavi"]))
-
-        grp_clients = df_inv2.groupby("campaign_id")["client_id"].nunique().rename("n_clienti").reset_index()
-        clienti_per_campagna = dict(zip(grp_clients["campaign_id"], grp_clients["n_clienti"]))
-
-    # ---- Costi marketing per campagna (Expense) ----
-    costi_per_campagna = {}
-    if not df_exp.empty:
-        df_exp["campaign_id"] = df_exp["campaign_id"].astype("Int64")
-        df_exp2 = df_exp[df_exp["campaign_id"].notna()].copy()
-        grp_cost = df_exp2.groupby("campaign_id")["importo_totale"].sum().rename("costi_marketing").reset_index()
-        costi_per_campagna = dict(zip(grp_cost["campaign_id"], grp_cost["costi_marketing"]))
-
-    # ---- Costruisci tabella KPI per campagna ----
-    kpis = []
-    for _, row in df_camp.iterrows():
-        cid = row["campaign_id"]
-        ricavi = float(ricavi_per_campagna.get(cid, 0.0) or 0.0)
-        costi = float(costi_per_campagna.get(cid, 0.0) or 0.0)
-        n_clienti = int(clienti_per_campagna.get(cid, 0) or 0)
-
-        cac = costi / n_clienti if n_clienti > 0 else 0.0  # [web:624][web:628]
-        ltv = ricavi / n_clienti if n_clienti > 0 else 0.0  # [web:629][web:632]
-        roi = ((ricavi - costi) / costi) if costi > 0 else 0.0  # [web:630][web:633]
-        ltv_cac = (ltv / cac) if cac > 0 else 0.0
-
-        kpis.append(
-            {
-                "campaign_id": cid,
-                "Nome campagna": row["nome"],
-                "Tipo": row.get("tipo", None),
-                "Canale": row.get("canale", None),
-                "Ricavi (€)": ricavi,
-                "Costi marketing (€)": costi,
-                "Clienti acquisiti": n_clienti,
-                "CAC (€)": cac,
-                "LTV (€)": ltv,
-                "LTV/CAC": ltv_cac,
-                "ROI": roi,
-            }
-        )
-
-    if not kpis:
-        st.info("Nessun dato sufficiente per calcolare CAC/ROI (mancano fatture e/o spese collegate a campagne).")
-        return
-
-    df_kpi = pd.DataFrame(kpis)
-
-    # ---- Filtri su KPI: anno (fatture) e canale ----
-    st.subheader("Filtri vista KPI")
+    # ---- Filtri su KPI: anno (fatture) e canale ----
+    st.subheader("Filtri vista KPI")
 
     col_f1, col_f2 = st.columns(2)
     with col_f1:
@@ -7736,80 +7948,252 @@ def page_capacity_people():
             key="cap_giorni_sett",
         )
 
-    # ---------- Carico timesheet ----------
-    with get_session() as session:
-        entries = session.exec(select(TimeEntry)).all()
-        employees = session.exec(select(Employee)).all()
-
-    if not entries:
-        st.info("Nessuna riga timesheet registrata.")
+    if data_a < data_da:
+        st.warning("La data finale deve essere successiva a quella iniziale.")
         st.stop()
 
-    df_te = pd.DataFrame([e.__dict__ for e in entries])
-    df_te["data_lavoro"] = pd.to_datetime(df_te["data_lavoro"], errors="coerce")
-    df_te = df_te.dropna(subset=["data_lavoro"])
-
-    df_te = df_te[
-        (df_te["data_lavoro"] >= pd.to_datetime(data_da)) &
-        (df_te["data_lavoro"] <= pd.to_datetime(data_a))
-    ]
+    # ---------- Carico vs capacità (profili, festività, alias operatori) ----------
+    res = compute_utilization(data_da, data_a, default_ore=ore_giorno, default_giorni=int(giorni_settimana))
+    df_people = res["people"]
+    st.caption(
+        "Capacità da profilo dipendente, altrimenti del reparto, altrimenti i parametri standard sopra. "
+        "Festività nazionali e chiusure del calendario escluse."
+    )
 
-    if df_te.empty:
+    if df_people["ore_registrate"].sum() == 0 and res["unmatched"].empty:
         st.info("Nessuna riga timesheet nel periodo selezionato.")
         st.stop()
 
-    # ---------- Mapping operatore -> employee / reparto ----------
-    df_emp = pd.DataFrame([e.__dict__ for e in (employees or [])])
-    if not df_emp.empty:
-        df_emp["nome_completo"] = df_emp["nome"] + " " + df_emp["cognome"]
-        df_te = df_te.merge(
-            df_emp[["employee_id", "department_id", "nome_completo"]],
-            how="left",
-            left_on="operatore",
-            right_on="nome_completo",
-        )
-    else:
-        df_te["employee_id"] = None
-        df_te["department_id"] = None
-
-    # ---------- Capacità teorica periodo ----------
-    giorni = pd.date_range(start=data_da, end=data_a, freq="D")
-    # 0 = lunedì ... 6 = domenica; prendiamo solo i primi 'giorni_settimana' valori
-    giorni_lav = [g for g in giorni if g.weekday() < giorni_settimana]
-    giorni_lav_count = len(giorni_lav)
-    capacita_teorica = giorni_lav_count * ore_giorno
-
-    # ---------- Aggregazione per persona ----------
-    agg = (
-        df_te.groupby("operatore")["ore"]
-        .sum()
-        .reset_index()
-        .rename(columns={"ore": "Ore_registrate"})
-    )
-    agg["Capacita_teorica"] = capacita_teorica
-    agg["Utilization_%"] = agg["Ore_registrate"] / agg["Capacita_teorica"] * 100.0
-
     st.subheader("Saturazione per persona (periodo)")
     st.dataframe(
-        agg.style.format(
+        df_people[
+            ["persona", "reparto", "ore_registrate", "giorni_lavorativi", "ore_giorno", "capacita", "utilization_pct"]
+        ]
+        .rename(
+            columns={
+                "persona": "Persona",
+                "reparto": "Reparto",
+                "ore_registrate": "Ore_registrate",
+                "giorni_lavorativi": "Giorni_lavorativi",
+                "ore_giorno": "Ore/giorno",
+                "capacita": "Capacita_teorica",
+                "utilization_pct": "Utilization_%",
+            }
+        )
+        .style.format(
             {
                 "Ore_registrate": "{:,.2f}",
+                "Ore/giorno": "{:,.1f}",
                 "Capacita_teorica": "{:,.2f}",
                 "Utilization_%": "{:,.1f}",
             }
-        )
+        ),
+        use_container_width=True,
+    )
+
+    st.subheader("Saturazione per reparto")
+    df_dep = res["departments"]
+    st.dataframe(
+        df_dep.rename(
+            columns={
+                "reparto": "Reparto",
+                "persone": "Persone",
+                "ore_registrate": "Ore_registrate",
+                "capacita": "Capacita_teorica",
+                "utilization_pct": "Utilization_%",
+            }
+        ).style.format({"Ore_registrate": "{:,.2f}", "Capacita_teorica": "{:,.2f}", "Utilization_%": "{:,.1f}"}),
+        use_container_width=True,
     )
 
     # ---------- Grafico utilizzo ----------
     fig = px.bar(
-        agg,
-        x="operatore",
-        y="Utilization_%",
+        df_people[df_people["ore_registrate"] > 0],
+        x="persona",
+        y="utilization_pct",
+        color="reparto",
         title="Utilization % per persona",
-        labels={"operatore": "Operatore", "Utilization_%": "Utilization (%)"},
+        labels={"persona": "Operatore", "utilization_pct": "Utilization (%)", "reparto": "Reparto"},
     )
     st.plotly_chart(fig, width="stretch")
 
+    # ---------- Operatori non riconosciuti ----------
+    df_unmatched = res["unmatched"]
+    if not df_unmatched.empty:
+        st.subheader("⚠️ Operatori timesheet non collegati a un dipendente")
+        st.dataframe(df_unmatched.rename(columns={"operatore": "Operatore", "ore": "Ore"}), use_container_width=True)
+
+    # ---------- Heatmap settimanale (aggregato TimesheetWeek) ----------
+    st.subheader("🗓️ Heatmap settimanale utilization")
+    col_h1, col_h2 = st.columns(2)
+    with col_h1:
+        n_weeks = st.slider("Settimane", min_value=4, max_value=104, value=52, step=4, key="cap_heat_weeks")
+    with col_h2:
+        heat_group = st.radio("Righe", ["Persona", "Reparto"], horizontal=True, key="cap_heat_group")
+
+    df_weeks = weekly_utilization(
+        data_a - timedelta(weeks=n_weeks - 1),
+        data_a,
+        default_ore=ore_giorno,
+        default_giorni=int(giorni_settimana),
+    )
+    row_col = "persona" if heat_group == "Persona" else "reparto"
+    df_heat = (
+        df_weeks.groupby([row_col, "week_start", "settimana"], as_index=False)
+        .agg(ore_registrate=("ore_registrate", "sum"), capacita=("capacita", "sum"))
+        .sort_values("week_start")
+    )
+    df_heat["utilization_pct"] = df_heat["ore_registrate"] / df_heat["capacita"].where(df_heat["capacita"] > 0) * 100.0
+
+    if row_col == "persona":
+        # persone ordinate per reparto, non collegati in fondo
+        row_order = (
+            df_weeks[["persona", "reparto"]].drop_duplicates("persona").sort_values(["reparto", "persona"])["persona"].tolist()
+        )
+    else:
+        row_order = sorted(df_heat["reparto"].unique())
+    week_order = df_heat.drop_duplicates("settimana")["settimana"].tolist()
+    z = df_heat.pivot(index=row_col, columns="settimana", values="utilization_pct").reindex(
+        index=row_order, columns=week_order
+    )
+    ore_pivot = df_heat.pivot(index=row_col, columns="settimana", values="ore_registrate").reindex(
+        index=row_order, columns=week_order
+    )
+    fig_heat = go.Heatmap(
+        z=z.to_numpy(),
+        x=week_order,
+        y=row_order,
+        customdata=ore_pivot.to_numpy(),
+        colorscale="RdYlGn_r",
+        zmin=0,
+        zmax=120,
+        colorbar={"title": "Utilization %"},
+        hovertemplate="%{y}<br>%{x}<br>Utilization %{z:.0f}%<br>Ore %{customdata:.1f}<extra></extra>",
+    )
+    st.plotly_chart(
+        go.Figure(fig_heat).update_layout(height=max(300, 18 * len(row_order) + 120), yaxis={"autorange": "reversed"}),
+        width="stretch",
+    )
+
+    # drill-down commessa/fase dallo stesso aggregato
+    col_d1, col_d2 = st.columns(2)
+    with col_d1:
+        drill_row = st.selectbox(heat_group, row_order, key="cap_drill_row")
+    with col_d2:
+        drill_week = st.selectbox("Settimana", week_order[::-1], key="cap_drill_week")
+    if drill_row is not None and drill_week is not None:
+        sel = df_weeks[df_weeks[row_col] == drill_row]
+        week_start = df_heat.loc[df_heat["settimana"] == drill_week, "week_start"].iloc[0].date()
+        df_drill = weekly_drilldown(
+            sel["employee_id"].dropna().astype(int).unique().tolist(),
+            week_start,
+            include_unmatched=bool(sel["employee_id"].isna().any()),
+        )
+        if df_drill.empty:
+            st.info("Nessuna ora registrata nella settimana selezionata.")
+        else:
+            df_drill["commessa_fase"] = (
+                df_drill["cod_commessa"].fillna("-").astype(str) + " / " + df_drill["nome_fase"].fillna("-").astype(str)
+            )
+            st.plotly_chart(
+                px.bar(
+                    df_drill.head(20),
+                    x="ore",
+                    y="commessa_fase",
+                    orientation="h",
+                    title=f"{drill_row} – ore per commessa/fase ({drill_week})",
+                    labels={"ore": "Ore", "commessa_fase": "Commessa / fase"},
+                ).update_layout(yaxis={"autorange": "reversed"}),
+                width="stretch",
+            )
+            st.dataframe(
+                df_drill[["cod_commessa", "nome_fase", "ore"]].rename(
+                    columns={"cod_commessa": "Commessa", "nome_fase": "Fase", "ore": "Ore"}
+                ),
+                use_container_width=True,
+            )
+
+    if st.session_state.get("role", "user") != "admin":
+        return
+
+    with get_session() as session:
+        employees = session.exec(select(Employee).order_by(Employee.cognome, Employee.nome)).all()
+        departments = session.exec(select(Department).order_by(Department.nome_reparto)).all()
+    emp_labels = {f"{e.nome} {e.cognome} (#{e.employee_id})": e.employee_id for e in employees}
+
+    if not df_unmatched.empty and emp_labels:
+        with st.form("operator_alias"):
+            st.markdown("**Collega operatore a dipendente (alias)**")
+            alias_op = st.selectbox("Operatore", df_unmatched["operatore"].tolist())
+            alias_emp = st.selectbox("Dipendente", list(emp_labels))
+            if st.form_submit_button("🔗 Salva alias"):
+                with get_session() as session:
+                    norm = normalize_operator(alias_op)
+                    existing = session.exec(select(OperatorAlias).where(OperatorAlias.alias == norm)).first()
+                    if existing:
+                        existing.employee_id = emp_labels[alias_emp]
+                        session.add(existing)
+                    else:
+                        session.add(OperatorAlias(alias=norm, employee_id=emp_labels[alias_emp]))
+                    session.commit()
+                st.success("Alias salvato.")
+                st.rerun()
+
+    with st.expander("⚙️ Profili di capacità e festività"):
+        with st.form("capacity_profile"):
+            st.markdown("**Profilo capacità** (dipendente oppure intero reparto)")
+            dep_labels = {d.nome_reparto: d.department_id for d in departments}
+            target = st.selectbox("Applica a", ["Reparto", "Dipendente"])
+            target_dep = st.selectbox("Reparto", list(dep_labels) or ["-"])
+            target_emp = st.selectbox("Dipendente", list(emp_labels) or ["-"])
+            col_p1, col_p2, col_p3 = st.columns(3)
+            with col_p1:
+                prof_ore = st.number_input("Ore/giorno profilo", min_value=0.5, max_value=12.0, value=8.0, step=0.5)
+            with col_p2:
+                prof_giorni = st.multiselect(
+                    "Giorni lavorativi",
+                    ["Lun", "Mar", "Mer", "Gio", "Ven", "Sab", "Dom"],
+                    default=["Lun", "Mar", "Mer", "Gio", "Ven"],
+                )
+            with col_p3:
+                prof_cal = st.text_input("Calendario festività", "IT")
+            if st.form_submit_button("💾 Salva profilo"):
+                weekmask = "".join("1" if g in prof_giorni else "0" for g in ["Lun", "Mar", "Mer", "Gio", "Ven", "Sab", "Dom"])
+                emp_id = emp_labels.get(target_emp) if target == "Dipendente" else None
+                dep_id = dep_labels.get(target_dep) if target == "Reparto" else None
+                if weekmask == "0000000" or (emp_id is None and dep_id is None):
+                    st.warning("Seleziona almeno un giorno lavorativo e un reparto/dipendente.")
+                else:
+                    with get_session() as session:
+                        prof = session.exec(
+                            select(CapacityProfile)
+                            .where(CapacityProfile.employee_id == emp_id)
+                            .where(CapacityProfile.department_id == dep_id)
+                        ).first() or CapacityProfile(employee_id=emp_id, department_id=dep_id)
+                        prof.ore_giorno = prof_ore
+                        prof.weekmask = weekmask
+                        prof.calendario = prof_cal.strip() or "IT"
+                        session.add(prof)
+                        session.commit()
+                    st.success("Profilo salvato.")
+                    st.rerun()
+
+        with st.form("holiday_new"):
+            st.markdown("**Chiusura / festività aggiuntiva** (oltre alle festività nazionali)")
+            col_h1, col_h2, col_h3 = st.columns(3)
+            with col_h1:
+                hol_data = st.date_input("Data", value=date.today(), key="hol_data")
+            with col_h2:
+                hol_cal = st.text_input("Calendario", "IT", key="hol_cal")
+            with col_h3:
+                hol_descr = st.text_input("Descrizione", "", key="hol_descr")
+            if st.form_submit_button("➕ Aggiungi chiusura"):
+                with get_session() as session:
+                    session.add(Holiday(data=hol_data, calendario=hol_cal.strip() or "IT", descrizione=hol_descr.strip() or None))
+                    session.commit()
+                st.success("Chiusura aggiunta.")
+                st.rerun()
+
 # =========================
 # PAGINE FINANZA AVANZATE
 # =========================
@@ -8487,7 +8871,7 @@ def page_finance_dashboard():
     with col_f2:
         data_a = st.date_input("A data", value=date.today())
 
-    with get_session() as session:
+    with get_analytics_session() as session:
         invoices = session.exec(select(Invoice)).all()
         expenses = session.exec(select(Expense)).all()
 
@@ -8898,7 +9282,7 @@ def page_finance_dashboard():
     st.markdown("---")
     st.subheader("📅 Sintesi Entrate / Uscite / Margine per anno")
 
-    with get_session() as session:
+    with get_analytics_session() as session:
         invoices_all = session.exec(select(Invoice)).all()
         expenses_all = session.exec(select(Expense)).all()
 
@@ -9204,6 +9588,12 @@ def page_cashflow_forecast():
         step=500.0,
         help="Inserisci il saldo di cassa/banca all'inizio dell'anno selezionato.",
     )
+    orizzonte = st.selectbox(
+        "Orizzonte proiezione (mesi)",
+        [12, 24, 36],
+        index=1,
+        help="La proiezione parte dal 01/01 dell'anno selezionato.",
+    )
 
     # Carico dati da DB
     with get_session() as session:
@@ -9220,10 +9610,6 @@ def page_cashflow_forecast():
             )
         ).all()
 
-        # Fatture e spese per consuntivo
-        invoices = session.exec(select(Invoice)).all()
-        expenses = session.exec(select(Expense)).all()
-
     # =========================
     # 1) BUDGET & EVENTI INPUT
     # =========================
@@ -9328,235 +9714,355 @@ def page_cashflow_forecast():
     st.markdown("---")
 
     # ---------------------------
-    # Consuntivo per mese (Actual)
+    # Forecast pluriennale (consuntivo + budget + eventi + incassi attesi)
     # ---------------------------
-    df_inv = pd.DataFrame([i.__dict__ for i in (invoices or [])])
-    df_exp = pd.DataFrame([e.__dict__ for e in (expenses or [])])
-
-    # Entrate: uso data_incasso se presente, altrimenti data_fattura
-    if not df_inv.empty:
-        df_inv["data_rif"] = pd.to_datetime(
-            df_inv["data_incasso"].fillna(df_inv["data_fattura"]),
-            errors="coerce",
-        )
-        df_inv = df_inv.dropna(subset=["data_rif"])
-        df_inv["anno"] = df_inv["data_rif"].dt.year
-        df_inv["mese"] = df_inv["data_rif"].dt.month
-        df_inv = df_inv[df_inv["anno"] == anno_sel]
-        entrate_actual = (
-            df_inv.groupby("mese")["importo_totale"]
-            .sum()
-            .rename("Entrate_actual")
-            .reset_index()
-        )
-    else:
-        entrate_actual = pd.DataFrame(columns=["mese", "Entrate_actual"])
+    df_cf = build_cashflow_forecast(date(anno_sel, 1, 1), orizzonte, saldo_iniziale)
 
-    # Uscite: uso data pagamento se presente, altrimenti data
-    if not df_exp.empty:
-        df_exp["data_rif"] = pd.to_datetime(
-            df_exp["data_pagamento"].fillna(df_exp["data"]),
-            errors="coerce",
-        )
-        df_exp = df_exp.dropna(subset=["data_rif"])
-        df_exp["anno"] = df_exp["data_rif"].dt.year
-        df_exp["mese"] = df_exp["data_rif"].dt.month
-        df_exp = df_exp[df_exp["anno"] == anno_sel]
-        uscite_actual = (
-            df_exp.groupby("mese")["importo_totale"]
-            .sum()
-            .rename("Uscite_actual")
-            .reset_index()
-        )
-    else:
-        uscite_actual = pd.DataFrame(columns=["mese", "Uscite_actual"])
+    df_view = df_cf.copy()
+    df_view["Mese"] = df_view["periodo"].str[5:7] + "/" + df_view["periodo"].str[:4]
+    df_view = df_view.rename(
+        columns={
+            "Budget_operativo": "Netto_operativo",
+            "Budget_fisco_inps": "Netto_fisco_inps",
+            "Budget_investimenti_altro": "Netto_investimenti_altro",
+        }
+    )
+    # il consuntivo ricade nella componente operativa
+    df_view["Netto_operativo"] = df_view["Netto_operativo"] + df_view["Netto_actual"]
 
-    # ---------------------------
-    # Budget per mese (con categorie di cashflow)
-    # ---------------------------
-    df_budget = pd.DataFrame(
-        [
-            {
-                "mese": b.mese,
-                "categoria": (b.categoria or "").strip(),
-                "importo_previsto": b.importo_previsto,
-            }
-            for b in (budgets or [])
-        ]
+    cols_show = [
+        "Mese",
+        "Entrate_actual",
+        "Uscite_actual",
+        "Netto_actual",
+        "Netto_budget",
+        "Events_netto",
+        "Incassi_attesi",
+        "Netto_operativo",
+        "Netto_fisco_inps",
+        "Netto_investimenti_altro",
+        "Netto_forecast",
+        "Saldo_iniziale",
+        "Saldo_finale",
+    ]
+    df_view = df_view[cols_show]
+    st.subheader("Tabella mensile Actual vs Budget + saldo proiettato")
+    st.caption(
+        "Incassi_attesi: fatture aperte collocate al ritardo di incasso mediano "
+        "del cliente (storico pagamenti), condizionato all'età della fattura."
     )
+    st.dataframe(df_view.style.format("{:,.2f}", subset=df_view.columns[1:]))
 
-    def _classifica_cashflow_cat(nome_cat: str) -> str:
-        """Restituisce: operativo / fisco_inps / investimenti_altro."""
-        nome = (nome_cat or "").lower()
-        if any(k in nome for k in ["fisco", "imposte", "tasse", "inps", "previd"]):
-            return "fisco_inps"
-        if any(k in nome for k in ["invest", "macchin", "impiant", "attrezz", "capex"]):
-            return "investimenti_altro"
-        # default: tutto ciò che non è fisco/INPS o investimenti lo consideriamo operativo
-        return "operativo"
-
-    if not df_budget.empty:
-        df_budget["macro_cat"] = df_budget["categoria"].apply(_classifica_cashflow_cat)
-        # netto totale budget (come prima)
-        budget_mese = (
-            df_budget.groupby("mese")["importo_previsto"]
-            .sum()
-            .rename("Netto_budget")
-            .reset_index()
-        )
-        # budget per macro-categoria
-        budget_mese_macro = (
-            df_budget.groupby(["mese", "macro_cat"])["importo_previsto"]
-            .sum()
-            .reset_index()
-            .pivot(index="mese", columns="macro_cat", values="importo_previsto")
-            .fillna(0.0)
-            .reset_index()
-        )
-        budget_mese_macro = budget_mese_macro.rename(
-            columns={
-                "operativo": "Budget_operativo",
-                "fisco_inps": "Budget_fisco_inps",
-                "investimenti_altro": "Budget_investimenti_altro",
-            }
-        )
-    else:
-        budget_mese = pd.DataFrame(columns=["mese", "Netto_budget"])
-        budget_mese_macro = pd.DataFrame(
-            columns=[
-                "mese",
-                "Budget_operativo",
-                "Budget_fisco_inps",
-                "Budget_investimenti_altro",
-            ]
-        )
+    with st.expander("🕒 Modello ritardi di incasso per cliente"):
+        df_model = collection_model_summary()
+        if df_model.empty:
+            st.info("Nessuno storico di incassi: uso un ritardo standard di 30 giorni.")
+        else:
+            client_names = {c["client_id"]: c["ragione_sociale"] for c in get_all_clients()}
+            df_model.insert(1, "Cliente", df_model["client_id"].map(client_names))
+            st.dataframe(df_model, hide_index=True, width="stretch")
 
     # ---------------------------
-    # Eventi puntuali (forecast)
+    # Scenari Monte Carlo sui ritardi di incasso
     # ---------------------------
-    df_events = pd.DataFrame(
-        [
-            {
-                "data": e.data,
-                "mese": e.data.month,
-                "tipo": e.tipo,
-                "importo": e.importo if e.tipo == "entrata" else -e.importo,
-            }
-            for e in (events or [])
-        ]
-    )
-    if not df_events.empty:
-        events_mese = (
-            df_events.groupby("mese")["importo"]
-            .sum()
-            .rename("Events_netto")
-            .reset_index()
-        )
-    else:
-        events_mese = pd.DataFrame(columns=["mese", "Events_netto"])
+    st.subheader("Andamento saldo proiettato per mese")
 
-    # ---------------------------
-    # Merge mensile e calcolo saldo
-    # ---------------------------
-    mesi_df = pd.DataFrame({"mese": list(range(1, 13))})
+    col_mc1, col_mc2 = st.columns(2)
+    with col_mc1:
+        n_sims = st.selectbox("Scenari Monte Carlo", [1_000, 10_000, 50_000], index=1)
+    with col_mc2:
+        seed_mc = st.number_input("Seed", value=42, step=1)
 
-    df_cf = mesi_df.merge(entrate_actual, on="mese", how="left")
-    df_cf = df_cf.merge(uscite_actual, on="mese", how="left")
-    df_cf = df_cf.merge(budget_mese, on="mese", how="left")
-    df_cf = df_cf.merge(events_mese, on="mese", how="left")
-    df_cf = df_cf.merge(budget_mese_macro, on="mese", how="left")
+    df_bande = simulate_cash_paths(
+        df_cf, saldo_iniziale=saldo_iniziale, n_sims=int(n_sims), seed=int(seed_mc)
+    )
 
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=df_bande["periodo"], y=df_bande["P95"], mode="lines",
+        line=dict(width=0), showlegend=False, hoverinfo="skip",
+    ))
+    fig.add_trace(go.Scatter(
+        x=df_bande["periodo"], y=df_bande["P5"], mode="lines",
+        line=dict(width=0), fill="tonexty", fillcolor="rgba(31,119,180,0.15)",
+        name="P5–P95",
+    ))
+    fig.add_trace(go.Scatter(
+        x=df_bande["periodo"], y=df_bande["P75"], mode="lines",
+        line=dict(width=0), showlegend=False, hoverinfo="skip",
+    ))
+    fig.add_trace(go.Scatter(
+        x=df_bande["periodo"], y=df_bande["P25"], mode="lines",
+        line=dict(width=0), fill="tonexty", fillcolor="rgba(31,119,180,0.30)",
+        name="P25–P75",
+    ))
+    fig.add_trace(go.Scatter(
+        x=df_bande["periodo"], y=df_bande["P50"], mode="lines",
+        line=dict(color="rgb(31,119,180)"), name="Mediana",
+    ))
+    fig.add_trace(go.Scatter(
+        x=df_cf["periodo"], y=df_cf["Saldo_finale"], mode="lines+markers",
+        line=dict(color="gray", dash="dot"), name="Forecast deterministico",
+    ))
+    fig.update_layout(xaxis_title="Mese", yaxis_title="Saldo finale previsto (€)")
+    st.plotly_chart(fig, width="stretch")
+
+    mesi_rischio = df_bande[df_bande["Prob_saldo_negativo_%"] > 0]
+    if not mesi_rischio.empty:
+        st.warning(
+            f"Probabilità massima di saldo negativo: "
+            f"{mesi_rischio['Prob_saldo_negativo_%'].max():.1f}% "
+            f"(primo mese a rischio: {mesi_rischio['periodo'].iloc[0]})"
+        )
 
-    df_cf = df_cf.fillna(0.0)
+# =========================
+# PAGINA PERFORMANCE (ADMIN)
+# =========================
 
-    df_cf["Entrate_forecast"] = df_cf["Entrate_actual"]
-    df_cf["Uscite_forecast"] = df_cf["Uscite_actual"]
+def page_performance():
+    st.title("⏱️ Performance applicazione")
 
-    # Dove non hai ancora consuntivo (mesi futuri), il netto budget + eventi aiuta il forecast
-    df_cf["Netto_actual"] = df_cf["Entrate_actual"] - df_cf["Uscite_actual"]
-    df_cf["Netto_budget_events"] = df_cf["Netto_budget"] + df_cf["Events_netto"]
-    df_cf["Netto_forecast"] = df_cf["Netto_actual"] + df_cf["Netto_budget_events"]
-    # Scomposizione del forecast per macro-categoria
-    df_cf["Netto_operativo"] = df_cf["Netto_actual"] + df_cf["Budget_operativo"]
-    df_cf["Netto_fisco_inps"] = df_cf["Budget_fisco_inps"]
-    df_cf["Netto_investimenti_altro"] = df_cf["Budget_investimenti_altro"]
+    if st.session_state.get("role") != "admin":
+        st.warning("Pagina riservata agli amministratori.")
+        st.stop()
 
-    # Controllo: somma delle tre componenti
-    df_cf["Netto_somma_componenti"] = (
-        df_cf["Netto_operativo"]
-        + df_cf["Netto_fisco_inps"]
-        + df_cf["Netto_investimenti_altro"]
+    replica = get_replica_status()
+    if replica["enabled"] and replica["refreshed_at"] is not None:
+        st.caption(
+            f"Replica analitica `{replica['path']}`: allineata alle "
+            f"{replica['refreshed_at'].strftime('%H:%M:%S')} ({replica['mode']}, seq {replica['applied_seq']}, "
+            f"{replica['changes']} modifiche in {replica['elapsed_s']:.3f}s)"
+        )
+
+    st.subheader("📧 Coda email (SMTP)")
+    mail = email_queue_status()
+    col_m1, col_m2, col_m3, col_m4 = st.columns(4)
+    col_m1.metric("In coda", mail["queued"] + mail["in_flight"])
+    col_m2.metric("Inviate", mail["sent"])
+    col_m3.metric("Fallite", mail["failed"], delta=f"{mail['retried']} ritentativi", delta_color="off")
+    col_m4.metric(
+        "Connessioni SMTP",
+        mail["connections"],
+        delta=f"{mail['per_connection']:.1f} msg/conn" if mail["per_connection"] else None,
+        delta_color="off",
     )
+    st.caption(
+        f"Worker {'attivo' if mail['worker_alive'] else 'fermo'} · limite {mail['rate_per_min'] or '∞'} msg/min"
+        + (f" · ultimo invio {mail['last_sent_at'].strftime('%H:%M:%S')}" if mail["last_sent_at"] else "")
+    )
+    failures = recent_failures()
+    if failures:
+        with st.expander(f"Invii falliti ({len(failures)} più recenti)"):
+            st.dataframe(pd.DataFrame(failures), width="stretch")
 
-    # Calcolo saldo mese per mese
-    saldi = []
-    saldo = saldo_iniziale
-    for _, row in df_cf.sort_values("mese").iterrows():
-        saldo_finale = saldo + row["Netto_forecast"]
-        saldi.append(
-            {
-                "mese": row["mese"],
-                "Saldo_iniziale": saldo,
-                "Netto_forecast": row["Netto_forecast"],
-                "Saldo_finale": saldo_finale,
-            }
+    if not perf_monitor.is_enabled():
+        st.info(
+            "Monitor performance disattivato. Avvia l'app con "
+            "`PERF_MONITOR_ENABLED=true` per raccogliere i tempi di pagine, query, cache e chiamate esterne."
         )
-        saldo = saldo_finale
+        st.stop()
 
-    df_saldi = pd.DataFrame(saldi)
+    col_b1, col_b2 = st.columns(2)
+    with col_b1:
+        st.download_button(
+            "⬇️ Esporta campioni (JSON)",
+            data=perf_monitor.export_json(),
+            file_name=f"perf_forgialean_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json",
+        )
+    with col_b2:
+        if st.button("🧹 Azzera campioni"):
+            perf_monitor.reset()
+            st.rerun()
 
-    # Join per tabella finale leggibile
-    df_view = df_cf.merge(df_saldi, on="mese")
-    df_view["Mese"] = df_view["mese"].apply(lambda m: f"{m:02d}/{anno_sel}")
+    fmt_ms = {"mean_ms": "{:,.1f}", "p50_ms": "{:,.1f}", "p95_ms": "{:,.1f}", "max_ms": "{:,.1f}"}
 
-    # Colonna forecast (qui in realtà è già in df_cf, questa riga può anche non servire)
-    # df_view["Netto_forecast"] = (
-    #     df_view["Netto_operativo"]
-    #     + df_view["Netto_fisco_inps"]
-    #     + df_view["Netto_investimenti_altro"]
-    # )
+    st.subheader("Pagine (p50 / p95)")
+    df_pages = perf_monitor.summarize("page")
+    if df_pages.empty:
+        st.info("Nessuna pagina misurata finora.")
+    else:
+        st.dataframe(df_pages.style.format(fmt_ms), width="stretch")
+        fig = px.bar(
+            df_pages,
+            x="name",
+            y=["p50_ms", "p95_ms"],
+            barmode="group",
+            title="Tempo di rendering per pagina",
+            labels={"name": "Pagina", "value": "ms", "variable": "Percentile"},
+        )
+        st.plotly_chart(fig, width="stretch")
 
-    cols_show = [
-        "Mese",
-        "Entrate_actual",
-        "Uscite_actual",
-        "Netto_actual",
-        "Netto_budget",
-        "Events_netto",
-        "Netto_operativo",
-        "Netto_fisco_inps",
-        "Netto_investimenti_altro",
-        "Netto_forecast",
-        "Saldo_iniziale",
-        "Saldo_finale",
-    ]
+    st.subheader("Builder e calcoli")
+    df_builders = perf_monitor.summarize("builder")
+    if df_builders.empty:
+        st.info("Nessun builder misurato finora.")
+    else:
+        st.dataframe(df_builders.style.format(fmt_ms), width="stretch")
 
-    # Filtra solo le colonne che esistono effettivamente
-    cols_show = [col for col in cols_show if col in df_view.columns]
+    st.subheader("Query SQL più lente")
+    top_n = st.number_input("Top N", min_value=5, max_value=200, value=20, step=5, key="perf_top_n")
+    df_slow = perf_monitor.top_slow_queries(int(top_n))
+    if df_slow.empty:
+        st.info("Nessuna query registrata.")
+    else:
+        st.dataframe(df_slow, width="stretch")
+    with st.expander("Query aggregate per statement"):
+        st.dataframe(perf_monitor.summarize("query").style.format(fmt_ms), width="stretch")
+
+    st.subheader("Cache (hit / miss)")
+    df_cache = perf_monitor.cache_stats()
+    if df_cache.empty:
+        st.info("Nessun accesso alla cache registrato.")
+    else:
+        st.dataframe(
+            df_cache.style.format({"hit_rate_%": "{:,.1f}", "mean_ms": "{:,.2f}"}),
+            width="stretch",
+        )
 
-    if cols_show:
-        df_view = df_view[cols_show]
-        st.subheader("Tabella mensile Actual vs Budget + saldo proiettato")
-        st.dataframe(df_view.style.format("{:,.2f}", subset=df_view.columns[1:]))
+    st.subheader("Chiamate esterne (HTTP / SMTP)")
+    df_ext = perf_monitor.summarize("external")
+    if df_ext.empty:
+        st.info("Nessuna chiamata esterna registrata.")
     else:
-        st.warning("Nessun dato disponibile per visualizzare il cashflow.")
-        return
+        st.dataframe(df_ext.style.format(fmt_ms), width="stretch")
 
-    # ---------------------------
-    # Grafico saldo proiettato
-    # ---------------------------
-    st.subheader("Andamento saldo proiettato per mese")
-    if not df_saldi.empty:
-        fig = px.line(
-            df_saldi,
-            x="mese",
-            y="Saldo_finale",
-            markers=True,
-            labels={"mese": "Mese", "Saldo_finale": "Saldo finale previsto (€)"},
+# =========================
+# PAGINA DATI OEE (ADMIN)
+# =========================
+
+def page_oee_data():
+    st.title("🏭 Dati OEE di linea")
+
+    if st.session_state.get("role") != "admin":
+        st.warning("Pagina riservata agli amministratori.")
+        st.stop()
+
+    st.caption(
+        "Eventi macchina importati da file o dall'endpoint locale (`python oee_store.py serve`). "
+        "La dashboard OEE legge solo i rollup per turno, giorno e settimana."
+    )
+
+    # ---------- Anagrafica linee ----------
+    st.subheader("Linee")
+    with get_session() as session:
+        linee = session.exec(select(OeeLine).order_by(OeeLine.codice)).all()
+
+    if linee:
+        st.dataframe(
+            pd.DataFrame([l.model_dump() for l in linee]).set_index("line_id"),
+            width="stretch",
         )
-        st.plotly_chart(fig, width="stretch")
     else:
-        st.info("Nessun dato di saldo disponibile.")
+        st.info("Nessuna linea registrata: aggiungila qui o importa eventi creando le linee mancanti.")
+
+    with st.expander("➕ Aggiungi / modifica linea"):
+        per_codice = {l.codice: l for l in linee}
+        scelta = st.selectbox("Linea", ["Nuova linea"] + list(per_codice), key="oee_line_pick")
+        linea = per_codice.get(scelta)
+        with st.form("oee_line_form"):
+            codice = st.text_input("Codice (come nei file macchina)", value=linea.codice if linea else "")
+            nome = st.text_input("Nome", value=linea.nome if linea else "")
+            reparto = st.text_input("Reparto", value=(linea.reparto or "") if linea else "")
+            pezzi_ora = st.number_input(
+                "Pezzi/ora nominali (0 = Performance non misurata)",
+                min_value=0.0, step=10.0,
+                value=float(linea.pezzi_ora_nominali or 0.0) if linea else 0.0,
+            )
+            valore_orario = st.number_input(
+                "Margine per ora di linea (€)", min_value=0.0, step=50.0,
+                value=float(linea.valore_orario or 0.0) if linea else 0.0,
+            )
+            attiva = st.checkbox("Attiva", value=linea.attiva if linea else True)
+            salva = st.form_submit_button("💾 Salva linea")
+
+        if salva:
+            codice = codice.strip()
+            if not codice:
+                st.error("Il codice linea è obbligatorio.")
+            elif codice in per_codice and per_codice[codice] is not linea:
+                st.error(f"Esiste già una linea con codice {codice}.")
+            else:
+                with get_session() as session:
+                    obj = session.get(OeeLine, linea.line_id) if linea else OeeLine(codice=codice, nome=codice)
+                    obj.codice = codice
+                    obj.nome = nome.strip() or codice
+                    obj.reparto = reparto.strip() or None
+                    obj.pezzi_ora_nominali = pezzi_ora or None
+                    obj.valore_orario = valore_orario
+                    obj.attiva = attiva
+                    session.add(obj)
+                    session.commit()
+                st.success(f"Linea {codice} salvata.")
+                st.rerun()
+
+    # ---------- Import eventi ----------
+    st.subheader("📥 Import eventi macchina (CSV / Excel)")
+    st.caption(
+        "Colonne: linea, ts, planned_s, run_s o downtime_s, total_count, good_count, downtime_reason "
+        "(facoltativa). Gli eventi già caricati (stessa linea e ts) vengono ignorati."
+    )
+    oee_file = st.file_uploader("File eventi", type=["csv", "xlsx"], key="oee_events_file")
+    if oee_file is not None:
+        try:
+            df_oee_upload = read_oee_file(oee_file.getvalue(), oee_file.name)
+        except Exception as e:
+            st.error(f"File non leggibile: {e}")
+            df_oee_upload = None
+
+        if df_oee_upload is not None:
+            oee_events, oee_errors = validate_oee_events(df_oee_upload)
+            st.write(f"Eventi validi: **{len(oee_events):,}** su {len(df_oee_upload):,}".replace(",", "."))
+            create_lines = False
+            if oee_errors:
+                st.warning(f"{len(oee_errors)} righe con errori.")
+                st.dataframe(pd.DataFrame(oee_errors).head(500), width="stretch")
+                if any(e["errore"] == "linea sconosciuta" for e in oee_errors):
+                    create_lines = st.checkbox("Crea le linee mancanti", value=False, key="oee_create_lines")
+            skip_invalid = st.checkbox("Importa solo le righe valide", value=False, key="oee_skip_invalid")
+
+            if st.button("📥 Importa eventi", key="oee_events_import", disabled=bool(oee_errors) and not (skip_invalid or create_lines)):
+                esito = import_oee_events(df_oee_upload, skip_invalid=skip_invalid, create_lines=create_lines)
+                if esito["errors"] and not skip_invalid:
+                    st.error(f"Import annullato: {len(esito['errors'])} righe ancora con errori.")
+                else:
+                    st.success(
+                        f"Importati {esito['inserted']} eventi in {esito['elapsed_s']:.2f}s "
+                        f"({esito['batches']} transazioni, {esito['duplicates']} già presenti), rollup aggiornati."
+                    )
+
+    # ---------- Rollup ----------
+    st.subheader("Rollup giornalieri")
+    primo, ultimo = oee_data_range()
+    if ultimo is None:
+        st.info("Nessun evento macchina importato.")
+        return
+
+    dal = max(primo, ultimo - timedelta(days=13))
+    df_giorni = load_oee_rollup("giorno", dal, ultimo)
+    kpi = summarize_oee(df_giorni)
+    col_o1, col_o2, col_o3, col_o4 = st.columns(4)
+    col_o1.metric("OEE (14 giorni)", f"{kpi['oee']:.1%}")
+    col_o2.metric("Availability", f"{kpi['availability']:.1%}")
+    col_o3.metric("Performance", f"{kpi['performance']:.1%}")
+    col_o4.metric("Quality", f"{kpi['quality']:.1%}")
+    st.caption(f"Dati dal {primo:%d/%m/%Y} al {ultimo:%d/%m/%Y} · {kpi['eventi']:,} eventi negli ultimi 14 giorni".replace(",", "."))
+
+    st.dataframe(
+        df_giorni[["periodo", "codice", "eventi", "planned_s", "run_s", "good_count", "total_count",
+                   "availability", "performance", "quality", "oee", "perdita_euro"]]
+        .sort_values(["periodo", "codice"], ascending=[False, True])
+        .style.format({
+            "periodo": "{:%d/%m/%Y}", "planned_s": "{:,.0f}", "run_s": "{:,.0f}",
+            "availability": "{:.1%}", "performance": "{:.1%}", "quality": "{:.1%}", "oee": "{:.1%}",
+            "perdita_euro": "{:,.0f} €",
+        }),
+        width="stretch",
+    )
+
+    if st.button("🔄 Ricalcola rollup dagli eventi", key="oee_rebuild"):
+        r = rebuild_oee_rollups()
+        st.success(f"Rollup ricalcolati dal {r['dal_giorno']} in {r['elapsed_s']:.2f}s.")
 
 PAGES = {
     "🏠 Home": {
@@ -9596,6 +10102,10 @@ PAGES = {
         "People & Reparti": page_people_departments,
         "Capacità People": page_capacity_people,
     },
+    "🛠️ Amministrazione": {
+        "Performance": page_performance,
+        "Dati OEE": page_oee_data,
+    },
 }
 
 # =========================
@@ -9625,6 +10135,43 @@ def render_breadcrumb(section: str, page: str):
     st.markdown(breadcrumb_html, unsafe_allow_html=True)
 
 
+SEARCH_ENTITY_LABELS = {
+    "client": "🏢 Cliente",
+    "opportunity": "💼 Opportunità",
+    "crmactivity": "📞 Attività",
+    "crmtask": "✅ Task",
+}
+
+
+def render_global_search(text: str):
+    """Risultati della ricerca globale, sopra la pagina corrente."""
+    entities = st.sidebar.multiselect(
+        "Cerca in",
+        list(SEARCH_ENTITY_LABELS),
+        format_func=SEARCH_ENTITY_LABELS.get,
+        key="global_search_entities",
+    )
+    t0 = time.perf_counter()
+    try:
+        hits = global_search(text, limit=30, entities=entities or None)
+    except Exception as e:
+        st.error(f"Ricerca non disponibile: {e}")
+        return
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+
+    with st.expander(f"🔎 Risultati per “{text.strip()}” ({len(hits)})", expanded=True):
+        st.caption(f"Ricerca in {elapsed_ms:.0f} ms")
+        if not hits:
+            st.info("Nessun risultato.")
+        for h in hits:
+            st.markdown(
+                f"**{SEARCH_ENTITY_LABELS.get(h['entity'], h['entity'])} #{h['id']} – {h['title'] or '(senza titolo)'}**  \n"
+                f"{h['snippet']}"
+            )
+            if h["context"]:
+                st.caption(h["context"])
+
+
 def main():
     # 👉 chiamate subito all'inizio
     inject_google_ads_tag()
@@ -9657,7 +10204,8 @@ def main():
         st.session_state["role"] = "admin"
         st.session_state["username"] = "DeepLink"
 
-        page_crm_sales()
+        with perf_monitor.track("page", "CRM & Vendite (deep link)"):
+            page_crm_sales()
         st.stop()
 
     # ========== SE NON LOGGATO ==========
@@ -9714,6 +10262,11 @@ def main():
 
     st.sidebar.markdown("---")
 
+    # Ricerca globale (FTS5 su clienti, opportunità, attività, task)
+    search_text = st.sidebar.text_input("🔎 Cerca", key="global_search", placeholder="cliente, nota, attività...")
+    if search_text.strip():
+        render_global_search(search_text)
+
     # Menu gerarchico per flussi di lavoro (solo per loggati)
     available_sections = list(PAGES.keys())
 
@@ -9751,7 +10304,8 @@ def main():
             debug=True,  # solo per test, poi toglilo
         )
 
-        page_func()
+        with perf_monitor.track("page", selected_page, section=section):
+            page_func()
     
     # Logo in fondo (per loggati)
     st.sidebar.markdown("---")
@@ -0,0 +1,368 @@
+# load_test.py
+"""
+Load test multi-utente della Control Tower con streamlit.testing.v1.AppTest.
+
+Simula N sessioni concorrenti che fanno login, navigano tra le pagine e
+inviano form reali (nuovo cliente, nuova campagna) sullo stesso file SQLite.
+
+Ogni sessione gira in un processo separato: AppTest imposta e azzera a ogni
+run lo stato globale di Streamlit (Runtime, secrets), quindi più AppTest
+nello stesso processo si pestano i piedi. La contesa sul file SQLite
+(lock in scrittura) resta identica a quella di produzione.
+
+Servizi esterni sostituiti da stub locali (gira offline):
+- HTTP (GA4, Facebook, Telegram) -> risposta 200 finta, nessuna rete
+- SMTP (mini-report OEE)         -> server finto che accetta e scarta
+- secrets                       -> valori fittizi
+
+Report: distribuzione latenze dei rerun (p50/p95/max) per azione e
+conteggio errori, con evidenza dei "database is locked".
+
+Uso:
+    python load_test.py --sessions 8 --iterations 20
+    python load_test.py --sessions 16 --iterations 50 --scale 10 --json data/load_10x.json
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent
+APP_SCRIPT = BASE_DIR / "forgialean_ai_control_tower.py"
+
+LOGIN_USER = "Marian Dutu"
+LOGIN_PASSWORD = "mariand"
+
+STUB_SECRETS = {
+    "tracking": {
+        "GA4_MEASUREMENT_ID": "G-LOADTEST",
+        "GA4_API_SECRET": "stub",
+        "GA4_CLIENT_ID_FALLBACK": "load-test",
+        "FB_PIXEL_ID": "0",
+        "FB_ACCESS_TOKEN": "stub",
+        "FB_EVENT_SOURCE_URL": "http://localhost/",
+        "TELEGRAM_BOT_TOKEN": "stub",
+        "TELEGRAM_CHAT_ID": "0",
+    },
+    "email": {
+        "SMTP_SERVER": "localhost",
+        "SMTP_PORT": "2525",
+        "SMTP_USER": "stub",
+        "SMTP_PASSWORD": "stub",
+        "FROM_ADDRESS": "loadtest@localhost",
+    },
+}
+
+# (sezione, pagina) visitate dalle sessioni simulate, con peso
+NAVIGATION = [
+    (("🏠 Home", "Overview"), 5),
+    (("📊 Gestionale Operativo", "Clienti"), 4),
+    (("📊 Gestionale Operativo", "CRM & Vendite"), 6),
+    (("📊 Gestionale Operativo", "Funnel CRM & campagne"), 2),
+    (("📊 Gestionale Operativo", "Operations / Commesse"), 2),
+    (("📊 Gestionale Operativo", "Campagne marketing"), 1),
+    (("💰 Finanza & Pagamenti", "Finanza / Fatture"), 3),
+    (("💰 Finanza & Pagamenti", "Finanza / Dashboard"), 3),
+    (("💰 Finanza & Pagamenti", "Marketing ROI"), 2),
+    (("📋 Checklist Mensile", "Bilancio gestionale"), 2),
+    (("📋 Checklist Mensile", "Cashflow proiettato"), 2),
+    (("👥 People & Organizzazione", "Capacità People"), 1),
+]
+
+# azioni con invio form, con peso (il resto è navigazione)
+FORM_ACTIONS = [("form_new_client", 2), ("form_new_campaign", 1)]
+
+
+# ========================
+# STUB SERVIZI ESTERNI
+# ========================
+
+class _StubResponse:
+    status_code = 200
+    ok = True
+    text = "{}"
+    content = b"{}"
+
+    def json(self):
+        return {"ok": True}
+
+    def raise_for_status(self):
+        return None
+
+
+class _StubSMTP:
+    """Sostituto di smtplib.SMTP: accetta tutto, non invia nulla."""
+    sent = 0
+    _lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def starttls(self, *args, **kwargs):
+        return (220, b"ok")
+
+    def login(self, *args, **kwargs):
+        return (235, b"ok")
+
+    def send_message(self, *args, **kwargs):
+        with _StubSMTP._lock:
+            _StubSMTP.sent += 1
+        return {}
+
+    sendmail = send_message
+
+    def quit(self):
+        return (221, b"bye")
+
+
+def install_stubs() -> None:
+    """Sostituisce rete, SMTP e secrets nel processo corrente."""
+    import smtplib
+    import requests
+    import streamlit as st
+    from streamlit.runtime.secrets import Secrets
+
+    def _stub_request(self, method, url, *args, **kwargs):
+        return _StubResponse()
+
+    requests.sessions.Session.request = _stub_request
+    smtplib.SMTP = _StubSMTP
+
+    # secrets fittizi globali: nessun token reale nel processo di test
+    stub = Secrets()
+    stub._secrets = STUB_SECRETS
+    st.secrets = stub
+
+
+# ========================
+# SESSIONE SIMULATA
+# ========================
+
+def _by_label(widgets, label):
+    for w in widgets:
+        if w.label == label:
+            return w
+    raise LookupError(f"widget '{label}' non trovato")
+
+
+def _errors(at) -> list[str]:
+    return [str(e.value) for e in at.exception] + [str(e.value) for e in at.error]
+
+
+class SimulatedUser:
+    def __init__(self, user_id: int, rng: random.Random, timeout: float, stats):
+        from streamlit.testing.v1 import AppTest
+
+        self.user_id = user_id
+        self.rng = rng
+        self.timeout = timeout
+        self.stats = stats
+        self.at = AppTest.from_file(str(APP_SCRIPT), default_timeout=timeout)
+
+    def _timed_run(self, action: str, fn) -> None:
+        t0 = time.perf_counter()
+        error = None
+        try:
+            fn()
+            errs = _errors(self.at)
+            if errs:
+                error = errs[0]
+        except Exception as e:  # timeout AppTest, widget mancante, ecc.
+            error = f"{type(e).__name__}: {e}"
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+        self.stats["latency"].setdefault(action, []).append(elapsed_ms)
+        if error:
+            key = "locked" if "locked" in error.lower() else "other"
+            self.stats["errors"][key].append({"user": self.user_id, "action": action, "error": error[:300]})
+
+    def login(self) -> None:
+        def _do():
+            self.at.run()
+            self.at.text_input(key="login_username").input(LOGIN_USER)
+            self.at.text_input(key="login_password").input(LOGIN_PASSWORD)
+            self.at.button(key="login_button").click().run()
+        self._timed_run("login", _do)
+
+    def navigate(self, section: str, page: str) -> None:
+        def _do():
+            self.at.sidebar.radio[0].set_value(section).run()
+            self.at.sidebar.selectbox[0].select(page).run()
+        self._timed_run(f"page:{page}", _do)
+
+    def form_new_client(self) -> None:
+        self.navigate("📊 Gestionale Operativo", "Clienti")
+        suffix = f"{self.user_id}-{self.rng.randint(0, 10**9)}"
+
+        def _do():
+            _by_label(self.at.text_input, "Ragione sociale").input(f"LoadTest {suffix} S.r.l.")
+            _by_label(self.at.text_input, "Settore").input("Load test")
+            _by_label(self.at.button, "Salva cliente").click().run()
+        self._timed_run("form_new_client", _do)
+
+    def form_new_campaign(self) -> None:
+        self.navigate("📊 Gestionale Operativo", "Campagne marketing")
+        suffix = f"{self.user_id}-{self.rng.randint(0, 10**9)}"
+
+        def _do():
+            _by_label(self.at.text_input, "Nome campagna").input(f"LoadTest {suffix}")
+            _by_label(self.at.button, "Salva campagna").click().run()
+        self._timed_run("form_new_campaign", _do)
+
+    def step(self) -> None:
+        if self.rng.random() < 0.2:
+            names, weights = zip(*FORM_ACTIONS)
+            getattr(self, self.rng.choices(names, weights)[0])()
+        else:
+            targets, weights = zip(*NAVIGATION)
+            section, page = self.rng.choices(targets, weights)[0]
+            self.navigate(section, page)
+
+
+# ========================
+# RUNNER
+# ========================
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def summarize(stats: dict) -> list[dict]:
+    rows = []
+    for action, values in sorted(stats["latency"].items()):
+        rows.append({
+            "action": action,
+            "count": len(values),
+            "p50_ms": statistics.median(values),
+            "p95_ms": _percentile(values, 0.95),
+            "max_ms": max(values),
+        })
+    return rows
+
+
+def _session_worker(user_id, db_path, iterations, seed, timeout, think_time, barrier, out_queue):
+    """Processo di una singola sessione utente: stub, login, N azioni."""
+    os.environ["FORGIALEAN_DB_PATH"] = str(db_path)
+    install_stubs()
+
+    stats = {"latency": {}, "errors": {"locked": [], "other": []}, "emails": 0}
+    rng = random.Random(seed * 1000 + user_id)
+    try:
+        user = SimulatedUser(user_id, rng, timeout, stats)
+        barrier.wait()
+        user.login()
+        for _ in range(iterations):
+            user.step()
+            if think_time:
+                time.sleep(rng.uniform(0, think_time))
+    except Exception as e:
+        stats["errors"]["other"].append({"user": user_id, "action": "worker", "error": f"{type(e).__name__}: {e}"})
+    stats["emails"] = _StubSMTP.sent
+    out_queue.put(stats)
+
+
+def run_load_test(db_path: Path, sessions: int, iterations: int, seed: int, timeout: float, think_time: float) -> dict:
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(sessions)
+    out_queue = ctx.Queue()
+
+    t0 = time.perf_counter()
+    procs = [
+        ctx.Process(
+            target=_session_worker,
+            args=(i, db_path, iterations, seed, timeout, think_time, barrier, out_queue),
+            name=f"user-{i}",
+        )
+        for i in range(sessions)
+    ]
+    for p in procs:
+        p.start()
+    partials = [out_queue.get() for _ in procs]
+    for p in procs:
+        p.join()
+    wall_s = time.perf_counter() - t0
+
+    stats = {"latency": defaultdict(list), "errors": defaultdict(list), "emails": 0}
+    for part in partials:
+        for action, values in part["latency"].items():
+            stats["latency"][action].extend(values)
+        for key, errs in part["errors"].items():
+            stats["errors"][key].extend(errs)
+        stats["emails"] += part["emails"]
+
+    return {"stats": stats, "wall_s": wall_s}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test multi-sessione (AppTest) ForgiaLean Control Tower")
+    parser.add_argument("--sessions", type=int, default=4, help="sessioni utente concorrenti")
+    parser.add_argument("--iterations", type=int, default=10, help="azioni per sessione dopo il login")
+    parser.add_argument("--scale", type=int, default=1, help="scala DB sintetico (vedi synthetic_data.py)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", type=Path, default=None, help="DB da usare (default data/forgialean_bench_<scale>x.db)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="timeout per singolo rerun (s)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="pausa massima casuale tra azioni (s)")
+    parser.add_argument("--json", type=Path, default=None, help="salva il report completo in JSON")
+    args = parser.parse_args()
+
+    db_path = args.db or BASE_DIR / "data" / f"forgialean_bench_{args.scale}x.db"
+
+    # Va impostato PRIMA di importare db (anche indirettamente tramite l'app)
+    os.environ["FORGIALEAN_DB_PATH"] = str(db_path)
+
+    import synthetic_data
+
+    if not db_path.exists():
+        print(f"🔧 Genero DB sintetico {args.scale}x in {db_path} ...")
+        synthetic_data.generate(db_path, scale=args.scale, seed=args.seed)
+
+    print(f"🚦 Load test: {args.sessions} sessioni × {args.iterations} azioni su {db_path}")
+    result = run_load_test(db_path, args.sessions, args.iterations, args.seed, args.timeout, args.think_time)
+    stats = result["stats"]
+    rows = summarize(stats)
+
+    print(f"\nDurata totale: {result['wall_s']:.1f}s")
+    print(f"{'azione':<40} {'n':>5} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10}")
+    for r in rows:
+        print(f"{r['action']:<40} {r['count']:>5} {r['p50_ms']:>10.0f} {r['p95_ms']:>10.0f} {r['max_ms']:>10.0f}")
+
+    n_locked = len(stats["errors"]["locked"])
+    n_other = len(stats["errors"]["other"])
+    print(f"\nErrori 'database is locked': {n_locked}")
+    print(f"Altri errori: {n_other}")
+    for err in stats["errors"]["other"][:5]:
+        print(f"  - [user {err['user']}] {err['action']}: {err['error']}")
+    print(f"Email intercettate dallo stub SMTP: {stats['emails']}")
+
+    if args.json:
+        args.json.parent.mkdir(parents=True, exist_ok=True)
+        args.json.write_text(json.dumps({
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "sessions": args.sessions,
+            "iterations": args.iterations,
+            "db": str(db_path),
+            "wall_s": result["wall_s"],
+            "summary": rows,
+            "latency_ms": stats["latency"],
+            "errors": stats["errors"],
+        }, indent=2, default=str))
+        print(f"✅ Report salvato in {args.json}")
+
+
+if __name__ == "__main__":
+    main()
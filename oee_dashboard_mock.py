@@ -2,8 +2,15 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import altair as alt
+from datetime import timedelta
 from pathlib import Path
 
+from sqlalchemy.exc import OperationalError
+
+from config import CACHE_TTL, OEE_TURNI_INIZIO
+from oee_engine import improvement_sweep
+from oee_store import load_downtime_pareto, load_oee_lines, load_oee_rollup, oee_data_range, summarize_oee
+
 # ----------------- CONFIGURAZIONE PAGINA -----------------
 st.set_page_config(
     page_title="Dashboard OEE - ForgiaLean",
@@ -50,12 +57,45 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
+# ----------------- DATI OEE REALI (rollup, vedi oee_store.py) -----------------
+@st.cache_data(ttl=CACHE_TTL["volatile"], show_spinner=False)
+def carica_linee_oee():
+    """Linee e ultimo giorno con dati; (vuoto, None) se il DB non ha ancora dati OEE."""
+    try:
+        _, ultimo = oee_data_range()
+    except OperationalError:  # tabelle OEE non ancora create
+        return pd.DataFrame(), None
+    return (load_oee_lines() if ultimo else pd.DataFrame()), ultimo
+
+
+@st.cache_data(ttl=CACHE_TTL["volatile"], show_spinner=False)
+def carica_rollup_oee(grain, dal, al, line_ids):
+    return load_oee_rollup(grain, dal, al, list(line_ids))
+
+
+@st.cache_data(ttl=CACHE_TTL["volatile"], show_spinner=False)
+def carica_pareto_oee(dal, al, line_ids):
+    return load_downtime_pareto(dal, al, list(line_ids))
+
+
+linee_oee, ultimo_giorno = carica_linee_oee()
+dati_reali = ultimo_giorno is not None
+
 # ----------------- SIDEBAR FILTRI -----------------
 st.sidebar.title("Filtri")
 
-linea = st.sidebar.selectbox("Linea", ["Linea 1", "Linea 2", "Linea 3"])
-prodotto = st.sidebar.selectbox("Prodotto", ["Articolo A", "Articolo B", "Articolo C"])
+if dati_reali:
+    etichette_linee = {"Tutte le linee": ()}
+    for r in linee_oee.itertuples():
+        etichette_linee[r.codice if r.nome == r.codice else f"{r.codice} · {r.nome}"] = (int(r.line_id),)
+    linea = st.sidebar.selectbox("Linea", list(etichette_linee))
+    line_ids = etichette_linee[linea]
+else:
+    linea = st.sidebar.selectbox("Linea", ["Linea 1", "Linea 2", "Linea 3"])
+    prodotto = st.sidebar.selectbox("Prodotto", ["Articolo A", "Articolo B", "Articolo C"])
 periodo = st.sidebar.selectbox("Periodo", ["Ultima settimana", "Ultimo mese", "Ultimi 3 mesi"])
+if dati_reali:
+    grana_trend = st.sidebar.radio("Andamento per", ["turno", "giorno", "settimana"], index=1, format_func=str.capitalize)
 
 miglioramento = st.sidebar.slider(
     "Miglioramento OEE (%)",
@@ -66,44 +106,69 @@ miglioramento = st.sidebar.slider(
 )
 
 st.sidebar.markdown("---")
+valore_linea = 0.0
+if dati_reali and line_ids:
+    valore_linea = float(linee_oee.loc[linee_oee["line_id"] == line_ids[0], "valore_orario"].iloc[0] or 0.0)
 costo_ora_linea = st.sidebar.number_input(
     "Margine medio per ora di linea (€)",
     min_value=100.0,
     max_value=2000.0,
-    value=600.0,
+    value=valore_linea if 100.0 <= valore_linea <= 2000.0 else 600.0,
     step=50.0,
 )
 st.sidebar.caption("Adatta a margine/linea della tua realtà.")
 
 # ----------------- PARAMETRI DI BASE -----------------
-ore_turno = 8
-turni_per_giorno = 3
-giorni_per_settimana = 5
-
-ore_periodo = {
-    "Ultima settimana": giorni_per_settimana * turni_per_giorno * ore_turno,
-    "Ultimo mese": 4 * giorni_per_settimana * turni_per_giorno * ore_turno,
-    "Ultimi 3 mesi": 12 * giorni_per_settimana * turni_per_giorno * ore_turno,
-}[periodo]
-
-np.random.seed(42)
-base_oee = 0.60 + np.random.rand() * 0.05
-target_oee = min(base_oee * (1 + miglioramento / 100), 0.85)
-
-base_A = 0.78
-base_P = 0.82
-base_Q = 0.97
-
-factor_A = 1 + (miglioramento * 0.5) / 100
-factor_P = 1 + (miglioramento * 0.4) / 100
-factor_Q = 1 + (miglioramento * 0.1) / 100
-
-after_A = min(base_A * factor_A, 0.95)
-after_P = min(base_P * factor_P, 0.97)
-after_Q = min(base_Q * factor_Q, 0.995)
-
-oee_after_raw = after_A * after_P * after_Q
-after_oee = min(max(oee_after_raw, target_oee - 0.02), 0.85)
+if dati_reali:
+    # periodo che termina con l'ultimo giorno caricato; solo rollup giornalieri, mai eventi grezzi
+    giorni_periodo = {"Ultima settimana": 7, "Ultimo mese": 30, "Ultimi 3 mesi": 91}[periodo]
+    data_dal = ultimo_giorno - timedelta(days=giorni_periodo - 1)
+    rollup_giorni = carica_rollup_oee("giorno", data_dal, ultimo_giorno, line_ids)
+    if rollup_giorni.empty:
+        st.warning("Nessun evento macchina per la linea nel periodo selezionato.")
+        st.stop()
+    kpi = summarize_oee(rollup_giorni)
+
+    ore_periodo = kpi["ore_pianificate"]
+    base_oee = kpi["oee"]
+    base_A = kpi["availability"]
+    base_P = kpi["performance"]
+    base_Q = kpi["quality"]
+else:
+    st.info(
+        "Dati dimostrativi: nessun evento macchina caricato. Importa gli eventi di linea "
+        "con `python oee_store.py import` o dalla pagina Dati OEE del Control Tower."
+    )
+    ore_turno = 8
+    turni_per_giorno = 3
+    giorni_per_settimana = 5
+
+    ore_periodo = {
+        "Ultima settimana": giorni_per_settimana * turni_per_giorno * ore_turno,
+        "Ultimo mese": 4 * giorni_per_settimana * turni_per_giorno * ore_turno,
+        "Ultimi 3 mesi": 12 * giorni_per_settimana * turni_per_giorno * ore_turno,
+    }[periodo]
+
+    np.random.seed(42)
+    base_oee = 0.60 + np.random.rand() * 0.05
+
+    base_A = 0.78
+    base_P = 0.82
+    base_Q = 0.97
+
+# Scenario scelto e superficie completa (miglioramento 10–30% × margine orario) in un solo calcolo
+sweep_miglioramenti = np.arange(10, 31)
+sweep_costi = np.arange(100.0, 2001.0, 50.0)
+sweep = improvement_sweep(
+    base_A, base_P, base_Q, ore_periodo,
+    np.append(sweep_miglioramenti, miglioramento)[:, None],
+    np.append(sweep_costi, costo_ora_linea)[None, :],
+    base_oee=base_oee,
+)
+after_A = float(sweep["after_a"][-1, 0])
+after_P = float(sweep["after_p"][-1, 0])
+after_Q = float(sweep["after_q"][-1, 0])
+after_oee = float(sweep["after_oee"][-1, 0])
 
 df_apq = pd.DataFrame({
     "Scenario": ["Prima", "Dopo"],
@@ -114,23 +179,22 @@ df_apq = pd.DataFrame({
 })
 
 # ----------------- MODELLO ECONOMICO -----------------
-ore_buone_prima = ore_periodo * base_oee
-ore_buone_dopo = ore_periodo * after_oee
-delta_ore_buone = ore_buone_dopo - ore_buone_prima
+delta_ore_buone = float(sweep["delta_ore"][-1, 0])
 
 capacita_persa_prima = ore_periodo * (1 - base_oee)
 
-impatto_euro = delta_ore_buone * costo_ora_linea
+impatto_euro = float(sweep["impatto_euro"][-1, -1])
 
-if periodo == "Ultima settimana":
-    impatto_annuo = impatto_euro * 52
-elif periodo == "Ultimo mese":
-    impatto_annuo = impatto_euro * 12
-else:
-    impatto_annuo = impatto_euro * 4
+periodi_anno = {"Ultima settimana": 52, "Ultimo mese": 12, "Ultimi 3 mesi": 4}[periodo]
+impatto_annuo = impatto_euro * periodi_anno
 
-categories = ["Setup", "Guasti", "Microfermi", "Attese materiali"]
-downtime_before = np.array([120, 180, 90, 60])
+if dati_reali:
+    df_causali = carica_pareto_oee(data_dal, ultimo_giorno, line_ids)
+    categories = df_causali["Categoria"].tolist() or ["Nessun fermo"]
+    downtime_before = df_causali["Minuti"].round().astype(int).to_numpy() if len(df_causali) else np.array([0])
+else:
+    categories = ["Setup", "Guasti", "Microfermi", "Attese materiali"]
+    downtime_before = np.array([120, 180, 90, 60])
 downtime_after = (downtime_before * (1 - miglioramento / 100)).astype(int)
 
 df_downtime = pd.DataFrame({
@@ -211,15 +275,50 @@ col4.metric(
 
 st.markdown("</div>", unsafe_allow_html=True)
 
+if dati_reali:
+    eventi, buoni, totali = (f"{kpi[k]:,}".replace(",", ".") for k in ("eventi", "pezzi_buoni", "pezzi_totali"))
+    contesto = (
+        f"Linea: {linea} · Periodo: {data_dal:%d/%m/%Y} – {ultimo_giorno:%d/%m/%Y} · "
+        f"{eventi} eventi macchina, {buoni} pezzi buoni su {totali}"
+    )
+else:
+    contesto = f"Linea: {linea} · Prodotto: {prodotto} · Periodo: {periodo}"
 st.markdown(
-    f"<p style='color:{TEXT_MUTED}; font-size:13px; margin-top:4px;'>"
-    f"Linea: {linea} · Prodotto: {prodotto} · Periodo: {periodo}"
-    f"</p>",
+    f"<p style='color:{TEXT_MUTED}; font-size:13px; margin-top:4px;'>{contesto}</p>",
     unsafe_allow_html=True,
 )
 
 st.markdown("---")
 
+# ----------------- ANDAMENTO OEE (solo dati reali) -----------------
+if dati_reali:
+    st.subheader("Andamento OEE")
+
+    df_trend = carica_rollup_oee(grana_trend, data_dal, ultimo_giorno, line_ids).copy()
+    if grana_trend == "turno":
+        inizio_turni = sorted(OEE_TURNI_INIZIO)
+        df_trend["periodo"] = df_trend["periodo"] + pd.to_timedelta([inizio_turni[t - 1] for t in df_trend["turno"]], unit="h")
+    df_trend["OEE"] = df_trend["oee"] * 100
+
+    trend_chart = (
+        alt.Chart(df_trend)
+        .mark_line(point=grana_trend != "turno")
+        .encode(
+            x=alt.X("periodo:T", title=""),
+            y=alt.Y("OEE:Q", title="OEE (%)", scale=alt.Scale(domain=[0, 100])),
+            color=alt.Color("codice:N", title="Linea"),
+            tooltip=[
+                alt.Tooltip("codice:N", title="Linea"),
+                alt.Tooltip("periodo:T", title="Periodo", format="%d/%m/%Y %H:%M" if grana_trend == "turno" else "%d/%m/%Y"),
+                alt.Tooltip("OEE:Q", format=".1f"),
+                alt.Tooltip("eventi:Q", title="Eventi"),
+            ],
+        )
+        .properties(height=260)
+    )
+    st.altair_chart(trend_chart, use_container_width=True)
+    st.markdown("---")
+
 # ----------------- RIGA 1: OEE/APQ + FERMATE -----------------
 left_col, right_col = st.columns([2, 1])
 
@@ -458,4 +557,40 @@ styled_df = (
     df_apq.set_index("Scenario")[["Availability", "Performance", "Quality", "OEE"]]
     .style.format("{:.1%}")
 )
-st.dataframe(styled_df, use_container_width=True)
\ No newline at end of file
+st.dataframe(styled_df, use_container_width=True)
+
+# --- Sensibilità: miglioramento × margine orario ---
+st.markdown("---")
+st.subheader("Sensibilità: valore annuo recuperato")
+st.caption(
+    "Ogni cella è lo scenario completo (A, P, Q e OEE dopo l'intervento) per un miglioramento "
+    "e un margine orario: tutta la superficie è calcolata in un'unica operazione NumPy."
+)
+
+df_surface = pd.DataFrame(
+    sweep["impatto_euro"][:-1, :-1] * periodi_anno,
+    index=pd.Index(sweep_miglioramenti, name="Miglioramento"),
+    columns=pd.Index(sweep_costi, name="Margine"),
+).stack().rename("Impatto").reset_index()
+
+surface_chart = (
+    alt.Chart(df_surface)
+    .mark_rect()
+    .encode(
+        x=alt.X("Margine:O", title="Margine medio per ora di linea (€)", axis=alt.Axis(labelAngle=-45, values=list(sweep_costi[::4]))),
+        y=alt.Y("Miglioramento:O", title="Miglioramento OEE (%)", sort="descending"),
+        color=alt.Color("Impatto:Q", title="€/anno", scale=alt.Scale(scheme="blues")),
+        tooltip=[
+            alt.Tooltip("Miglioramento:O", title="Miglioramento (%)"),
+            alt.Tooltip("Margine:O", title="Margine (€/h)"),
+            alt.Tooltip("Impatto:Q", title="€/anno", format=",.0f"),
+        ],
+    )
+    .properties(height=380)
+)
+selezione = (
+    alt.Chart(pd.DataFrame({"Miglioramento": [miglioramento], "Margine": [min(sweep_costi, key=lambda c: abs(c - costo_ora_linea))]}))
+    .mark_rect(fill=None, stroke=BEFORE_COLOR, strokeWidth=2)
+    .encode(x="Margine:O", y=alt.Y("Miglioramento:O", sort="descending"))
+)
+st.altair_chart(surface_chart + selezione, use_container_width=True)
@@ -0,0 +1,197 @@
+# oee_engine.py
+"""
+Motore OEE vettoriale (NumPy) per calcolatori, lead magnet e dashboard OEE.
+
+Tutte le funzioni accettano scalari o array di qualunque forma
+(es. linee × turni × giorni) e usano il broadcasting NumPy:
+
+- compute_oee(...)         Availability / Performance / Quality / OEE,
+                           ore buone, ore perse vs target, perdita in €
+- classify_fascia(oee)     critica (< 60%) / intermedia (< 80%) / alta
+- aggregate_oee(...)       OEE aggregato su uno o più assi, pesato sul tempo
+                           (non la media degli OEE)
+- improvement_sweep(...)   scenario "prima/dopo" della dashboard per ogni
+                           combinazione di miglioramento % e costo orario:
+                           miglioramenti (m, 1) × costi (1, c) -> superficie (m, c)
+
+Uso:
+    python oee_engine.py bench --lines 20 --shifts 3 --days 365
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+# OEE di riferimento world class: la perdita si misura come distanza da qui
+OEE_TARGET = 0.85
+
+# Soglie fasce del mini-report (OEE < 60% critica, < 80% intermedia)
+SOGLIE_FASCIA = (0.60, 0.80)
+
+# Modello miglioramento della dashboard: quota del miglioramento % che va su A, P, Q
+PESI_MIGLIORAMENTO_APQ = (0.5, 0.4, 0.1)
+# ...e valori massimi realistici dopo l'intervento
+MAX_APQ_DOPO = (0.95, 0.97, 0.995)
+OEE_MAX_DOPO = 0.85
+
+
+# ========================
+# CALCOLO OEE
+# ========================
+
+def compute_oee(ore_pianificate, ore_fermi, velocita_pct, scarti_pct, valore_orario=0.0, oee_target: float = OEE_TARGET) -> dict:
+    """
+    A = 1 - fermi/ore, P = velocità reale/nominale, Q = 1 - scarti.
+    Ore pianificate <= 0 danno OEE 0 e nessuna perdita. Ritorna array con
+    la forma del broadcasting degli input (0-d per input scalari).
+    """
+    ore = np.asarray(ore_pianificate, dtype=float)
+    fermi = np.asarray(ore_fermi, dtype=float)
+    ore_pos = np.maximum(ore, 0.0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        availability = np.where(ore > 0, np.maximum(0.0, 1.0 - fermi / np.where(ore > 0, ore, 1.0)), 0.0)
+    performance = np.asarray(velocita_pct, dtype=float) / 100.0
+    quality = np.maximum(0.0, 1.0 - np.asarray(scarti_pct, dtype=float) / 100.0)
+
+    availability, performance, quality, ore_pos = np.broadcast_arrays(availability, performance, quality, ore_pos)
+    oee = availability * performance * quality
+    ore_perse = np.maximum(0.0, oee_target - oee) * ore_pos
+    return {
+        "availability": availability,
+        "performance": performance,
+        "quality": quality,
+        "oee": oee,
+        "ore_buone": oee * ore_pos,
+        "ore_perse": ore_perse,
+        "perdita_euro": ore_perse * np.asarray(valore_orario, dtype=float),
+    }
+
+
+def classify_fascia(oee):
+    """Fascia del mini-report per ogni valore di OEE (frazione 0-1)."""
+    oee = np.asarray(oee, dtype=float)
+    return np.select([oee < SOGLIE_FASCIA[0], oee < SOGLIE_FASCIA[1]], ["critica", "intermedia"], default="alta")
+
+
+def aggregate_oee(ore_pianificate, availability, performance, quality, axis=None) -> dict:
+    """
+    OEE aggregato sugli assi indicati, pesato sul tempo:
+    A = tempo in marcia / pianificato, P = tempo netto / in marcia,
+    Q = tempo buono / netto, OEE = tempo buono / pianificato.
+    """
+    ore = np.asarray(ore_pianificate, dtype=float)
+    marcia = ore * availability
+    netto = marcia * performance
+    buono = netto * quality
+    tot = {k: np.sum(v, axis=axis) for k, v in (("ore", ore), ("marcia", marcia), ("netto", netto), ("buono", buono))}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "ore_pianificate": tot["ore"],
+            "availability": np.where(tot["ore"] > 0, tot["marcia"] / tot["ore"], 0.0),
+            "performance": np.where(tot["marcia"] > 0, tot["netto"] / tot["marcia"], 0.0),
+            "quality": np.where(tot["netto"] > 0, tot["buono"] / tot["netto"], 0.0),
+            "oee": np.where(tot["ore"] > 0, tot["buono"] / tot["ore"], 0.0),
+            "ore_buone": tot["buono"],
+        }
+
+
+# ========================
+# SCENARI DI MIGLIORAMENTO
+# ========================
+
+def improvement_sweep(base_a, base_p, base_q, ore_periodo, miglioramento_pct, costo_ora, base_oee=None) -> dict:
+    """
+    Scenario dopo un miglioramento di miglioramento_pct %: A, P, Q crescono
+    secondo PESI_MIGLIORAMENTO_APQ (con i tetti MAX_APQ_DOPO), l'OEE dopo
+    resta tra target - 2 punti e OEE_MAX_DOPO. base_oee di default è A·P·Q.
+
+    Tutti gli argomenti fanno broadcasting: una sola chiamata con
+    miglioramento_pct[:, None] e costo_ora[None, :] dà l'intera superficie.
+    """
+    base_a, base_p, base_q = (np.asarray(x, dtype=float) for x in (base_a, base_p, base_q))
+    base_oee = base_a * base_p * base_q if base_oee is None else np.asarray(base_oee, dtype=float)
+    m = np.asarray(miglioramento_pct, dtype=float) / 100.0
+
+    target_oee = np.minimum(base_oee * (1.0 + m), OEE_MAX_DOPO)
+    after_a = np.minimum(base_a * (1.0 + m * PESI_MIGLIORAMENTO_APQ[0]), MAX_APQ_DOPO[0])
+    after_p = np.minimum(base_p * (1.0 + m * PESI_MIGLIORAMENTO_APQ[1]), MAX_APQ_DOPO[1])
+    after_q = np.minimum(base_q * (1.0 + m * PESI_MIGLIORAMENTO_APQ[2]), MAX_APQ_DOPO[2])
+    after_oee = np.minimum(np.maximum(after_a * after_p * after_q, target_oee - 0.02), OEE_MAX_DOPO)
+
+    delta_ore = np.asarray(ore_periodo, dtype=float) * (after_oee - base_oee)
+    return {
+        "base_oee": base_oee,
+        "after_a": after_a,
+        "after_p": after_p,
+        "after_q": after_q,
+        "after_oee": after_oee,
+        "delta_ore": delta_ore,
+        "impatto_euro": delta_ore * np.asarray(costo_ora, dtype=float),
+    }
+
+
+# ========================
+# BENCHMARK
+# ========================
+
+def run_benchmark(lines: int = 20, shifts: int = 3, days: int = 365) -> dict:
+    rng = np.random.default_rng(42)
+    shape = (lines, shifts, days)
+    ore = np.full(shape, 8.0)
+    fermi = rng.uniform(0, 3, shape)
+    velocita = rng.uniform(60, 100, shape)
+    scarti = rng.uniform(0, 10, shape)
+    valore = rng.choice([150.0, 300.0, 600.0], size=(lines, 1, 1))
+
+    # prima: un turno alla volta con aritmetica scalare (come calcola_oee_e_perdita)
+    t0 = time.perf_counter()
+    perdita_loop = 0.0
+    for idx in np.ndindex(shape):
+        a = max(0.0, 1.0 - fermi[idx] / ore[idx])
+        oee = a * (velocita[idx] / 100.0) * max(0.0, 1.0 - scarti[idx] / 100.0)
+        perdita_loop += max(0.0, OEE_TARGET - oee) * ore[idx] * valore[idx[0], 0, 0]
+    loop_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    r = compute_oee(ore, fermi, velocita, scarti, valore)
+    per_linea = aggregate_oee(ore, r["availability"], r["performance"], r["quality"], axis=(1, 2))
+    vec_s = time.perf_counter() - t0
+
+    miglioramenti = np.arange(10, 31)[:, None]
+    costi = np.arange(100, 2001, 50)[None, :]
+    t0 = time.perf_counter()
+    surface = improvement_sweep(0.78, 0.82, 0.97, 5 * 3 * 8, miglioramenti, costi)["impatto_euro"]
+    sweep_ms = (time.perf_counter() - t0) * 1000
+
+    return {
+        "cells": int(np.prod(shape)),
+        "loop_s": loop_s,
+        "vec_s": vec_s,
+        "match": bool(np.isclose(perdita_loop, r["perdita_euro"].sum())),
+        "oee_linee": per_linea["oee"],
+        "sweep_shape": surface.shape,
+        "sweep_ms": sweep_ms,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Motore OEE vettoriale")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_bench = sub.add_parser("bench", help="ciclo scalare contro calcolo vettoriale")
+    p_bench.add_argument("--lines", type=int, default=20)
+    p_bench.add_argument("--shifts", type=int, default=3)
+    p_bench.add_argument("--days", type=int, default=365)
+    args = parser.parse_args(argv)
+
+    r = run_benchmark(args.lines, args.shifts, args.days)
+    print(f"🏭 {r['cells']:,} turni ({args.lines} linee × {args.shifts} turni × {args.days} giorni)")
+    print(f"   ciclo scalare:   {r['loop_s'] * 1000:,.1f} ms")
+    print(f"   NumPy:           {r['vec_s'] * 1000:,.1f} ms (x{r['loop_s'] / r['vec_s']:,.0f}, risultati {'uguali' if r['match'] else 'DIVERSI'})")
+    print(f"   OEE per linea:   {', '.join(f'{v:.1%}' for v in r['oee_linee'][:5])}{' ...' if args.lines > 5 else ''}")
+    print(f"   superficie miglioramento × costo orario {r['sweep_shape'][0]}×{r['sweep_shape'][1]}: {r['sweep_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,724 @@
+# oee_store.py
+"""
+Dati OEE reali: eventi macchina, ingestion massiva e rollup per la dashboard.
+
+Modello (tabelle in db.py):
+- OeeLine          anagrafica linee (codice dei file macchina, velocità nominale, €/h)
+- OeeEvent         evento grezzo: linea, istante, turno, tempo pianificato/in marcia/
+                   fermo, pezzi totali/buoni, causale fermo
+- OeeShiftStat     somme per linea × giornata × turno
+- OeeDayStat       somme per linea × giornata
+- OeeWeekStat      somme per linea × settimana ISO
+- OeeDowntimeDay   fermi per linea × giornata × causale
+
+Ingestion a blocchi di OEE_INGEST_BATCH_ROWS eventi, una transazione per blocco:
+executemany in una tabella temporanea, scarto dei doppioni (stesso evento già
+caricato: re-import idempotente), INSERT ... SELECT negli eventi e upsert a
+delta dei rollup con una GROUP BY sul solo blocco. La dashboard legge solo i
+rollup (poche migliaia di righe all'anno per linea), mai gli eventi grezzi,
+che possono essere eliminati dopo OEE_RAW_RETENTION_DAYS.
+
+Colonne accettate (maiuscole/minuscole indifferenti):
+    linea, ts (o timestamp), planned_s, run_s e/o downtime_s,
+    total_count, good_count, downtime_reason (o causale)
+
+Endpoint HTTP locale (al posto di un broker MQTT, per i gateway di linea):
+    python oee_store.py serve --port 8766
+    POST /events   body: [{"linea": "L1", "ts": "2026-03-02 06:00", "planned_s": 60, ...}, ...]
+                   oppure {"events": [...], "skip_invalid": true, "create_lines": true}
+    GET  /health
+    Se OEE_API_TOKEN è impostato serve l'header "X-Api-Token".
+
+Uso da riga di comando:
+    python oee_store.py import eventi_L1.csv [--skip-invalid] [--create-lines]
+    python oee_store.py generate demo.csv --lines 3 --days 30     # eventi sintetici
+    python oee_store.py rebuild                                   # ricalcola i rollup
+    python oee_store.py purge --days 90                           # elimina eventi vecchi
+    python oee_store.py bench --lines 50 --days 30                # DB sintetico, mai il DB reale
+"""
+
+import argparse
+import hmac
+import io
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+from sqlmodel import SQLModel
+
+from config import OEE_INGEST_BATCH_ROWS, OEE_RAW_RETENTION_DAYS, OEE_TURNI_INIZIO
+from db import (
+    DATA_DIR,
+    SQLITE_FILE_NAME,
+    OeeDayStat,
+    OeeDowntimeDay,
+    OeeEvent,
+    OeeLine,
+    OeeShiftStat,
+    OeeWeekStat,
+    engine,
+)
+from oee_engine import compute_oee
+
+BENCH_DB_PATH = DATA_DIR / "forgialean_oee_bench.db"
+
+# Durata massima di un singolo evento (un giorno)
+MAX_EVENT_S = 86_400
+
+# Dimensione massima del body JSON accettato dall'endpoint
+MAX_BODY_BYTES = 50 * 1024 * 1024
+
+CAUSALE_NON_SPECIFICATA = "Non specificata"
+
+COLUMN_ALIASES = {
+    "line": "linea",
+    "codice_linea": "linea",
+    "timestamp": "ts",
+    "data_ora": "ts",
+    "causale": "downtime_reason",
+    "causale_fermo": "downtime_reason",
+}
+
+MEASURES = ("planned_s", "run_s", "downtime_s", "total_count", "good_count")
+
+# tabella rollup -> colonne chiave (giornata e turno calcolati in ingestion)
+ROLLUPS = {
+    "oeeshiftstat": ("line_id", "giorno", "turno"),
+    "oeedaystat": ("line_id", "giorno"),
+    "oeeweekstat": ("line_id", "week_start"),
+}
+
+# grana della dashboard -> (tabella, colonna periodo)
+GRAINS = {
+    "turno": ("oeeshiftstat", "giorno"),
+    "giorno": ("oeedaystat", "giorno"),
+    "settimana": ("oeeweekstat", "week_start"),
+}
+
+_STAGING_DDL = """
+CREATE TEMP TABLE IF NOT EXISTS oee_staging (
+    line_id INTEGER NOT NULL,
+    ts TEXT NOT NULL,
+    giorno TEXT NOT NULL,
+    turno INTEGER NOT NULL,
+    week_start TEXT NOT NULL,
+    planned_s REAL NOT NULL,
+    run_s REAL NOT NULL,
+    downtime_s REAL NOT NULL,
+    total_count INTEGER NOT NULL,
+    good_count INTEGER NOT NULL,
+    downtime_reason TEXT,
+    PRIMARY KEY (line_id, ts)
+)
+"""
+
+_STAGING_COLUMNS = (
+    "line_id", "ts", "giorno", "turno", "week_start",
+    "planned_s", "run_s", "downtime_s", "total_count", "good_count", "downtime_reason",
+)
+
+# lunedì della settimana ISO di una colonna data (SQLite: %w = 0 domenica)
+_WEEK_START_SQL = "date(giorno, '-' || ((CAST(strftime('%w', giorno) AS INTEGER) + 6) % 7) || ' days')"
+
+
+# ========================
+# TURNI
+# ========================
+
+def assign_shift(ts: pd.Series, turni_inizio=OEE_TURNI_INIZIO) -> tuple[pd.Series, pd.Series]:
+    """
+    Giornata produttiva (datetime a mezzanotte) e turno (1..n) per ogni istante.
+    La giornata parte dal primo turno: con turni 6/14/22 le 03:00 del 3 marzo
+    sono il turno 3 del 2 marzo.
+    """
+    starts = np.asarray(sorted(turni_inizio), dtype="int64") * 3600
+    shifted = ts - pd.Timedelta(seconds=int(starts[0]))
+    giorno = shifted.dt.floor("D")
+    secondi = (shifted - giorno).dt.total_seconds().to_numpy()
+    turno = np.searchsorted(starts - starts[0], secondi, side="right")
+    return giorno, pd.Series(turno, index=ts.index, dtype="int64")
+
+
+# ========================
+# LETTURA E VALIDAZIONE
+# ========================
+
+def read_oee_file(data: bytes, filename: str) -> pd.DataFrame:
+    """CSV (separatore , o ; dalla prima riga) oppure Excel. Il parser C regge file da milioni di righe."""
+    if filename.lower().endswith((".xlsx", ".xls")):
+        return pd.read_excel(io.BytesIO(data), dtype={"ts": str, "timestamp": str})
+    header = data[:4096].split(b"\n", 1)[0]
+    sep = ";" if header.count(b";") > header.count(b",") else ","
+    return pd.read_csv(io.BytesIO(data), sep=sep, dtype={"linea": str, "line": str, "downtime_reason": str, "causale": str})
+
+
+def _line_index(bind) -> dict:
+    with bind.connect() as conn:
+        return dict(conn.execute(text("SELECT codice, line_id FROM oeeline")).all())
+
+
+def _create_lines(bind, codici) -> None:
+    with bind.begin() as conn:
+        conn.execute(
+            text("INSERT OR IGNORE INTO oeeline (codice, nome, valore_orario, attiva) VALUES (:c, :c, 0, 1)"),
+            [{"c": c} for c in codici],
+        )
+
+
+def _numeric(values: pd.Series) -> pd.Series:
+    if values.dtype == object or pd.api.types.is_string_dtype(values):
+        values = values.astype(str).str.replace(",", ".", regex=False)
+    return pd.to_numeric(values, errors="coerce")
+
+
+def validate_oee_events(df: pd.DataFrame, create_lines: bool = False, bind=None) -> tuple[pd.DataFrame, list[dict]]:
+    """
+    Ritorna (eventi validi con line_id, giornata, turno e settimana, errori [{riga, errore}]).
+    Linee sconosciute sono un errore, salvo create_lines=True (create con nome = codice).
+    Riga senza run_s: run = planned - downtime; senza downtime_s: downtime = planned - run.
+    """
+    bind = bind or engine
+    df = df.rename(columns=lambda c: COLUMN_ALIASES.get(str(c).strip().lower(), str(c).strip().lower()))
+    required = {"linea", "ts", "planned_s", "total_count", "good_count"}
+    if not required <= set(df.columns) or not {"run_s", "downtime_s"} & set(df.columns):
+        return df.iloc[0:0], [{"riga": 0, "errore": "Colonne obbligatorie: linea, ts, planned_s, run_s o downtime_s, total_count, good_count"}]
+
+    df = df.reset_index(drop=True)
+    linea = df["linea"].astype("string").str.strip()
+    ts = pd.to_datetime(df["ts"], errors="coerce", format="ISO8601")
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_convert(None)
+    planned = _numeric(df["planned_s"])
+    missing = pd.Series(np.nan, index=df.index)
+    run = _numeric(df["run_s"]) if "run_s" in df.columns else missing
+    downtime = _numeric(df["downtime_s"]) if "downtime_s" in df.columns else missing
+    run = run.fillna(planned - downtime)
+    downtime = downtime.fillna(planned - run)
+    total = _numeric(df["total_count"])
+    good = _numeric(df["good_count"])
+
+    lines = _line_index(bind)
+    nuove = set(linea.dropna().unique()) - set(lines) - {""}
+    if nuove and create_lines:
+        _create_lines(bind, sorted(nuove))
+        lines = _line_index(bind)
+    line_id = linea.map(lines)
+
+    checks = [
+        (linea.isna() | (linea == ""), "linea mancante"),
+        (linea.notna() & (linea != "") & line_id.isna(), "linea sconosciuta"),
+        (ts.isna(), "ts non valido"),
+        (planned.isna() | (planned <= 0) | (planned > MAX_EVENT_S), f"planned_s deve essere tra 0 e {MAX_EVENT_S}"),
+        (run.isna() | (run < 0) | (run > planned + 1e-6), "run_s deve essere tra 0 e planned_s"),
+        (downtime.isna() | (downtime < 0) | (downtime > planned + 1e-6), "downtime_s deve essere tra 0 e planned_s"),
+        (total.isna() | (total < 0) | (total % 1 != 0), "total_count deve essere un intero >= 0"),
+        (good.isna() | (good < 0) | (good % 1 != 0) | (good > total), "good_count deve essere un intero tra 0 e total_count"),
+    ]
+    errors = []
+    invalid = pd.Series(False, index=df.index)
+    for mask, message in checks:
+        mask = mask.fillna(False).astype(bool)
+        errors += [{"riga": int(i) + 1, "errore": message} for i in df.index[mask & ~invalid]]
+        invalid |= mask
+    errors.sort(key=lambda e: e["riga"])
+
+    valid = ~invalid
+    ts = ts[valid]
+    giorno, turno = assign_shift(ts)
+    reason = df["downtime_reason"].astype("string").str.strip() if "downtime_reason" in df.columns else pd.Series(pd.NA, index=df.index, dtype="string")
+    events = pd.DataFrame({
+        "line_id": line_id[valid].astype("int64"),
+        "ts": ts,
+        "giorno": giorno,
+        "turno": turno,
+        "week_start": giorno - pd.to_timedelta(giorno.dt.weekday, unit="D"),
+        "planned_s": planned[valid].astype(float),
+        "run_s": run[valid].astype(float),
+        "downtime_s": downtime[valid].astype(float),
+        "total_count": total[valid].astype("int64"),
+        "good_count": good[valid].astype("int64"),
+        "downtime_reason": reason[valid].replace("", pd.NA),
+    })
+    return events.reset_index(drop=True), errors
+
+
+# ========================
+# INGESTION
+# ========================
+
+def _staging_rows(events: pd.DataFrame) -> list[tuple]:
+    # stesso formato testo di SQLAlchemy per DateTime/Date (confronti e indice unico coerenti)
+    def iso(col: str, unit: str) -> list[str]:
+        return np.datetime_as_string(events[col].to_numpy(dtype=f"datetime64[{unit}]"), unit=unit).tolist()
+
+    cols = {
+        "ts": [s.replace("T", " ") for s in iso("ts", "us")],
+        "giorno": iso("giorno", "D"),
+        "week_start": iso("week_start", "D"),
+        "downtime_reason": events["downtime_reason"].astype(object).where(events["downtime_reason"].notna(), None).tolist(),
+    }
+    return list(zip(*(cols[c] if c in cols else events[c].tolist() for c in _STAGING_COLUMNS)))
+
+
+def _upsert_rollups(conn) -> None:
+    sums = ", ".join(f"SUM({m})" for m in MEASURES)
+    deltas = ", ".join(f"{m} = {m} + excluded.{m}" for m in (*MEASURES, "eventi"))
+    for table, keys in ROLLUPS.items():
+        k = ", ".join(keys)
+        # WHERE true: evita l'ambiguità SQLite tra ON CONFLICT e JOIN nell'INSERT ... SELECT
+        conn.exec_driver_sql(
+            f"INSERT INTO {table} ({k}, {', '.join(MEASURES)}, eventi) "
+            f"SELECT {k}, {sums}, COUNT(*) FROM temp.oee_staging WHERE true GROUP BY {k} "
+            f"ON CONFLICT ({k}) DO UPDATE SET {deltas}"
+        )
+    conn.exec_driver_sql(
+        "INSERT INTO oeedowntimeday (line_id, giorno, causale, downtime_s, occorrenze) "
+        f"SELECT line_id, giorno, COALESCE(downtime_reason, '{CAUSALE_NON_SPECIFICATA}'), SUM(downtime_s), COUNT(*) "
+        "FROM temp.oee_staging WHERE downtime_s > 0 GROUP BY 1, 2, 3 "
+        "ON CONFLICT (line_id, giorno, causale) DO UPDATE SET "
+        "downtime_s = downtime_s + excluded.downtime_s, occorrenze = occorrenze + excluded.occorrenze"
+    )
+
+
+def ingest_oee_events(events: pd.DataFrame, bind=None) -> dict:
+    """
+    Scrive eventi già validati a blocchi (una transazione per blocco, rollup compresi).
+    Eventi già presenti (stessa linea e ts) o ripetuti nel blocco sono ignorati.
+    """
+    bind = bind or engine
+    t0 = time.perf_counter()
+    inserted = batches = 0
+    cols = ", ".join(c for c in _STAGING_COLUMNS if c != "week_start")
+    placeholders = ", ".join("?" for _ in _STAGING_COLUMNS)
+    for start in range(0, len(events), OEE_INGEST_BATCH_ROWS):
+        rows = _staging_rows(events.iloc[start:start + OEE_INGEST_BATCH_ROWS])
+        with bind.begin() as conn:
+            conn.exec_driver_sql(_STAGING_DDL)
+            conn.exec_driver_sql("DELETE FROM temp.oee_staging")
+            conn.exec_driver_sql(f"INSERT OR IGNORE INTO temp.oee_staging VALUES ({placeholders})", rows)
+            conn.exec_driver_sql(
+                "DELETE FROM temp.oee_staging WHERE EXISTS ("
+                "SELECT 1 FROM oeeevent e WHERE e.line_id = oee_staging.line_id AND e.ts = oee_staging.ts)"
+            )
+            n = conn.exec_driver_sql(f"INSERT INTO oeeevent ({cols}) SELECT {cols} FROM temp.oee_staging").rowcount
+            if n:
+                _upsert_rollups(conn)
+            conn.exec_driver_sql("DELETE FROM temp.oee_staging")
+        inserted += n
+        batches += 1
+    return {
+        "inserted": inserted,
+        "duplicates": len(events) - inserted,
+        "batches": batches,
+        "elapsed_s": round(time.perf_counter() - t0, 3),
+    }
+
+
+def import_oee_events(df: pd.DataFrame, skip_invalid: bool = False, create_lines: bool = False, bind=None) -> dict:
+    """Valida e importa eventi macchina. Con errori e skip_invalid=False non scrive nulla."""
+    events, errors = validate_oee_events(df, create_lines=create_lines, bind=bind)
+    report = {"rows": len(df), "valid": len(events), "errors": errors, "inserted": 0, "duplicates": 0, "batches": 0}
+    if errors and not skip_invalid:
+        return report
+    report.update(ingest_oee_events(events, bind=bind))
+    return report
+
+
+# ========================
+# MANUTENZIONE ROLLUP
+# ========================
+
+def rebuild_oee_rollups(bind=None) -> dict:
+    """
+    Ricalcola i rollup dagli eventi grezzi ancora presenti: turni, giorni e
+    fermi dal primo giorno con eventi in poi (i giorni più vecchi, già
+    eliminati, restano come sono), settimane dalle somme giornaliere.
+    """
+    bind = bind or engine
+    t0 = time.perf_counter()
+    sums = ", ".join(f"SUM({m})" for m in MEASURES)
+    with bind.begin() as conn:
+        primo = conn.exec_driver_sql("SELECT MIN(giorno) FROM oeeevent").scalar()
+        if primo is not None:
+            for table in ("oeeshiftstat", "oeedaystat", "oeedowntimeday"):
+                conn.exec_driver_sql(f"DELETE FROM {table} WHERE giorno >= ?", (primo,))
+            for table in ("oeeshiftstat", "oeedaystat"):
+                k = ", ".join(ROLLUPS[table])
+                conn.exec_driver_sql(
+                    f"INSERT INTO {table} ({k}, {', '.join(MEASURES)}, eventi) "
+                    f"SELECT {k}, {sums}, COUNT(*) FROM oeeevent WHERE giorno >= ? GROUP BY {k}",
+                    (primo,),
+                )
+            conn.exec_driver_sql(
+                "INSERT INTO oeedowntimeday (line_id, giorno, causale, downtime_s, occorrenze) "
+                f"SELECT line_id, giorno, COALESCE(downtime_reason, '{CAUSALE_NON_SPECIFICATA}'), SUM(downtime_s), COUNT(*) "
+                "FROM oeeevent WHERE giorno >= ? AND downtime_s > 0 GROUP BY 1, 2, 3",
+                (primo,),
+            )
+        conn.exec_driver_sql("DELETE FROM oeeweekstat")
+        conn.exec_driver_sql(
+            f"INSERT INTO oeeweekstat (line_id, week_start, {', '.join(MEASURES)}, eventi) "
+            f"SELECT line_id, {_WEEK_START_SQL}, {sums}, SUM(eventi) FROM oeedaystat GROUP BY 1, 2"
+        )
+        giorni = conn.exec_driver_sql("SELECT COUNT(*) FROM oeedaystat").scalar()
+    return {"dal_giorno": primo, "giorni": giorni, "elapsed_s": round(time.perf_counter() - t0, 3)}
+
+
+def purge_oee_events(older_than_days: int = OEE_RAW_RETENTION_DAYS, bind=None) -> int:
+    """Elimina gli eventi grezzi più vecchi di N giorni (0 = nessuno). I rollup non cambiano."""
+    if older_than_days <= 0:
+        return 0
+    bind = bind or engine
+    limite = (date.today() - timedelta(days=older_than_days)).isoformat()
+    with bind.begin() as conn:
+        return conn.exec_driver_sql("DELETE FROM oeeevent WHERE giorno < ?", (limite,)).rowcount
+
+
+# ========================
+# LETTURA PER LA DASHBOARD
+# ========================
+
+def load_oee_lines(bind=None) -> pd.DataFrame:
+    bind = bind or engine
+    with bind.connect() as conn:
+        return pd.read_sql_query(
+            text(
+                "SELECT line_id, codice, nome, reparto, pezzi_ora_nominali, valore_orario, attiva "
+                "FROM oeeline ORDER BY codice"
+            ),
+            conn,
+        )
+
+
+def oee_data_range(bind=None) -> tuple:
+    """(primo giorno, ultimo giorno) con rollup giornalieri, (None, None) se non ci sono dati."""
+    bind = bind or engine
+    with bind.connect() as conn:
+        primo, ultimo = conn.execute(text("SELECT MIN(giorno), MAX(giorno) FROM oeedaystat")).one()
+    if primo is None:
+        return None, None
+    return date.fromisoformat(primo), date.fromisoformat(ultimo)
+
+
+def _line_filter(line_ids) -> str:
+    if not line_ids:
+        return ""
+    return f" AND s.line_id IN ({', '.join(str(int(x)) for x in line_ids)})"
+
+
+def add_oee_kpis(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aggiunge availability / performance / quality / oee / perdita_euro a righe
+    di rollup (planned_s, run_s, total_count, good_count, ideal_s, valore_orario).
+    Performance = tempo ideale dei pezzi / tempo in marcia, al massimo 100%.
+    """
+    df = df.copy()
+    run = df["run_s"].to_numpy(dtype=float)
+    total = df["total_count"].to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        velocita = np.where(run > 0, np.minimum(df["ideal_s"].to_numpy(dtype=float) / run, 1.0) * 100, 0.0)
+        scarti = np.where(total > 0, (1 - df["good_count"].to_numpy(dtype=float) / total) * 100, 0.0)
+    r = compute_oee(
+        df["planned_s"].to_numpy(dtype=float) / 3600,
+        (df["planned_s"] - df["run_s"]).to_numpy(dtype=float) / 3600,
+        velocita,
+        scarti,
+        df["valore_orario"].to_numpy(dtype=float),
+    )
+    for k in ("availability", "performance", "quality", "oee", "perdita_euro"):
+        df[k] = r[k]
+    return df
+
+
+def load_oee_rollup(grain: str, date_from: date, date_to: date, line_ids=None, bind=None) -> pd.DataFrame:
+    """
+    Righe di rollup (grain: turno, giorno, settimana) nel periodo, con KPI OEE.
+    Il tempo ideale usa la velocità nominale della linea (senza: ideale = tempo in marcia).
+    """
+    bind = bind or engine
+    table, period_col = GRAINS[grain]
+    extra_keys = ", s.turno" if grain == "turno" else ""
+    where_lines = _line_filter(line_ids)
+    sql = (
+        f"SELECT s.line_id, l.codice, l.nome, s.{period_col} AS periodo{extra_keys}, "
+        f"{', '.join('s.' + m for m in MEASURES)}, s.eventi, "
+        "COALESCE(s.total_count * 3600.0 / NULLIF(l.pezzi_ora_nominali, 0), s.run_s) AS ideal_s, "
+        "l.valore_orario "
+        f"FROM {table} s JOIN oeeline l ON l.line_id = s.line_id "
+        f"WHERE s.{period_col} BETWEEN :dal AND :al{where_lines} "
+        f"ORDER BY periodo{extra_keys}, l.codice"
+    )
+    if grain == "settimana":
+        date_from = date_from - timedelta(days=date_from.weekday())
+    with bind.connect() as conn:
+        df = pd.read_sql_query(text(sql), conn, params={"dal": date_from.isoformat(), "al": date_to.isoformat()})
+    df["periodo"] = pd.to_datetime(df["periodo"])
+    return add_oee_kpis(df)
+
+
+def summarize_oee(rollup: pd.DataFrame) -> dict:
+    """KPI OEE del totale di più righe di rollup (somme dei tempi, non media degli OEE)."""
+    cols = [*MEASURES, "eventi", "ideal_s"]
+    tot = rollup[cols].sum().to_frame().T
+    tot["valore_orario"] = 0.0
+    r = add_oee_kpis(tot).iloc[0]
+    return {
+        "ore_pianificate": r["planned_s"] / 3600,
+        "ore_marcia": r["run_s"] / 3600,
+        "ore_fermo": r["downtime_s"] / 3600,
+        "pezzi_totali": int(r["total_count"]),
+        "pezzi_buoni": int(r["good_count"]),
+        "eventi": int(r["eventi"]),
+        "availability": float(r["availability"]),
+        "performance": float(r["performance"]),
+        "quality": float(r["quality"]),
+        "oee": float(r["oee"]),
+        "perdita_euro": float(rollup["perdita_euro"].sum()),
+    }
+
+
+def load_downtime_pareto(date_from: date, date_to: date, line_ids=None, bind=None) -> pd.DataFrame:
+    """Minuti di fermo per causale nel periodo, dal più grande."""
+    bind = bind or engine
+    where_lines = _line_filter(line_ids)
+    sql = (
+        "SELECT s.causale AS Categoria, SUM(s.downtime_s) / 60.0 AS Minuti, SUM(s.occorrenze) AS Occorrenze "
+        f"FROM oeedowntimeday s WHERE s.giorno BETWEEN :dal AND :al{where_lines} "
+        "GROUP BY s.causale ORDER BY Minuti DESC"
+    )
+    with bind.connect() as conn:
+        return pd.read_sql_query(text(sql), conn, params={"dal": date_from.isoformat(), "al": date_to.isoformat()})
+
+
+# ========================
+# EVENTI SINTETICI
+# ========================
+
+def synthetic_events(lines: int = 3, days: int = 30, interval_s: int = 60, start: date | None = None, seed: int = 42) -> pd.DataFrame:
+    """Eventi macchina plausibili (un evento ogni interval_s secondi per linea) per demo e benchmark."""
+    rng = np.random.default_rng(seed)
+    start = start or date.today() - timedelta(days=days)
+    per_line = days * 86_400 // interval_s
+    n = lines * per_line
+    base = np.datetime64(start.isoformat(), "s") + np.arange(per_line) * np.timedelta64(interval_s, "s")
+    causali = np.array(["Setup", "Guasti", "Microfermi", "Attese materiali"])
+
+    # ogni linea ha una sua disponibilità/velocità/qualità di fondo
+    fermo_p = np.repeat(rng.uniform(0.08, 0.25, lines), per_line)
+    fermo = rng.random(n) < fermo_p
+    downtime = np.where(fermo, rng.uniform(0.3, 1.0, n) * interval_s, 0.0).round(1)
+    run = interval_s - downtime
+    ritmo = np.repeat(rng.uniform(0.70, 0.95, lines) * 600 / 3600, per_line)  # 600 pezzi/h nominali
+    total = rng.poisson(run * ritmo)
+    good = total - rng.binomial(total, np.repeat(rng.uniform(0.01, 0.05, lines), per_line))
+    return pd.DataFrame({
+        "linea": np.repeat([f"L{i + 1}" for i in range(lines)], per_line),
+        "ts": np.tile(base, lines).astype("datetime64[s]").astype(str),
+        "planned_s": float(interval_s),
+        "run_s": run,
+        "downtime_s": downtime,
+        "total_count": total,
+        "good_count": good,
+        "downtime_reason": np.where(fermo, rng.choice(causali, n, p=[0.2, 0.35, 0.3, 0.15]), ""),
+    })
+
+
+# ========================
+# ENDPOINT HTTP LOCALE
+# ========================
+
+class OeeEventHandler(BaseHTTPRequestHandler):
+    token = os.getenv("OEE_API_TOKEN")
+
+    def _reply(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, {"status": "ok"})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/events":
+            self._reply(404, {"error": "not found"})
+            return
+        if self.token and not hmac.compare_digest(self.headers.get("X-Api-Token", "").encode(), self.token.encode()):
+            self._reply(401, {"error": "token non valido"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            self._reply(413 if length else 400, {"error": "body mancante o troppo grande"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(length))
+        except ValueError:
+            self._reply(400, {"error": "JSON non valido"})
+            return
+
+        events = payload.get("events") if isinstance(payload, dict) else payload
+        if not isinstance(events, list) or not events or not all(isinstance(e, dict) for e in events):
+            self._reply(400, {"error": "atteso un elenco di eventi macchina"})
+            return
+        options = payload if isinstance(payload, dict) else {}
+
+        report = import_oee_events(
+            pd.DataFrame(events),
+            skip_invalid=bool(options.get("skip_invalid")),
+            create_lines=bool(options.get("create_lines")),
+        )
+        status = 400 if report["errors"] and not report["inserted"] and not report["duplicates"] else 200
+        self._reply(status, report)
+
+    def log_message(self, fmt, *args):
+        print(f"[{datetime.now():%H:%M:%S}] {self.address_string()} {fmt % args}")
+
+
+def serve(host: str = "127.0.0.1", port: int = 8766) -> ThreadingHTTPServer:
+    # senza token l'endpoint accetta scritture da chiunque lo raggiunga: solo in locale
+    if not OeeEventHandler.token and host not in ("127.0.0.1", "::1", "localhost"):
+        raise SystemExit(f"⚠️ OEE_API_TOKEN non impostato: endpoint consentito solo su loopback, non su {host}")
+    server = ThreadingHTTPServer((host, port), OeeEventHandler)
+    print(f"✅ Endpoint eventi OEE su http://{host}:{port}/events")
+    return server
+
+
+# ========================
+# BENCHMARK
+# ========================
+
+def run_benchmark(db_path: Path, lines: int = 50, days: int = 30, interval_s: int = 60) -> dict:
+    """Ingestion di un mese di eventi e query dashboard: rollup contro GROUP BY sugli eventi grezzi."""
+    db_path.unlink(missing_ok=True)
+    bind = create_engine(f"sqlite:///{db_path}")
+    SQLModel.metadata.create_all(
+        bind,
+        tables=[t.__table__ for t in (OeeLine, OeeEvent, OeeShiftStat, OeeDayStat, OeeWeekStat, OeeDowntimeDay)],
+    )
+
+    raw = synthetic_events(lines, days, interval_s)
+    t0 = time.perf_counter()
+    events, errors = validate_oee_events(raw, create_lines=True, bind=bind)
+    validate_s = time.perf_counter() - t0
+    ingest = ingest_oee_events(events, bind=bind)
+    again = ingest_oee_events(events.iloc[:OEE_INGEST_BATCH_ROWS], bind=bind)
+
+    primo, ultimo = oee_data_range(bind)
+    t0 = time.perf_counter()
+    rollup = load_oee_rollup("giorno", primo, ultimo, bind=bind)
+    summary = summarize_oee(rollup)
+    load_downtime_pareto(primo, ultimo, bind=bind)
+    rollup_ms = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    with bind.connect() as conn:
+        raw_tot = conn.exec_driver_sql(
+            "SELECT SUM(planned_s), SUM(run_s), SUM(good_count), COUNT(*) FROM oeeevent"
+        ).one()
+        conn.exec_driver_sql("SELECT line_id, giorno, SUM(planned_s), SUM(run_s) FROM oeeevent GROUP BY 1, 2").all()
+    raw_ms = (time.perf_counter() - t0) * 1000
+    bind.dispose()
+
+    return {
+        "eventi": len(raw),
+        "errori": len(errors),
+        "validazione_s": round(validate_s, 2),
+        "ingestion_s": ingest["elapsed_s"],
+        "eventi_al_s": round(ingest["inserted"] / ingest["elapsed_s"]),
+        "transazioni": ingest["batches"],
+        "reimport_doppioni": again["duplicates"],
+        "righe_rollup_giorno": len(rollup),
+        "query_rollup_ms": round(rollup_ms, 1),
+        "query_eventi_grezzi_ms": round(raw_ms, 1),
+        "rollup_uguali_a_grezzi": bool(
+            np.isclose(summary["ore_pianificate"] * 3600, raw_tot[0])
+            and np.isclose(summary["ore_marcia"] * 3600, raw_tot[1])
+            and summary["pezzi_buoni"] == raw_tot[2]
+            and summary["eventi"] == raw_tot[3]
+        ),
+        "oee": round(summary["oee"], 4),
+        "db_mb": round(db_path.stat().st_size / 1e6, 1),
+    }
+
+
+# ========================
+# CLI
+# ========================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dati OEE di linea ForgiaLean")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_serve = sub.add_parser("serve", help="avvia l'endpoint JSON locale")
+    p_serve.add_argument("--host", default="127.0.0.1")
+    p_serve.add_argument("--port", type=int, default=8766)
+    p_import = sub.add_parser("import", help="importa un file CSV/XLSX di eventi")
+    p_import.add_argument("file")
+    p_import.add_argument("--skip-invalid", action="store_true")
+    p_import.add_argument("--create-lines", action="store_true")
+    p_gen = sub.add_parser("generate", help="scrive un CSV di eventi sintetici")
+    p_gen.add_argument("file")
+    p_gen.add_argument("--lines", type=int, default=3)
+    p_gen.add_argument("--days", type=int, default=30)
+    p_gen.add_argument("--interval", type=int, default=60)
+    sub.add_parser("rebuild", help="ricalcola i rollup dagli eventi grezzi")
+    p_purge = sub.add_parser("purge", help="elimina gli eventi grezzi vecchi")
+    p_purge.add_argument("--days", type=int, default=OEE_RAW_RETENTION_DAYS)
+    p_bench = sub.add_parser("bench", help="benchmark su DB sintetico")
+    p_bench.add_argument("--db", type=Path, default=BENCH_DB_PATH)
+    p_bench.add_argument("--lines", type=int, default=50)
+    p_bench.add_argument("--days", type=int, default=30)
+    p_bench.add_argument("--interval", type=int, default=60)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "serve":
+        server = serve(args.host, args.port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    elif args.cmd == "import":
+        with open(args.file, "rb") as f:
+            df = read_oee_file(f.read(), args.file)
+        report = import_oee_events(df, skip_invalid=args.skip_invalid, create_lines=args.create_lines)
+        for e in report["errors"][:20]:
+            print(f"❌ riga {e['riga']}: {e['errore']}")
+        if len(report["errors"]) > 20:
+            print(f"   ... altri {len(report['errors']) - 20} errori")
+        if report["inserted"] or report["duplicates"]:
+            print(
+                f"✅ {report['inserted']} eventi importati in {report['elapsed_s']:.2f}s "
+                f"({report['batches']} blocchi, {report['duplicates']} già presenti)"
+            )
+        else:
+            print("⚠️ Nessun evento importato")
+    elif args.cmd == "generate":
+        df = synthetic_events(args.lines, args.days, args.interval)
+        df.to_csv(args.file, index=False)
+        print(f"✅ {len(df):,} eventi sintetici in {args.file}")
+    elif args.cmd == "rebuild":
+        r = rebuild_oee_rollups()
+        print(f"✅ Rollup OEE ricalcolati dal {r['dal_giorno']}: {r['giorni']} giorni-linea in {r['elapsed_s']:.2f}s")
+    elif args.cmd == "purge":
+        print(f"🧹 {purge_oee_events(args.days)} eventi grezzi eliminati (più vecchi di {args.days} giorni)")
+    elif args.cmd == "bench":
+        if args.db.resolve() == Path(SQLITE_FILE_NAME).resolve():
+            raise SystemExit("⚠️ Il benchmark non gira sul DB reale")
+        print(f"⏱️ Benchmark OEE: {args.lines} linee × {args.days} giorni, un evento ogni {args.interval}s su {args.db}")
+        print(json.dumps(run_benchmark(args.db, args.lines, args.days, args.interval), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+# perf_monitor.py
+"""
+Strumentazione opzionale delle performance per ForgiaLean Control Tower.
+
+Attiva solo con PERF_MONITOR_ENABLED=true (variabile d'ambiente).
+Quando è spenta, decoratori e context manager non aggiungono overhead.
+
+Cosa misura:
+- page:     tempo di rendering di ogni pagina lanciata da main()
+- builder:  funzioni build_* / calcoli finanziari decorati con @timed
+- query:    ogni statement SQL sull'engine (before/after_cursor_execute)
+- cache:    hit/miss delle funzioni in cache_functions
+- external: chiamate HTTP (requests) e invii SMTP
+
+I campioni restano in memoria nel processo Streamlit (buffer circolare
+condiviso tra le sessioni) e sono consultabili dalla pagina admin
+"Performance" oppure esportabili in JSON per analisi offline.
+
+Uso:
+    import perf_monitor
+
+    perf_monitor.install_all(engine)      # una volta all'avvio
+
+    with perf_monitor.track("page", "Overview"):
+        page_overview()
+
+    @perf_monitor.timed("builder")
+    def build_cashflow_monthly(anno): ...
+"""
+
+import functools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlparse
+
+import pandas as pd
+from sqlalchemy import event
+
+from config import PERF_MONITOR_ENABLED, PERF_MONITOR_MAX_SAMPLES
+
+KINDS = ("page", "builder", "query", "cache", "external")
+
+_LOCK = threading.Lock()
+_SAMPLES = {kind: deque(maxlen=PERF_MONITOR_MAX_SAMPLES) for kind in KINDS}
+_INSTALLED: set = set()
+
+# Lunghezza massima dello statement SQL salvato nel campione
+_MAX_STATEMENT_LEN = 500
+
+
+def is_enabled() -> bool:
+    return PERF_MONITOR_ENABLED
+
+
+# ========================
+# REGISTRAZIONE CAMPIONI
+# ========================
+
+def record(kind: str, name: str, duration_ms: float, **extra) -> None:
+    """Aggiunge un campione al buffer del tipo indicato."""
+    if not PERF_MONITOR_ENABLED:
+        return
+    sample = {
+        "name": name,
+        "duration_ms": float(duration_ms),
+        "ts": datetime.utcnow().isoformat(timespec="milliseconds"),
+        **extra,
+    }
+    with _LOCK:
+        _SAMPLES[kind].append(sample)
+
+
+@contextmanager
+def track(kind: str, name: str, **extra):
+    """Context manager che misura il blocco e registra il campione."""
+    if not PERF_MONITOR_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(kind, name, (time.perf_counter() - start) * 1000.0, **extra)
+
+
+def timed(kind: str = "builder", name: str | None = None):
+    """Decoratore: misura ogni chiamata della funzione (no-op se disattivo)."""
+    def decorator(func):
+        if not PERF_MONITOR_ENABLED:
+            return func
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track(kind, label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_cache(func, cache_decorator):
+    """
+    Applica cache_decorator (es. st.cache_data(ttl=...)) a func registrando
+    hit/miss: la funzione originale viene eseguita solo in caso di miss.
+    Mantiene .clear() per l'invalidazione selettiva.
+    """
+    state = threading.local()
+
+    @functools.wraps(func)
+    def _on_miss(*args, **kwargs):
+        state.miss = True
+        return func(*args, **kwargs)
+
+    cached = cache_decorator(_on_miss)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        state.miss = False
+        start = time.perf_counter()
+        try:
+            return cached(*args, **kwargs)
+        finally:
+            record(
+                "cache",
+                func.__name__,
+                (time.perf_counter() - start) * 1000.0,
+                hit=not state.miss,
+            )
+
+    wrapper.clear = cached.clear
+    return wrapper
+
+
+# ========================
+# HOOK: SQLALCHEMY / HTTP
+# ========================
+
+def install_sqlalchemy_hooks(engine) -> None:
+    """Registra i listener before/after_cursor_execute (e handle_error) sull'engine."""
+    key = ("sqlalchemy", id(engine))
+    if not PERF_MONITOR_ENABLED or key in _INSTALLED:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("perf_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("perf_query_start")
+        if not starts:
+            return
+        duration_ms = (time.perf_counter() - starts.pop()) * 1000.0
+        sql = " ".join(statement.split())
+        record(
+            "query",
+            sql[:_MAX_STATEMENT_LEN],
+            duration_ms,
+            rows=cursor.rowcount if cursor.rowcount is not None else -1,
+            executemany=bool(executemany),
+        )
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        # query fallita: after_cursor_execute non arriva, l'inizio va tolto qui
+        # altrimenti la pila resta sfasata sulla connessione del pool
+        conn = context.connection
+        starts = conn.info.get("perf_query_start") if conn is not None else None
+        if not starts:
+            return
+        duration_ms = (time.perf_counter() - starts.pop()) * 1000.0
+        sql = " ".join((context.statement or "").split())
+        record("query", sql[:_MAX_STATEMENT_LEN], duration_ms, rows=-1, error=True)
+
+    _INSTALLED.add(key)
+
+
+def install_http_hooks() -> None:
+    """
+    Misura tutte le chiamate fatte con requests (GA4, Facebook, Telegram...).
+    requests.get/post passano tutte da Session.request.
+    """
+    if not PERF_MONITOR_ENABLED or "http" in _INSTALLED:
+        return
+    import requests
+
+    original = requests.sessions.Session.request
+
+    @functools.wraps(original)
+    def _request(self, method, url, *args, **kwargs):
+        host = urlparse(str(url)).netloc
+        start = time.perf_counter()
+        status = None
+        try:
+            resp = original(self, method, url, *args, **kwargs)
+            status = resp.status_code
+            return resp
+        finally:
+            record(
+                "external",
+                f"{method.upper()} {host}",
+                (time.perf_counter() - start) * 1000.0,
+                status=status,
+            )
+
+    requests.sessions.Session.request = _request
+    _INSTALLED.add("http")
+
+
+def install_all(engine) -> None:
+    """Installa tutti gli hook (idempotente, sicuro ad ogni rerun)."""
+    install_sqlalchemy_hooks(engine)
+    install_http_hooks()
+
+
+# ========================
+# LETTURA / AGGREGATI
+# ========================
+
+def get_samples(kind: str) -> pd.DataFrame:
+    with _LOCK:
+        rows = list(_SAMPLES[kind])
+    return pd.DataFrame(rows)
+
+
+def summarize(kind: str) -> pd.DataFrame:
+    """Conteggio, media, p50, p95 e max (ms) per nome, ordinati per p95."""
+    df = get_samples(kind)
+    if df.empty:
+        return pd.DataFrame(columns=["name", "count", "mean_ms", "p50_ms", "p95_ms", "max_ms"])
+    grp = df.groupby("name")["duration_ms"]
+    out = pd.DataFrame(
+        {
+            "count": grp.count(),
+            "mean_ms": grp.mean(),
+            "p50_ms": grp.quantile(0.50),
+            "p95_ms": grp.quantile(0.95),
+            "max_ms": grp.max(),
+        }
+    ).reset_index()
+    return out.sort_values("p95_ms", ascending=False).reset_index(drop=True)
+
+
+def top_slow_queries(n: int = 20) -> pd.DataFrame:
+    """Le N esecuzioni SQL più lente registrate."""
+    df = get_samples("query")
+    if df.empty:
+        return df
+    return df.sort_values("duration_ms", ascending=False).head(n).reset_index(drop=True)
+
+
+def cache_stats() -> pd.DataFrame:
+    """Hit, miss e hit-rate per funzione di cache."""
+    df = get_samples("cache")
+    if df.empty:
+        return pd.DataFrame(columns=["name", "hit", "miss", "hit_rate_%", "mean_ms"])
+    out = (
+        df.groupby("name")
+        .agg(
+            hit=("hit", "sum"),
+            calls=("hit", "count"),
+            mean_ms=("duration_ms", "mean"),
+        )
+        .reset_index()
+    )
+    out["miss"] = out["calls"] - out["hit"]
+    out["hit_rate_%"] = out["hit"] / out["calls"] * 100.0
+    return out[["name", "hit", "miss", "hit_rate_%", "mean_ms"]]
+
+
+def export_json() -> str:
+    """Esporta tutti i campioni grezzi in JSON (per analisi offline)."""
+    with _LOCK:
+        payload = {
+            "exported_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "max_samples": PERF_MONITOR_MAX_SAMPLES,
+            "samples": {kind: list(buf) for kind, buf in _SAMPLES.items()},
+        }
+    return json.dumps(payload, indent=2, default=str)
+
+
+def reset() -> None:
+    with _LOCK:
+        for buf in _SAMPLES.values():
+            buf.clear()
@@ -0,0 +1,209 @@
+# restore_db.py
+"""
+Ripristino verificato del database all'avvio (cold start del container).
+
+Sceglie lo snapshot valido più recente tra quelli prodotti da backup_db.py
+(manifest in db_backups/snapshots), lo ricostruisce in streaming
+decomprimendo le pagine, controlla hash pagina per pagina, sha256 del file
+e PRAGMA quick_check, poi lo copia sul DB con l'API di backup di SQLite.
+
+Se nessuno snapshot è valido usa il vecchio file singolo
+db_backups/forgialean_latest.db (anche .db.gz / .db.zst, decompresso in
+streaming), sempre verificato con quick_check prima della copia.
+
+Il numero di snapshot provati è limitato (MAX_SNAPSHOT_ATTEMPTS): un
+backup corrotto non blocca l'avvio per minuti. Esito e tempi vengono
+aggiunti a data/restore_log.jsonl.
+
+Uso:
+    from restore_db import restore_if_needed
+    report = restore_if_needed(SQLITE_FILE_NAME)   # None se il DB è già presente
+
+    python restore_db.py --target data/forgialean.db [--force]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import backup_db
+
+BASE_DIR = Path(__file__).parent
+BACKUP_DIR = BASE_DIR / "db_backups"
+RESTORE_LOG = BASE_DIR / "data" / "restore_log.jsonl"
+
+# Sotto questa dimensione il DB è considerato vuoto/mancante
+MIN_DB_BYTES = 1000
+
+# Snapshot provati (dal più recente) prima di passare al file legacy
+MAX_SNAPSHOT_ATTEMPTS = 3
+
+LEGACY_FILES = ("forgialean_latest.db", "forgialean_latest.db.zst", "forgialean_latest.db.gz")
+
+
+def needs_restore(db_path: Path) -> bool:
+    db_path = Path(db_path)
+    return not db_path.exists() or db_path.stat().st_size < MIN_DB_BYTES
+
+
+# ========================
+# SNAPSHOT DEDUPLICATI
+# ========================
+
+def _restore_from_snapshots(target: Path, backup_dir: Path, attempts: list) -> dict | None:
+    manifests = backup_db.list_snapshots(backup_dir) if backup_dir.exists() else []
+    for path in reversed(manifests[-MAX_SNAPSHOT_ATTEMPTS:]):
+        t0 = time.perf_counter()
+        try:
+            manifest = backup_db.load_manifest(path)
+            if manifest.get("quick_check") != "ok":
+                raise ValueError("snapshot archiviato senza quick_check ok")
+            backup_db.restore_snapshot(manifest, target, backup_dir)
+        except (OSError, ValueError, RuntimeError, sqlite3.Error) as e:
+            attempts.append({"source": path.name, "error": str(e), "elapsed_s": round(time.perf_counter() - t0, 3)})
+            continue
+        return {
+            "source": manifest["snapshot_id"],
+            "snapshot_created_at": manifest["created_at"],
+            "db_bytes": manifest["db_bytes"],
+            "sha256": manifest["sha256"],
+        }
+    return None
+
+
+# ========================
+# FILE LEGACY (anche compresso)
+# ========================
+
+def _open_stream(path: Path):
+    """Apre il file decomprimendo in streaming in base all'estensione."""
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    if path.suffix == ".zst":
+        if backup_db.zstandard is None:
+            raise RuntimeError("File .zst: installa il pacchetto 'zstandard'")
+        return backup_db.zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+
+def _restore_from_legacy(target: Path, backup_dir: Path, attempts: list) -> dict | None:
+    for name in LEGACY_FILES:
+        path = backup_dir / name
+        if not path.exists():
+            continue
+        t0 = time.perf_counter()
+        fd, tmp_name = tempfile.mkstemp(prefix="restore_", suffix=".db", dir=target.parent)
+        os.close(fd)
+        tmp = Path(tmp_name)
+        try:
+            with _open_stream(path) as src, open(tmp, "wb") as out:
+                shutil.copyfileobj(src, out, length=1024 * 1024)
+            check = backup_db.quick_check(tmp)
+            if check != "ok":
+                raise ValueError(f"quick_check fallito: {check}")
+            _backup_api_copy(tmp, target)
+        except (OSError, ValueError, RuntimeError, sqlite3.Error) as e:
+            attempts.append({"source": name, "error": str(e), "elapsed_s": round(time.perf_counter() - t0, 3)})
+            continue
+        finally:
+            tmp.unlink(missing_ok=True)
+        return {"source": name, "db_bytes": target.stat().st_size}
+    return None
+
+
+def _backup_api_copy(src_file: Path, target: Path) -> None:
+    src = sqlite3.connect(f"file:{src_file}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+# ========================
+# ENTRY POINT
+# ========================
+
+def _log(report: dict) -> None:
+    try:
+        RESTORE_LOG.parent.mkdir(parents=True, exist_ok=True)
+        with open(RESTORE_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(report) + "\n")
+    except OSError:
+        pass
+
+
+def restore_latest(target: Path, backup_dir: Path = BACKUP_DIR) -> dict:
+    """
+    Ripristina in target il backup valido più recente.
+    Ritorna un report con esito, sorgente usata, tentativi falliti e tempi.
+    """
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+    attempts: list = []
+
+    result = _restore_from_snapshots(target, backup_dir, attempts)
+    if result is None:
+        result = _restore_from_legacy(target, backup_dir, attempts)
+
+    report = {
+        "ts": datetime.now().isoformat(timespec="seconds"),
+        "target": str(target),
+        "restored": result is not None,
+        **(result or {}),
+        "failed_attempts": attempts,
+        "elapsed_s": round(time.perf_counter() - t0, 3),
+    }
+    _log(report)
+    return report
+
+
+def restore_if_needed(db_path: Path, backup_dir: Path = BACKUP_DIR) -> dict | None:
+    """Ripristina solo se il DB manca o è vuoto; None se non serviva."""
+    db_path = Path(db_path)
+    if not needs_restore(db_path):
+        return None
+    # un file sotto MIN_DB_BYTES non contiene dati: lo sostituisce come faceva la copia diretta
+    db_path.unlink(missing_ok=True)
+    return restore_latest(db_path, backup_dir)
+
+
+def last_restores(n: int = 20) -> list[dict]:
+    """Ultimi report di ripristino (più recente in fondo)."""
+    if not RESTORE_LOG.exists():
+        return []
+    with open(RESTORE_LOG, encoding="utf-8") as f:
+        lines = f.readlines()[-n:]
+    return [json.loads(line) for line in lines if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ripristino verificato del DB ForgiaLean")
+    parser.add_argument("--target", type=Path, required=True)
+    parser.add_argument("--backup-dir", type=Path, default=BACKUP_DIR)
+    parser.add_argument("--force", action="store_true", help="ripristina anche se il DB esiste già")
+    args = parser.parse_args(argv)
+
+    if not args.force and not needs_restore(args.target):
+        print(f"ℹ️ {args.target} già presente, nessun ripristino (usa --force)")
+        return
+    report = restore_latest(args.target, args.backup_dir)
+    for a in report["failed_attempts"]:
+        print(f"❌ {a['source']}: {a['error']}")
+    if report["restored"]:
+        print(f"✅ Ripristinato da {report['source']} in {report['elapsed_s']:.2f}s")
+    else:
+        print("⚠️ Nessun backup valido trovato")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+# search_index.py
+"""
+Ricerca full-text (SQLite FTS5) su clienti, opportunità, attività e task CRM.
+
+Un'unica tabella virtuale search_fts(title, body) indicizza:
+    client       ragione sociale + email, P.IVA, settore, comune...
+    opportunity  nome + note, note prossima azione, fase, owner
+    crmactivity  oggetto + descrizione, esito, tipo, canale
+    crmtask      titolo + note, tipo
+Il rowid codifica entità e chiave (pk * 8 + codice entità): aggiornare o
+cancellare una riga dell'indice è un accesso per rowid, senza scansioni.
+
+Trigger fts_* AFTER INSERT / UPDATE OF <colonne testo> / DELETE tengono
+l'indice allineato a qualunque scrittura (sessioni, bulk, SQL diretto).
+Tokenizer unicode61 senza accenti ("attività" = "attivita"), ultima parola
+cercata come prefisso (ricerca mentre si scrive) espandendola nei primi
+SEARCH_PREFIX_TERMS termini del vocabolario, ordinamento bm25 con il
+titolo che pesa più del corpo. Per i termini molto comuni (oltre
+SEARCH_MAX_RANKED corrispondenze) niente bm25, che leggerebbe tutte le
+liste: si mostrano le corrispondenze più recenti, prima quelle nel titolo.
+
+Uso:
+    python search_index.py rebuild                 # ricostruisce l'indice
+    python search_index.py search "manutenzione pressa"
+    python search_index.py bench --rows 1000000    # DB sintetico, mai il DB reale
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sqlite3
+import statistics
+import time
+import unicodedata
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent
+DB_PATH = Path(os.getenv("FORGIALEAN_DB_PATH", BASE_DIR / "data" / "forgialean.db"))
+BENCH_DB_PATH = BASE_DIR / "data" / "forgialean_search_bench.db"
+
+SEARCH_TABLE = "search_fts"
+TRIGGER_PREFIX = "fts_"
+
+# Oltre questo numero di corrispondenze niente bm25: più recenti, prima il titolo
+SEARCH_MAX_RANKED = 2_000
+
+# Termini dell'indice in cui si espande l'ultima parola cercata (prefisso)
+SEARCH_PREFIX_TERMS = 8
+
+_ROWID_MULT = 8
+
+# entità -> codice nel rowid, tabella, chiave, colonna titolo, colonne corpo
+SEARCH_ENTITIES = {
+    "client": {
+        "code": 1,
+        "pk": "client_id",
+        "title": "ragione_sociale",
+        "body": ["email", "piva", "cod_fiscale", "settore", "comune", "provincia", "pec_fatturazione"],
+    },
+    "opportunity": {
+        "code": 2,
+        "pk": "opportunity_id",
+        "title": "nome_opportunita",
+        "body": ["note", "note_prossima_azione", "fase_pipeline", "owner", "tipo_prossima_azione"],
+    },
+    "crmactivity": {
+        "code": 3,
+        "pk": "activity_id",
+        "title": "oggetto",
+        "body": ["descrizione", "esito", "tipo", "canale"],
+    },
+    "crmtask": {
+        "code": 4,
+        "pk": "task_id",
+        "title": "titolo",
+        "body": ["note", "tipo"],
+    },
+}
+_ENTITY_BY_CODE = {e["code"]: name for name, e in SEARCH_ENTITIES.items()}
+
+# Contesto mostrato accanto ai risultati (una query per entità)
+_CONTEXT_SQL = {
+    "client": "SELECT client_id, coalesce(settore, '') FROM client WHERE client_id IN ({ids})",
+    "opportunity": (
+        "SELECT o.opportunity_id, coalesce(c.ragione_sociale, '') || ' · ' || coalesce(o.fase_pipeline, '') "
+        "FROM opportunity o LEFT JOIN client c ON c.client_id = o.client_id WHERE o.opportunity_id IN ({ids})"
+    ),
+    "crmactivity": (
+        "SELECT a.activity_id, coalesce(o.nome_opportunita, '') || ' · ' || coalesce(a.data_attivita, date(a.created_at)) "
+        "FROM crmactivity a LEFT JOIN opportunity o ON o.opportunity_id = a.opportunity_id WHERE a.activity_id IN ({ids})"
+    ),
+    "crmtask": (
+        "SELECT t.task_id, coalesce(o.nome_opportunita, '') || ' · scad. ' || t.data_scadenza "
+        "FROM crmtask t LEFT JOIN opportunity o ON o.opportunity_id = t.opportunity_id WHERE t.task_id IN ({ids})"
+    ),
+}
+
+# kind: nome dell'entità come token, per filtrare per entità dentro MATCH
+_FTS_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    "title, body, kind, tokenize = 'unicode61 remove_diacritics 2')"
+)
+
+# Vocabolario dell'indice (per istanza: lettura pigra, seek per termine)
+_VOCAB_DDL = f"CREATE VIRTUAL TABLE IF NOT EXISTS temp.search_vocab USING fts5vocab(main, {SEARCH_TABLE}, 'instance')"
+
+
+def _q(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+# ========================
+# TRIGGER E RICOSTRUZIONE
+# ========================
+
+def _entity_columns(conn) -> dict[str, dict]:
+    """Entità presenti nel DB, con le sole colonne corpo esistenti."""
+    out = {}
+    for table, spec in SEARCH_ENTITIES.items():
+        cols = {r[1] for r in conn.execute(f"PRAGMA table_info({_q(table)})")}
+        if spec["pk"] in cols and spec["title"] in cols:
+            out[table] = {**spec, "body": [c for c in spec["body"] if c in cols]}
+    return out
+
+
+def _exprs(alias: str, spec: dict) -> tuple[str, str, str]:
+    rowid = f"{alias}.{_q(spec['pk'])} * {_ROWID_MULT} + {spec['code']}"
+    title = f"coalesce({alias}.{_q(spec['title'])}, '')"
+    body = " || ' ' || ".join(f"coalesce({alias}.{_q(c)}, '')" for c in spec["body"]) or "''"
+    return rowid, title, body
+
+
+def trigger_statements(table: str, spec: dict) -> dict[str, str]:
+    """SQL dei trigger di una entità (nome trigger -> CREATE TRIGGER)."""
+    new_rowid, new_title, new_body = _exprs("NEW", spec)
+    old_rowid = _exprs("OLD", spec)[0]
+    # OR REPLACE: anche INSERT OR REPLACE sulla tabella sorgente (replica CDC) resta coerente
+    insert = (
+        f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, title, body, kind) "
+        f"VALUES ({new_rowid}, {new_title}, {new_body}, '{table}');"
+    )
+    delete = f"DELETE FROM {SEARCH_TABLE} WHERE rowid = {old_rowid};"
+    watched = ", ".join(_q(c) for c in [spec["pk"], spec["title"], *spec["body"]])
+    base = f"{TRIGGER_PREFIX}{table}"
+    return {
+        f"{base}_ai": f"CREATE TRIGGER {_q(base + '_ai')} AFTER INSERT ON {_q(table)} BEGIN {insert} END",
+        f"{base}_au": f"CREATE TRIGGER {_q(base + '_au')} AFTER UPDATE OF {watched} ON {_q(table)} BEGIN {delete} {insert} END",
+        f"{base}_ad": f"CREATE TRIGGER {_q(base + '_ad')} AFTER DELETE ON {_q(table)} BEGIN {delete} END",
+    }
+
+
+def rebuild_search_index(conn) -> int:
+    """Svuota e ripopola l'indice da tutte le entità (connessione sqlite3). Ritorna le righe."""
+    conn.execute(_FTS_DDL)
+    conn.execute(f"DELETE FROM {SEARCH_TABLE}")
+    total = 0
+    for table, spec in _entity_columns(conn).items():
+        rowid, title, body = _exprs("t", spec)
+        total += conn.execute(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, title, body, kind) "
+            f"SELECT {rowid}, {title}, {body}, '{table}' FROM {_q(table)} AS t"
+        ).rowcount
+    conn.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+    conn.commit()
+    return total
+
+
+def install_search_index(conn) -> dict:
+    """
+    Crea tabella FTS e trigger (connessione sqlite3). Ricrea solo i trigger il
+    cui SQL è cambiato; se la tabella è nuova (o con una definizione diversa)
+    o le colonne indicizzate sono cambiate ricostruisce l'indice.
+    Errore se SQLite non ha FTS5.
+    """
+    current = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (SEARCH_TABLE,)
+    ).fetchone()
+    is_new = current is None or current[0] != _FTS_DDL.replace(" IF NOT EXISTS", "")
+    if current is not None and is_new:
+        # definizione cambiata (colonne, tokenizer): trigger e tabella ricreati da zero
+        for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE ?", (TRIGGER_PREFIX + "%",)
+        ).fetchall():
+            conn.execute(f"DROP TRIGGER IF EXISTS {_q(name)}")
+        conn.execute(f"DROP TABLE {SEARCH_TABLE}")
+    conn.execute(_FTS_DDL)
+
+    existing = dict(conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE ?",
+        (TRIGGER_PREFIX + "%",),
+    ).fetchall())
+    wanted = {}
+    for table, spec in _entity_columns(conn).items():
+        wanted.update(trigger_statements(table, spec))
+
+    created = 0
+    for name, sql in wanted.items():
+        if existing.get(name) == sql:
+            continue
+        conn.execute(f"DROP TRIGGER IF EXISTS {_q(name)}")
+        conn.execute(sql)
+        created += 1
+    for name in existing.keys() - wanted.keys():
+        conn.execute(f"DROP TRIGGER IF EXISTS {_q(name)}")
+    conn.commit()
+
+    rows = rebuild_search_index(conn) if is_new or created else None
+    return {"created": is_new, "triggers": created, "rows": rows}
+
+
+# ========================
+# RICERCA
+# ========================
+
+def _fold(token: str) -> str:
+    """Come il tokenizer: minuscolo e senza accenti."""
+    s = unicodedata.normalize("NFKD", token.lower())
+    return "".join(ch for ch in s if not unicodedata.combining(ch))
+
+
+def _prefix_terms(conn, prefix: str, limit: int = SEARCH_PREFIX_TERMS) -> list[str]:
+    """
+    Primi `limit` termini dell'indice che iniziano con prefix, con un seek per
+    termine sul vocabolario: niente fusione delle liste di tutto l'intervallo
+    come farebbe "prefix"* su termini molto frequenti.
+    """
+    conn.execute(_VOCAB_DDL)
+    terms, cursor = [], prefix
+    while len(terms) < limit:
+        row = conn.execute(
+            "SELECT term FROM temp.search_vocab WHERE term >= ? AND term < ? LIMIT 1",
+            (cursor, prefix + "\U0010ffff"),
+        ).fetchone()
+        if row is None:
+            break
+        terms.append(row[0])
+        cursor = row[0] + "\x00"
+    return terms
+
+
+def build_match_query(conn, text: str, entities=None, columns: str = "title body") -> str | None:
+    """
+    'manutenz pressa' -> '{title body} : ("manutenz" AND ("pressa" OR "pressatura"))':
+    tutte le parole, l'ultima espansa nei termini che la estendono.
+    None se non c'è nulla da cercare (o l'ultima parola non ha corrispondenze).
+    """
+    tokens = [_fold(t) for t in re.findall(r"\w+", text or "")]
+    if not tokens:
+        return None
+    parts = [f'"{t}"' for t in tokens[:-1]]
+    last = tokens[-1]
+    if len(last) >= 2:
+        terms = _prefix_terms(conn, last)
+        if not terms:
+            return None
+        parts.append("(" + " OR ".join(f'"{t}"' for t in terms) + ")")
+    else:
+        parts.append(f'"{last}"')
+    match = "{" + columns + "} : (" + " AND ".join(parts) + ")"
+    if entities:
+        match = f"kind : ({' OR '.join(entities)}) AND {match}"
+    return match
+
+
+def search(conn, text: str, limit: int = 20, entities=None, max_ranked: int = SEARCH_MAX_RANKED) -> list[dict]:
+    """
+    Risultati ordinati per pertinenza:
+    [{entity, id, title, snippet, context, score}] (score bm25: più basso = migliore).
+
+    Con più di max_ranked corrispondenze bm25 costerebbe una scansione di tutte
+    (calcola la frequenza dei termini sull'intero indice): si prendono le
+    max_ranked più recenti, prima quelle con il testo nel titolo, e score è None.
+    """
+    entities = [e for e in entities or () if e in SEARCH_ENTITIES]
+    match = build_match_query(conn, text, entities)
+    if match is None:
+        return []
+
+    floor = conn.execute(
+        f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+        (match, max_ranked - 1),
+    ).fetchone()
+    if floor is None:
+        ranked = conn.execute(
+            f"SELECT rowid, bm25({SEARCH_TABLE}, 5.0, 1.0, 0.0) AS score FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH ? ORDER BY score LIMIT ?",
+            (match, limit),
+        ).fetchall()
+    else:
+        ranked = []
+        for q in (build_match_query(conn, text, entities, columns="title"), match):
+            seen = {r for r, _ in ranked}
+            ranked += [
+                (r, None)
+                for (r,) in conn.execute(
+                    f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH ? AND rowid >= ? "
+                    "ORDER BY rowid DESC LIMIT ?",
+                    (q, floor[0], limit),
+                )
+                if r not in seen
+            ]
+        ranked = ranked[:limit]
+    if not ranked:
+        return []
+
+    # snippet solo per i risultati mostrati (nella query di ranking verrebbe calcolato per ogni corrispondenza)
+    texts = {
+        rowid: (title, snippet)
+        for rowid, title, snippet in conn.execute(
+            f"SELECT rowid, title, snippet({SEARCH_TABLE}, 1, '**', '**', '…', 12) FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH ? AND rowid IN ({','.join(str(r) for r, _ in ranked)})",
+            (match,),
+        )
+    }
+    rows = [(rowid, *texts.get(rowid, ("", "")), score) for rowid, score in ranked]
+
+    hits = [
+        {
+            "entity": _ENTITY_BY_CODE.get(rowid % _ROWID_MULT, "?"),
+            "id": rowid // _ROWID_MULT,
+            "title": title,
+            "snippet": snippet,
+            "context": "",
+            "score": round(score, 3) if score is not None else None,
+        }
+        for rowid, title, snippet, score in rows
+    ]
+    for entity, sql in _CONTEXT_SQL.items():
+        ids = [h["id"] for h in hits if h["entity"] == entity]
+        if ids:
+            context = dict(conn.execute(sql.format(ids=",".join(map(str, ids)))).fetchall())
+            for h in hits:
+                if h["entity"] == entity:
+                    h["context"] = context.get(h["id"], "")
+    return hits
+
+
+def index_stats(conn) -> dict:
+    rows = conn.execute(
+        f"SELECT rowid % {_ROWID_MULT}, COUNT(*) FROM {SEARCH_TABLE} GROUP BY 1"
+    ).fetchall()
+    return {_ENTITY_BY_CODE.get(code, str(code)): n for code, n in rows}
+
+
+# ========================
+# BENCHMARK
+# ========================
+
+_BENCH_WORDS = (
+    "chiamata cliente offerta preventivo manutenzione pressa linea stampaggio ordine consegna "
+    "ritardo fermo macchina qualità scarti audit demo webinar follow-up contratto rinnovo sconto "
+    "listino ricambi saldatura collaudo fornitore logistica magazzino turno straordinario oee "
+    "setup attrezzaggio formazione sicurezza verifica campione riunione budget approvazione"
+).split()
+
+
+def _bench_rows(rng: random.Random, start_id: int, n: int, opp_ids: list[int]):
+    for i in range(start_id, start_id + n):
+        words = rng.choices(_BENCH_WORDS, k=rng.randint(8, 30))
+        words.insert(rng.randrange(len(words)), f"rif{i}")  # codice univoco per la query rara
+        yield (
+            i,
+            rng.choice(opp_ids),
+            rng.choice(["chiamata", "email", "meeting", "nota"]),
+            " ".join(rng.choices(_BENCH_WORDS, k=4)),
+            " ".join(words),
+            rng.choice(["interessato", "rimandare", "non_risponde", "risposta"]),
+        )
+
+
+def _timed(conn, query: str, repeat: int, **kwargs) -> tuple[float, int]:
+    times, n = [], 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        n = len(search(conn, query, **kwargs))
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times), n
+
+
+def run_benchmark(db_path: Path, rows: int, repeat: int = 20, seed: int = 42) -> dict:
+    """Aggiunge `rows` attività CRM sintetiche (trigger attivi) e misura ricerca e ricostruzione."""
+    conn = sqlite3.connect(db_path)
+    install_search_index(conn)
+    rng = random.Random(seed)
+    opp_ids = [r[0] for r in conn.execute("SELECT opportunity_id FROM opportunity")] or [1]
+    start_id = (conn.execute("SELECT MAX(activity_id) FROM crmactivity").fetchone()[0] or 0) + 1
+
+    t0 = time.perf_counter()
+    batch = 50_000
+    for off in range(0, rows, batch):
+        conn.executemany(
+            "INSERT INTO crmactivity (activity_id, opportunity_id, tipo, oggetto, descrizione, esito, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, datetime('now'))",
+            _bench_rows(rng, start_id + off, min(batch, rows - off), opp_ids),
+        )
+        conn.commit()
+    insert_s = time.perf_counter() - t0
+    total = conn.execute(f"SELECT COUNT(*) FROM {SEARCH_TABLE}").fetchone()[0]
+
+    queries = {
+        "rara (codice univoco)": (f"rif{start_id + rows // 2}", {}),
+        "comune (1 termine)": ("manutenzione", {}),
+        "due termini": ("fermo pressa", {}),
+        "prefisso": ("attrezz", {}),
+        "comune, solo clienti": ("manutenzione", {"entities": ["client"]}),
+    }
+    results = {}
+    for label, (q, kwargs) in queries.items():
+        ms, n = _timed(conn, q, repeat, **kwargs)
+        results[label] = {"query": q, "median_ms": round(ms, 2), "hits": n}
+
+    t0 = time.perf_counter()
+    rebuilt = rebuild_search_index(conn)
+    rebuild_s = time.perf_counter() - t0
+    conn.close()
+    return {
+        "rows_added": rows,
+        "index_rows": total,
+        "insert_rows_per_s": round(rows / insert_s) if insert_s else None,
+        "queries": results,
+        "rebuild_rows": rebuilt,
+        "rebuild_s": round(rebuild_s, 2),
+    }
+
+
+# ========================
+# CLI
+# ========================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ricerca full-text ForgiaLean (FTS5)")
+    parser.add_argument("--db", type=Path, default=None)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("rebuild", help="crea/ricostruisce indice e trigger")
+    p_search = sub.add_parser("search", help="cerca dal terminale")
+    p_search.add_argument("text")
+    p_search.add_argument("--limit", type=int, default=20)
+    p_bench = sub.add_parser("bench", help="benchmark su DB sintetico")
+    p_bench.add_argument("--rows", type=int, default=1_000_000)
+    p_bench.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "bench":
+        db_path = args.db or BENCH_DB_PATH
+        if db_path.resolve() == DB_PATH.resolve():
+            raise SystemExit("⚠️ Il benchmark non gira sul DB reale")
+        if not db_path.exists():
+            os.environ["FORGIALEAN_DB_PATH"] = str(db_path)
+            import synthetic_data
+
+            print(f"🔧 Genero DB sintetico in {db_path} ...")
+            synthetic_data.generate(db_path, scale=1)
+        print(f"⏱️ Benchmark ricerca: +{args.rows} attività su {db_path}")
+        print(json.dumps(run_benchmark(db_path, args.rows, args.repeat), indent=2, ensure_ascii=False))
+        return
+
+    conn = sqlite3.connect(args.db or DB_PATH)
+    if args.cmd == "rebuild":
+        t0 = time.perf_counter()
+        install_search_index(conn)
+        n = rebuild_search_index(conn)
+        print(f"✅ Indice ricerca ricostruito: {n} righe in {time.perf_counter() - t0:.2f}s {index_stats(conn)}")
+    elif args.cmd == "search":
+        for h in search(conn, args.text, limit=args.limit):
+            print(f"[{h['entity']} #{h['id']}] {h['title']} – {h['snippet']} ({h['context']})")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
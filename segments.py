@@ -0,0 +1,443 @@
+# segments.py
+"""
+Motore di segmentazione CRM su bitset NumPy.
+
+Per ogni tag (e per alcuni predicati sulle opportunità) l'indice tiene un
+bitset di client_id: il bit i è acceso se il cliente i ha quel tag.
+I bitset sono array uint64 (64 clienti per parola): AND/OR/NOT tra segmenti
+sono operazioni vettoriali su qualche migliaio di parole anche con 100k
+contatti.
+
+Espressioni (maiuscole/minuscole indifferenti per gli operatori):
+    tag:"Lead caldo" AND NOT tag:Newsletter
+    (tag:Webinar OR tag:Fiera) AND opp:stato=aperta
+    opp:fase="Offerta" AND NOT opp:stato=vinta
+    opp:any / tutti
+
+L'indice si aggiorna in modo incrementale leggendo il journal CDC
+(contacttag, opportunity, client) dalla sequenza già applicata; se il
+journal non c'è o ha un buco viene ricostruito. Senza journal le scritture
+ORM dell'app su queste tabelle invalidano l'indice al commit; il TTL
+SEGMENT_INDEX_TTL_S copre le modifiche fatte fuori dall'app.
+
+Uso:
+    from segments import resolve_segment
+    client_ids = resolve_segment('tag:"Cliente attivo" AND NOT opp:stato=persa')
+"""
+
+import json
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from cdc_journal import JOURNAL_TABLE, index_snapshot, installed_journal_seq, sync_index
+from db import SEGMENT_DATA_CHANGED, Client, ContactTag, Opportunity, Tag, engine
+
+# Senza journal CDC l'indice viene ricostruito al massimo ogni N secondi
+SEGMENT_INDEX_TTL_S = 60
+
+_WORD_BITS = 64
+
+_INDEX: dict = {
+    "built": False,
+    "seq": None,           # ultima seq CDC applicata (None = journal non disponibile)
+    "built_at": 0.0,
+    "universe": None,      # bitset dei client esistenti
+    "tags": {},            # tag_id -> bitset
+    "tag_names": {},       # nome minuscolo -> tag_id
+    "ct_pair": {},         # contacttag.id -> (contact_id, tag_id)
+    "opp_rows": {},        # opportunity_id -> (client_id, stato, fase)
+    "opp": {},             # chiave predicato -> bitset
+}
+_INDEX_LOCK = threading.Lock()
+
+
+# ========================
+# BITSET
+# ========================
+
+def _empty(n_words: int) -> np.ndarray:
+    return np.zeros(n_words, dtype=np.uint64)
+
+
+def _grow(bits: np.ndarray, n_words: int) -> np.ndarray:
+    if len(bits) >= n_words:
+        return bits
+    out = _empty(n_words)
+    out[: len(bits)] = bits
+    return out
+
+
+def _n_words(max_id: int) -> int:
+    return max_id // _WORD_BITS + 1
+
+
+def _bits_from_ids(ids: np.ndarray, n_words: int) -> np.ndarray:
+    bits = _empty(n_words)
+    if len(ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        np.bitwise_or.at(bits, ids >> 6, np.left_shift(np.uint64(1), (ids & 63).astype(np.uint64)))
+    return bits
+
+
+def _set_bit(bits: np.ndarray, i: int, on: bool) -> None:
+    mask = np.uint64(1) << np.uint64(i & 63)
+    if on:
+        bits[i >> 6] |= mask
+    else:
+        bits[i >> 6] &= ~mask
+
+
+def bits_to_ids(bits: np.ndarray) -> np.ndarray:
+    """client_id accesi nel bitset, in ordine crescente."""
+    return np.flatnonzero(np.unpackbits(bits.view(np.uint8), bitorder="little"))
+
+
+def bits_count(bits: np.ndarray) -> int:
+    return int(np.unpackbits(bits.view(np.uint8)).sum())
+
+
+# ========================
+# COSTRUZIONE INDICE
+# ========================
+
+def _opp_keys(stato, fase) -> list[str]:
+    keys = ["any"]
+    if stato:
+        keys.append(f"stato={str(stato).lower()}")
+    if fase:
+        keys.append(f"fase={str(fase).lower()}")
+    return keys
+
+
+def _rebuild(conn) -> None:
+    seq = installed_journal_seq(conn)
+    client_ids = np.array([r[0] for r in conn.execute("SELECT client_id FROM client")], dtype=np.int64)
+    ct_rows = conn.execute("SELECT id, contact_id, tag_id FROM contacttag").fetchall()
+    opp_rows = conn.execute(
+        "SELECT opportunity_id, client_id, stato_opportunita, fase_pipeline FROM opportunity"
+    ).fetchall()
+    tag_rows = conn.execute("SELECT tag_id, nome FROM tag").fetchall()
+
+    ct = np.array([(r[1], r[2]) for r in ct_rows if r[1] is not None and r[2] is not None],
+                  dtype=np.int64).reshape(-1, 2)
+    opp_cids = np.array([r[1] if r[1] is not None else -1 for r in opp_rows], dtype=np.int64)
+    max_id = max(
+        int(client_ids.max()) if len(client_ids) else 0,
+        int(ct[:, 0].max()) if len(ct) else 0,
+        int(opp_cids.max()) if len(opp_cids) else 0,
+    )
+    n = _n_words(max_id)
+
+    # un bitset per tag: coppie ordinate per tag e spezzate sui cambi di tag_id
+    tags = {}
+    if len(ct):
+        ct = ct[np.argsort(ct[:, 1], kind="stable")]
+        tag_ids, starts = np.unique(ct[:, 1], return_index=True)
+        for tag_id, ids in zip(tag_ids, np.split(ct[:, 0], starts[1:])):
+            tags[int(tag_id)] = _bits_from_ids(ids, n)
+
+    opp = {}
+    df_opp = pd.DataFrame(opp_rows, columns=["opportunity_id", "client_id", "stato", "fase"])
+    df_opp = df_opp[df_opp["client_id"].notna()]
+    if not df_opp.empty:
+        opp["any"] = _bits_from_ids(df_opp["client_id"].to_numpy(np.int64), n)
+        for field in ("stato", "fase"):
+            for value, ids in df_opp.groupby(df_opp[field].str.lower())["client_id"]:
+                if value:
+                    opp[f"{field}={value}"] = _bits_from_ids(ids.to_numpy(np.int64), n)
+
+    _INDEX.update(
+        built=True,
+        seq=seq,
+        built_at=time.monotonic(),
+        universe=_bits_from_ids(client_ids, n),
+        tags=tags,
+        tag_names={str(nome).lower(): tid for tid, nome in tag_rows},
+        ct_pair={r[0]: (r[1], r[2]) for r in ct_rows},
+        opp_rows={r[0]: (r[1], r[2], r[3]) for r in opp_rows},
+        opp=opp,
+    )
+
+
+def _ensure_words(n: int) -> None:
+    _INDEX["universe"] = _grow(_INDEX["universe"], n)
+    for d in (_INDEX["tags"], _INDEX["opp"]):
+        for k in d:
+            d[k] = _grow(d[k], n)
+
+
+def _refresh_opp_clients(conn, client_ids: set) -> None:
+    """Ricalcola i bit opportunità dei clienti toccati (stato/fase/cliente cambiati)."""
+    client_ids = {c for c in client_ids if c is not None}
+    if not client_ids:
+        return
+    _ensure_words(_n_words(max(client_ids)))
+    for bits in _INDEX["opp"].values():
+        for cid in client_ids:
+            _set_bit(bits, cid, False)
+    n = len(_INDEX["universe"])
+    for cid, stato, fase in _INDEX["opp_rows"].values():
+        if cid in client_ids:
+            for k in _opp_keys(stato, fase):
+                bits = _INDEX["opp"].get(k)
+                if bits is None:
+                    bits = _INDEX["opp"][k] = _empty(n)
+                _set_bit(bits, cid, True)
+
+
+def _apply_journal(conn, after_seq: int) -> int:
+    rows = conn.execute(
+        f"SELECT seq, table_name, op, pk, row_json FROM {JOURNAL_TABLE} "
+        "WHERE seq > ? AND table_name IN ('contacttag', 'opportunity', 'client', 'tag') ORDER BY seq",
+        (after_seq,),
+    ).fetchall()
+    touched_opp_clients: set = set()
+    removed_pairs: set = set()
+    for seq, table, op, pk, row_json in rows:
+        key = next(iter(json.loads(pk).values()))
+        row = json.loads(row_json) if row_json else None
+        if table == "client":
+            _ensure_words(_n_words(key))
+            _set_bit(_INDEX["universe"], key, op != "D")
+        elif table == "tag":
+            _INDEX["tag_names"] = {n: t for n, t in _INDEX["tag_names"].items() if t != key}
+            if op != "D":
+                _INDEX["tag_names"][str(row["nome"]).lower()] = key
+        elif table == "contacttag":
+            old = _INDEX["ct_pair"].pop(key, None)
+            if old is not None:
+                removed_pairs.add(old)
+            if op != "D" and row["contact_id"] is not None:
+                pair = (row["contact_id"], row["tag_id"])
+                _INDEX["ct_pair"][key] = pair
+                removed_pairs.discard(pair)
+                _ensure_words(_n_words(pair[0]))
+                bits = _INDEX["tags"].get(pair[1])
+                if bits is None:
+                    bits = _INDEX["tags"][pair[1]] = _empty(len(_INDEX["universe"]))
+                _set_bit(bits, pair[0], True)
+        elif table == "opportunity":
+            old = _INDEX["opp_rows"].pop(key, None)
+            if old is not None:
+                touched_opp_clients.add(old[0])
+            if op != "D":
+                _INDEX["opp_rows"][key] = (row["client_id"], row.get("stato_opportunita"), row.get("fase_pipeline"))
+                touched_opp_clients.add(row["client_id"])
+        after_seq = seq
+
+    # un bit si spegne solo se non resta un'altra riga con la stessa coppia (duplicati)
+    if removed_pairs:
+        remaining = set(_INDEX["ct_pair"].values())
+        for cid, tag_id in removed_pairs:
+            if (cid, tag_id) not in remaining and tag_id in _INDEX["tags"]:
+                _set_bit(_INDEX["tags"][tag_id], cid, False)
+    _refresh_opp_clients(conn, touched_opp_clients)
+    return after_seq
+
+
+def refresh_index() -> dict:
+    """Allinea l'indice al DB (incrementale se possibile). Ritorna lo stato."""
+    with index_snapshot(engine) as conn, _INDEX_LOCK:
+        sync_index(conn, _INDEX, _rebuild, _apply_journal, SEGMENT_INDEX_TTL_S)
+        return index_stats()
+
+
+def index_stats() -> dict:
+    universe = _INDEX["universe"]
+    return {
+        "clients": bits_count(universe) if universe is not None else 0,
+        "tags": len(_INDEX["tags"]),
+        "opp_predicates": len(_INDEX["opp"]),
+        "bytes": sum(b.nbytes for b in _INDEX["tags"].values()) + sum(b.nbytes for b in _INDEX["opp"].values()),
+        "seq": _INDEX["seq"],
+    }
+
+
+def invalidate_index() -> None:
+    with _INDEX_LOCK:
+        _INDEX["built"] = False
+
+
+_SEGMENT_MODELS = (Client, ContactTag, Opportunity, Tag)
+
+
+@event.listens_for(Session, "after_flush")
+def _on_flush(session, flush_context):
+    changed = (*session.new, *session.dirty, *session.deleted)
+    if any(isinstance(obj, _SEGMENT_MODELS) for obj in changed):
+        session.info[SEGMENT_DATA_CHANGED] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _on_commit(session):
+    # con il journal l'indice si aggiorna da solo, in modo incrementale
+    if session.info.pop(SEGMENT_DATA_CHANGED, False) and _INDEX["seq"] is None:
+        invalidate_index()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _on_rollback(session, previous_transaction):
+    session.info.pop(SEGMENT_DATA_CHANGED, None)
+
+
+# ========================
+# ESPRESSIONI
+# ========================
+
+_TOKEN_RE = re.compile(
+    r'\s*(?:(?P<lpar>\()|(?P<rpar>\))|(?P<op>AND|OR|NOT)\b|'
+    r'(?P<atom>(?:tag|opp):(?:"[^"]*"|[^\s()"=]+)(?:=(?:"[^"]*"|[^\s()"]+))?|tutti|all))',
+    re.IGNORECASE,
+)
+
+
+def _tokenize(expr: str) -> list[tuple[str, str]]:
+    tokens, pos = [], 0
+    expr = expr.strip()
+    while pos < len(expr):
+        m = _TOKEN_RE.match(expr, pos)
+        if not m or m.end() == pos:
+            raise ValueError(f"Espressione non valida vicino a: '{expr[pos:pos + 20]}'")
+        kind = m.lastgroup
+        tokens.append((kind, m.group(kind)))
+        pos = m.end()
+        while pos < len(expr) and expr[pos].isspace():
+            pos += 1
+    return tokens
+
+
+def _unquote(s: str) -> str:
+    return s[1:-1] if len(s) >= 2 and s[0] == s[-1] == '"' else s
+
+
+def _atom_bits(atom: str) -> np.ndarray:
+    n = len(_INDEX["universe"])
+    a = atom.lower()
+    if a in ("tutti", "all"):
+        return _INDEX["universe"].copy()
+    kind, _, rest = atom.partition(":")
+    kind = kind.lower()
+    if kind == "tag":
+        name = _unquote(rest)
+        tag_id = int(name) if name.isdigit() else _INDEX["tag_names"].get(name.lower())
+        if tag_id is None:
+            raise ValueError(f"Tag non trovato: {name}")
+        return _grow(_INDEX["tags"].get(tag_id, _empty(n)), n)
+    # opp:any / opp:stato=... / opp:fase=...
+    field, _, value = rest.partition("=")
+    key = field.lower() if not value else f"{field.lower()}={_unquote(value).lower()}"
+    if field.lower() not in ("any", "stato", "fase"):
+        raise ValueError(f"Predicato opportunità non supportato: {atom}")
+    return _grow(_INDEX["opp"].get(key, _empty(n)), n)
+
+
+def _evaluate(tokens: list, pos: int = 0) -> tuple[np.ndarray, int]:
+    """expr := term (OR term)* ; term := factor (AND factor)* ; factor := NOT factor | (expr) | atom"""
+
+    def factor(p):
+        if p >= len(tokens):
+            raise ValueError("Espressione incompleta")
+        kind, val = tokens[p]
+        if kind == "op" and val.upper() == "NOT":
+            bits, p = factor(p + 1)
+            return _INDEX["universe"] & ~bits, p
+        if kind == "lpar":
+            bits, p = expr(p + 1)
+            if p >= len(tokens) or tokens[p][0] != "rpar":
+                raise ValueError("Parentesi non chiusa")
+            return bits, p + 1
+        if kind == "atom":
+            return _atom_bits(val), p + 1
+        raise ValueError(f"Token inatteso: {val}")
+
+    def term(p):
+        bits, p = factor(p)
+        while p < len(tokens) and tokens[p][0] == "op" and tokens[p][1].upper() == "AND":
+            other, p = factor(p + 1)
+            bits = bits & other
+        return bits, p
+
+    def expr(p):
+        bits, p = term(p)
+        while p < len(tokens) and tokens[p][0] == "op" and tokens[p][1].upper() == "OR":
+            other, p = term(p + 1)
+            bits = bits | other
+        return bits, p
+
+    return expr(pos)
+
+
+def evaluate_bits(expression: str) -> np.ndarray:
+    """Bitset dei clienti che soddisfano l'espressione (indice già aggiornato)."""
+    tokens = _tokenize(expression)
+    if not tokens:
+        raise ValueError("Espressione vuota")
+    with _INDEX_LOCK:
+        bits, pos = _evaluate(tokens)
+        if pos != len(tokens):
+            raise ValueError(f"Token inatteso: {tokens[pos][1]}")
+        return bits & _INDEX["universe"]
+
+
+def resolve_segment(expression: str) -> np.ndarray:
+    """client_id del segmento (array ordinato), con indice riallineato al DB."""
+    refresh_index()
+    return bits_to_ids(evaluate_bits(expression))
+
+
+# ========================
+# RIGHE DEL SEGMENTO
+# ========================
+
+# Anagrafica + numero opportunità dei soli clienti del segmento
+_ROWS_SQL = """
+    SELECT c.client_id, c.ragione_sociale, c.email, COUNT(o.opportunity_id) AS num_opps
+    FROM client c
+    LEFT JOIN opportunity o ON o.client_id = c.client_id
+    WHERE c.client_id IN (SELECT value FROM json_each(?))
+    GROUP BY c.client_id
+    ORDER BY c.ragione_sociale
+"""
+_ROWS_CACHE_MAX = 32
+_ROWS_CACHE: dict = {"version": None, "frames": {}}
+
+
+def segment_version() -> tuple:
+    """Cambia a ogni modifica applicata dal journal o ricostruzione dell'indice."""
+    return (_INDEX["seq"], _INDEX["built_at"])
+
+
+def segment_clients(expression: str, client_ids: np.ndarray) -> pd.DataFrame:
+    """
+    Clienti del segmento (client_id, ragione_sociale, email, num_opps) letti solo
+    per gli id risolti; in cache per espressione finché la versione dell'indice non cambia.
+    """
+    version = segment_version()
+    if _ROWS_CACHE["version"] != version:
+        _ROWS_CACHE["version"], _ROWS_CACHE["frames"] = version, {}
+    frames = _ROWS_CACHE["frames"]
+    df = frames.get(expression)
+    if df is None:
+        raw = engine.raw_connection()
+        try:
+            df = pd.read_sql_query(
+                _ROWS_SQL, raw.driver_connection, params=(json.dumps(client_ids.tolist()),)
+            )
+        finally:
+            raw.close()
+        if len(frames) >= _ROWS_CACHE_MAX:
+            frames.clear()
+        frames[expression] = df
+    return df
+
+
+def tag_expression(tag_names: list[str], mode: str = "AND") -> str:
+    """Espressione per una lista di tag (tutti = AND, almeno uno = OR)."""
+    joiner = f" {mode} "
+    return joiner.join(f'tag:"{n}"' for n in tag_names)
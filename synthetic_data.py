@@ -0,0 +1,503 @@
+# synthetic_data.py
+"""
+Generatore di dati sintetici (riproducibili) per load-test e benchmark.
+
+Riempie un database SQLite SEPARATO con clienti, opportunità, task CRM,
+fatture, pagamenti, spese, timesheet e serie KPI, scalabili con un
+fattore (1x, 10x, 100x). Stesso seed => stessi dati.
+
+Uso:
+    python synthetic_data.py --scale 10 --seed 42
+    python synthetic_data.py --scale 100 --db data/forgialean_bench_100x.db
+
+Per puntare l'app (o benchmark.py) al DB generato:
+    FORGIALEAN_DB_PATH=data/forgialean_bench_10x.db streamlit run forgialean_ai_control_tower.py
+"""
+
+import argparse
+import random
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlmodel import SQLModel
+
+from db import (
+    DATA_DIR,
+    Client,
+    MarketingCampaign,
+    Opportunity,
+    CrmTask,
+    CrmActivity,
+    CrmAutomationRule,
+    Invoice,
+    Payment,
+    ProjectCommessa,
+    TaskFase,
+    TimeEntry,
+    Department,
+    Employee,
+    KpiDepartmentTimeseries,
+    KpiEmployeeTimeseries,
+    TaxConfig,
+    InpsContribution,
+    TaxDeadline,
+    Vendor,
+    ExpenseCategory,
+    Account,
+    Expense,
+    Tag,
+    ContactTag,
+)
+
+# Dimensioni a scala 1x (moltiplicate per --scale)
+BASE_SIZES = {
+    "clients": 200,
+    "campaigns": 10,
+    "opportunities": 400,
+    "crm_tasks": 800,
+    "crm_activities": 1200,
+    "invoices": 600,
+    "vendors": 30,
+    "expenses": 800,
+    "commesse": 40,
+    "employees": 30,
+    "time_entries": 5000,
+}
+
+# Dimensioni fisse (non scalano)
+DEPARTMENTS = ["Produzione", "Qualità", "Logistica", "Ufficio tecnico", "Amministrazione"]
+EXPENSE_CATEGORIES = ["Software", "Viaggi", "Formazione", "Affitti", "Marketing", "Consulenze", "Utenze", "Attrezzature"]
+TAGS = [
+    ("Lead Source: LinkedIn", "Lead Source"),
+    ("Lead Source: Google Ads", "Lead Source"),
+    ("Lead Source: Referral", "Lead Source"),
+    ("Interesse: OEE", "Interesse"),
+    ("Interesse: Lean", "Interesse"),
+    ("Interesse: Formazione", "Interesse"),
+    ("Interesse: Dashboard KPI", "Interesse"),
+    ("Stato Funnel: MQL", "Stato Funnel"),
+    ("Stato Funnel: SQL", "Stato Funnel"),
+    ("Stato Funnel: Cliente", "Stato Funnel"),
+    ("Settore: Metalmeccanico", "Settore"),
+    ("Settore: Elettronica", "Settore"),
+]
+KPI_DEPARTMENT = [("OEE", 75.0, "%"), ("Scarti", 2.0, "%"), ("Lead time", 5.0, "gg")]
+KPI_EMPLOYEE = [("Produttività", 90.0, "%"), ("Ore formazione", 4.0, "h")]
+
+FASI_STANDARD = ["Analisi", "Progettazione", "Implementazione", "Follow-up"]
+FASI_PIPELINE = [
+    "Lead pre-qualificato (MQL)",
+    "Lead qualificato (SQL)",
+    "Lead",
+    "Offerta",
+    "Negoziazione",
+    "Vinta",
+    "Persa",
+]
+SETTORI = ["Metalmeccanico", "Elettronica", "Alimentare", "Plastica", "Packaging", "Automotive", "Servizi"]
+CANALI = ["google_ads", "meta_ads", "linkedin", "email", "organico", "referral"]
+NOMI = ["Luca", "Marco", "Giulia", "Sara", "Paolo", "Anna", "Davide", "Elena", "Matteo", "Chiara", "Andrea", "Francesca"]
+COGNOMI = ["Rossi", "Bianchi", "Verdi", "Russo", "Ferrari", "Esposito", "Romano", "Colombo", "Ricci", "Marino", "Greco", "Bruno"]
+SUFFISSI = ["S.r.l.", "S.p.A.", "S.n.c.", "S.a.s."]
+
+PRODUCTION_DB = (DATA_DIR / "forgialean.db").resolve()
+
+
+def default_db_path(scale: int) -> Path:
+    return DATA_DIR / f"forgialean_bench_{scale}x.db"
+
+
+def _rand_date(rng: random.Random, start: date, end: date) -> date:
+    return start + timedelta(days=rng.randint(0, max((end - start).days, 0)))
+
+
+def _bulk_insert(conn, model, rows: list[dict]) -> int:
+    if rows:
+        conn.execute(model.__table__.insert(), rows)
+    return len(rows)
+
+
+def generate(db_path: Path, scale: int = 1, seed: int = 42, years: int = 3) -> dict:
+    """
+    Crea (da zero) il DB sintetico in db_path e restituisce i conteggi per tabella.
+    Gli id sono assegnati in sequenza, così le FK non richiedono round-trip.
+    """
+    db_path = Path(db_path)
+    if db_path.resolve() == PRODUCTION_DB:
+        raise ValueError(f"Rifiuto di scrivere dati sintetici sul DB applicativo: {db_path}")
+
+    rng = random.Random(seed)
+    n = {k: max(1, v * scale) for k, v in BASE_SIZES.items()}
+
+    today = date.today()
+    start = date(today.year - years + 1, 1, 1)
+    end = date(today.year, 12, 31)
+
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    if db_path.exists():
+        db_path.unlink()
+    eng = create_engine(f"sqlite:///{db_path}", echo=False)
+    SQLModel.metadata.create_all(eng)
+
+    counts = {}
+    with eng.begin() as conn:
+        # ---------- Anagrafiche base ----------
+        counts["department"] = _bulk_insert(conn, Department, [
+            {"department_id": i, "nome_reparto": nome, "responsabile": f"{rng.choice(NOMI)} {rng.choice(COGNOMI)}"}
+            for i, nome in enumerate(DEPARTMENTS, start=1)
+        ])
+
+        employees = []
+        for i in range(1, n["employees"] + 1):
+            employees.append({
+                "employee_id": i,
+                "nome": rng.choice(NOMI),
+                "cognome": f"{rng.choice(COGNOMI)}{i}",
+                "ruolo": rng.choice(["Operatore", "Capoturno", "Tecnico", "Impiegato"]),
+                "department_id": rng.randint(1, len(DEPARTMENTS)),
+                "data_assunzione": _rand_date(rng, date(2010, 1, 1), start),
+                "stato": "attivo",
+            })
+        counts["employee"] = _bulk_insert(conn, Employee, employees)
+
+        counts["expensecategory"] = _bulk_insert(conn, ExpenseCategory, [
+            {"category_id": i, "nome": nome, "deducibilita_perc": 1.0}
+            for i, nome in enumerate(EXPENSE_CATEGORIES, start=1)
+        ])
+        counts["account"] = _bulk_insert(conn, Account, [
+            {"account_id": 1, "nome": "Conto corrente", "tipo": "bank", "saldo_iniziale": 20000.0, "valuta": "EUR"},
+            {"account_id": 2, "nome": "Carta credito", "tipo": "card", "saldo_iniziale": 0.0, "valuta": "EUR"},
+        ])
+        counts["tag"] = _bulk_insert(conn, Tag, [
+            {"tag_id": i, "nome": nome, "categoria": cat}
+            for i, (nome, cat) in enumerate(TAGS, start=1)
+        ])
+
+        # ---------- Clienti e tag ----------
+        clients = []
+        client_delay = {}  # ritardo medio di incasso per cliente (giorni)
+        for i in range(1, n["clients"] + 1):
+            settore = rng.choice(SETTORI)
+            nome = f"{rng.choice(COGNOMI)} {settore} {i} {rng.choice(SUFFISSI)}"
+            clients.append({
+                "client_id": i,
+                "ragione_sociale": nome,
+                "email": f"info@cliente{i}.it",
+                "piva": f"{rng.randint(0, 99999999999):011d}",
+                "settore": settore,
+                "paese": "IT",
+                "canale_acquisizione": rng.choice(CANALI),
+                "segmento_cliente": rng.choice(["PMI", "Mid-market", "Enterprise"]),
+                "data_creazione": _rand_date(rng, start, today),
+                "stato_cliente": rng.choice(["attivo", "prospect", "prospect", "perso"]),
+                "comune": "Bologna",
+                "provincia": "BO",
+            })
+            client_delay[i] = rng.choice([0, 15, 30, 30, 45, 60, 90])
+        counts["client"] = _bulk_insert(conn, Client, clients)
+
+        contact_tags = []
+        for cid in range(1, n["clients"] + 1):
+            for tag_id in rng.sample(range(1, len(TAGS) + 1), rng.randint(0, 4)):
+                contact_tags.append({
+                    "contact_id": cid,
+                    "tag_id": tag_id,
+                    "created_at": datetime.combine(_rand_date(rng, start, today), datetime.min.time()),
+                })
+        counts["contacttag"] = _bulk_insert(conn, ContactTag, contact_tags)
+
+        # ---------- Campagne e opportunità ----------
+        campaigns = []
+        for i in range(1, n["campaigns"] + 1):
+            d0 = _rand_date(rng, start, today)
+            campaigns.append({
+                "campaign_id": i,
+                "nome": f"Campagna {i} – {rng.choice(['OEE', 'Lean', 'Webinar', 'Fiera'])}",
+                "tipo": rng.choice(["ads", "email", "referral", "evento"]),
+                "canale": rng.choice(CANALI),
+                "data_inizio": d0,
+                "data_fine": d0 + timedelta(days=rng.randint(14, 120)),
+                "budget_previsto": float(rng.randrange(500, 20000, 100)),
+            })
+        counts["marketingcampaign"] = _bulk_insert(conn, MarketingCampaign, campaigns)
+
+        opportunities = []
+        for i in range(1, n["opportunities"] + 1):
+            fase = rng.choice(FASI_PIPELINE)
+            stato = {"Vinta": "vinta", "Persa": "persa"}.get(fase, "aperta")
+            d_open = _rand_date(rng, start, today)
+            step = FASI_PIPELINE.index(fase) if fase != "Persa" else rng.randint(0, 4)
+            flags = {
+                "form_oee_completed": step >= 1 or rng.random() < 0.7,
+                "form_call_completed": step >= 1,
+                "demo_scheduled": step >= 3,
+                "contract_sent": step >= 4,
+                "contract_signed": stato == "vinta",
+            }
+            points = (
+                10 * flags["form_oee_completed"] + 20 * flags["form_call_completed"]
+                + 30 * flags["demo_scheduled"] + 40 * flags["contract_sent"] + 100 * flags["contract_signed"]
+            )
+            opportunities.append({
+                "opportunity_id": i,
+                "client_id": rng.randint(1, n["clients"]),
+                "nome_opportunita": f"Progetto {rng.choice(['OEE', 'Lean', 'SMED', 'Kaizen', 'Dashboard'])} #{i}",
+                "fase_pipeline": fase,
+                "owner": "Marian Dutu",
+                "valore_stimato": float(rng.randrange(2000, 60000, 500)),
+                "probabilita": float(rng.choice([10, 20, 40, 60, 80, 100 if stato == "vinta" else 0])),
+                "data_apertura": d_open,
+                "data_chiusura_prevista": d_open + timedelta(days=rng.randint(15, 120)),
+                "data_prossima_azione": (
+                    _rand_date(rng, today - timedelta(days=30), today + timedelta(days=30))
+                    if stato == "aperta" and rng.random() < 0.8 else None
+                ),
+                "stato_opportunita": stato,
+                "campaign_id": rng.randint(1, n["campaigns"]) if rng.random() < 0.6 else None,
+                "flame_points": points,
+                **flags,
+                "date_form_oee": d_open if flags["form_oee_completed"] else None,
+                "date_form_call": d_open + timedelta(days=3) if flags["form_call_completed"] else None,
+                "date_demo": d_open + timedelta(days=10) if flags["demo_scheduled"] else None,
+                "date_contract_sent": d_open + timedelta(days=20) if flags["contract_sent"] else None,
+                "date_contract_signed": d_open + timedelta(days=30) if flags["contract_signed"] else None,
+            })
+        counts["opportunity"] = _bulk_insert(conn, Opportunity, opportunities)
+
+        tasks = []
+        for i in range(1, n["crm_tasks"] + 1):
+            created = datetime.combine(_rand_date(rng, start, today), datetime.min.time())
+            tasks.append({
+                "task_id": i,
+                "opportunity_id": rng.randint(1, n["opportunities"]),
+                "titolo": rng.choice(["Richiamare", "Inviare offerta", "Demo", "Follow-up email"]),
+                "tipo": rng.choice(["telefonata", "email", "demo", "meeting"]),
+                "data_scadenza": created.date() + timedelta(days=rng.randint(0, 30)),
+                "stato": rng.choice(["da_fare", "fatto", "fatto", "posticipato"]),
+                "created_at": created,
+                "updated_at": created,
+            })
+        counts["crmtask"] = _bulk_insert(conn, CrmTask, tasks)
+
+        activities = []
+        for i in range(1, n["crm_activities"] + 1):
+            d = _rand_date(rng, start, today)
+            activities.append({
+                "activity_id": i,
+                "opportunity_id": rng.randint(1, n["opportunities"]),
+                "tipo": rng.choice(["chiamata", "email", "meeting", "whatsapp", "nota"]),
+                "canale": rng.choice(["telefono", "gmail", "whatsapp", "linkedin"]),
+                "oggetto": rng.choice(["Primo contatto", "Invio offerta", "Follow-up", "Cambio fase"]),
+                "descrizione": f"Attività sintetica {i}: {rng.choice(['interessato a OEE', 'richiede preventivo', 'da richiamare', 'nessuna risposta'])}",
+                "esito": rng.choice(["risposta", "non_risponde", "rimandare", "interessato"]),
+                "created_at": datetime.combine(d, datetime.min.time()),
+                "data_attivita": d,
+            })
+        counts["crmactivity"] = _bulk_insert(conn, CrmActivity, activities)
+
+        counts["crmautomationrule"] = _bulk_insert(conn, CrmAutomationRule, [
+            {"rule_id": 1, "trigger_type": "status_change", "to_status": "aperta", "action_type": "create_task",
+             "task_title": "Primo contatto lead", "task_type": "telefonata", "days_offset": 1, "attiva": True,
+             "created_at": datetime.utcnow()},
+        ])
+
+        # ---------- Commesse, fasi, timesheet ----------
+        commesse, fasi = [], []
+        fase_id = 0
+        for i in range(1, n["commesse"] + 1):
+            d0 = _rand_date(rng, start, today)
+            commesse.append({
+                "commessa_id": i,
+                "cod_commessa": f"COM-{d0.year}-{i:05d}",
+                "descrizione_cliente": clients[rng.randrange(len(clients))]["ragione_sociale"],
+                "stato_commessa": rng.choice(["aperta", "in corso", "chiusa"]),
+                "data_inizio": d0,
+                "data_fine_prevista": d0 + timedelta(days=rng.randint(30, 180)),
+                "ore_previste": 0.0,
+                "ore_consumate": 0.0,
+                "costo_previsto": float(rng.randrange(5000, 80000, 500)),
+            })
+            for nome_fase in FASI_STANDARD:
+                fase_id += 1
+                fasi.append({
+                    "fase_id": fase_id,
+                    "commessa_id": i,
+                    "nome_fase": nome_fase,
+                    "stato_fase": rng.choice(["aperta", "in corso", "chiusa"]),
+                    "data_inizio": d0,
+                    "ore_previste": float(rng.randrange(8, 200, 4)),
+                    "ore_consumate": 0.0,
+                })
+
+        time_entries = []
+        ore_fase = {}
+        for i in range(1, n["time_entries"] + 1):
+            f = fasi[rng.randrange(len(fasi))]
+            emp = employees[rng.randrange(len(employees))]
+            ore = rng.choice([1.0, 2.0, 4.0, 4.0, 8.0, 8.0])
+            ore_fase[f["fase_id"]] = ore_fase.get(f["fase_id"], 0.0) + ore
+            time_entries.append({
+                "entry_id": i,
+                "commessa_id": f["commessa_id"],
+                "fase_id": f["fase_id"],
+                "data_lavoro": _rand_date(rng, start, today),
+                "ore": ore,
+                "operatore": f"{emp['nome']} {emp['cognome']}",
+            })
+
+        # rollup ore coerenti con il timesheet
+        ore_commessa = {}
+        for f in fasi:
+            f["ore_consumate"] = ore_fase.get(f["fase_id"], 0.0)
+            ore_commessa[f["commessa_id"]] = ore_commessa.get(f["commessa_id"], 0.0) + f["ore_consumate"]
+        for c in commesse:
+            c["ore_previste"] = sum(f["ore_previste"] for f in fasi if f["commessa_id"] == c["commessa_id"])
+            c["ore_consumate"] = ore_commessa.get(c["commessa_id"], 0.0)
+
+        counts["projectcommessa"] = _bulk_insert(conn, ProjectCommessa, commesse)
+        counts["taskfase"] = _bulk_insert(conn, TaskFase, fasi)
+        counts["timeentry"] = _bulk_insert(conn, TimeEntry, time_entries)
+
+        # ---------- Fatture e pagamenti ----------
+        invoices, payments = [], []
+        payment_id = 0
+        for i in range(1, n["invoices"] + 1):
+            cid = rng.randint(1, n["clients"])
+            d_fatt = _rand_date(rng, start, today)
+            imponibile = float(rng.randrange(500, 15000, 50))
+            iva = round(imponibile * 0.22, 2)
+            totale = imponibile + iva
+            scadenza = d_fatt + timedelta(days=rng.choice([30, 60, 90]))
+            delay = max(0, int(rng.gauss(client_delay[cid], 10)))
+            d_inc = scadenza + timedelta(days=delay - 30)
+            stato, data_incasso = "emessa", None
+            if d_inc <= today and rng.random() < 0.9:
+                stato, data_incasso = "incassata", d_inc
+                # pagamento unico o in due tranche
+                if rng.random() < 0.8:
+                    tranche = [(d_inc, totale)]
+                else:
+                    tranche = [(d_inc - timedelta(days=20), round(totale / 2, 2)), (d_inc, totale - round(totale / 2, 2))]
+                for pay_date, amount in tranche:
+                    payment_id += 1
+                    payments.append({
+                        "payment_id": payment_id,
+                        "invoice_id": i,
+                        "payment_date": pay_date,
+                        "amount": amount,
+                        "method": rng.choice(["bonifico", "bonifico", "riba"]),
+                    })
+            elif scadenza < today:
+                stato = "scaduta"
+            # ~40% delle fatture collegate a una commessa/fase
+            fase = fasi[rng.randrange(len(fasi))] if rng.random() < 0.4 else None
+            invoices.append({
+                "invoice_id": i,
+                "client_id": cid,
+                "num_fattura": f"FL-{d_fatt.year}-{i:06d}",
+                "data_fattura": d_fatt,
+                "data_scadenza": scadenza,
+                "importo_imponibile": imponibile,
+                "iva": iva,
+                "importo_totale": totale,
+                "stato_pagamento": stato,
+                "data_incasso": data_incasso,
+                "commessa_id": fase["commessa_id"] if fase else None,
+                "fase_id": fase["fase_id"] if fase else None,
+            })
+        counts["invoice"] = _bulk_insert(conn, Invoice, invoices)
+        counts["payment"] = _bulk_insert(conn, Payment, payments)
+
+        # ---------- Fornitori e spese ----------
+        counts["vendor"] = _bulk_insert(conn, Vendor, [
+            {"vendor_id": i, "ragione_sociale": f"Fornitore {i} {rng.choice(SUFFISSI)}", "paese": "IT",
+             "giorni_pagamento_default": rng.choice([0, 30, 60])}
+            for i in range(1, n["vendors"] + 1)
+        ])
+        expenses = []
+        for i in range(1, n["expenses"] + 1):
+            d = _rand_date(rng, start, today)
+            imponibile = float(rng.randrange(20, 3000, 5))
+            iva = round(imponibile * 0.22, 2)
+            pagata = rng.random() < 0.85
+            expenses.append({
+                "expense_id": i,
+                "data": d,
+                "vendor_id": rng.randint(1, n["vendors"]),
+                "category_id": rng.randint(1, len(EXPENSE_CATEGORIES)),
+                "account_id": rng.randint(1, 2),
+                "descrizione": f"Spesa sintetica {i}",
+                "importo_imponibile": imponibile,
+                "iva": iva,
+                "importo_totale": imponibile + iva,
+                "pagata": pagata,
+                "data_pagamento": d + timedelta(days=rng.choice([0, 0, 30, 60])) if pagata else None,
+                "campaign_id": rng.randint(1, n["campaigns"]) if rng.random() < 0.15 else None,
+            })
+        counts["expense"] = _bulk_insert(conn, Expense, expenses)
+
+        # ---------- Fisco & INPS ----------
+        tax_cfg, deadlines, inps = [], [], []
+        for y in range(start.year, end.year + 1):
+            tax_cfg.append({"year": y, "regime": "forfettario", "aliquota_imposta": 0.15,
+                            "aliquota_inps": 0.2607, "redditivita_forfettario": 0.78})
+            for due, tipo in [(date(y, 6, 30), "saldo imposta"), (date(y, 6, 30), "acconto 1 imposta"),
+                              (date(y, 11, 30), "acconto 2 imposta")]:
+                amount = float(rng.randrange(1000, 8000, 50))
+                paid = due <= today
+                deadlines.append({"year": y, "due_date": due, "type": tipo, "estimated_amount": amount,
+                                  "amount_paid": amount if paid else 0.0, "payment_date": due if paid else None,
+                                  "status": "paid" if paid else "planned"})
+            for due, desc in [(date(y, 6, 30), "Saldo e 1° acconto INPS"), (date(y, 11, 30), "2° acconto INPS")]:
+                amount = float(rng.randrange(1500, 9000, 50))
+                paid = due <= today
+                inps.append({"year": y, "due_date": due, "amount_due": amount,
+                             "amount_paid": amount if paid else 0.0, "payment_date": due if paid else None,
+                             "description": desc, "status": "paid" if paid else "planned"})
+        counts["taxconfig"] = _bulk_insert(conn, TaxConfig, tax_cfg)
+        counts["taxdeadline"] = _bulk_insert(conn, TaxDeadline, deadlines)
+        counts["inpscontribution"] = _bulk_insert(conn, InpsContribution, inps)
+
+        # ---------- Serie KPI (giornaliere reparto, settimanali persona) ----------
+        kpi_dept, kpi_emp = [], []
+        days = (min(end, today) - start).days + 1
+        for offset in range(days):
+            d = start + timedelta(days=offset)
+            for dep_id in range(1, len(DEPARTMENTS) + 1):
+                for name, target, unit in KPI_DEPARTMENT:
+                    kpi_dept.append({"department_id": dep_id, "data": d, "kpi_name": name,
+                                     "valore": round(rng.gauss(target, target * 0.1), 2), "target": target, "unita": unit})
+            if d.weekday() == 0:
+                for emp in employees:
+                    for name, target, unit in KPI_EMPLOYEE:
+                        kpi_emp.append({"employee_id": emp["employee_id"], "data": d, "kpi_name": name,
+                                        "valore": round(rng.gauss(target, target * 0.15), 2), "target": target, "unita": unit})
+        counts["kpidepartmenttimeseries"] = _bulk_insert(conn, KpiDepartmentTimeseries, kpi_dept)
+        counts["kpiemployeetimeseries"] = _bulk_insert(conn, KpiEmployeeTimeseries, kpi_emp)
+
+    eng.dispose()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera un DB sintetico per benchmark ForgiaLean")
+    parser.add_argument("--scale", type=int, default=1, help="fattore di scala (1, 10, 100...)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--years", type=int, default=3, help="anni di storico fino all'anno corrente")
+    parser.add_argument("--db", type=Path, default=None, help="percorso DB (default data/forgialean_bench_<scale>x.db)")
+    args = parser.parse_args()
+
+    db_path = args.db or default_db_path(args.scale)
+    t0 = time.perf_counter()
+    counts = generate(db_path, scale=args.scale, seed=args.seed, years=args.years)
+    elapsed = time.perf_counter() - t0
+
+    print(f"✅ DB sintetico {args.scale}x creato in {db_path} ({elapsed:.1f}s, seed={args.seed})")
+    for table, count in counts.items():
+        print(f"  {table:<26} {count:>10,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+# timesheet_import.py
+"""
+Import massivo delle ore (TimeEntry) da file CSV/XLSX o da un endpoint JSON.
+
+- righe lette e validate in blocco con pandas (niente form riga per riga);
+- commessa/fase controllate contro un indice in memoria
+  {fase_id: commessa_id}, ricaricato solo se arriva un id sconosciuto
+  o dopo TIMESHEET_INDEX_TTL_S;
+- inserimento con executemany a blocchi di TIMESHEET_BATCH_ROWS righe, rollup
+  ore_consumate aggiornati una volta per blocco (insert_time_entries_bulk in
+  db.py), tutto in un'unica transazione: un errore non lascia import parziali;
+- i file caricati sono registrati per sha256 (TimesheetImport): lo stesso
+  file non viene importato due volte.
+
+Di default un file con errori non viene importato (nessuna riga scritta);
+con skip_invalid=True si importano solo le righe valide.
+
+Colonne accettate (maiuscole/minuscole indifferenti):
+    commessa_id (o commessa), fase_id (o fase), data_lavoro (o data), ore, operatore
+
+Endpoint HTTP locale (per i terminali di reparto):
+    python timesheet_import.py serve --port 8765
+    POST /timesheet   body: [{"fase_id": 3, "data_lavoro": "2026-03-02", "ore": 7.5}, ...]
+                      oppure {"entries": [...], "skip_invalid": true}
+    GET  /health
+    Se TIMESHEET_API_TOKEN è impostato serve l'header "X-Api-Token".
+
+Uso da riga di comando:
+    python timesheet_import.py import ore_marzo.csv [--skip-invalid]
+"""
+
+import argparse
+import hashlib
+import hmac
+import io
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+from sqlmodel import Session, select
+
+from db import ProjectCommessa, TaskFase, TimesheetImport, engine, insert_time_entries_bulk
+
+# Righe per executemany (e per aggiornamento rollup) dentro la transazione di import
+TIMESHEET_BATCH_ROWS = 5_000
+
+# Validità dell'indice commesse/fasi in memoria
+TIMESHEET_INDEX_TTL_S = 300
+
+# Ore massime per singola riga (una giornata)
+MAX_ORE_RIGA = 24.0
+
+# Dimensione massima del body JSON accettato dall'endpoint
+MAX_BODY_BYTES = 20 * 1024 * 1024
+
+COLUMN_ALIASES = {
+    "commessa": "commessa_id",
+    "fase": "fase_id",
+    "data": "data_lavoro",
+}
+
+_index: dict = {"fasi": {}, "commesse": set(), "loaded_at": 0.0}
+_index_lock = threading.Lock()
+
+
+# ========================
+# INDICE COMMESSE / FASI
+# ========================
+
+def _load_index() -> None:
+    with Session(engine) as session:
+        _index["fasi"] = dict(session.exec(select(TaskFase.fase_id, TaskFase.commessa_id)).all())
+        _index["commesse"] = set(session.exec(select(ProjectCommessa.commessa_id)).all())
+    _index["loaded_at"] = time.monotonic()
+
+
+def get_id_index(unknown_fasi=(), unknown_commesse=()) -> dict:
+    """
+    Indice {fasi: {fase_id: commessa_id}, commesse: {...}}.
+    Ricaricato se scaduto o se contiene id mai visti (fasi create da poco).
+    """
+    with _index_lock:
+        stale = time.monotonic() - _index["loaded_at"] >= TIMESHEET_INDEX_TTL_S
+        missing = any(f not in _index["fasi"] for f in unknown_fasi) or any(
+            c not in _index["commesse"] for c in unknown_commesse
+        )
+        if stale or missing:
+            _load_index()
+        return {"fasi": _index["fasi"], "commesse": _index["commesse"]}
+
+
+# ========================
+# LETTURA E VALIDAZIONE
+# ========================
+
+def read_timesheet_file(data: bytes, filename: str) -> pd.DataFrame:
+    """CSV (separatore , o ; rilevato) oppure Excel."""
+    if filename.lower().endswith((".xlsx", ".xls")):
+        return pd.read_excel(io.BytesIO(data), dtype=str)
+    return pd.read_csv(io.BytesIO(data), sep=None, engine="python", dtype=str)
+
+
+def _parse_dates(values: pd.Series) -> pd.Series:
+    # ISO (2026-03-02) prima, poi formato italiano (02/03/2026)
+    parsed = pd.to_datetime(values, format="%Y-%m-%d", errors="coerce")
+    retry = parsed.isna() & values.notna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(values[retry], dayfirst=True, format="mixed", errors="coerce")
+    return parsed
+
+
+def validate_timesheet(df: pd.DataFrame) -> tuple[list[dict], list[dict]]:
+    """
+    Ritorna (righe valide pronte per l'insert, errori [{riga, errore}]).
+    Numero riga = posizione nel file (1 = prima riga dati).
+    """
+    df = df.rename(columns=lambda c: COLUMN_ALIASES.get(str(c).strip().lower(), str(c).strip().lower()))
+    if "fase_id" not in df.columns or "ore" not in df.columns or "data_lavoro" not in df.columns:
+        return [], [{"riga": 0, "errore": "Colonne obbligatorie: fase_id, data_lavoro, ore"}]
+    if "commessa_id" not in df.columns:
+        df["commessa_id"] = None
+    if "operatore" not in df.columns:
+        df["operatore"] = None
+
+    df = df.reset_index(drop=True)
+    fase = pd.to_numeric(df["fase_id"], errors="coerce")
+    commessa = pd.to_numeric(df["commessa_id"], errors="coerce")
+    ore = pd.to_numeric(df["ore"].astype(str).str.replace(",", ".", regex=False), errors="coerce")
+    data = _parse_dates(df["data_lavoro"].astype("string").str.strip())
+
+    # inf, 1e400, 2.5: errori di riga, non id da convertire in int
+    fase_bad = fase.isna() | ~np.isfinite(fase) | (fase % 1 != 0)
+    commessa_bad = commessa.notna() & (~np.isfinite(commessa) | (commessa % 1 != 0))
+
+    index = get_id_index(
+        unknown_fasi={int(f) for f in fase[~fase_bad]},
+        unknown_commesse={int(c) for c in commessa[commessa.notna() & ~commessa_bad]},
+    )
+    fase_commessa = fase.where(~fase_bad).map(index["fasi"])
+
+    checks = [
+        (fase_bad, "fase_id mancante o non numerico"),
+        (commessa_bad, "commessa_id non numerico"),
+        (fase.notna() & fase_commessa.isna(), "fase inesistente"),
+        (commessa.notna() & ~commessa.isin(list(index["commesse"])), "commessa inesistente"),
+        (commessa.notna() & fase_commessa.notna() & (commessa != fase_commessa), "la fase non appartiene alla commessa"),
+        (data.isna(), "data_lavoro non valida"),
+        (ore.isna() | (ore <= 0) | (ore > MAX_ORE_RIGA), f"ore devono essere tra 0 e {MAX_ORE_RIGA:g}"),
+    ]
+    errors = []
+    invalid = pd.Series(False, index=df.index)
+    for mask, message in checks:
+        mask = mask.fillna(False).astype(bool)
+        errors += [{"riga": int(i) + 1, "errore": message} for i in df.index[mask & ~invalid]]
+        invalid |= mask
+    errors.sort(key=lambda e: e["riga"])
+
+    operatore = df["operatore"].astype("string").str.strip()
+    valid = df.index[~invalid]
+    rows = [
+        {
+            "commessa_id": int(fase_commessa[i]),
+            "fase_id": int(fase[i]),
+            "data_lavoro": data[i].date(),
+            "ore": float(ore[i]),
+            "operatore": operatore[i] if pd.notna(operatore[i]) and operatore[i] else None,
+        }
+        for i in valid
+    ]
+    return rows, errors
+
+
+# ========================
+# IMPORT
+# ========================
+
+def file_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def find_previous_import(digest: str) -> TimesheetImport | None:
+    """Import già registrato per questo contenuto di file, se c'è."""
+    with Session(engine) as session:
+        return session.exec(select(TimesheetImport).where(TimesheetImport.file_hash == digest)).first()
+
+
+def import_timesheet_rows(rows: list[dict], digest: str | None = None, filename: str | None = None) -> dict:
+    """
+    Scrive righe già validate in un'unica transazione (un aggiornamento rollup per
+    blocco di TIMESHEET_BATCH_ROWS). Con digest il file viene registrato nella stessa
+    transazione; se era già stato importato non scrive nulla (duplicate=True).
+    """
+    t0 = time.perf_counter()
+    inserted = batches = 0
+    with Session(engine) as session:
+        if digest is not None:
+            if session.exec(select(TimesheetImport.import_id).where(TimesheetImport.file_hash == digest)).first():
+                return {"inserted": 0, "batches": 0, "duplicate": True, "elapsed_s": 0.0}
+            # indice unico su file_hash: due import concorrenti dello stesso file non passano entrambi
+            session.add(TimesheetImport(file_hash=digest, filename=filename or "", righe=len(rows)))
+        for start in range(0, len(rows), TIMESHEET_BATCH_ROWS):
+            inserted += insert_time_entries_bulk(session, rows[start:start + TIMESHEET_BATCH_ROWS])
+            batches += 1
+        session.commit()
+    return {"inserted": inserted, "batches": batches, "duplicate": False, "elapsed_s": round(time.perf_counter() - t0, 3)}
+
+
+def import_timesheet(df: pd.DataFrame, skip_invalid: bool = False, digest: str | None = None,
+                     filename: str | None = None) -> dict:
+    """Valida e importa un DataFrame di ore. Con errori e skip_invalid=False non scrive nulla."""
+    rows, errors = validate_timesheet(df)
+    report = {"rows": len(df), "valid": len(rows), "errors": errors, "inserted": 0, "batches": 0, "duplicate": False}
+    if errors and not skip_invalid:
+        return report
+    report.update(import_timesheet_rows(rows, digest, filename))
+    return report
+
+
+# ========================
+# ENDPOINT HTTP LOCALE
+# ========================
+
+class TimesheetHandler(BaseHTTPRequestHandler):
+    token = os.getenv("TIMESHEET_API_TOKEN")
+
+    def _reply(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, {"status": "ok"})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/timesheet":
+            self._reply(404, {"error": "not found"})
+            return
+        if self.token and not hmac.compare_digest(self.headers.get("X-Api-Token", "").encode(), self.token.encode()):
+            self._reply(401, {"error": "token non valido"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            self._reply(413 if length else 400, {"error": "body mancante o troppo grande"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(length))
+        except ValueError:
+            self._reply(400, {"error": "JSON non valido"})
+            return
+
+        entries = payload.get("entries") if isinstance(payload, dict) else payload
+        if not isinstance(entries, list) or not all(isinstance(e, dict) for e in entries):
+            self._reply(400, {"error": "atteso un elenco di righe timesheet"})
+            return
+        skip_invalid = bool(payload.get("skip_invalid")) if isinstance(payload, dict) else False
+
+        report = import_timesheet(pd.DataFrame(entries, dtype=str), skip_invalid=skip_invalid)
+        status = 400 if report["errors"] and not report["inserted"] else 200
+        self._reply(status, report)
+
+    def log_message(self, fmt, *args):
+        print(f"[{datetime.now():%H:%M:%S}] {self.address_string()} {fmt % args}")
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    # senza token l'endpoint accetta scritture da chiunque lo raggiunga: solo in locale
+    if not TimesheetHandler.token and host not in ("127.0.0.1", "::1", "localhost"):
+        raise SystemExit(f"⚠️ TIMESHEET_API_TOKEN non impostato: endpoint consentito solo su loopback, non su {host}")
+    server = ThreadingHTTPServer((host, port), TimesheetHandler)
+    print(f"✅ Endpoint timesheet su http://{host}:{port}/timesheet")
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import massivo timesheet ForgiaLean")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_serve = sub.add_parser("serve", help="avvia l'endpoint JSON locale")
+    p_serve.add_argument("--host", default="127.0.0.1")
+    p_serve.add_argument("--port", type=int, default=8765)
+    p_import = sub.add_parser("import", help="importa un file CSV/XLSX")
+    p_import.add_argument("file")
+    p_import.add_argument("--skip-invalid", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "serve":
+        server = serve(args.host, args.port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    with open(args.file, "rb") as f:
+        data = f.read()
+    df = read_timesheet_file(data, args.file)
+    report = import_timesheet(df, skip_invalid=args.skip_invalid, digest=file_hash(data), filename=args.file)
+    if report["duplicate"]:
+        print(f"⚠️ {args.file} già importato (stesso contenuto): nessuna riga scritta")
+        return
+    for e in report["errors"][:20]:
+        print(f"❌ riga {e['riga']}: {e['errore']}")
+    if len(report["errors"]) > 20:
+        print(f"   ... altri {len(report['errors']) - 20} errori")
+    if report["inserted"]:
+        print(f"✅ {report['inserted']} righe importate in {report['elapsed_s']:.2f}s ({report['batches']} blocchi)")
+    else:
+        print("⚠️ Nessuna riga importata")
+
+
+if __name__ == "__main__":
+    main()